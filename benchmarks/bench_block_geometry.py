@@ -0,0 +1,99 @@
+"""
+Microbenchmark of the block geometry computations that run on every blockwise request:
+finding the blocks that intersect a roi, their bounds, and the slicings that copy each
+block's portion into the result.
+
+"per-block" is the previous approach (getIntersectingBlocks() via TinyVector, then getBlockBounds(),
+getIntersection() and roiToSlice() for every block), "batched" is getIntersectingBlockGeometry().
+
+Example:
+
+    python benchmarks/bench_block_geometry.py --blocks-per-axis 1 2 4 8 16
+"""
+import argparse
+import timeit
+
+import numpy
+
+from lazyflow.roi import TinyVector, getIntersection, getIntersectingBlockGeometry, roiFromShape, roiToSlice
+
+
+def legacy_intersecting_blocks(blockshape, roi):
+    roistart = TinyVector(roi[0])
+    roistop = TinyVector(roi[1])
+    blockshape = TinyVector(blockshape)
+
+    block_index_map_start = roistart // blockshape
+    block_index_map_stop = (roistop + (blockshape - 1)) // blockshape
+    block_index_map_shape = block_index_map_stop - block_index_map_start
+
+    block_indices = numpy.indices(block_index_map_shape)
+    block_indices = numpy.rollaxis(block_indices, 0, len(blockshape) + 1)
+    block_indices += block_index_map_start
+    block_indices *= blockshape
+    return numpy.reshape(block_indices, (-1, len(blockshape)))
+
+
+def legacy_block_bounds(dataset_shape, block_shape, block_start):
+    assert (numpy.mod(block_start, block_shape) == 0).all()
+    block_shape = TinyVector(block_shape)
+    return getIntersection((block_start, block_start + block_shape), roiFromShape(dataset_shape))
+
+
+def per_block(dataset_shape, blockshape, roi):
+    result = []
+    for block_start in legacy_intersecting_blocks(blockshape, roi):
+        block_roi = legacy_block_bounds(dataset_shape, blockshape, block_start)
+        intersecting_roi = getIntersection(roi, block_roi)
+        destination_slicing = roiToSlice(*numpy.subtract(intersecting_roi, roi[0]))
+        source_slicing = roiToSlice(*numpy.subtract(intersecting_roi, block_start))
+        result.append((block_roi, destination_slicing, source_slicing))
+    return result
+
+
+def batched(dataset_shape, blockshape, roi):
+    geometry = getIntersectingBlockGeometry(dataset_shape, blockshape, roi)
+    return list(
+        zip(
+            zip(geometry.block_starts, geometry.block_stops),
+            geometry.destination_slicings(),
+            geometry.source_slicings(),
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blockshape", type=int, nargs="+", default=[1, 64, 64, 64, 1], help="tzyxc")
+    parser.add_argument(
+        "--blocks-per-axis",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16],
+        help="The requested roi spans this many (partial) blocks along each spatial axis",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    blockshape = numpy.array(args.blockshape)
+    spatial = blockshape > 1
+    print(f"{'blocks':>8} | {'per-block (us)':>15} | {'batched (us)':>15} | {'speedup':>8}")
+    for n in args.blocks_per_axis:
+        dataset_shape = tuple(numpy.where(spatial, blockshape * (n + 2), blockshape))
+        # Unaligned roi, so that the blocks at the border are clipped
+        start = numpy.where(spatial, blockshape // 2, 0)
+        stop = numpy.where(spatial, start + blockshape * (n - 1) + 1, blockshape)
+        roi = (tuple(start), tuple(stop))
+
+        num_blocks = len(per_block(dataset_shape, blockshape, roi))
+        assert num_blocks == len(batched(dataset_shape, blockshape, roi))
+        number = max(1, 20000 // num_blocks)
+        times = []
+        for func in (per_block, batched):
+            timer = timeit.Timer(lambda: func(dataset_shape, blockshape, roi))
+            times.append(min(timer.repeat(args.repeat, number)) / number * 1e6)
+        print(f"{num_blocks:>8} | {times[0]:>15.1f} | {times[1]:>15.1f} | {times[0] / times[1]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Replay a block access trace against the cache eviction policies of the cache memory manager.
+
+Every access to a block that is not cached costs the block's compute time.  Whenever the cached
+bytes exceed the budget, the policy frees blocks until 90% of the budget is reached, just like
+_CacheMemoryManager._cleanup().  The total recomputation time is reported per policy.
+
+By default, a synthetic trace is generated that resembles interactive browsing of a volume
+with three caches in a pipeline: large and cheap raw data blocks, large and expensive
+feature blocks and small, very expensive prediction blocks.
+A recorded trace can be replayed instead (CSV, one access per line: key,compute_time,nbytes).
+
+Example:
+
+    python benchmarks/bench_cache_eviction.py --budget-fraction 0.1 0.25 0.5
+    python benchmarks/bench_cache_eviction.py --dump-trace trace.csv
+    python benchmarks/bench_cache_eviction.py --trace trace.csv
+"""
+import argparse
+import csv
+import random
+
+from lazyflow.operators.cacheEvictionPolicies import CacheEntry, EVICTION_POLICIES, create_eviction_policy
+
+MB = 2 ** 20
+
+#: name, compute time per block (s), bytes per block
+LAYERS = [("raw", 0.005, 8 * MB), ("features", 1.0, 32 * MB), ("predictions", 4.0, 4 * MB)]
+
+
+def synthetic_trace(num_steps, num_blocks, seed):
+    """
+    A random walk over a row of blocks.  Every step views a window of 3 neighbouring blocks in every layer;
+    occasionally, the user jumps to a random location.
+    """
+    rng = random.Random(seed)
+    position = num_blocks // 2
+    trace = []
+    for _ in range(num_steps):
+        if rng.random() < 0.05:
+            position = rng.randrange(num_blocks)
+        else:
+            position = min(num_blocks - 1, max(0, position + rng.choice((-1, 0, 1))))
+        for block in range(max(0, position - 1), min(num_blocks, position + 2)):
+            for name, compute_time, nbytes in LAYERS:
+                trace.append((f"{name}:{block}", compute_time, nbytes))
+    return trace
+
+
+def read_trace(path):
+    with open(path) as f:
+        return [(key, float(compute_time), int(nbytes)) for key, compute_time, nbytes in csv.reader(f)]
+
+
+def write_trace(path, trace):
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(trace)
+
+
+def replay(trace, policy, budget, target_usage=0.9):
+    """Returns (hit rate, total recomputation time in seconds)."""
+    cached = {}  # key -> [last_access_time, compute_time, nbytes]
+    used = 0
+    hits = 0
+    recompute_time = 0.0
+
+    def free(key):
+        return cached.pop(key)[2]
+
+    for clock, (key, compute_time, nbytes) in enumerate(trace):
+        if key in cached:
+            hits += 1
+            cached[key][0] = clock
+            continue
+
+        recompute_time += compute_time
+        cached[key] = [clock, compute_time, nbytes]
+        used += nbytes
+        if used <= budget:
+            continue
+
+        entries = [CacheEntry(k, k, t, cost, size, lambda k=k: free(k)) for k, (t, cost, size) in cached.items()]
+        for entry in policy.order(entries):
+            if used <= target_usage * budget:
+                break
+            used -= entry.free()
+            policy.evicted(entry)
+
+    return hits / len(trace), recompute_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", help="Replay this trace (CSV) instead of a synthetic one")
+    parser.add_argument("--dump-trace", help="Write the trace to this file (CSV) and exit")
+    parser.add_argument("--steps", type=int, default=5000, help="Steps of the synthetic trace")
+    parser.add_argument("--blocks", type=int, default=200, help="Blocks per layer of the synthetic trace")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--budget-fraction",
+        type=float,
+        nargs="+",
+        default=[0.05, 0.1, 0.25, 0.5],
+        help="Cache budgets, as fractions of the total size of all distinct blocks in the trace",
+    )
+    parser.add_argument("--policies", nargs="+", default=list(EVICTION_POLICIES), choices=list(EVICTION_POLICIES))
+    args = parser.parse_args()
+
+    trace = read_trace(args.trace) if args.trace else synthetic_trace(args.steps, args.blocks, args.seed)
+    if args.dump_trace:
+        write_trace(args.dump_trace, trace)
+        return
+
+    working_set = sum({key: nbytes for key, _, nbytes in trace}.values())
+    compulsory = sum({key: cost for key, cost, _ in trace}.values())
+    print(f"{len(trace)} accesses, working set {working_set / MB:.0f} MB, compulsory compute time {compulsory:.1f} s")
+    print(f"{'budget':>10} | " + " | ".join(f"{name:>24}" for name in args.policies))
+    print(f"{'(MB)':>10} | " + " | ".join(f"{'hit rate  recompute (s)':>24}" for _ in args.policies))
+    for fraction in args.budget_fraction:
+        budget = fraction * working_set
+        results = [replay(trace, create_eviction_policy(name), budget) for name in args.policies]
+        print(
+            f"{budget / MB:>10.0f} | "
+            + " | ".join(f"{hit_rate:>8.1%} {recompute_time:>15.1f}" for hit_rate, recompute_time in results)
+        )
+
+
+if __name__ == "__main__":
+    main()
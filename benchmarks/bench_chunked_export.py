@@ -0,0 +1,141 @@
+"""
+Write throughput of blockwise exports to hdf5 (h5py) and n5 (z5py), comparing two ways of choosing
+the dataset chunks and the request blocks, as OpH5N5WriterBigDataset does:
+
+  * independent: ~512KB chunks from determineBlockShape(), and the request blockshape as given.
+    Blocks that straddle chunks cause partial chunk writes (read-modify-write, recompression).
+  * aligned: determine_chunk_aligned_shapes(), so that every block covers whole chunks.
+
+n5 datasets are also written with several threads in parallel, which is only safe for aligned blocks.
+The "straddled" column counts the chunks that are written by more than one block.
+
+Example:
+
+    python benchmarks/bench_chunked_export.py --shape 1 256 512 512 1 --blockshape 1 100 100 100 1
+    python benchmarks/bench_chunked_export.py --compression --order morton
+"""
+import argparse
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import time
+
+import h5py
+import numpy
+import z5py
+
+from lazyflow.roi import (
+    determineBlockShape,
+    determine_chunk_aligned_shapes,
+    getIntersectingBlockGeometry,
+    getMortonOrder,
+    roiToSlice,
+)
+
+MB = 2 ** 20
+TARGET_CHUNK_BYTES = 512_000
+
+
+def make_data(shape, dtype, seed):
+    rng = numpy.random.RandomState(seed)
+    grid = numpy.indices(shape, dtype=numpy.float32)
+    smooth = sum(numpy.sin(g / (7.0 + 3 * i)) for i, g in enumerate(grid))
+    return (50 * (smooth + 5) + rng.normal(0, 2, size=shape)).astype(dtype)
+
+
+def plans(shape, blockshape, itemsize):
+    # chunks never span multiple time steps or channels (axes 0 and -1 are t and c)
+    max_chunkshape = (1,) + tuple(shape[1:-1]) + (1,)
+    independent = determineBlockShape(max_chunkshape, TARGET_CHUNK_BYTES / itemsize), tuple(blockshape)
+    aligned = determine_chunk_aligned_shapes(max_chunkshape, blockshape, shape, TARGET_CHUNK_BYTES / itemsize)
+    return [("independent", independent), ("aligned", aligned)]
+
+
+def block_rois(shape, blockshape, order):
+    roi = ((0,) * len(shape), tuple(shape))
+    geometry = getIntersectingBlockGeometry(shape, blockshape, roi)
+    if order == "morton":
+        indices = getMortonOrder(geometry.block_starts // numpy.asarray(blockshape))
+    else:
+        indices = range(geometry.num_blocks)
+    return [(geometry.starts[i], geometry.stops[i]) for i in indices]
+
+
+def count_straddled_chunks(shape, chunkshape, rois):
+    writers_per_chunk = {}
+    for start, stop in rois:
+        geometry = getIntersectingBlockGeometry(shape, chunkshape, (start, stop))
+        for chunk_start in map(tuple, geometry.block_starts):
+            writers_per_chunk[chunk_start] = writers_per_chunk.get(chunk_start, 0) + 1
+    return sum(1 for count in writers_per_chunk.values() if count > 1)
+
+
+def create_dataset(target, directory, shape, dtype, chunkshape, compression):
+    if target == "h5py":
+        f = h5py.File(os.path.join(directory, "export.h5"), "w")
+        kwargs = {"compression": "gzip", "compression_opts": 1} if compression else {}
+    else:
+        f = z5py.N5File(os.path.join(directory, "export.n5"), "w")
+        kwargs = {"compression": "gzip", "level": 1} if compression else {"compression": "raw"}
+    return f, f.create_dataset("data", shape=shape, dtype=dtype, chunks=chunkshape, **kwargs)
+
+
+def write(dataset, data, rois, threads):
+    def write_block(roi):
+        slicing = roiToSlice(*roi)
+        dataset[slicing] = data[slicing]
+
+    if threads == 1:
+        for roi in rois:
+            write_block(roi)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+            list(pool.map(write_block, rois))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shape", type=int, nargs=5, default=[1, 128, 512, 512, 1], help="tzyxc")
+    parser.add_argument("--blockshape", type=int, nargs=5, default=[1, 100, 100, 100, 1], help="request blockshape")
+    parser.add_argument("--dtype", default="uint8")
+    parser.add_argument("--compression", action="store_true", help="gzip level 1 (default: uncompressed)")
+    parser.add_argument("--order", choices=["C", "morton"], default="C", help="Order in which blocks are written")
+    parser.add_argument("--threads", type=int, default=4, help="Writer threads for the parallel n5 export")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    shape = tuple(args.shape)
+    data = make_data(shape, numpy.dtype(args.dtype), args.seed)
+    size_mb = data.nbytes / MB
+    print(f"data: shape {shape}, {data.dtype}, {size_mb:.0f} MB, compression: {args.compression}")
+
+    header = ["target", "plan", "threads", "chunks", "blocks", "straddled", "MB/s"]
+    print(" | ".join(f"{h:>22}" for h in header))
+    for target in ["h5py", "z5py"]:
+        for plan_name, (chunkshape, blockshape) in plans(shape, args.blockshape, data.dtype.itemsize):
+            rois = block_rois(shape, blockshape, args.order)
+            straddled = count_straddled_chunks(shape, chunkshape, rois)
+            # Parallel writes of straddling blocks would corrupt chunks, and hdf5 serializes them anyway
+            thread_counts = [1, args.threads] if target == "z5py" and straddled == 0 else [1]
+            for threads in thread_counts:
+                directory = tempfile.mkdtemp()
+                try:
+                    f, dataset = create_dataset(target, directory, shape, data.dtype, chunkshape, args.compression)
+                    start = time.perf_counter()
+                    write(dataset, data, rois, threads)
+                    if target == "h5py":
+                        f.flush()
+                    elapsed = time.perf_counter() - start
+                    assert (dataset[...] == data).all()
+                    f.close()
+                finally:
+                    shutil.rmtree(directory)
+                print(
+                    f"{target:>22} | {plan_name:>22} | {threads:>22} | {str(chunkshape):>22} | "
+                    f"{str(blockshape):>22} | {straddled:>22} | {size_mb / elapsed:>22.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Compare the block storage backends of OpCompressedCache: in-memory hdf5 "core" files with lzf
+compression (the previous backend) and CompressedChunkArray with every available codec.
+
+For each backend, a volume is split into blocks and the following is measured:
+
+  * write: throughput of storing all blocks
+  * read: throughput of reading all blocks back, one thread
+  * read parallel: the same, with the chunks decompressed by a thread pool
+    (hdf5 serializes all access, so this is only measured for CompressedChunkArray)
+  * lookups: latency of reading single pixels at random positions
+  * compressed: size of the stored data
+  * overhead: resident memory per block beyond the stored data, measured with many small blocks
+
+Example:
+
+    python benchmarks/bench_compressed_cache.py --shape 256 256 256 --blockshape 128 128 128
+    python benchmarks/bench_compressed_cache.py --data labels --threads 4
+"""
+import argparse
+import concurrent.futures
+import gc
+import itertools
+import time
+
+import h5py
+import numpy
+import psutil
+
+from lazyflow.operators.compressedBlockStore import CompressedChunkArray, available_codecs, create_codec
+
+MB = 2 ** 20
+
+
+def make_data(kind, shape, seed):
+    rng = numpy.random.RandomState(seed)
+    if kind == "raw":
+        # smooth background with noise, similar to microscopy data
+        grid = numpy.indices(shape, dtype=numpy.float32)
+        smooth = sum(numpy.sin(g / (7.0 + 3 * i)) for i, g in enumerate(grid))
+        noisy = 100 * (smooth + 3) + rng.normal(0, 2, size=shape)
+        return noisy.astype(numpy.uint16)
+    if kind == "features":
+        grid = numpy.indices(shape, dtype=numpy.float32)
+        return sum(numpy.cos(g / (5.0 + 2 * i)) for i, g in enumerate(grid)).astype(numpy.float32)
+    if kind == "labels":
+        # sparse brush strokes
+        labels = numpy.zeros(shape, dtype=numpy.uint8)
+        for _ in range(20):
+            start = [rng.randint(0, s) for s in shape]
+            labels[tuple(slice(a, a + 5) for a in start)] = rng.randint(1, 4)
+        return labels
+    raise ValueError(kind)
+
+
+def choose_chunkshape(blockshape, itemsize):
+    """Same rule as OpUnmanagedCompressedCache: the whole block, or slices of about 1MiB."""
+    chunkshape = list(blockshape)
+    while numpy.prod(chunkshape) * itemsize > MB:
+        axis = int(numpy.argmax(chunkshape))
+        chunkshape[axis] = (chunkshape[axis] + 1) // 2
+    return tuple(chunkshape)
+
+
+def block_slicings(shape, blockshape):
+    ranges = [range(0, s, b) for s, b in zip(shape, blockshape)]
+    for start in itertools.product(*ranges):
+        yield tuple(slice(a, min(a + b, s)) for a, b, s in zip(start, blockshape, shape))
+
+
+class Hdf5Backend:
+    name = "hdf5 core/lzf"
+    parallel = False
+
+    def __init__(self):
+        self._counter = itertools.count()
+
+    def create(self, shape, dtype, chunkshape):
+        f = h5py.File("bench{}".format(next(self._counter)), driver="core", backing_store=False, mode="w")
+        f.create_dataset("data", shape=shape, dtype=dtype, chunks=chunkshape, compression="lzf")
+        return f
+
+    def write(self, block, data, pool):
+        block["data"][...] = data
+
+    def read(self, block, slicing, out, pool):
+        out[...] = block["data"][slicing]
+
+    def nbytes(self, block):
+        return block["data"].id.get_storage_size()
+
+
+class ChunkArrayBackend:
+    parallel = True
+
+    def __init__(self, codec_name):
+        self.name = "chunks/" + codec_name
+        self._codec = create_codec(codec_name)
+
+    def create(self, shape, dtype, chunkshape):
+        return CompressedChunkArray(shape, dtype, chunkshape, self._codec)
+
+    def write(self, block, data, pool):
+        self._run(block.write_tasks(..., data), pool)
+
+    def read(self, block, slicing, out, pool):
+        self._run(block.read_tasks(slicing, out), pool)
+
+    def nbytes(self, block):
+        return block.nbytes
+
+    @staticmethod
+    def _run(tasks, pool):
+        if pool is None or len(tasks) == 1:
+            for task in tasks:
+                task()
+        else:
+            list(pool.map(lambda task: task(), tasks))
+
+
+def measure(backend, data, blockshape, pool, num_lookups, rng):
+    chunkshape = choose_chunkshape(blockshape, data.dtype.itemsize)
+    slicings = list(block_slicings(data.shape, blockshape))
+
+    start = time.perf_counter()
+    blocks = []
+    for slicing in slicings:
+        block_data = data[slicing]
+        block_chunkshape = tuple(min(c, s) for c, s in zip(chunkshape, block_data.shape))
+        block = backend.create(block_data.shape, data.dtype, block_chunkshape)
+        backend.write(block, block_data, None)
+        blocks.append(block)
+    write_time = time.perf_counter() - start
+
+    def read_all(read_pool):
+        out = numpy.empty_like(data)
+        start = time.perf_counter()
+        for slicing, block in zip(slicings, blocks):
+            backend.read(block, (slice(None),) * data.ndim, out[slicing], read_pool)
+        elapsed = time.perf_counter() - start
+        assert (out == data).all()
+        return elapsed
+
+    read_time = read_all(None)
+    parallel_read_time = read_all(pool) if backend.parallel and pool is not None else None
+
+    out = numpy.empty((1,) * data.ndim, dtype=data.dtype)
+    start = time.perf_counter()
+    for _ in range(num_lookups):
+        index = rng.randint(len(blocks))
+        block_shape = [s.stop - s.start for s in slicings[index]]
+        pixel = tuple(slice(p, p + 1) for p in (rng.randint(s) for s in block_shape))
+        backend.read(blocks[index], pixel, out, None)
+    lookup_time = (time.perf_counter() - start) / num_lookups
+
+    nbytes = sum(backend.nbytes(block) for block in blocks)
+    return write_time, read_time, parallel_read_time, lookup_time, nbytes
+
+
+def per_block_overhead(backend, num_blocks):
+    """Resident memory per (tiny) block that is not accounted for by the stored data."""
+    gc.collect()
+    process = psutil.Process()
+    before = process.memory_info().rss
+    data = numpy.ones((4, 4, 4), dtype=numpy.float32)
+    blocks = []
+    for _ in range(num_blocks):
+        block = backend.create(data.shape, data.dtype, data.shape)
+        backend.write(block, data, None)
+        blocks.append(block)
+    stored = sum(backend.nbytes(block) for block in blocks)
+    overhead = (process.memory_info().rss - before - stored) / num_blocks
+    del blocks
+    gc.collect()
+    return overhead
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shape", type=int, nargs="+", default=[192, 192, 192])
+    parser.add_argument("--blockshape", type=int, nargs="+", default=[96, 96, 96])
+    parser.add_argument("--data", choices=["raw", "features", "labels"], default="raw")
+    parser.add_argument("--threads", type=int, default=psutil.cpu_count())
+    parser.add_argument("--lookups", type=int, default=2000, help="Number of single pixel lookups")
+    parser.add_argument("--overhead-blocks", type=int, default=2000, help="Number of tiny blocks for the overhead")
+    parser.add_argument("--codecs", nargs="+", default=available_codecs(), choices=available_codecs())
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    assert len(args.shape) == len(args.blockshape), "shape and blockshape must have the same dimensionality"
+    data = make_data(args.data, tuple(args.shape), args.seed)
+    size_mb = data.nbytes / MB
+    print(f"{args.data} data: shape {data.shape}, {data.dtype}, {size_mb:.0f} MB, blockshape {tuple(args.blockshape)}")
+
+    backends = [Hdf5Backend()] + [ChunkArrayBackend(name) for name in args.codecs]
+    header = ["backend", "write MB/s", "read MB/s", "parallel MB/s", "lookup us", "compressed", "overhead/block"]
+    print(" | ".join(f"{h:>14}" for h in header))
+    with concurrent.futures.ThreadPoolExecutor(args.threads) as pool:
+        for backend in backends:
+            rng = numpy.random.RandomState(args.seed)
+            write_time, read_time, parallel_time, lookup_time, nbytes = measure(
+                backend, data, tuple(args.blockshape), pool, args.lookups, rng
+            )
+            overhead = per_block_overhead(backend, args.overhead_blocks)
+            parallel = f"{size_mb / parallel_time:>14.0f}" if parallel_time is not None else f"{'-':>14}"
+            print(
+                f"{backend.name:>14} | {size_mb / write_time:>14.0f} | {size_mb / read_time:>14.0f} | {parallel} | "
+                f"{lookup_time * 1e6:>14.1f} | {100.0 * nbytes / data.nbytes:>13.1f}% | {overhead:>13.0f}B"
+            )
+
+
+if __name__ == "__main__":
+    main()
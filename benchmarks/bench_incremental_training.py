@@ -0,0 +1,94 @@
+"""
+Latency and accuracy of retraining a ParallelVigraRfLazyflowClassifier after labeling changes:
+
+  * full: create_and_train() from scratch after every change (the default)
+  * update k: update_and_train(), which retrains only the k oldest forests and reuses the others
+
+The labeling session is simulated with a synthetic classification problem: the user starts with half of the
+labels and then adds the other half in --steps batches.  The new labels are concentrated in a region of the
+feature space that the first labels didn't cover, so that reused forests are noticeably out of date.
+Accuracy is measured on a held-out test set after every step.
+
+Example:
+
+    python benchmarks/bench_incremental_training.py --samples 200000 --trees 100 --forests 8
+    python benchmarks/bench_incremental_training.py --steps 10 --update 1 2 4
+"""
+import argparse
+import time
+
+import numpy
+
+from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory
+
+
+def make_problem(num_samples, num_features, num_classes, seed):
+    rng = numpy.random.RandomState(seed)
+    centers = rng.normal(0, 3, size=(num_classes * 4, num_features))
+    cluster = rng.randint(0, len(centers), size=num_samples)
+    X = (centers[cluster] + rng.normal(0, 1.5, size=(num_samples, num_features))).astype(numpy.float32)
+    y = (cluster % num_classes + 1).astype(numpy.uint32)
+    # The "first" feature orders the samples: early labels only cover small values
+    order = numpy.argsort(X[:, 0] + rng.normal(0, 2, size=num_samples))
+    return X[order], y[order]
+
+
+def run(factory, X, y, X_test, y_test, initial, batch, steps, num_forests_to_retrain):
+    classifier = factory.create_and_train(X[:initial], y[:initial])
+    timings, accuracies = [], []
+    for step in range(1, steps + 1):
+        stop = initial + step * batch
+        start_time = time.perf_counter()
+        if num_forests_to_retrain is None:
+            classifier = factory.create_and_train(X[:stop], y[:stop])
+        else:
+            classifier = factory.update_and_train(
+                classifier, X[:stop], y[:stop], num_forests_to_retrain=num_forests_to_retrain
+            )
+        timings.append(time.perf_counter() - start_time)
+        predictions = numpy.argmax(classifier.predict_probabilities(X_test), axis=1) + 1
+        accuracies.append((predictions == y_test).mean())
+    return timings, accuracies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=100000, help="Labeled samples at the end of the session")
+    parser.add_argument("--features", type=int, default=20)
+    parser.add_argument("--classes", type=int, default=3)
+    parser.add_argument("--trees", type=int, default=100)
+    parser.add_argument("--forests", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=5, help="Labeling changes (retrainings)")
+    parser.add_argument("--update", type=int, nargs="+", default=[1, 2], help="Forests retrained per update")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    X, y = make_problem(args.samples + 20000, args.features, args.classes, args.seed)
+    test = numpy.random.RandomState(args.seed).choice(len(X), 20000, replace=False)
+    train = numpy.setdiff1d(numpy.arange(len(X)), test)
+    X_test, y_test = X[test], y[test]
+    X, y = X[train], y[train]
+
+    initial = args.samples // 2
+    batch = (args.samples - initial) // args.steps
+    factory = ParallelVigraRfLazyflowClassifierFactory(args.trees, num_forests=args.forests)
+    print(
+        f"{args.samples} samples ({initial} initially, +{batch} per step), {args.features} features, "
+        f"{args.trees} trees in {args.forests} forests"
+    )
+
+    print(f"{'mode':>10} | {'mean time (s)':>13} | {'speedup':>8} | {'mean accuracy':>13} | {'final accuracy':>14}")
+    full_time = None
+    for num_forests_to_retrain in [None] + args.update:
+        timings, accuracies = run(factory, X, y, X_test, y_test, initial, batch, args.steps, num_forests_to_retrain)
+        mean_time = numpy.mean(timings)
+        full_time = full_time or mean_time
+        mode = "full" if num_forests_to_retrain is None else f"update {num_forests_to_retrain}"
+        print(
+            f"{mode:>10} | {mean_time:>13.2f} | {full_time / mean_time:>7.1f}x | "
+            f"{numpy.mean(accuracies):>13.4f} | {accuracies[-1]:>14.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
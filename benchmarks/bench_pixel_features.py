@@ -0,0 +1,80 @@
+"""
+Runtime of OpPixelFeaturesPresmoothed for the full feature matrix (all 6 features at all 7 default scales),
+with and without the shared feature bank:
+
+  * per-feature: every feature of the matrix is computed by its own filter operator
+    (use_feature_bank = False, the previous behaviour).
+  * feature bank: the features of one scale share their smoothings and derivatives (see FeatureBank).
+
+The "max diff" column is the largest absolute difference between the two results.
+
+Example:
+
+    python benchmarks/bench_pixel_features.py --shape 1 1 1 512 512
+    python benchmarks/bench_pixel_features.py --shape 1 1 64 128 128 --2d
+"""
+import argparse
+import time
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpPixelFeaturesPresmoothed
+from lazyflow.operators.filterOperators import WITH_FAST_FILTERS
+
+SCALES = [0.3, 0.7, 1.0, 1.6, 3.5, 5.0, 10.0]
+FEATURE_IDS = [
+    "GaussianSmoothing",
+    "LaplacianOfGaussian",
+    "GaussianGradientMagnitude",
+    "DifferenceOfGaussians",
+    "StructureTensorEigenvalues",
+    "HessianOfGaussianEigenvalues",
+]
+
+
+def make_operator(data, compute_in_2d):
+    op = OpPixelFeaturesPresmoothed(graph=Graph())
+    op.Scales.setValue(SCALES)
+    op.FeatureIds.setValue(FEATURE_IDS)
+    op.SelectionMatrix.setValue(numpy.ones((len(FEATURE_IDS), len(SCALES)), dtype=bool))
+    op.ComputeIn2d.setValue([compute_in_2d] * len(SCALES))
+    op.Input.setValue(data)
+    return op
+
+
+def measure(op, use_feature_bank, repeat):
+    OpPixelFeaturesPresmoothed.use_feature_bank = use_feature_bank
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = op.Output[:].wait()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shape", type=int, nargs=5, default=[1, 1, 1, 512, 512], help="tczyx")
+    parser.add_argument("--2d", dest="compute_in_2d", action="store_true", help="Compute the features per z slice")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = numpy.random.RandomState(args.seed)
+    data = vigra.taggedView(rng.rand(*args.shape).astype(numpy.float32), "tczyx")
+    op = make_operator(data, args.compute_in_2d)
+    print(f"data: shape {data.shape}, 2d: {args.compute_in_2d}, fastfilters: {WITH_FAST_FILTERS}")
+
+    before, expected = measure(op, False, args.repeat)
+    after, computed = measure(op, True, args.repeat)
+    OpPixelFeaturesPresmoothed.use_feature_bank = True
+
+    max_diff = numpy.abs(computed - expected).max()
+    print(f"{'per-feature (s)':>15} | {'feature bank (s)':>16} | {'speedup':>8} | {'max diff':>9}")
+    print(f"{before:>15.2f} | {after:>16.2f} | {before / after:>7.2f}x | {max_diff:>9.2g}")
+
+
+if __name__ == "__main__":
+    main()
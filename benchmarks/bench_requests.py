@@ -0,0 +1,102 @@
+"""
+Microbenchmarks of the request framework overhead, using workloads that do (almost) nothing.
+
+  * create: constructing a Request, from a foreign thread and from within a request (child request)
+  * wait inline: wait() on a request that was not submitted, so it runs in the waiting thread/greenlet
+  * submit + wait: round trip through the thread pool
+  * notify: latency from submit() until a notify_finished() callback has run in the worker
+  * with_value: Request.with_value(x).wait(), for comparison
+
+All numbers are microseconds per request (best of --repeat runs).
+
+Example:
+
+    python benchmarks/bench_requests.py --workers 4 --number 20000
+"""
+import argparse
+import threading
+import time
+import timeit
+
+from lazyflow.request import Request
+
+
+def noop():
+    return 42
+
+
+def measure(stmt, number, repeat):
+    return min(timeit.Timer(stmt).repeat(repeat, number)) / number * 1e6
+
+
+def measure_in_request(stmt, number, repeat):
+    """Like measure(), but stmt is timed within a request that runs in the thread pool."""
+    req = Request(lambda: measure(stmt, number, repeat))
+    req.submit()
+    return req.wait()
+
+
+def create_children():
+    return Request(noop)
+
+
+def wait_child_inline():
+    return Request(noop).wait()
+
+
+def submit_and_wait():
+    req = Request(noop)
+    req.submit()
+    return req.wait()
+
+
+def notify_latency(number, repeat):
+    finished = threading.Event()
+
+    def callback(result):
+        finished.set()
+
+    best = float("inf")
+    for _ in range(repeat):
+        elapsed = 0.0
+        for _ in range(number):
+            finished.clear()
+            req = Request(noop)
+            req.notify_finished(callback)
+            start = time.perf_counter()
+            req.submit()
+            finished.wait()
+            elapsed += time.perf_counter() - start
+        best = min(best, elapsed / number * 1e6)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=None, help="Size of the thread pool (default: one per CPU)")
+    parser.add_argument("--number", type=int, default=20000, help="Requests per run")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    Request.reset_thread_pool(args.workers)
+    number, repeat = args.number, args.repeat
+    # the pool round trips are much slower than the rest
+    pool_number = max(1, number // 10)
+
+    results = [
+        ("create (foreign thread)", measure(lambda: Request(noop), number, repeat)),
+        ("create (within request)", measure_in_request(create_children, number, repeat)),
+        ("wait inline (foreign thread)", measure(lambda: Request(noop).wait(), number, repeat)),
+        ("wait inline (within request)", measure_in_request(wait_child_inline, number, repeat)),
+        ("submit + wait (foreign thread)", measure(submit_and_wait, pool_number, repeat)),
+        ("submit + wait (within request)", measure_in_request(submit_and_wait, pool_number, repeat)),
+        ("notify_finished latency", notify_latency(pool_number, repeat)),
+        ("with_value", measure(lambda: Request.with_value(42).wait(), number, repeat)),
+    ]
+    print(f"{'benchmark':>32} | {'us/request':>10}")
+    for name, us in results:
+        print(f"{name:>32} | {us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Block lookup cost against cache size, for the block bookkeeping of OpUnblockedArrayCache.
+
+Compares the previous approach (a linear scan over all stored block rois,
+via containing_rois() and getIntersection()) with RoiIndex.
+
+Example:
+
+    python benchmarks/bench_roi_index.py --sizes 100 1000 10000 50000
+"""
+import argparse
+import itertools
+import random
+import time
+
+import numpy
+
+from lazyflow.roi import containing_rois, getIntersection
+from lazyflow.utility.roiIndex import RoiIndex
+
+
+def make_block_rois(num_blocks, block_shape):
+    """Tile a roughly cubic volume with num_blocks blocks."""
+    blocks_per_axis = int(numpy.ceil(num_blocks ** (1.0 / len(block_shape))))
+    rois = []
+    for block_index in itertools.islice(itertools.product(range(blocks_per_axis), repeat=len(block_shape)), num_blocks):
+        start = tuple(int(i * s) for i, s in zip(block_index, block_shape))
+        stop = tuple(int(a + s) for a, s in zip(start, block_shape))
+        rois.append((start, stop))
+    return rois
+
+
+def random_subroi(rng, roi):
+    start = tuple(rng.randint(a, b - 1) for a, b in zip(*roi))
+    stop = tuple(rng.randint(a + 1, b) for a, b in zip(start, roi[1]))
+    return (start, stop)
+
+
+def time_per_call(fn, queries):
+    start = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000], help="Numbers of cached blocks"
+    )
+    parser.add_argument("--block-shape", type=int, nargs="+", default=[64, 64, 64])
+    parser.add_argument("--queries", type=int, default=200, help="Queries per measurement")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(
+        f"{'blocks':>8} | {'contain: scan':>14} {'index':>10} | "
+        f"{'dirty: scan':>14} {'index':>10}   (microseconds per call)"
+    )
+    for num_blocks in args.sizes:
+        block_rois = make_block_rois(num_blocks, args.block_shape)
+        index = RoiIndex()
+        for roi in block_rois:
+            index.add(roi)
+
+        lookups = [random_subroi(rng, rng.choice(block_rois)) for _ in range(args.queries)]
+        # Small dirty rois, e.g. from a brush stroke
+        dirty_rois = [random_subroi(rng, rng.choice(block_rois)) for _ in range(args.queries)]
+
+        scan_contain = time_per_call(lambda q: containing_rois(list(block_rois), q), lookups)
+        index_contain = time_per_call(index.containing, lookups)
+        scan_dirty = time_per_call(
+            lambda q: [r for r in block_rois if getIntersection(r, q, assertIntersect=False)], dirty_rois
+        )
+        index_dirty = time_per_call(index.intersecting, dirty_rois)
+
+        print(
+            f"{num_blocks:>8} | {scan_contain * 1e6:>14.1f} {index_contain * 1e6:>10.1f} |"
+            f" {scan_dirty * 1e6:>14.1f} {index_dirty * 1e6:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
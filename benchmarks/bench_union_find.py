@@ -0,0 +1,145 @@
+"""
+Compare the NumPy based UnionFindArray of OpLazyConnectedComponents with the previous implementation,
+a dict mapping every label to its parent without path compression or union by rank.
+
+Two measurements are made:
+
+  * union find: reserve --labels labels, join --labels random pairs and resolve all labels,
+    with one call per label (old) or with the batched methods (new)
+  * labeling: label a synthetic volume with many small objects using OpLazyConnectedComponents,
+    once with each implementation, and check that both find the same objects
+
+Example:
+
+    python benchmarks/bench_union_find.py --labels 1000000
+    python benchmarks/bench_union_find.py --shape 400 400 200 --chunkshape 64 64 64 --density 0.4
+"""
+import argparse
+import time
+from threading import Lock
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import opLazyConnectedComponents
+from lazyflow.operators.opLazyConnectedComponents import OpLazyConnectedComponents, threadsafe
+
+
+class DictUnionFindArray:
+    """The previous UnionFindArray, with the batched interface implemented the way the operator used to call it."""
+
+    def __init__(self, nextFree=1, dtype=None):
+        self._map = dict(zip(*(range(nextFree),) * 2))
+        self._lock = Lock()
+        self._nextFree = nextFree
+
+    @threadsafe
+    def makeUnion(self, a, b):
+        a = self._findIndex(a)
+        b = self._findIndex(b)
+        if a > b:
+            a, b = b, a
+        self._map[b] = a
+
+    def makeUnions(self, a, b):
+        for x, y in zip(a, b):
+            self.makeUnion(x, y)
+
+    @threadsafe
+    def makeNewIndex(self):
+        newLabel = self._nextFree
+        self._nextFree += 1
+        self._map[newLabel] = newLabel
+        return newLabel
+
+    def makeNewIndices(self, n):
+        first = self.makeNewIndex()
+        for _ in range(n - 1):
+            self.makeNewIndex()
+        return first
+
+    @threadsafe
+    def findIndex(self, a):
+        return self._findIndex(a)
+
+    def _findIndex(self, a):
+        while a != self._map[a]:
+            a = self._map[a]
+        return a
+
+    def findIndices(self, labels):
+        return numpy.asarray(list(map(self.findIndex, labels)), dtype=opLazyConnectedComponents._LABEL_TYPE)
+
+
+IMPLEMENTATIONS = [("old (dict)", DictUnionFindArray), ("new (numpy)", opLazyConnectedComponents.UnionFindArray)]
+
+
+def bench_union_find(uf_class, num_labels, seed):
+    rng = numpy.random.RandomState(seed)
+    a = rng.randint(1, num_labels + 1, size=num_labels).astype(numpy.uint32)
+    b = rng.randint(1, num_labels + 1, size=num_labels).astype(numpy.uint32)
+
+    start_time = time.perf_counter()
+    uf = uf_class(1)
+    uf.makeNewIndices(num_labels)
+    uf.makeUnions(a, b)
+    roots = uf.findIndices(numpy.arange(1, num_labels + 1, dtype=numpy.uint32))
+    return time.perf_counter() - start_time, len(numpy.unique(roots))
+
+
+def bench_labeling(uf_class, volume, chunkshape):
+    original = opLazyConnectedComponents.UnionFindArray
+    opLazyConnectedComponents.UnionFindArray = uf_class
+    try:
+        op = OpLazyConnectedComponents(graph=Graph())
+        op.Input.setValue(volume)
+        op.ChunkShape.setValue(chunkshape)
+        start_time = time.perf_counter()
+        result = op.Output[...].wait()
+        return time.perf_counter() - start_time, result
+    finally:
+        opLazyConnectedComponents.UnionFindArray = original
+
+
+def same_objects(x, y):
+    """True if the label images x and y differ only by a renaming of labels."""
+    pairs = numpy.unique(x.astype(numpy.uint64).ravel() << 32 | y.ravel())
+    return len(pairs) == len(numpy.unique(x)) == len(numpy.unique(y))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", type=int, default=500000, help="Labels for the union find benchmark")
+    parser.add_argument("--shape", type=int, nargs=3, default=[256, 256, 128], help="Volume shape (xyz)")
+    parser.add_argument("--chunkshape", type=int, nargs=3, default=[64, 64, 64])
+    parser.add_argument("--density", type=float, default=0.3, help="Fraction of foreground pixels")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"union find: {args.labels} labels, {args.labels} random unions")
+    print(f"{'implementation':>14} | {'time (s)':>9} | {'speedup':>8} | {'sets':>9}")
+    old_time = None
+    for name, uf_class in IMPLEMENTATIONS:
+        elapsed, num_sets = bench_union_find(uf_class, args.labels, args.seed)
+        old_time = old_time or elapsed
+        print(f"{name:>14} | {elapsed:>9.2f} | {old_time / elapsed:>7.1f}x | {num_sets:>9}")
+
+    rng = numpy.random.RandomState(args.seed)
+    volume = (rng.rand(*args.shape) < args.density).astype(numpy.uint8)
+    volume = vigra.taggedView(volume, axistags="xyz")
+    print()
+    print(f"labeling: volume {tuple(args.shape)}, chunks {tuple(args.chunkshape)}, density {args.density}")
+    print(f"{'implementation':>14} | {'time (s)':>9} | {'speedup':>8} | {'objects':>9}")
+    old_time = None
+    results = []
+    for name, uf_class in IMPLEMENTATIONS:
+        elapsed, result = bench_labeling(uf_class, volume, tuple(args.chunkshape))
+        old_time = old_time or elapsed
+        results.append(result)
+        print(f"{name:>14} | {elapsed:>9.2f} | {old_time / elapsed:>7.1f}x | {int(result.max()):>9}")
+    print("same objects:", same_objects(*results))
+
+
+if __name__ == "__main__":
+    main()
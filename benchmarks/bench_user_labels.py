@@ -0,0 +1,121 @@
+"""
+Memory and brush stroke latency of OpCompressedUserLabelArray with dense block storage
+(CompressedChunkArray, the default) and with sparse block storage (SparseArray, SparseStorage=True).
+
+A labeling session on a large 3D volume is simulated: brush strokes are painted into random z-slices,
+each a random walk of a round brush, as drawn in a slice view.  Every tenth stroke erases the previous one.
+For each storage mode, the following is measured:
+
+  * stroke: latency of writing one stroke with setInSlot (mean and 95th percentile)
+  * view: latency of reading the 512x512 tile of the slice around each stroke, as the viewer does after painting
+  * memory: size of the stored labels at the end of the session
+
+Both modes must end up with the same labels, which is checked on all labeled blocks.
+
+Example:
+
+    python benchmarks/bench_user_labels.py --shape 512 2048 2048 --strokes 1000
+    python benchmarks/bench_user_labels.py --blockshape 256 256 256 --radius 15
+"""
+import argparse
+import time
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpCompressedUserLabelArray
+
+ERASER = 255
+MB = 2 ** 20
+
+
+def make_strokes(shape, num_strokes, radius, length, seed):
+    """A list of (roi, stroke data) for the given zyxc volume shape"""
+    rng = numpy.random.RandomState(seed)
+    yy, xx = numpy.mgrid[-radius : radius + 1, -radius : radius + 1]
+    brush = xx ** 2 + yy ** 2 <= radius ** 2
+
+    strokes = []
+    for i in range(num_strokes):
+        if i % 10 == 9:
+            previous_roi, previous_data = strokes[-1]
+            strokes.append((previous_roi, numpy.where(previous_data != 0, ERASER, 0).astype(numpy.uint8)))
+            continue
+
+        walk = rng.normal(0, radius / 2.0, size=(length, 2)).cumsum(axis=0).astype(int)
+        walk -= walk.min(axis=0)
+        extent = numpy.minimum(walk.max(axis=0) + 2 * radius + 1, shape[1:3])
+        data = numpy.zeros((1,) + tuple(walk.max(axis=0) + 2 * radius + 1) + (1,), dtype=numpy.uint8)
+        label = rng.randint(1, 4)
+        for y, x in walk:
+            data[0, y : y + 2 * radius + 1, x : x + 2 * radius + 1, 0][brush] = label
+        data = data[:, : extent[0], : extent[1]]
+
+        start = [rng.randint(0, shape[0])] + [rng.randint(0, s - e + 1) for s, e in zip(shape[1:3], extent)] + [0]
+        stop = numpy.add(start, data.shape)
+        strokes.append(((tuple(start), tuple(stop)), data))
+    return strokes
+
+
+def run(shape, blockshape, strokes, sparse):
+    op = OpCompressedUserLabelArray(graph=Graph())
+    # Only the metadata of the Input is used, so it doesn't need real data.
+    op.Input.setValue(vigra.taggedView(numpy.broadcast_to(numpy.zeros((), dtype=numpy.uint8), shape), "zyxc"))
+    op.blockShape.setValue(blockshape)
+    op.eraser.setValue(ERASER)
+    op.SparseStorage.setValue(sparse)
+
+    stroke_times, view_times = [], []
+    for (start, stop), data in strokes:
+        start_time = time.perf_counter()
+        op.Input[tuple(slice(a, b) for a, b in zip(start, stop))] = data
+        stroke_times.append(time.perf_counter() - start_time)
+
+        center = (numpy.add(start, stop) // 2)[1:3]
+        view_start = numpy.clip(center - 256, 0, numpy.maximum(numpy.subtract(shape[1:3], 512), 0))
+        view_stop = numpy.minimum(view_start + 512, shape[1:3])
+        start_time = time.perf_counter()
+        op.Output[start[0] : start[0] + 1, view_start[0] : view_stop[0], view_start[1] : view_stop[1], :].wait()
+        view_times.append(time.perf_counter() - start_time)
+    return op, numpy.array(stroke_times), numpy.array(view_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shape", type=int, nargs=3, default=[512, 1024, 1024], help="Volume shape (zyx)")
+    parser.add_argument("--blockshape", type=int, nargs=3, default=[128, 128, 128], help="Label block shape (zyx)")
+    parser.add_argument("--strokes", type=int, default=500)
+    parser.add_argument("--radius", type=int, default=8, help="Brush radius")
+    parser.add_argument("--length", type=int, default=100, help="Steps of the random walk of each stroke")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    shape = tuple(args.shape) + (1,)
+    blockshape = tuple(args.blockshape) + (1,)
+    strokes = make_strokes(shape, args.strokes, args.radius, args.length, args.seed)
+    print(f"volume {shape}, blocks {blockshape}, {args.strokes} strokes with radius {args.radius}")
+
+    print(
+        f"{'storage':>7} | {'stroke mean (ms)':>16} | {'stroke p95 (ms)':>15} | "
+        f"{'view mean (ms)':>14} | {'memory (MB)':>11} | {'blocks':>6}"
+    )
+    ops = []
+    for name, sparse in [("dense", False), ("sparse", True)]:
+        op, stroke_times, view_times = run(shape, blockshape, strokes, sparse)
+        ops.append(op)
+        print(
+            f"{name:>7} | {1000 * stroke_times.mean():>16.2f} | {1000 * numpy.percentile(stroke_times, 95):>15.2f} | "
+            f"{1000 * view_times.mean():>14.2f} | {op.usedMemory() / MB:>11.2f} | {len(op.nonzeroBlocks.value):>6}"
+        )
+
+    dense_op, sparse_op = ops
+    blocks = dense_op.nonzeroBlocks.value
+    same = len(blocks) == len(sparse_op.nonzeroBlocks.value) and all(
+        numpy.array_equal(dense_op.Output[block].wait(), sparse_op.Output[block].wait()) for block in blocks
+    )
+    print("same labels:", same)
+
+
+if __name__ == "__main__":
+    main()
@@ -31,6 +31,18 @@ class LazyflowVectorwiseClassifierFactoryABC(with_metaclass(abc.ABCMeta, object)
         """
         raise NotImplementedError
 
+    def update_and_train(self, classifier, X, y, feature_names=None):
+        """
+        Train a classifier with the (updated) feature matrix X and label vector y,
+        reusing parts of a classifier that was previously trained by this factory (a "warm start").
+        This is meant to be faster than create_and_train(), at the cost of a possibly less accurate classifier.
+
+        The default implementation doesn't reuse anything and trains a new classifier from scratch.
+
+        classifier: The previously trained classifier, which must not be modified.
+        """
+        return self.create_and_train(X, y, feature_names)
+
     @abc.abstractproperty
     def description(self):
         """
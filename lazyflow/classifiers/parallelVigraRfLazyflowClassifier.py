@@ -58,7 +58,7 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
     Trains an RF as a forest-of-forests, so that they can be trained in parallel.
     """
 
-    VERSION = 2  # This is used to determine compatibility of pickled classifier factories.
+    VERSION = 3  # This is used to determine compatibility of pickled classifier factories.
     # You must bump this if any instance members are added/removed/renamed.
 
     def __init__(
@@ -68,6 +68,7 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
         variable_importance_path=None,
         label_proportion=None,
         variable_importance_enabled=False,
+        prediction_ram_budget=None,
         **kwargs
     ):
         """
@@ -83,6 +84,10 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
         variable_importance_path: If provided, the feature importance table will also be writen to a file.
                                   (May only be used with variable_importance_enabled=True)
 
+        prediction_ram_budget: If provided, the trained classifiers predict in row chunks, so that the temporary
+                               RAM (in bytes) of one predict_probabilities() call stays below this budget,
+                               see ParallelVigraRfLazyflowClassifier.
+
         kwargs: Additional keyword args, passed directly to the vigra.RandomForest constructor.
         """
         assert (
@@ -93,6 +98,7 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
         self._label_proportion = label_proportion
         self._variable_importance_path = variable_importance_path
         self._variable_importance_enabled = variable_importance_enabled
+        self._prediction_ram_budget = prediction_ram_budget
         self._kwargs = kwargs
 
         # By default, num_forests matches the number of lazyflow worker threads
@@ -108,6 +114,9 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
     def set_label_proportion(self, label_proportion):
         self._label_proportion = label_proportion
 
+    def set_prediction_ram_budget(self, prediction_ram_budget):
+        self._prediction_ram_budget = prediction_ram_budget
+
     def create_and_train(self, X, y, feature_names=None):
         logger.debug("Training parallel vigra RF")
 
@@ -120,26 +129,7 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
 
         # Save for future reference
         known_labels = numpy.unique(y)
-
-        X = numpy.asarray(X, numpy.float32)
-        y = numpy.asarray(y, numpy.uint32)
-        if y.ndim == 1:
-            y = y[:, numpy.newaxis]
-
-        assert X.ndim == 2
-        assert len(X) == len(y)
-
-        # Sample X and y
-        if self._label_proportion:
-            proportion = self._label_proportion
-            row_num = int(proportion * X.shape[0])
-            idx = random.sample(list(range(X.shape[0])), row_num)
-            X = X[idx, :]
-            y = y[idx]
-            assert (numpy.unique(y) == known_labels).all(), (
-                "Sampled labels are not representative of the complete set: some label values are missing!\n"
-                "Sampled labels include {}, but complete set has {}".format(numpy.unique(y), known_labels)
-            )
+        X, y = self._prepare_training_data(X, y, known_labels)
 
         # Create N forests to train
         # (treecount of each might differ)
@@ -166,7 +156,98 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
             oobs = self._train_forests(forests, X, y)
 
         logger.info("Training complete. Average OOB: {}".format(numpy.average(oobs)))
-        return ParallelVigraRfLazyflowClassifier(forests, oobs, known_labels, feature_names, named_importances)
+        return ParallelVigraRfLazyflowClassifier(
+            forests, oobs, known_labels, feature_names, named_importances, self._prediction_ram_budget
+        )
+
+    def update_and_train(self, classifier, X, y, feature_names=None, num_forests_to_retrain=None):
+        """
+        Retrain only some of the forests of the given classifier with the new training data, and reuse the others.
+        The forests are replaced in a rolling fashion, oldest first, so that repeated updates eventually replace
+        every forest.  Forests that are reused have not seen the latest label changes, so the result is
+        (temporarily) less accurate than a classifier that was trained from scratch.
+
+        If the classifier can't be reused (e.g. a label class was added or removed, or the features changed),
+        a new classifier is trained from scratch.
+
+        num_forests_to_retrain: Defaults to a quarter of the forests (at least one).
+        """
+        known_labels = numpy.unique(y)
+        if not self._can_update(classifier, X, known_labels, feature_names):
+            return self.create_and_train(X, y, feature_names)
+
+        logger.debug("Updating parallel vigra RF")
+        forests = list(classifier._forests)
+        oobs = list(classifier.oobs)
+        generations = list(classifier.forest_generations)
+        generation = max(generations) + 1
+
+        if num_forests_to_retrain is None:
+            num_forests_to_retrain = (len(forests) + 3) // 4
+        num_forests_to_retrain = min(max(1, num_forests_to_retrain), len(forests))
+
+        # The oldest forests (the first ones of equally old forests)
+        oldest = sorted(range(len(forests)), key=lambda i: generations[i])[:num_forests_to_retrain]
+        new_forests = [vigra.learning.RandomForest(forests[i].treeCount(), **self._kwargs) for i in oldest]
+
+        X, y = self._prepare_training_data(X, y, known_labels)
+        new_oobs = self._train_forests(new_forests, X, y)
+
+        for i, forest, oob in zip(oldest, new_forests, new_oobs):
+            forests[i] = forest
+            oobs[i] = oob
+            generations[i] = generation
+
+        logger.info(
+            "Retrained {} of {} forests. Average OOB: {}".format(len(oldest), len(forests), numpy.average(oobs))
+        )
+        return ParallelVigraRfLazyflowClassifier(
+            forests,
+            oobs,
+            known_labels,
+            classifier.feature_names,
+            classifier.named_importances,
+            self._prediction_ram_budget,
+            generations,
+        )
+
+    def _can_update(self, classifier, X, known_labels, feature_names):
+        if not isinstance(classifier, ParallelVigraRfLazyflowClassifier):
+            return False
+        if self._variable_importance_enabled:
+            # The importances of the reused forests would be mixed with the new ones
+            return False
+        if list(classifier.known_classes) != list(known_labels):
+            return False
+        if classifier.feature_count != numpy.shape(X)[1]:
+            return False
+        if feature_names is not None and classifier.feature_names is not None:
+            if list(feature_names) != list(classifier.feature_names):
+                return False
+        # The factory settings must still match the classifier
+        return sum(forest.treeCount() for forest in classifier._forests) == self._num_trees
+
+    def _prepare_training_data(self, X, y, known_labels):
+        X = numpy.asarray(X, numpy.float32)
+        y = numpy.asarray(y, numpy.uint32)
+        if y.ndim == 1:
+            y = y[:, numpy.newaxis]
+
+        assert X.ndim == 2
+        assert len(X) == len(y)
+
+        # Sample X and y
+        if self._label_proportion:
+            proportion = self._label_proportion
+            row_num = int(proportion * X.shape[0])
+            idx = random.sample(list(range(X.shape[0])), row_num)
+            X = X[idx, :]
+            y = y[idx]
+            assert (numpy.unique(y) == known_labels).all(), (
+                "Sampled labels are not representative of the complete set: some label values are missing!\n"
+                "Sampled labels include {}, but complete set has {}".format(numpy.unique(y), known_labels)
+            )
+        return X, y
 
     @staticmethod
     def _train_forests(forests, X, y):
@@ -233,7 +314,11 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
         return oobs, named_importances
 
     def estimated_ram_usage_per_requested_predictionchannel(self):
-        return (Request.global_thread_pool.num_workers) * 4
+        if self._prediction_ram_budget is not None:
+            # Only the (float32) result scales with the number of pixels, the temporaries are bounded by the budget.
+            return 4
+        # The result, plus the full-size predictions of each forest that is predicting in parallel
+        return (1 + min(self._num_forests, max(1, Request.global_thread_pool.num_workers))) * 4
 
     @property
     def description(self):
@@ -313,9 +398,23 @@ def generate_importance_table(named_importances_dict, sort=None, export_path=Non
 class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
     """
     Adapt the vigra RandomForest class to the interface lazyflow expects.
+
+    By default, each forest predicts all rows of X (in parallel), which needs a full-size temporary
+    probability array per forest.  With a prediction_ram_budget (bytes), X is split into row chunks instead.
+    Each worker owns a preallocated chunk-sized buffer and every n-th chunk, predicts all forests of its chunks
+    into the buffer and adds them to its rows of the result, so that the buffers of all workers fit into the budget.
     """
 
-    def __init__(self, forests, oobs, known_labels, feature_names=None, named_importances=None):
+    def __init__(
+        self,
+        forests,
+        oobs,
+        known_labels,
+        feature_names=None,
+        named_importances=None,
+        prediction_ram_budget=None,
+        forest_generations=None,
+    ):
         self._known_labels = known_labels
         self._forests = forests
         self._feature_names = feature_names
@@ -328,6 +427,11 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
         # Named importances for the variable importance table
         self._named_importances = named_importances
 
+        self._prediction_ram_budget = prediction_ram_budget
+
+        # For each forest, the number of the (incremental) training that created it, see update_and_train()
+        self._forest_generations = forest_generations or [0] * len(forests)
+
     def predict_probabilities(self, X):
         logger.debug("Predicting with parallel vigra RF")
         X = numpy.asarray(X, dtype=numpy.float32)
@@ -340,6 +444,9 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
                 "Expected features: {}".format(X.shape[1], len(self._feature_names), self._feature_names)
             )
 
+        if self._prediction_ram_budget is not None:
+            return self._predict_probabilities_chunked(X)
+
         # As each forest completes, aggregate results in a shared array.
         # (Must put in a list so we can update it in this closure.)
         total_predictions = [None]
@@ -365,6 +472,36 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
         total_predictions[0] /= self._num_trees
         return total_predictions[0]
 
+    def _predict_probabilities_chunked(self, X):
+        label_count = self._forests[0].labelCount()
+        # Each worker has one (chunk_rows, label_count) float32 buffer for its predictions
+        num_workers = max(1, Request.global_thread_pool.num_workers)
+        chunk_rows = max(1, self._prediction_ram_budget // (num_workers * label_count * 4))
+        chunk_starts = list(range(0, len(X), chunk_rows))
+        num_workers = max(1, min(num_workers, len(chunk_starts)))
+
+        total_predictions = numpy.zeros((len(X), label_count), dtype=numpy.float32)
+
+        def predict_chunks(worker_index):
+            # The chunks of a worker don't overlap with those of the other workers, so no lock is needed.
+            buffer = numpy.empty((chunk_rows, label_count), dtype=numpy.float32)
+            for start in chunk_starts[worker_index::num_workers]:
+                stop = min(start + chunk_rows, len(X))
+                rows = slice(start, stop)
+                forest_predictions = buffer[: stop - start]
+                for forest in self._forests:
+                    forest.predictProbabilities(X[rows], out=forest_predictions)
+                    forest_predictions *= forest.treeCount()
+                    total_predictions[rows] += forest_predictions
+
+        pool = RequestPool()
+        for worker_index in range(num_workers):
+            pool.add(Request(partial(predict_chunks, worker_index)))
+        pool.wait()
+
+        total_predictions /= self._num_trees
+        return total_predictions
+
     @property
     def oobs(self):
         return self._oobs
@@ -385,6 +522,10 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
     def named_importances(self):
         return self._named_importances
 
+    @property
+    def forest_generations(self):
+        return self._forest_generations
+
     def serialize_hdf5(self, h5py_group):
         for forest in self._forests:
             if forest is None:
@@ -419,6 +560,10 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
             h5py_group.create_dataset("named_importances_keys", data=list(self._named_importances.keys()))
             h5py_group.create_dataset("named_importances_values", data=list(self._named_importances.values()))
 
+        h5py_group["forest_generations"] = self._forest_generations
+        if self._prediction_ram_budget is not None:
+            h5py_group["prediction_ram_budget"] = self._prediction_ram_budget
+
         os.remove(cachePath)
         os.rmdir(tmpDir)
 
@@ -466,10 +611,23 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
         except KeyError:
             named_importances = None
 
+        try:
+            forest_generations = list(map(int, h5py_group["forest_generations"][:]))
+        except KeyError:
+            # Older projects didn't store the forest generations.
+            forest_generations = None
+
+        try:
+            prediction_ram_budget = int(h5py_group["prediction_ram_budget"][()])
+        except KeyError:
+            prediction_ram_budget = None
+
         os.remove(cachePath)
         os.rmdir(tmpDir)
 
-        return ParallelVigraRfLazyflowClassifier(forests, oobs, known_labels, feature_names, named_importances)
+        return ParallelVigraRfLazyflowClassifier(
+            forests, oobs, known_labels, feature_names, named_importances, prediction_ram_budget, forest_generations
+        )
 
 
 assert issubclass(ParallelVigraRfLazyflowClassifier, LazyflowVectorwiseClassifierABC)
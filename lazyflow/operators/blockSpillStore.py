@@ -0,0 +1,227 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+import collections
+import itertools
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import weakref
+import zlib
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+
+class BlockSpillStore:
+    """
+    Disk tier for cache blocks that the cache memory manager evicts from RAM.
+
+    Each block is stored as a zlib-compressed file in a scratch directory,
+    together with a header that describes the array and a CRC32 checksum of the payload.
+    Blocks are read back via mmap and are verified before they are returned;
+    corrupted or truncated files are deleted and reported as a miss.
+
+    The store has its own byte budget (of compressed data on disk).
+    When it is exceeded, the least recently used blocks are deleted.
+
+    One store can be shared by several caches. Every cache gets its own namespace
+    (see ``new_namespace()``), so that equal block ids of different caches don't collide.
+
+    Thread-safe.
+    """
+
+    MAGIC = b"LFSPILL1"
+    _HEADER_SIZE = struct.Struct("<I")
+
+    Stats = collections.namedtuple("Stats", "hits misses corrupted evictions nbytes num_blocks")
+
+    def __init__(self, max_bytes, directory=None, compression_level=1):
+        """
+        :param max_bytes: disk budget in bytes
+        :param directory: scratch directory in which a private subdirectory is created
+                          (default: the system's temporary directory)
+        :param compression_level: zlib compression level
+        """
+        self._max_bytes = int(max_bytes)
+        self._compression_level = compression_level
+        self._directory = tempfile.mkdtemp(prefix="lazyflow-spill-", dir=directory)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self._directory, True)
+
+        self._lock = threading.Lock()
+        # (namespace, block_id) -> (path, nbytes), in LRU order
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+        self._file_counter = itertools.count()
+        self._namespace_counter = itertools.count()
+
+        self._hits = 0
+        self._misses = 0
+        self._corrupted = 0
+        self._evictions = 0
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    def new_namespace(self):
+        """Return a namespace id that has never been handed out by this store."""
+        return next(self._namespace_counter)
+
+    def put(self, namespace, block_id, data):
+        """
+        Store a copy of the given array.
+
+        :returns: list of block ids of the given namespace that were deleted to stay within the budget
+                  (may include block_id itself, if it doesn't fit at all)
+        """
+        data = numpy.ascontiguousarray(data)
+        payload = zlib.compress(data.data, self._compression_level)
+        header = json.dumps(
+            {"dtype": data.dtype.str, "shape": data.shape, "size": len(payload), "crc32": zlib.crc32(payload)}
+        ).encode()
+
+        path = os.path.join(self._directory, "{}.blk".format(next(self._file_counter)))
+        with open(path + ".tmp", "wb") as f:
+            f.write(self.MAGIC)
+            f.write(self._HEADER_SIZE.pack(len(header)))
+            f.write(header)
+            f.write(payload)
+        os.replace(path + ".tmp", path)
+        nbytes = os.path.getsize(path)
+
+        key = (namespace, block_id)
+        with self._lock:
+            self._remove_entry(key)
+            self._entries[key] = (path, nbytes)
+            self._nbytes += nbytes
+            evicted = []
+            while self._nbytes > self._max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove_entry(oldest)
+                self._evictions += 1
+                evicted.append(oldest)
+        return [evicted_id for ns, evicted_id in evicted if ns == namespace]
+
+    def get(self, namespace, block_id):
+        """
+        Read back a block.
+
+        :returns: the array, or None if the block is not in the store or failed the integrity check
+        """
+        key = (namespace, block_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            data = self._read(entry[0])
+        except (OSError, ValueError, KeyError, struct.error, zlib.error) as e:
+            with self._lock:
+                self._misses += 1
+                # If the entry was replaced or deleted in the meantime, the file is just gone.
+                if self._entries.get(key) == entry:
+                    logger.warning("Discarding corrupted spilled block {}: {}".format(block_id, e))
+                    self._corrupted += 1
+                    self._remove_entry(key)
+            return None
+
+        with self._lock:
+            self._hits += 1
+        return data
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def discard(self, namespace, block_id):
+        with self._lock:
+            self._remove_entry((namespace, block_id))
+
+    def discard_namespace(self, namespace):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == namespace]:
+                self._remove_entry(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove_entry(key)
+
+    def close(self):
+        """Delete all spilled blocks and the scratch directory."""
+        self.clear()
+        self._finalizer()
+
+    def stats(self):
+        with self._lock:
+            return self.Stats(
+                self._hits, self._misses, self._corrupted, self._evictions, self._nbytes, len(self._entries)
+            )
+
+    def _remove_entry(self, key):
+        """Must be called with self._lock held."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        path, nbytes = entry
+        self._nbytes -= nbytes
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _read(self, path):
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped[: len(self.MAGIC)] != self.MAGIC:
+                raise ValueError("bad magic number")
+            offset = len(self.MAGIC)
+            (header_size,) = self._HEADER_SIZE.unpack_from(mapped, offset)
+            offset += self._HEADER_SIZE.size
+            header = json.loads(mapped[offset : offset + header_size].decode())
+            offset += header_size
+
+            if len(mapped) - offset != header["size"]:
+                raise ValueError("truncated file")
+            with memoryview(mapped)[offset:] as payload:
+                if zlib.crc32(payload) != header["crc32"]:
+                    raise ValueError("checksum mismatch")
+                raw = zlib.decompress(payload)
+
+        dtype = numpy.dtype(header["dtype"])
+        shape = tuple(header["shape"])
+        if len(raw) != dtype.itemsize * int(numpy.prod(shape)):
+            raise ValueError("size mismatch")
+        # frombuffer() of bytes is read-only, so copy into a writeable array
+        return numpy.frombuffer(raw, dtype=dtype).reshape(shape).copy()
@@ -0,0 +1,152 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+"""
+Policies that decide in which order the cache memory manager frees cache entries.
+
+A policy only sees ``CacheEntry`` tuples, so it can be used (and benchmarked)
+independently of the cache operators.
+"""
+import collections
+from abc import ABCMeta, abstractmethod
+from typing import Iterable, List
+
+#: One unit of memory that the manager can free: a single block of a blocked cache, or a whole cache.
+#:  key: hashable id, unique among all entries (e.g. (id(cache), block_id))
+#:  info: human-readable description (for logging)
+#:  last_access_time: python timestamp
+#:  compute_time: seconds it took to compute the data, or None if unknown
+#:  nbytes: bytes occupied by the data, or None if unknown
+#:  free: callable that frees the entry and returns the number of bytes freed
+CacheEntry = collections.namedtuple("CacheEntry", "key info last_access_time compute_time nbytes free")
+
+
+def cost_per_byte(entry: CacheEntry) -> float:
+    """
+    Recomputation cost (seconds) per byte of the entry.
+    Entries with unknown cost or size are considered free to recompute.
+    """
+    if not entry.compute_time or not entry.nbytes:
+        return 0.0
+    return entry.compute_time / entry.nbytes
+
+
+class EvictionPolicy(metaclass=ABCMeta):
+    """
+    Interface for eviction policies.
+
+    The manager calls ``order()`` once per cleanup and frees entries in the returned order
+    until enough memory is available, calling ``evicted()`` for every freed entry.
+    """
+
+    name = None
+
+    @abstractmethod
+    def order(self, entries: Iterable[CacheEntry]) -> List[CacheEntry]:
+        """
+        Return the given entries sorted by eviction order (first entry is freed first).
+        """
+        raise NotImplementedError
+
+    def evicted(self, entry: CacheEntry):
+        """
+        Called after the given entry (as returned by ``order()``) has been freed.
+        """
+        pass
+
+
+class LruEvictionPolicy(EvictionPolicy):
+    """
+    Free the least recently used entries first.
+    """
+
+    name = "lru"
+
+    def order(self, entries):
+        return sorted(entries, key=lambda entry: entry.last_access_time)
+
+
+class CostPerByteEvictionPolicy(EvictionPolicy):
+    """
+    Free the entries that are cheapest to recompute (per byte) first.
+    Among entries of equal cost, the least recently used one is freed first.
+
+    Note: Entries are never aged, so expensive entries stay in the cache
+          until all cheaper entries have been freed.
+    """
+
+    name = "cost_per_byte"
+
+    def order(self, entries):
+        return sorted(entries, key=lambda entry: (cost_per_byte(entry), entry.last_access_time))
+
+
+class GreedyDualSizeEvictionPolicy(EvictionPolicy):
+    """
+    GreedyDual-Size (Cao & Irani, 1997).
+
+    Every entry has a value H = L + cost/size, which is (re-)assigned whenever the entry is added or accessed.
+    The entry with the lowest H is freed first, and the global inflation value L is raised to the H
+    of every freed entry.  Thereby, expensive entries are kept longer than cheap ones,
+    but entries that have not been accessed for a long time eventually age out.
+
+    Accesses are not reported to the policy individually.  Instead, an entry whose last_access_time
+    has changed since the previous cleanup is treated as accessed.
+    """
+
+    name = "greedy_dual_size"
+
+    def __init__(self):
+        self._inflation = 0.0
+        # key -> (last_access_time, H)
+        self._values = {}
+
+    def order(self, entries):
+        entries = list(entries)
+        values = {}
+        for entry in entries:
+            previous = self._values.get(entry.key)
+            if previous is not None and previous[0] == entry.last_access_time:
+                values[entry.key] = previous
+            else:
+                values[entry.key] = (entry.last_access_time, self._inflation + cost_per_byte(entry))
+
+        # Forget entries that don't exist any more
+        self._values = values
+        return sorted(entries, key=lambda entry: (values[entry.key][1], entry.last_access_time))
+
+    def evicted(self, entry):
+        value = self._values.pop(entry.key, None)
+        if value is not None:
+            self._inflation = max(self._inflation, value[1])
+
+
+EVICTION_POLICIES = {
+    policy.name: policy for policy in (LruEvictionPolicy, CostPerByteEvictionPolicy, GreedyDualSizeEvictionPolicy)
+}
+DEFAULT_EVICTION_POLICY = LruEvictionPolicy.name
+
+
+def create_eviction_policy(name: str) -> EvictionPolicy:
+    try:
+        return EVICTION_POLICIES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown eviction policy {name!r}. Choose one of: {', '.join(EVICTION_POLICIES)}") from None
@@ -35,6 +35,12 @@ import warnings
 from lazyflow.utility import OrderedSignal
 from lazyflow.utility import log_exception
 from lazyflow.utility import Memory
+from lazyflow.operators.cacheEvictionPolicies import (
+    CacheEntry,
+    EvictionPolicy,
+    create_eviction_policy,
+    DEFAULT_EVICTION_POLICY,
+)
 
 
 import logging
@@ -72,6 +78,16 @@ class _CacheMemoryManager(threading.Thread):
 
     the interval is measured in seconds. Each change of refresh interval
     triggers cleanup.
+
+    In addition to the periodic sweep, caches report the memory they
+    allocate via notifyMemoryAllocated(). As soon as the estimated cache
+    memory exceeds the allowed amount, the thread is woken up to clean up
+    immediately, instead of waiting for the next sweep.
+
+    The order in which cache blocks are freed is determined by an eviction
+    policy (see cacheEvictionPolicies.py), which can be exchanged at runtime::
+
+        cache_mem_manager.setEvictionPolicy("greedy_dual_size")
     """
 
     totalCacheMemory = OrderedSignal()
@@ -92,11 +108,21 @@ class _CacheMemoryManager(threading.Thread):
         self._refresh_interval = default_refresh_interval
         self._first_class_caches_lock = threading.Lock()
 
-        # maximum fraction of *allowed memory* used
+        # maximum fraction of *allowed memory* used (high-water mark)
         self._max_usage = 1.0
         # target usage fraction
         self._target_usage = 0.90
 
+        self._eviction_policy = create_eviction_policy(DEFAULT_EVICTION_POLICY)
+
+        # Allocation accounting between cleanups (see notifyMemoryAllocated())
+        self._allocation_lock = threading.Lock()
+        # cache memory measured in the last cleanup
+        self._last_total = 0
+        # bytes reported by caches since the last cleanup
+        self._allocated_since_cleanup = 0
+        self._cleanup_requested = False
+
         self._stopped = False
         self.start()
         atexit.register(self.stop)
@@ -158,20 +184,46 @@ class _CacheMemoryManager(threading.Thread):
         main loop
         """
         while not self._stopped:
-            self._wait()
+            requested = self._wait()
 
             # acquire lock so that we don't get disabled during cleanup
             with self._disable_lock:
                 if self._disabled or self._stopped:
                     continue
-                self._cleanup()
+                # Cleanups triggered by allocations happen while the caches are being filled,
+                # don't stall all threads with a full garbage collection there.
+                self._cleanup(collect_garbage=not requested)
+
+    def notifyMemoryAllocated(self, nbytes):
+        """
+        account for nbytes of memory newly allocated by a cache
 
-    def _cleanup(self):
+        Wakes the cleanup thread as soon as the cache memory (as measured in
+        the last cleanup plus everything reported since) exceeds the
+        high-water mark. The cleanup itself happens in the manager thread.
+        """
+        with self._allocation_lock:
+            self._allocated_since_cleanup += nbytes
+            if self._cleanup_requested:
+                return
+            estimate = self._last_total + self._allocated_since_cleanup
+            if estimate <= self._max_usage * Memory.getAvailableRamCaches():
+                return
+            self._cleanup_requested = True
+
+        with self._condition:
+            self._condition.notify_all()
+
+    def _cleanup(self, collect_garbage=True):
         """
         clean up once
         """
         from lazyflow.operators.opCache import ObservableCache
 
+        with self._allocation_lock:
+            # Allocations from now on are reported on top of the total measured below.
+            self._allocated_since_cleanup = 0
+
         try:
             # notify subscribed functions about current cache memory
             total = 0
@@ -202,30 +254,43 @@ class _CacheMemoryManager(threading.Thread):
             )
 
             if total <= self._max_usage * cache_memory:
+                self._last_total = total
                 return
 
             cache_entries = []
             cache_entries += [
-                (cache.lastAccessTime(), cache.name, cache.freeMemory) for cache in list(self._managed_caches)
+                CacheEntry(id(cache), cache.name, cache.lastAccessTime(), None, None, cache.freeMemory)
+                for cache in list(self._managed_caches)
             ]
             cache_entries += [
-                (lastAccessTime, f"{cache.name}: {blockKey}", functools.partial(cache.freeBlock, blockKey))
+                CacheEntry(
+                    (id(cache), blockKey),
+                    f"{cache.name}: {blockKey}",
+                    lastAccessTime,
+                    computeTime,
+                    nbytes,
+                    functools.partial(cache.evictBlock, blockKey),
+                )
                 for cache in list(self._managed_blocked_caches)
-                for blockKey, lastAccessTime in cache.getBlockAccessTimes()
+                for blockKey, lastAccessTime, computeTime, nbytes in cache.getBlockStats()
             ]
-            cache_entries.sort(key=lambda entry: entry[0])
 
-            for lastAccessTime, info, cleanupFun in cache_entries:
+            policy = self._eviction_policy
+            for entry in policy.order(cache_entries):
                 if total <= self._target_usage * cache_memory:
                     break
-                mem = cleanupFun()
-                logger.debug(f"Cleaned up {info} ({Memory.format(mem)})")
+                mem = entry.free()
+                policy.evicted(entry)
+                logger.debug(f"Cleaned up {entry.info} ({Memory.format(mem)})")
                 total -= mem
 
+            self._last_total = total
+
             # Remove references to cache entries before triggering garbage collection.
-            cleanupFun = None
+            entry = None
             cache_entries = None
-            gc.collect()
+            if collect_garbage:
+                gc.collect()
 
             msg = "Done cleaning up, cache memory usage is now at {}".format(Memory.format(total))
             if cache_memory > 0:
@@ -237,9 +302,16 @@ class _CacheMemoryManager(threading.Thread):
     def _wait(self):
         """
         sleep for _refresh_interval seconds or until woken up
+
+        @return True if the cleanup was requested by notifyMemoryAllocated()
         """
         with self._condition:
-            self._condition.wait(self._refresh_interval)
+            if not self._cleanup_requested:
+                self._condition.wait(self._refresh_interval)
+        with self._allocation_lock:
+            requested = self._cleanup_requested
+            self._cleanup_requested = False
+        return requested
 
     def stop(self):
         """
@@ -258,6 +330,22 @@ class _CacheMemoryManager(threading.Thread):
             self._refresh_interval = t
             self._condition.notifyAll()
 
+    def setEvictionPolicy(self, policy):
+        """
+        set the policy that decides which cache blocks are freed first
+
+        policy: an EvictionPolicy instance or the name of a policy
+                (one of cacheEvictionPolicies.EVICTION_POLICIES)
+        """
+        if not isinstance(policy, EvictionPolicy):
+            policy = create_eviction_policy(policy)
+        # don't swap the policy in the middle of a cleanup
+        with self._disable_lock:
+            self._eviction_policy = policy
+
+    def getEvictionPolicy(self):
+        return self._eviction_policy
+
     def disable(self):
         """
         disable all memory management
@@ -300,3 +388,11 @@ def addFirstClassCache(cache):
 
 def setRefreshInterval(seconds):
     _cache_memory_manager.setRefreshInterval(seconds)
+
+
+def notifyMemoryAllocated(nbytes):
+    _cache_memory_manager.notifyMemoryAllocated(nbytes)
+
+
+def setEvictionPolicy(policy):
+    _cache_memory_manager.setEvictionPolicy(policy)
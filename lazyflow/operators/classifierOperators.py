@@ -59,6 +59,7 @@ class OpTrainClassifierBlocked(Operator):
     ClassifierFactory = InputSlot()
     nonzeroLabelBlocks = InputSlot(level=1)  # Used only in the pixelwise case.
     MaxLabel = InputSlot()
+    IncrementalTraining = InputSlot(value=False)  # Used only in the vectorwise case.
 
     Classifier = OutputSlot()
 
@@ -73,6 +74,7 @@ class OpTrainClassifierBlocked(Operator):
         self._opVectorwiseTrain.Labels.connect(self.Labels)
         self._opVectorwiseTrain.ClassifierFactory.connect(self.ClassifierFactory)
         self._opVectorwiseTrain.MaxLabel.connect(self.MaxLabel)
+        self._opVectorwiseTrain.IncrementalTraining.connect(self.IncrementalTraining)
         self._opVectorwiseTrain.progressSignal.subscribe(self.progressSignal)
 
         # Fully connect the pixelwise training operator
@@ -246,6 +248,7 @@ class OpTrainVectorwiseClassifierBlocked(Operator):
     Labels = InputSlot(level=1)
     ClassifierFactory = InputSlot()
     MaxLabel = InputSlot()
+    IncrementalTraining = InputSlot(value=False)
 
     Classifier = OutputSlot()
 
@@ -269,6 +272,7 @@ class OpTrainVectorwiseClassifierBlocked(Operator):
         self._opTrainFromFeatures.ClassifierFactory.connect(self.ClassifierFactory)
         self._opTrainFromFeatures.LabelAndFeatureMatrix.connect(self._opConcatenateFeatureMatrices.ConcatenatedOutput)
         self._opTrainFromFeatures.MaxLabel.connect(self.MaxLabel)
+        self._opTrainFromFeatures.IncrementalTraining.connect(self.IncrementalTraining)
 
         self.Classifier.connect(self._opTrainFromFeatures.Classifier)
 
@@ -307,11 +311,17 @@ class OpTrainClassifierFromFeatureVectors(Operator):
     LabelAndFeatureMatrix = InputSlot()
 
     MaxLabel = InputSlot()
+
+    # If True, the classifier is retrained with the factory's update_and_train(),
+    # which may reuse parts of the previous classifier (faster, but possibly less accurate).
+    IncrementalTraining = InputSlot(value=False)
+
     Classifier = OutputSlot()
 
     def __init__(self, *args, **kwargs):
         super(OpTrainClassifierFromFeatureVectors, self).__init__(*args, **kwargs)
         self.trainingCompleteSignal = OrderedSignal()
+        self._previous_classifier = None
 
         # TODO: Progress...
         # self.progressSignal = OrderedSignal()
@@ -343,8 +353,16 @@ class OpTrainClassifierFromFeatureVectors(Operator):
             "".format(type(classifier_factory))
         )
 
-        logger.debug("Training new classifier: {}".format(classifier_factory.description))
-        classifier = classifier_factory.create_and_train(featMatrix, labelsMatrix[:, 0], channel_names)
+        previous_classifier = self._previous_classifier
+        if self.IncrementalTraining.value and previous_classifier is not None:
+            logger.debug("Updating classifier: {}".format(classifier_factory.description))
+            classifier = classifier_factory.update_and_train(
+                previous_classifier, featMatrix, labelsMatrix[:, 0], channel_names
+            )
+        else:
+            logger.debug("Training new classifier: {}".format(classifier_factory.description))
+            classifier = classifier_factory.create_and_train(featMatrix, labelsMatrix[:, 0], channel_names)
+        self._previous_classifier = classifier
         result[0] = classifier
         if classifier is not None:
             assert issubclass(type(classifier), LazyflowVectorwiseClassifierABC), (
@@ -356,6 +374,12 @@ class OpTrainClassifierFromFeatureVectors(Operator):
         return result
 
     def propagateDirty(self, slot, subindex, roi):
+        if slot == self.IncrementalTraining:
+            # The current classifier stays valid
+            return
+        if slot == self.ClassifierFactory:
+            # The previous classifier can't be updated by a different factory
+            self._previous_classifier = None
         self.Classifier.setDirty()
 
 
@@ -425,7 +449,8 @@ class OpBaseClassifierPredict(Operator):
     Classifier = InputSlot()
 
     # An entire prediction request is skipped if the mask is all zeros for the requested roi.
-    # Otherwise, the request is serviced as usual and the mask is ignored.
+    # Otherwise, the predictions of masked-out pixels are set to zero
+    # (and OpVectorwiseClassifierPredict doesn't compute them at all, see SparsePrediction).
     PredictionMask = InputSlot(optional=True)
 
     PMaps = OutputSlot()
@@ -478,7 +503,7 @@ class OpBaseClassifierPredict(Operator):
                 result[:] = 0.0
                 return result
 
-        probabilities = self._calculate_probabilities(roi)
+        probabilities = self._calculate_probabilities(roi, mask)
 
         # We're expecting a channel for each label class.
         # If we didn't provide at least one sample for each label,
@@ -504,8 +529,11 @@ class OpBaseClassifierPredict(Operator):
         return result
 
     @abstractmethod
-    def _calculate_probabilities(roi):
-        """Returns the channel-wise probability maps calculated on roi"""
+    def _calculate_probabilities(self, roi, mask=None):
+        """
+        Returns the channel-wise probability maps calculated on roi.
+        If a (single-channel, boolean) mask is given, the probabilities of masked-out pixels may be left out (zero).
+        """
         pass
 
     def propagateDirty(self, slot, subindex, roi):
@@ -519,7 +547,7 @@ class OpBaseClassifierPredict(Operator):
 
 
 class OpPixelwiseClassifierPredict(OpBaseClassifierPredict):
-    def _calculate_probabilities(self, roi):
+    def _calculate_probabilities(self, roi, mask=None):
         classifier = self.Classifier.value
 
         assert isinstance(
@@ -555,6 +583,10 @@ class OpPixelwiseClassifierPredict(OpBaseClassifierPredict):
 
 
 class OpVectorwiseClassifierPredict(OpBaseClassifierPredict):
+    # If there is a PredictionMask, only the feature vectors of the masked-in pixels are passed to the classifier,
+    # and only the bounding box of the mask is requested from the Image.
+    SparsePrediction = InputSlot(value=True)
+
     def setupOutputs(self):
         super().setupOutputs()
         nlabels = max(self.LabelsCount.value, 1)
@@ -578,13 +610,16 @@ class OpVectorwiseClassifierPredict(OpBaseClassifierPredict):
         feature_ram_per_pixel = max(self.Image.meta.dtype().nbytes, 4) * input_channels
         self.PMaps.meta.ram_usage_per_requested_pixel = classifier_ram_per_pixel + feature_ram_per_pixel
 
-    def _calculate_probabilities(self, roi):
+    def _calculate_probabilities(self, roi, mask=None):
         classifier = self.Classifier.value
 
         assert isinstance(
             classifier, LazyflowVectorwiseClassifierABC
         ), f"Classifier {classifier} must be sublcass of {LazyflowVectorwiseClassifierABC}"
 
+        if mask is not None and self.SparsePrediction.value:
+            return self._calculate_masked_probabilities(classifier, roi, mask[..., 0])
+
         key = roi.toSlice()
         newKey = key[:-1]
         newKey += (slice(0, self.Image.meta.shape[-1], None),)
@@ -607,3 +642,34 @@ class OpVectorwiseClassifierPredict(OpBaseClassifierPredict):
 
         probabilities.shape = shape[:-1] + (probabilities.shape[-1],)
         return probabilities
+
+    def _calculate_masked_probabilities(self, classifier, roi, mask):
+        """
+        Predict only the pixels where mask (without channel axis) is True,
+        requesting the features of the mask's bounding box only.
+        """
+        bounding_box = nonzero_bounding_box(mask)
+        bounding_box_slicing = roiToSlice(*bounding_box)
+
+        feature_roi = numpy.zeros((2, len(roi.start)), dtype=int)
+        feature_roi[:, :-1] = bounding_box + roi.start[:-1]
+        feature_roi[1, -1] = self.Image.meta.shape[-1]
+
+        with Timer() as features_timer:
+            input_data = self.Image(*feature_roi).wait()
+
+        # C-order, like the rows of the dense feature matrix
+        bounding_box_mask = mask[bounding_box_slicing]
+        features = numpy.asarray(input_data, numpy.float32)[bounding_box_mask]
+
+        with Timer() as prediction_timer:
+            masked_probabilities = classifier.predict_probabilities(features)
+
+        logger.debug(
+            f"Features took {features_timer.seconds()} seconds."
+            f" Prediction of {len(features)} of {mask.size} pixels took {prediction_timer.seconds()} seconds. {roi}"
+        )
+
+        probabilities = numpy.zeros(mask.shape + masked_probabilities.shape[-1:], dtype=masked_probabilities.dtype)
+        probabilities[bounding_box_slicing][bounding_box_mask] = masked_probabilities
+        return probabilities
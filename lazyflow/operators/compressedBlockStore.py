@@ -0,0 +1,450 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+"""
+In-memory storage for the blocks of OpUnmanagedCompressedCache.
+
+A block is a CompressedChunkArray: a grid of chunks that are compressed independently
+and kept as plain bytes in a dict.  Unlike h5py datasets, the chunks can be
+(de)compressed by several threads at once, see read_tasks() and write_tasks().
+
+Blocks that are almost entirely zero, like user-drawn labels, can be stored as a SparseArray instead,
+which only keeps the coordinates and values of the nonzero elements.
+"""
+import functools
+import itertools
+import threading
+import zlib
+
+import numpy
+
+try:
+    import numcodecs
+
+    _numcodecs_available = True
+except ImportError:
+    _numcodecs_available = False
+
+
+class _ZlibCodec:
+    """Fallback codec from the standard library, used if numcodecs is not installed."""
+
+    name = "zlib"
+
+    def __init__(self, level=1):
+        self._level = level
+
+    def encode(self, chunk):
+        return zlib.compress(chunk.data, self._level)
+
+    def decode(self, buf, out):
+        out.reshape(-1)[:] = numpy.frombuffer(zlib.decompress(buf), dtype=out.dtype)
+
+
+class _BloscCodec:
+    """Blosc with byte shuffling.  Blosc releases the GIL, so chunks can be decoded in parallel."""
+
+    def __init__(self, cname, clevel):
+        self.name = cname
+        self._codec = numcodecs.Blosc(cname=cname, clevel=clevel, shuffle=numcodecs.Blosc.SHUFFLE)
+
+    def encode(self, chunk):
+        return self._codec.encode(chunk)
+
+    def decode(self, buf, out):
+        self._codec.decode(buf, out=out)
+
+
+#: codec name -> (factory, requires numcodecs)
+CODECS = {
+    "lz4": (functools.partial(_BloscCodec, "lz4", 5), True),
+    "zstd": (functools.partial(_BloscCodec, "zstd", 3), True),
+    "zlib": (_ZlibCodec, False),
+}
+
+DEFAULT_CODEC = "lz4" if _numcodecs_available else "zlib"
+
+
+def available_codecs():
+    return [name for name, (_, needs_numcodecs) in CODECS.items() if _numcodecs_available or not needs_numcodecs]
+
+
+def create_codec(name=DEFAULT_CODEC):
+    """
+    :param name: one of CODECS
+    :raises ValueError: if the codec is unknown or its library is not installed
+    """
+    try:
+        factory, needs_numcodecs = CODECS[name]
+    except KeyError:
+        raise ValueError("Unknown codec '{}', choose one of {}".format(name, list(CODECS)))
+    if needs_numcodecs and not _numcodecs_available:
+        raise ValueError("Codec '{}' requires numcodecs, which is not installed".format(name))
+    return factory()
+
+
+class _BlockArray:
+    """
+    Common interface of the block storage classes:
+    h5py-style reading and writing of rectangular regions (``a[()]``, ``a[...]`` and tuples of slices
+    without step), and read_tasks() and write_tasks(), which split these operations into callables
+    that may be run in any order and in parallel.
+    """
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(numpy.prod(self.shape))
+
+    @property
+    def uncompressed_nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __getitem__(self, key):
+        start, stop = self._key_to_roi(key)
+        out = numpy.empty(numpy.subtract(stop, start), dtype=self.dtype)
+        for task in self.read_tasks(key, out):
+            task()
+        return out
+
+    def __setitem__(self, key, value):
+        for task in self.write_tasks(key, value):
+            task()
+
+    def read_tasks(self, key, out):
+        raise NotImplementedError
+
+    def write_tasks(self, key, value):
+        raise NotImplementedError
+
+    def _key_to_roi(self, key):
+        if key is Ellipsis or key == ():
+            return (0,) * self.ndim, self.shape
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1 :]
+        key = key + (slice(None),) * (self.ndim - len(key))
+        if len(key) != self.ndim or not all(isinstance(k, slice) for k in key):
+            raise TypeError("Only tuples of slices are supported as index, not {}".format(key))
+        start, stop = [], []
+        for k, s in zip(key, self.shape):
+            k_start, k_stop, k_step = k.indices(s)
+            if k_step != 1:
+                raise TypeError("Slices with a step are not supported: {}".format(key))
+            start.append(k_start)
+            stop.append(max(k_start, k_stop))
+        return tuple(start), tuple(stop)
+
+
+class CompressedChunkArray(_BlockArray):
+    """
+    An n-dimensional array, stored as a regular grid of independently compressed chunks.
+
+    Chunks that have never been written, or that only contain zero bytes, are not stored at all
+    and read as zeros.
+
+    Writing a region that covers whole chunks only replaces them, so concurrent writes to
+    distinct chunks and reads of other chunks are safe.  Partially covered chunks are
+    updated read-modify-write under an internal lock.
+    """
+
+    def __init__(self, shape, dtype, chunkshape, codec=None):
+        self.shape = tuple(int(s) for s in shape)
+        self.dtype = numpy.dtype(dtype)
+        self.chunkshape = tuple(int(min(c, s)) for c, s in zip(chunkshape, self.shape))
+        self._codec = codec if codec is not None else create_codec()
+        self._chunks = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._rmw_lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """Size of the compressed data in bytes."""
+        return self._nbytes
+
+    @property
+    def num_stored_chunks(self):
+        return len(self._chunks)
+
+    def clear(self):
+        with self._lock:
+            self._chunks = {}
+            self._nbytes = 0
+
+    def read_tasks(self, key, out):
+        """
+        Return a list of callables that copy the region ``key`` into the array ``out``, one per chunk.
+        They may be run in any order and in parallel.
+        """
+        start, stop = self._key_to_roi(key)
+        assert out.shape == tuple(numpy.subtract(stop, start)), "out has the wrong shape for {}".format(key)
+        return [
+            functools.partial(self._read_chunk, chunk_index, chunk_slicing, out[out_slicing])
+            for chunk_index, chunk_slicing, out_slicing in self._intersecting_chunks(start, stop)
+        ]
+
+    def write_tasks(self, key, value):
+        """
+        Return a list of callables that write ``value`` (broadcast to the shape of the region ``key``),
+        one per chunk.  They may be run in any order and in parallel.
+        """
+        start, stop = self._key_to_roi(key)
+        value = numpy.broadcast_to(numpy.asarray(value, dtype=self.dtype), tuple(numpy.subtract(stop, start)))
+        return [
+            functools.partial(self._write_chunk, chunk_index, chunk_slicing, value[value_slicing])
+            for chunk_index, chunk_slicing, value_slicing in self._intersecting_chunks(start, stop)
+        ]
+
+    def _chunk_shape_at(self, chunk_index):
+        return tuple(min(c, s - i * c) for i, c, s in zip(chunk_index, self.chunkshape, self.shape))
+
+    def _decode_chunk(self, chunk_index, buf):
+        chunk = numpy.empty(self._chunk_shape_at(chunk_index), dtype=self.dtype)
+        if buf is None:
+            chunk[...] = 0
+        else:
+            self._codec.decode(buf, self._codec_view(chunk))
+        return chunk
+
+    def _read_chunk(self, chunk_index, chunk_slicing, out):
+        buf = self._chunks.get(chunk_index)
+        if buf is None:
+            out[...] = 0
+        else:
+            out[...] = self._decode_chunk(chunk_index, buf)[chunk_slicing]
+
+    def _write_chunk(self, chunk_index, chunk_slicing, value):
+        if value.shape == self._chunk_shape_at(chunk_index):
+            self._store_chunk(chunk_index, numpy.ascontiguousarray(value))
+        else:
+            with self._rmw_lock:
+                chunk = self._decode_chunk(chunk_index, self._chunks.get(chunk_index))
+                chunk[chunk_slicing] = value
+                self._store_chunk(chunk_index, chunk)
+
+    def _store_chunk(self, chunk_index, chunk):
+        # Compare the bytes, so that e.g. -0.0 is not mistaken for an empty chunk
+        if chunk.reshape(-1).view(numpy.uint8).any():
+            buf = self._codec.encode(self._codec_view(chunk))
+        else:
+            buf = None
+        with self._lock:
+            old = self._chunks.pop(chunk_index, None)
+            if old is not None:
+                self._nbytes -= len(old)
+            if buf is not None:
+                self._chunks[chunk_index] = buf
+                self._nbytes += len(buf)
+
+    @staticmethod
+    def _codec_view(chunk):
+        # not every codec accepts bool arrays
+        return chunk.view(numpy.uint8) if chunk.dtype == bool else chunk
+
+    def _intersecting_chunks(self, start, stop):
+        """Yield (chunk index, slicing within the chunk, slicing within the region) for every chunk in the region."""
+        if any(a >= b for a, b in zip(start, stop)):
+            return
+        ranges = [range(a // c, (b - 1) // c + 1) for a, b, c in zip(start, stop, self.chunkshape)]
+        for chunk_index in itertools.product(*ranges):
+            chunk_start = [i * c for i, c in zip(chunk_index, self.chunkshape)]
+            chunk_slicing, region_slicing = [], []
+            for a, b, c0, c in zip(start, stop, chunk_start, self.chunkshape):
+                lo, hi = max(a, c0), min(b, c0 + c)
+                chunk_slicing.append(slice(lo - c0, hi - c0))
+                region_slicing.append(slice(lo - a, hi - a))
+            yield chunk_index, tuple(chunk_slicing), tuple(region_slicing)
+
+
+class SparseArray(_BlockArray):
+    """
+    An n-dimensional array that only stores its nonzero elements, run-length encoded in C order:
+    each run of consecutive elements with the same value is stored as its flat start index, length and value.
+    Data that lies in rows along the last axis, like brush strokes in a slice, compresses well.
+
+    paint() writes only the nonzero elements of the given data, without materializing the array.
+    Apart from copying the run arrays, its cost is proportional to the size of the painted data
+    and of the runs it intersects.  Reading a region materializes it as a dense array.
+
+    The chunkshape is not used for storage, only as a hint for exporting the array (see OpUnmanagedCompressedCache).
+    """
+
+    def __init__(self, shape, dtype, chunkshape=None):
+        self.shape = tuple(int(s) for s in shape)
+        self.dtype = numpy.dtype(dtype)
+        if chunkshape is None:
+            chunkshape = self.shape
+        self.chunkshape = tuple(int(min(c, s)) for c, s in zip(chunkshape, self.shape))
+        # (starts, lengths, values) of the runs, sorted by start.
+        # Always replaced as a whole, so that readers don't need the lock.
+        self._runs = self._empty_runs()
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """Size of the stored runs in bytes."""
+        return sum(a.nbytes for a in self._runs)
+
+    @property
+    def num_runs(self):
+        return len(self._runs[0])
+
+    @property
+    def num_nonzero(self):
+        return int(self._runs[1].sum())
+
+    @property
+    def num_stored_chunks(self):
+        # For compatibility with CompressedChunkArray: the runs count as one chunk
+        return int(self.num_runs > 0)
+
+    def count_values(self, minlength=1):
+        """
+        Like numpy.bincount() of all elements, but without counting the zeros (integer arrays only).
+        """
+        _, lengths, values = self._runs
+        return numpy.bincount(values, weights=lengths, minlength=minlength).astype(numpy.int64)
+
+    def clear(self):
+        with self._lock:
+            self._runs = self._empty_runs()
+
+    def read_tasks(self, key, out):
+        """
+        Return a list with a single callable that copies the region ``key`` into the array ``out``.
+        """
+        start, stop = self._key_to_roi(key)
+        assert out.shape == tuple(numpy.subtract(stop, start)), "out has the wrong shape for {}".format(key)
+        return [functools.partial(self._read, start, stop, out)]
+
+    def write_tasks(self, key, value):
+        """
+        Return a list with a single callable that writes ``value`` (broadcast to the shape of the region ``key``).
+        """
+        start, stop = self._key_to_roi(key)
+        value = numpy.broadcast_to(numpy.asarray(value, dtype=self.dtype), tuple(numpy.subtract(stop, start)))
+        return [functools.partial(self._write, start, stop, value)]
+
+    def paint(self, key, value, eraser_value=None):
+        """
+        Overwrite the elements of the region ``key`` for which ``value`` is nonzero, leave the others unchanged.
+        Elements for which ``value`` equals eraser_value are set to zero.
+        """
+        start, stop = self._key_to_roi(key)
+        value = numpy.asarray(value, dtype=self.dtype)
+        assert value.shape == tuple(numpy.subtract(stop, start)), "value has the wrong shape for {}".format(key)
+        new_indices, new_values = self._nonzero_elements(start, value)
+        if len(new_indices) == 0:
+            return
+
+        with self._lock:
+            starts, lengths, values = self._runs
+            # The runs that contain any of the new elements are decoded and merged with them
+            run_indices = numpy.searchsorted(starts, new_indices, side="right") - 1
+            hit = run_indices >= 0
+            hit[hit] = new_indices[hit] < starts[run_indices[hit]] + lengths[run_indices[hit]]
+            affected = numpy.zeros(len(starts), dtype=bool)
+            affected[run_indices[hit]] = True
+
+            old_indices, old_values = self._decode(starts[affected], lengths[affected], values[affected])
+            replaced = numpy.isin(old_indices, new_indices, assume_unique=True)
+            indices = numpy.concatenate([old_indices[~replaced], new_indices])
+            merged_values = numpy.concatenate([old_values[~replaced], new_values])
+            if eraser_value is not None:
+                not_erased = merged_values != eraser_value
+                indices, merged_values = indices[not_erased], merged_values[not_erased]
+            order = numpy.argsort(indices, kind="stable")
+            merged_runs = self._encode(indices[order], merged_values[order])
+
+            # None of the other runs lies between the merged elements, so the new runs can just be inserted.
+            unaffected = [a[~affected] for a in self._runs]
+            positions = numpy.searchsorted(unaffected[0], merged_runs[0])
+            self._runs = tuple(numpy.insert(a, positions, b) for a, b in zip(unaffected, merged_runs))
+
+    def _empty_runs(self):
+        return numpy.zeros((0,), dtype=numpy.intp), numpy.zeros((0,), dtype=numpy.intp), numpy.zeros((0,), self.dtype)
+
+    @staticmethod
+    def _decode(starts, lengths, values):
+        """Flat indices and values of all elements of the given runs"""
+        offsets = numpy.cumsum(lengths) - lengths
+        indices = numpy.arange(lengths.sum(), dtype=numpy.intp) - numpy.repeat(offsets - starts, lengths)
+        return indices, numpy.repeat(values, lengths)
+
+    @staticmethod
+    def _encode(indices, values):
+        """Runs of the given elements, which must be sorted by their flat indices"""
+        breaks = numpy.flatnonzero((numpy.diff(indices) != 1) | (values[1:] != values[:-1])) + 1
+        firsts = numpy.concatenate([[0], breaks]) if len(indices) > 0 else breaks
+        lengths = numpy.diff(numpy.append(firsts, len(indices)))
+        return indices[firsts], lengths.astype(numpy.intp), values[firsts]
+
+    def _nonzero_elements(self, start, value):
+        """Flat indices (sorted) and values of the nonzero elements of ``value``, which is located at ``start``."""
+        coords = numpy.nonzero(value)
+        indices = numpy.ravel_multi_index(tuple(c + s for c, s in zip(coords, start)), self.shape)
+        return indices.astype(numpy.intp, copy=False), value[coords]
+
+    def _region_runs(self, runs, start, stop):
+        """Range of the given runs that contains all runs intersecting the region [start, stop)"""
+        starts, lengths, _ = runs
+        first = numpy.ravel_multi_index(start, self.shape)
+        last = numpy.ravel_multi_index(tuple(b - 1 for b in stop), self.shape)
+        return numpy.searchsorted(starts + lengths, first, side="right"), numpy.searchsorted(starts, last, side="right")
+
+    def _region_mask(self, indices, start, stop):
+        """Which of the given flat indices lie within the region [start, stop)"""
+        mask = numpy.ones(len(indices), dtype=bool)
+        for coord, a, b in zip(numpy.unravel_index(indices, self.shape), start, stop):
+            mask &= (coord >= a) & (coord < b)
+        return mask
+
+    def _read(self, start, stop, out):
+        out[...] = 0
+        if out.size == 0:
+            return
+        runs = self._runs
+        lo, hi = self._region_runs(runs, start, stop)
+        indices, values = self._decode(*(a[lo:hi] for a in runs))
+        inside = self._region_mask(indices, start, stop)
+        coords = numpy.unravel_index(indices[inside], self.shape)
+        out[tuple(c - a for c, a in zip(coords, start))] = values[inside]
+
+    def _write(self, start, stop, value):
+        if value.size == 0:
+            return
+        new_indices, new_values = self._nonzero_elements(start, value)
+        with self._lock:
+            runs = self._runs
+            lo, hi = self._region_runs(runs, start, stop)
+            old_indices, old_values = self._decode(*(a[lo:hi] for a in runs))
+            outside = ~self._region_mask(old_indices, start, stop)
+            indices = numpy.concatenate([old_indices[outside], new_indices])
+            values = numpy.concatenate([old_values[outside], new_values])
+            order = numpy.argsort(indices, kind="stable")
+            merged_runs = self._encode(indices[order], values[order])
+            self._runs = tuple(numpy.concatenate([a[:lo], b, a[hi:]]) for a, b in zip(runs, merged_runs))
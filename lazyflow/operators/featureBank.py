@@ -0,0 +1,176 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2018, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+#          http://ilastik.org/license/
+###############################################################################
+import numpy
+import vigra
+
+from .filterOperators import WITH_FAST_FILTERS
+
+if WITH_FAST_FILTERS:
+    import fastfilters
+
+
+class FeatureBank(object):
+    """
+    Computes the pixel features of one single-channel 2D or 3D image at one scale,
+    sharing the intermediate results between the features:
+
+    - GaussianSmoothing and DifferenceOfGaussians share the Gaussian smoothing at the scale.
+    - GaussianGradientMagnitude and StructureTensorEigenvalues share the Gaussian gradient.
+    - LaplacianOfGaussian and HessianOfGaussianEigenvalues share the Hessian of Gaussian
+      (the Laplacian is its trace).
+
+    The parameters of the features match the corresponding operators in
+    :py:mod:`lazyflow.operators.filterOperators`, as they are used by OpPixelFeaturesPresmoothed
+    (e.g. the outer scale of the structure tensor is half the scale).
+
+    With fastfilters (which provides only the final features), the derivatives can't be shared:
+    only the smoothings are, and the Laplacian is derived from the Hessian eigenvalues if these are computed anyway.
+
+    All features are returned as float32 arrays with the channels first: ``(channels, *image.shape)``.
+    """
+
+    FEATURE_IDS = (
+        "GaussianSmoothing",
+        "LaplacianOfGaussian",
+        "GaussianGradientMagnitude",
+        "DifferenceOfGaussians",
+        "StructureTensorEigenvalues",
+        "HessianOfGaussianEigenvalues",
+    )
+
+    #: Ratio of the two scales of the difference of Gaussians, see OpPixelFeaturesPresmoothed
+    DOG_RATIO = 0.66
+    #: Ratio of the outer and the inner scale of the structure tensor, see OpPixelFeaturesPresmoothed
+    STRUCTURE_TENSOR_RATIO = 0.5
+
+    def __init__(self, image, scale, window_size):
+        """
+        :param image: 2D or 3D (yx or zyx) array without channel axis.
+        :param scale: Scale (sigma) of the features.
+        :param window_size: Size of the filter kernels, in multiples of sigma.
+        """
+        assert image.ndim in (2, 3), image.shape
+        self._image = numpy.require(image, dtype=numpy.float32)
+        self._axes = "zyx"[-image.ndim :]
+        self._scale = scale
+        self._window_size = window_size
+        self._results = {}
+
+    def compute(self, feature_id):
+        """The feature as a ``(channels, *image.shape)`` array."""
+        assert feature_id in self.FEATURE_IDS, f"Unknown feature: {feature_id}"
+        return self._cached(feature_id, getattr(self, "_" + feature_id))
+
+    def compute_all(self, feature_ids):
+        """
+        Compute several features, in an order that lets them share the most.
+        Returns a dict of feature id to feature.
+        """
+        # (The Laplacian can only be derived from the Hessian eigenvalues that have been computed before.)
+        ordered = sorted(set(feature_ids), key=lambda feature_id: feature_id != "HessianOfGaussianEigenvalues")
+        return {feature_id: self.compute(feature_id) for feature_id in ordered}
+
+    def _cached(self, key, fn, *args):
+        try:
+            return self._results[(key, *args)]
+        except KeyError:
+            result = self._results[(key, *args)] = fn(*args)
+            return result
+
+    def _GaussianSmoothing(self):
+        return self._cached("smoothing", self._smoothing, self._scale)
+
+    def _DifferenceOfGaussians(self):
+        return self._GaussianSmoothing() - self._cached("smoothing", self._smoothing, self._scale * self.DOG_RATIO)
+
+    if WITH_FAST_FILTERS:
+
+        def _smoothing(self, sigma):
+            return self._channels_first(fastfilters.gaussianSmoothing(self._image, sigma, self._window_size))
+
+        def _GaussianGradientMagnitude(self):
+            return self._channels_first(
+                fastfilters.gaussianGradientMagnitude(self._image, self._scale, self._window_size)
+            )
+
+        def _StructureTensorEigenvalues(self):
+            return self._channels_first(
+                fastfilters.structureTensorEigenvalues(
+                    self._image, self._scale, self._scale * self.STRUCTURE_TENSOR_RATIO, self._window_size
+                )
+            )
+
+        def _HessianOfGaussianEigenvalues(self):
+            return self._channels_first(
+                fastfilters.hessianOfGaussianEigenvalues(self._image, self._scale, self._window_size)
+            )
+
+        def _LaplacianOfGaussian(self):
+            eigenvalues = self._results.get(("HessianOfGaussianEigenvalues",))
+            if eigenvalues is not None:
+                return eigenvalues.sum(axis=0, keepdims=True, dtype=numpy.float32)
+            return self._channels_first(fastfilters.laplacianOfGaussian(self._image, self._scale, self._window_size))
+
+    else:
+
+        def _smoothing(self, sigma):
+            return self._channels_first(
+                vigra.filters.gaussianSmoothing(self._tagged(), sigma, window_size=self._window_size)
+            )
+
+        def _gradient(self):
+            """The Gaussian gradient, as a vigra vector image."""
+            return vigra.filters.gaussianGradient(self._tagged(), self._scale, window_size=self._window_size)
+
+        def _hessian(self):
+            """The Hessian of Gaussian, as a vigra tensor image."""
+            return vigra.filters.hessianOfGaussian(self._tagged(), self._scale, window_size=self._window_size)
+
+        def _GaussianGradientMagnitude(self):
+            gradient = self._channels_first(self._cached("gradient", self._gradient))
+            return numpy.sqrt(numpy.square(gradient).sum(axis=0, keepdims=True))
+
+        def _StructureTensorEigenvalues(self):
+            tensor = vigra.filters.vectorToTensor(self._cached("gradient", self._gradient))
+            tensor = vigra.filters.gaussianSmoothing(
+                tensor, self._scale * self.STRUCTURE_TENSOR_RATIO, window_size=self._window_size
+            )
+            return self._channels_first(vigra.filters.tensorEigenvalues(tensor))
+
+        def _HessianOfGaussianEigenvalues(self):
+            return self._channels_first(vigra.filters.tensorEigenvalues(self._cached("hessian", self._hessian)))
+
+        def _LaplacianOfGaussian(self):
+            return self._channels_first(vigra.filters.tensorTrace(self._cached("hessian", self._hessian)))
+
+        def _tagged(self):
+            return vigra.taggedView(self._image, self._axes)
+
+    def _channels_first(self, result):
+        if isinstance(result, vigra.VigraArray) and result.axistags is not None:
+            result = result.withAxes("c", *self._axes)
+        elif result.ndim == self._image.ndim:
+            result = result[numpy.newaxis]
+        else:
+            # Plain arrays have their channels last.
+            result = numpy.moveaxis(result, -1, 0)
+        return numpy.require(result.view(numpy.ndarray), dtype=numpy.float32)
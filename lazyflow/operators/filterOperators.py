@@ -24,8 +24,11 @@ import logging
 import numpy
 import vigra
 
+from functools import partial
+
 from lazyflow import roi
 from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.request import RequestPool
 from lazyflow.roi import roiToSlice
 
 logger = logging.getLogger(__name__)
@@ -180,30 +183,17 @@ class OpBaseFilter(Operator):
 
         filter_kwargs = self.filter_kwargs
 
-        def step(tstep, target_z_slice, full_input_slice, full_result_slice):
-            if sourceArray is None:
-                # no tmatter, if slices or indices are in 'full_input_slice', they will be converted to slices => 5d
-                source = self.Input[full_input_slice].wait()[0]  # => remove singleton t dimension
-                if process_in_2d:
-                    source = source[:, 0]  # if processing in 2d, remove singleton z dimension
-
-                assert source.shape[0] == 1  # single channel axis for input
-            else:
-                assert sourceArray.shape[1] == self.Input.meta.shape[1]
-                source = sourceArray[tstep, full_input_slice[1], ...]
-                if process_in_2d:
-                    # eliminate singleton z dimension
-                    assert isinstance(target_z_slice, int)
-                    source = source[:, target_z_slice]  # in 2d z is shared between source and target (like time)
-
-            source = numpy.require(source, dtype=self.input_dtype)
+        def step(tstep, target_c_slice, target_z_slice, source, full_result_slice):
+            # sources from the fetched block are copied to contiguous arrays,
+            # as a separate request per step returned them
+            source = numpy.require(source, dtype=self.input_dtype, requirements="C" if sourceArray is None else None)
             source = source.view(vigra.VigraArray)
-            source.axistags = axistags
+            source.axistags = copy.copy(axistags)
 
             supports_roi = self.supports_roi
             # in vigra the roi parameter does not support a channel roi
             if not WITH_FAST_FILTERS:
-                if target_c_stop - target_c_start != self.resultingChannels():
+                if target_c_slice.stop - target_c_slice.start != self.resultingChannels():
                     supports_roi = False
 
             if supports_roi:
@@ -212,7 +202,7 @@ class OpBaseFilter(Operator):
                     filter_roi = roi.sliceToRoi(full_result_slice[1:], source.shape[1:])
                 if self.supports_out:
                     try:
-                        subtarget = target[tstep, target_c_start:target_c_stop, target_z_slice].view(vigra.VigraArray)
+                        subtarget = target[tstep, target_c_slice, target_z_slice].view(vigra.VigraArray)
                         if process_in_2d:
                             subtarget = subtarget[:, 0]
 
@@ -249,19 +239,39 @@ class OpBaseFilter(Operator):
                 result = result[full_result_slice]
 
             try:
-                target[tstep, target_c_start:target_c_stop, target_z_slice] = result
+                target[tstep, target_c_slice, target_z_slice] = result
             except Exception:
-                logger.error(f"t  : {target.shape} {target[tstep, target_c_start:target_c_stop].shape} {result.shape}")
-                logger.error(f"tstep {tstep}  c {target_c_start},{target_c_stop}  z {target_z_slice} {result.shape}")
+                logger.error(f"t  : {target.shape} {target[tstep, target_c_slice].shape} {result.shape}")
+                logger.error(f"tstep {tstep}  c {target_c_slice}  z {target_z_slice} {result.shape}")
                 raise
 
         resC = self.resultingChannels()
+        first_input_c = int(numpy.floor(full_output_start[1] / resC))
+        stop_input_c = int(numpy.ceil(full_output_stop[1] / resC))
+
+        if sourceArray is None:
+            # Fetch the source of all time steps and channels (and z slices) with a single request,
+            # instead of one request per filter call.
+            source_block = self.Input[
+                (slice(full_output_start[0], full_output_stop[0]), slice(first_input_c, stop_input_c), *input_slice)
+            ].wait()
+        else:
+            assert sourceArray.shape[1] == self.Input.meta.shape[1]
 
-        for tstep, t in enumerate(range(full_output_start[0], full_output_stop[0])):
+        def get_source(tstep, input_c, target_z=None):
+            if sourceArray is None:
+                source = source_block[tstep, input_c - first_input_c : input_c - first_input_c + 1]
+            else:
+                source = sourceArray[tstep, input_c : input_c + 1, ...]
+            if process_in_2d:
+                # eliminate singleton z dimension
+                source = source[:, target_z]  # in 2d z is shared between source and target (like time)
+            return source
+
+        steps = []
+        for tstep in range(full_output_stop[0] - full_output_start[0]):
             target_c_stop = 0
-            for input_c in range(
-                int(numpy.floor(full_output_start[1] / resC)), int(numpy.ceil(full_output_stop[1] / resC))
-            ):
+            for input_c in range(first_input_c, stop_input_c):
                 output_c_start = resC * input_c
                 output_c_stop = resC * (input_c + 1)
                 result_c_start = 0
@@ -275,24 +285,27 @@ class OpBaseFilter(Operator):
 
                 target_c_start = target_c_stop
                 target_c_stop += result_c_stop - result_c_start
+                target_c_slice = slice(target_c_start, target_c_stop)
                 result_c_slice = slice(result_c_start, result_c_stop)
-                input_c_slice = slice(input_c, input_c + 1)
 
                 if process_in_2d:
-                    for target_z, input_z in enumerate(range(input_start[0], input_stop[0])):
-                        step(
-                            tstep,
-                            target_z_slice=target_z,
-                            full_input_slice=(t, input_c_slice, input_z, *input_slice[1:]),
-                            full_result_slice=(result_c_slice, *result_slice[1:]),
-                        )
+                    for target_z in range(input_stop[0] - input_start[0]):
+                        source = get_source(tstep, input_c, target_z)
+                        full_result_slice = (result_c_slice, *result_slice[1:])
+                        steps.append(partial(step, tstep, target_c_slice, target_z, source, full_result_slice))
                 else:
-                    step(
-                        tstep,
-                        target_z_slice=slice(None),
-                        full_input_slice=(t, input_c_slice, *input_slice),
-                        full_result_slice=(result_c_slice, *result_slice),
-                    )
+                    source = get_source(tstep, input_c)
+                    full_result_slice = (result_c_slice, *result_slice)
+                    steps.append(partial(step, tstep, target_c_slice, slice(None), source, full_result_slice))
+
+        if len(steps) == 1:
+            steps[0]()
+        else:
+            # The steps write to disjoint parts of the target, so they can run in parallel.
+            pool = RequestPool()
+            for fn in steps:
+                pool.request(fn)
+            pool.wait()
 
     def _n_per_space_axis(self, n=1):
         if self.invalid_z or self.ComputeIn2d.value:
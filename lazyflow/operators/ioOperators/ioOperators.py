@@ -39,8 +39,10 @@ import numpy
 import vigra
 
 from lazyflow.graph import OrderedSignal, Operator, OutputSlot, InputSlot
-from lazyflow.roi import roiToSlice, roiFromShape, determineBlockShape
+from lazyflow.request import Request
+from lazyflow.roi import roiToSlice, roiFromShape, determine_chunk_aligned_shapes
 from lazyflow.utility.bigRequestStreamer import BigRequestStreamer
+from lazyflow.utility.blockJournal import AttributeBlockJournal
 
 
 class OpImageReader(Operator):
@@ -539,6 +541,8 @@ class OpH5N5WriterBigDataset(Operator):
     # h5py uses single-threaded gzip comression, which really slows down export.
     CompressionEnabled = InputSlot(value=False)
     BatchSize = InputSlot(optional=True)
+    # If True, keep an existing (compatible) dataset and only write the blocks that its journal doesn't list.
+    Resume = InputSlot(value=False)
 
     WriteImage = OutputSlot()
 
@@ -546,6 +550,11 @@ class OpH5N5WriterBigDataset(Operator):
     logger = logging.getLogger(loggingName)
     traceLogger = logging.getLogger("TRACE." + loggingName)
 
+    #: Number of threads that write finished blocks to N5 files.  (HDF5 serializes all writes, so it gets one.)
+    n5WriterThreads = 4
+    #: Order in which the (chunk-aligned) blocks are requested and written, see BigRequestStreamer.
+    blockOrder = "C"
+
     def __init__(
         self,
         h5N5File=None,
@@ -553,6 +562,7 @@ class OpH5N5WriterBigDataset(Operator):
         Image=None,
         BatchSize: int = None,
         CompressionEnabled: bool = None,
+        Resume: bool = None,
         *args,
         **kwargs,
     ):
@@ -567,6 +577,7 @@ class OpH5N5WriterBigDataset(Operator):
         self.Image.setOrConnectIfAvailable(Image)
         self.BatchSize.setOrConnectIfAvailable(BatchSize)
         self.CompressionEnabled.setOrConnectIfAvailable(CompressionEnabled)
+        self.Resume.setOrConnectIfAvailable(Resume)
 
     def cleanUp(self):
         super().cleanUp()
@@ -614,9 +625,21 @@ class OpH5N5WriterBigDataset(Operator):
         if "c" in tagged_maxshape:
             tagged_maxshape["c"] = 1
 
-        self.chunkShape = determineBlockShape(list(tagged_maxshape.values()), 512_000.0 / dtypeBytes)
+        # Choose the chunks and the request blocks together, so that every request writes whole chunks.
+        # (Otherwise, chunks that straddle two requests have to be read, modified and recompressed.)
+        num_threads = max(1, Request.global_thread_pool.num_workers)
+        self.chunkShape, self.requestBlockShape = determine_chunk_aligned_shapes(
+            list(tagged_maxshape.values()),
+            BigRequestStreamer.determine_blockshape(self.Image, num_threads),
+            dataShape,
+            512_000.0 / dtypeBytes,
+        )
 
         if datasetName in list(g.keys()):
+            if self.Resume.value and self._isResumable(g[datasetName], dataShape, dtype):
+                self.logger.info(f"Resuming the export to the existing dataset {h5N5Path}")
+                self.d = g[datasetName]
+                return
             del g[datasetName]
         kwargs = {"shape": dataShape, "dtype": dtype, "chunks": self.chunkShape}
         if self.CompressionEnabled.value:
@@ -636,6 +659,17 @@ class OpH5N5WriterBigDataset(Operator):
         if self.Image.meta.display_mode is not None:
             self.d.attrs["display_mode"] = self.Image.meta.display_mode
 
+    def _isResumable(self, dataset, shape, dtype):
+        """
+        Whether an existing dataset was left by an unfinished export of the same image.
+        """
+        return (
+            AttributeBlockJournal.ATTRIBUTE_NAME in dataset.attrs
+            and tuple(dataset.shape) == tuple(shape)
+            and dataset.dtype == numpy.dtype(dtype)
+            and tuple(dataset.chunks) == tuple(self.chunkShape)
+        )
+
     def execute(self, slot, subindex, rroi, result):
         self.progressSignal(0)
 
@@ -652,10 +686,37 @@ class OpH5N5WriterBigDataset(Operator):
         batch_size = None
         if self.BatchSize.ready():
             batch_size = self.BatchSize.value
-        requester = BigRequestStreamer(self.Image, roiFromShape(self.Image.meta.shape), batchSize=batch_size)
+
+        # Write the blocks behind the computation, so that the workers don't wait for the disk.
+        if isinstance(self.f, z5py.N5File):
+            # z5py can write distinct chunks in parallel.
+            # The blocks are aligned to the chunks, so no chunk is written by two threads.
+            num_writers = self.n5WriterThreads
+        else:
+            num_writers = 1
+
+        # Record the written blocks, so that an interrupted export can be resumed.
+        # (The hdf5 file is flushed with every update, so the journal never lists blocks that aren't on disk.)
+        flush = self.f.file.flush if isinstance(self.f, h5py.File) else None
+        journal = AttributeBlockJournal(self.d.attrs, flush)
+        if not self.Resume.value:
+            journal.remove()
+
+        requester = BigRequestStreamer(
+            self.Image,
+            roiFromShape(self.Image.meta.shape),
+            self.requestBlockShape,
+            batchSize=batch_size,
+            allowParallelResults=num_writers > 1,
+            numWriters=num_writers,
+            blockGrid=self.chunkShape,
+            blockOrder=self.blockOrder,
+            journal=journal,
+        )
         requester.resultSignal.subscribe(handle_block_result)
         requester.progressSignal.subscribe(self.progressSignal)
         requester.execute()
+        journal.remove()
 
         # Be paranoid: Flush right now.
         if isinstance(self.f, h5py.File):
@@ -20,6 +20,7 @@
 # 		   http://ilastik.org/license/
 ###############################################################################
 
+import itertools
 import logging
 import pathlib
 import textwrap
@@ -34,7 +35,7 @@ import vigra
 
 from lazyflow.graph import InputSlot, Operator
 from lazyflow.operators.opReorderAxes import OpReorderAxes
-from lazyflow.utility import OrderedSignal, RoiRequestBatch
+from lazyflow.utility import FileBlockJournal, OrderedSignal, RoiRequestBatch
 
 logger = logging.getLogger(__name__)
 
@@ -45,11 +46,14 @@ class OpExportMultipageTiff(Operator):
     Attributes:
         Input: Image data source (input slot).
         Filepath: Path to the exported image (input slot).
+        Resume: Continue an interrupted export to Filepath (input slot).
+            The pages that were written before are copied from the existing file instead of being computed.
         progressSignal: Subscribe to this signal to receive export progress updates.
     """
 
     Input = InputSlot()
     Filepath = InputSlot()
+    Resume = InputSlot(value=False)
 
     _DEFAULT_BATCH_SIZE = 4
     # OME-TIFF requires 5D with arbitrary order.
@@ -65,6 +69,7 @@ class OpExportMultipageTiff(Operator):
         self._opReorderAxes.AxisOrder.setValue(self._EXPORT_AXES)
 
         self._page_buf = None
+        self._journal = None
 
     def setupOutputs(self):
         pass
@@ -78,20 +83,50 @@ class OpExportMultipageTiff(Operator):
     def run_export(self) -> None:
         """Export an image from Input to Filepath."""
         path = pathlib.Path(self.Filepath.value)
-        if path.exists():
-            path.unlink()
+        shape = self._opReorderAxes.Output.meta.shape
 
-        self._page_buf = _NdBuf(self._opReorderAxes.Output.meta.shape[:-2])
+        # Pages are written in order, and journaled once they are in the file.
+        self._journal = FileBlockJournal(f"{path}.journal")
+        plan = {"shape": [int(s) for s in shape], "dtype": self._dtype.str}
+        num_done = self._num_resumable_pages(path, plan) if self.Resume.value else 0
+        partial_path = path.with_name(path.name + ".partial")
+        if num_done:
+            path.replace(partial_path)
+        elif path.exists():
+            path.unlink()
+        self._journal.start(plan)
+
+        self._page_buf = _NdBuf(shape[:-2])
+        if num_done:
+            logger.info(f"Resuming the export to {path}: copying {num_done} finished pages")
+            with tifffile.TiffFile(str(partial_path)) as partial:
+                for i in range(num_done):
+                    page = vigra.taggedView(partial.pages[i].asarray(), self._EXPORT_AXES[-2:])
+                    self._write_page(i, page)
+            self._page_buf.skip(num_done)
+        if partial_path.exists():
+            partial_path.unlink()
 
         batch = RoiRequestBatch(
             outputSlot=self._opReorderAxes.Output,
-            roiIterator=_page_rois(*self._opReorderAxes.Output.meta.shape),
-            totalVolume=np.prod(self._opReorderAxes.Output.meta.shape),
+            roiIterator=itertools.islice(_page_rois(*shape), num_done, None),
+            totalVolume=np.prod(shape) - num_done * np.prod(shape[-2:]),
             batchSize=self._batch_size,
         )
         batch.progressSignal.subscribe(self.progressSignal)
         batch.resultSignal.subscribe(self._write_buffered_pages)
         batch.execute()
+        self._journal.remove()
+
+    def _num_resumable_pages(self, path: pathlib.Path, plan) -> int:
+        """Number of leading pages that an interrupted export of the same image has written to path."""
+        stored_plan, finished = self._journal.read()
+        if stored_plan != plan or not path.exists():
+            return 0
+        num_done = 0
+        while num_done in finished:
+            num_done += 1
+        return num_done
 
     def _write_buffered_pages(self, roi, page) -> None:
         """Store a new page in the buffer and write all in-order buffered pages to the file."""
@@ -102,19 +137,20 @@ class OpExportMultipageTiff(Operator):
         self._page_buf[page_idx] = page
 
         for i, page in self._page_buf:
-            if not i:
-                self._write_first_page(page)
-            else:
-                vigra.impex.writeImage(page, self.Filepath.value, dtype="", compression="NONE", mode="a")
+            self._write_page(i, page)
+
+    def _write_page(self, i: int, page) -> None:
+        """Append the page with the (raveled) index i to the file."""
+        if not i:
+            self._write_first_page(page)
+        else:
+            vigra.impex.writeImage(page, self.Filepath.value, dtype="", compression="NONE", mode="a")
+        self._journal.add(i)
 
     def _write_first_page(self, page) -> None:
         """Write the first page differently: it needs the OME-XML `ImageDescription` field."""
-        dtype = self._opReorderAxes.Output.meta.dtype
-        if isinstance(dtype, type):
-            dtype = dtype().dtype
-
         desc = _image_desc_xml(
-            dtype=dtype,
+            dtype=self._dtype,
             axes=self._opReorderAxes.Output.meta.getAxisKeys(),
             shape=self._opReorderAxes.Output.meta.shape,
             file_uuid=str(uuid.uuid1()),
@@ -130,6 +166,13 @@ class OpExportMultipageTiff(Operator):
         with tifffile.TiffWriter(self.Filepath.value, software="ilastik", byteorder="<") as writer:
             writer.save(page, description=desc, planarconfig="planar")
 
+    @property
+    def _dtype(self) -> np.dtype:
+        dtype = self._opReorderAxes.Output.meta.dtype
+        if isinstance(dtype, type):
+            dtype = dtype().dtype
+        return dtype
+
     @property
     def _batch_size(self) -> int:
         bytes_per_pixel = self.Input.meta.ram_usage_per_requested_pixel
@@ -161,6 +204,10 @@ class _NdBuf:
         i = np.ravel_multi_index(key, self._shape)
         self._items[i] = value
 
+    def skip(self, n: int):
+        """Start giving back items at the raveled index n."""
+        self._index = n
+
     def __iter__(self) -> Iterable[Any]:
         while self._index in self._items:
             i = self._index
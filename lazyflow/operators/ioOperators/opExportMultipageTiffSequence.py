@@ -29,7 +29,7 @@ import math
 import numpy
 
 from lazyflow.graph import Operator, InputSlot
-from lazyflow.utility import OrderedSignal
+from lazyflow.utility import FileBlockJournal, OrderedSignal
 from lazyflow.roi import roiFromShape
 from lazyflow.operators.generic import OpSubRegion
 
@@ -46,6 +46,7 @@ class OpExportMultipageTiffSequence(Operator):
 
     FilepathPattern = InputSlot()  # A complete filepath including a {slice_index} member and a valid file extension.
     SliceIndexOffset = InputSlot(value=0)  # Added to the {slice_index} in the export filename.
+    Resume = InputSlot(value=False)  # Skip the files that an interrupted export finished, and resume the last one.
 
     def __init__(self, *args, **kwargs):
         super(OpExportMultipageTiffSequence, self).__init__(*args, **kwargs)
@@ -80,10 +81,26 @@ class OpExportMultipageTiffSequence(Operator):
         if "{slice_index}" in filepattern:
             filepattern = filepattern.format(slice_index="{" + "slice_index:0{}".format(self._max_slice_digits) + "}")
 
+        # Each file journals its own pages, this journal lists the finished files.
+        journal = FileBlockJournal(self.FilepathPattern.value + ".journal")
+        plan = {
+            "shape": [int(s) for s in self.Input.meta.shape],
+            "pattern": filepattern,
+            "offset": self.SliceIndexOffset.value,
+        }
+        finished = set()
+        if self.Resume.value:
+            stored_plan, finished = journal.read()
+            if stored_plan != plan:
+                finished = set()
+        journal.start(plan, finished)
+
         self.progressSignal(0)
         # Nothing fancy here: Just loop over the blocks in order.
         tagged_shape = self.Input.meta.getTaggedShape()
         for block_index in range(tagged_shape[step_axis]):
+            if block_index in finished:
+                continue
             roi = numpy.array(roiFromShape(block_shape))
             roi += block_index * block_step
             roi = list(map(tuple, roi))
@@ -97,6 +114,7 @@ class OpExportMultipageTiffSequence(Operator):
                 opExportBlock = OpExportMultipageTiff(parent=self)
                 opExportBlock.Input.connect(opSubregion.Output)
                 opExportBlock.Filepath.setValue(formatted_path)
+                opExportBlock.Resume.setValue(self.Resume.value)
 
                 block_start_progress = 100 * block_index // tagged_shape[step_axis]
 
@@ -107,10 +125,12 @@ class OpExportMultipageTiffSequence(Operator):
 
                 # Run the export for this block
                 opExportBlock.run_export()
+                journal.add(block_index)
             finally:
                 opExportBlock.cleanUp()
                 opSubregion.cleanUp()
 
+        journal.remove()
         self.progressSignal(100)
 
     def setupOutputs(self):
@@ -76,6 +76,8 @@ class OpExportSlot(Operator):
     CoordinateOffset = InputSlot(
         optional=True
     )  # Add an offset to the roi coordinates in the export path (useful if Input is a subregion of a larger dataset)
+    # Continue an interrupted export (hdf5, n5, numpy and multipage tiff formats), instead of starting over.
+    Resume = InputSlot(value=False)
 
     ExportPath = OutputSlot()
     FormatSelectionErrorMsg = OutputSlot()
@@ -261,21 +263,26 @@ class OpExportSlot(Operator):
 
         # Create and open the hdf5/n5 file
         export_components = PathComponents(self.ExportPath.value)
+        # When resuming, keep the file: OpH5N5WriterBigDataset decides whether the dataset can be continued.
+        resume = self.Resume.value and os.path.exists(export_components.externalPath)
+        if not resume:
+            try:
+                if os.path.isdir(export_components.externalPath):  # externalPath leads to a n5 file
+                    shutil.rmtree(export_components.externalPath)  # n5 is stored as a directory structure
+                else:
+                    os.remove(export_components.externalPath)
+            except OSError as ex:
+                # It's okay if the file isn't there.
+                if ex.errno != 2:
+                    raise
         try:
-            if os.path.isdir(export_components.externalPath):  # externalPath leads to a n5 file
-                shutil.rmtree(export_components.externalPath)  # n5 is stored as a directory structure
-            else:
-                os.remove(export_components.externalPath)
-        except OSError as ex:
-            # It's okay if the file isn't there.
-            if ex.errno != 2:
-                raise
-        try:
-            with OpStreamingH5N5Reader.get_h5_n5_file(export_components.externalPath, "w") as h5N5File:
+            mode = "a" if resume else "w"
+            with OpStreamingH5N5Reader.get_h5_n5_file(export_components.externalPath, mode) as h5N5File:
                 # Create a temporary operator to do the work for us
                 opH5N5Writer = OpH5N5WriterBigDataset(parent=self)
                 try:
                     opH5N5Writer.CompressionEnabled.setValue(compress)
+                    opH5N5Writer.Resume.setValue(resume)
                     opH5N5Writer.h5N5File.setValue(h5N5File)
                     opH5N5Writer.h5N5Path.setValue(export_components.internalPath)
                     opH5N5Writer.Image.connect(self.Input)
@@ -303,6 +310,7 @@ class OpExportSlot(Operator):
         try:
             opWriter = OpNpyWriter(parent=self)
             opWriter.Filepath.setValue(export_path)
+            opWriter.Resume.setValue(self.Resume.value)
             opWriter.Input.connect(self.Input)
 
             # Run the export in this thread
@@ -373,6 +381,7 @@ class OpExportSlot(Operator):
         try:
             opExport = OpExportMultipageTiff(parent=self)
             opExport.Filepath.setValue(export_path)
+            opExport.Resume.setValue(self.Resume.value)
             opExport.Input.connect(self.Input)
             opExport.progressSignal.subscribe(self.progressSignal)
 
@@ -390,6 +399,7 @@ class OpExportSlot(Operator):
         try:
             opExport = OpExportMultipageTiffSequence(parent=self)
             opExport.FilepathPattern.setValue(export_path_pattern)
+            opExport.Resume.setValue(self.Resume.value)
             opExport.Input.connect(self.Input)
             opExport.progressSignal.subscribe(self.progressSignal)
 
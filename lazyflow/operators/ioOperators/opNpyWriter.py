@@ -19,11 +19,13 @@
 # This information is also available on the ilastik web site at:
 # 		   http://ilastik.org/license/
 ###############################################################################
+import os
+
 import numpy
 from lazyflow.graph import Operator, InputSlot
 
 from lazyflow.roi import roiToSlice, roiFromShape
-from lazyflow.utility import BigRequestStreamer, OrderedSignal
+from lazyflow.utility import BigRequestStreamer, FileBlockJournal, OrderedSignal
 
 import logging
 
@@ -33,6 +35,8 @@ logger = logging.getLogger(__name__)
 class OpNpyWriter(Operator):
     Input = InputSlot()
     Filepath = InputSlot()
+    # If True, continue an interrupted export: only the blocks that are not listed in the journal are written.
+    Resume = InputSlot(value=False)
 
     def __init__(self, *args, **kwargs):
         super(OpNpyWriter, self).__init__(*args, **kwargs)
@@ -51,27 +55,41 @@ class OpNpyWriter(Operator):
         """
         Requests the entire input and saves it to the file.
         This function executes synchronously.
-        """
-        # TODO: Use a lazyflow.utility.BigRequestStreamer to split up
-        #       this giant request into a series of streamed subrequests.
 
-        logger.warning(
-            "The current implementation of NPY-format data export computes the entire dataset at once, which requires lots of RAM."
-        )
+        The blocks are written directly into the (memory-mapped) file as they arrive,
+        and recorded in a journal file next to it until the export is complete.
+        """
         path = self.Filepath.value
+        # Like numpy.save
+        if not path.endswith(".npy"):
+            path += ".npy"
+        shape = self.Input.meta.shape
+        dtype = numpy.dtype(self.Input.meta.dtype)
 
         self.progressSignal(0)
 
-        final_data = numpy.zeros(self.Input.meta.shape, self.Input.meta.dtype)
+        journal = FileBlockJournal(path + ".journal")
+        final_data = None
+        if self.Resume.value and os.path.exists(path) and os.path.exists(journal.path):
+            final_data = numpy.lib.format.open_memmap(path, mode="r+")
+            if final_data.shape != shape or final_data.dtype != dtype:
+                final_data = None
+        if final_data is None:
+            journal.remove()
+            final_data = numpy.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
 
         def handle_block_result(roi, data):
             slicing = roiToSlice(*roi)
             final_data[slicing] = data
+            # The block must be on disk before it is journaled.
+            final_data.flush()
 
-        requester = BigRequestStreamer(self.Input, roiFromShape(self.Input.meta.shape))
+        requester = BigRequestStreamer(self.Input, roiFromShape(shape), journal=journal)
         requester.resultSignal.subscribe(handle_block_result)
         requester.progressSignal.subscribe(self.progressSignal)
         requester.execute()
 
-        numpy.save(path, final_data)
+        final_data.flush()
+        del final_data
+        journal.remove()
         self.progressSignal(100)
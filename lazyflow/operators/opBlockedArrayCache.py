@@ -123,12 +123,21 @@ class OpBlockedArrayCache(Operator, ManagedBlockedCache):
     def getBlockAccessTimes(self):
         return self._opSimpleBlockedArrayCache.getBlockAccessTimes()
 
+    def getBlockStats(self):
+        return self._opSimpleBlockedArrayCache.getBlockStats()
+
     def freeMemory(self):
         return self._opSimpleBlockedArrayCache.freeMemory()
 
     def freeBlock(self, key):
         return self._opSimpleBlockedArrayCache.freeBlock(key)
 
+    def evictBlock(self, key):
+        return self._opSimpleBlockedArrayCache.evictBlock(key)
+
+    def setSpillStore(self, store):
+        self._opSimpleBlockedArrayCache.setSpillStore(store)
+
     def freeDirtyMemory(self):
         return self._opSimpleBlockedArrayCache.freeDirtyMemory()
 
@@ -22,6 +22,7 @@ from builtins import object
 # 		   http://ilastik.org/license/
 ###############################################################################
 
+import threading
 from abc import abstractmethod, ABCMeta
 
 # lazyflow
@@ -108,6 +109,16 @@ class ObservableCache(Cache):
         """
         return 0.0
 
+    def notifyMemoryAllocated(self, nbytes):
+        """
+        report nbytes of memory newly allocated by this cache to the memory manager
+
+        Caches should call this whenever they store new data, so that the
+        manager can clean up as soon as the memory limit is exceeded instead
+        of at its next periodic sweep.
+        """
+        cacheMemoryManager.notifyMemoryAllocated(nbytes)
+
     def generateReport(self, memInfoNode):
         super(ObservableCache, self).generateReport(memInfoNode)
         memInfoNode.usedMemory = self.usedMemory()
@@ -188,6 +199,17 @@ class ManagedBlockedCache(ManagedCache):
         """
         raise NotImplementedError("No default implementation for getBlockAccessTimes()")
 
+    def getBlockStats(self):
+        """
+        get a list of (block_id, last_access_time, compute_time, nbytes) tuples
+
+        compute_time is the time in seconds it took to produce the block,
+        nbytes the memory occupied by the block.  Either may be None if unknown.
+        The cost aware eviction policies of the cache memory manager rely on
+        these values, the default implementation reports both as unknown.
+        """
+        return [(block_id, access_time, None, None) for block_id, access_time in self.getBlockAccessTimes()]
+
     @abstractmethod
     def freeBlock(self, block_id):
         """
@@ -201,6 +223,27 @@ class ManagedBlockedCache(ManagedCache):
         """
         raise NotImplementedError("No default implementation for freeBlock()")
 
+    def evictBlock(self, block_id):
+        """
+        free a block on behalf of the cache memory manager
+
+        Unlike blocks passed to freeBlock(), which is also used to discard
+        dirty data, an evicted block still holds valid data. Caches with a
+        disk tier (see setSpillStore()) keep a copy on disk, all others just
+        free the block.
+
+        @return amount of bytes freed in RAM
+        """
+        return self.freeBlock(block_id)
+
+    def setSpillStore(self, store):
+        """
+        spill evicted blocks to the given BlockSpillStore (or stop spilling,
+        if store is None) and read them back from there when they are
+        requested again
+        """
+        raise NotImplementedError("{} does not support spilling blocks to disk".format(type(self).__name__))
+
 
 class MemInfoNode(object):
     """
@@ -241,3 +284,31 @@ class MemInfoNode(object):
 
     def __init__(self):
         self.children = list()
+
+
+class TierHitCounter(object):
+    """
+    thread-safe statistics of where cache lookups were served from
+    (memory, the disk tier of a spilling cache, or recomputed upstream)
+    """
+
+    TIERS = ("memory", "disk", "recomputed")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.TIERS, 0)
+
+    def count(self, tier):
+        with self._lock:
+            self._counts[tier] += 1
+
+    def counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def __str__(self):
+        counts = self.counts()
+        total = sum(counts.values())
+        if total == 0:
+            return "Lookups: none"
+        return "Lookups: " + ", ".join("{} {:.1f}%".format(tier, 100.0 * counts[tier] / total) for tier in self.TIERS)
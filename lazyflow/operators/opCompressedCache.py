@@ -29,7 +29,6 @@ from builtins import map
 import logging
 from functools import partial
 import collections
-import itertools
 import time
 
 # Third-party
@@ -39,28 +38,28 @@ import h5py
 # Lazyflow
 from lazyflow.request import Request, RequestPool, RequestLock
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.roi import TinyVector, getIntersectingBlocks, getBlockBounds, roiToSlice, getIntersection
-from lazyflow.operators.opCache import ManagedBlockedCache
+from lazyflow.roi import (
+    TinyVector,
+    getIntersectingBlocks,
+    getIntersectingBlockGeometry,
+    getBlockBounds,
+    roiToSlice,
+)
+from lazyflow.operators.opCache import ManagedBlockedCache, TierHitCounter
+from lazyflow.operators.compressedBlockStore import CompressedChunkArray, create_codec
 from lazyflow.utility.chunkHelpers import chooseChunkShape
 
 logger = logging.getLogger(__name__)
 
 
-def get_storage_size(h5dataset):
-    """
-    get the storage size allocated for this hdf5 dataset in bytes
-
-    (shorthand for the hidden h5py functionality)
-    """
-    return h5py.h5d.DatasetID.get_storage_size(h5dataset.id)
-
-
 class OpUnmanagedCompressedCache(Operator):
     """
-    A blockwise cache that stores each block as a separate in-memory hdf5 file with a compressed dataset.
+    A blockwise cache that stores each block as a grid of compressed chunks in memory
+    (see lazyflow.operators.compressedBlockStore).
 
-    The files for each block have an internal chunk-shape, which corresponds to
+    The blocks have an internal chunk-shape, which corresponds to
     the amount of data that has to be decompressed for a single pixel lookup.
+    Chunks are compressed and decompressed in parallel.
     The chunk shape is prioritized as follows:
         1. Input.meta.ideal_blockshape
            (make sure to set BlockShape to a multiple of ideal_blockshape!)
@@ -80,7 +79,7 @@ class OpUnmanagedCompressedCache(Operator):
     # Also used to asynchronously force data into the cache via __setitem__ (see setInSlot(), below()
     Input = InputSlot(allow_mask=True)
 
-    # shape of internal in-memory hdf5 files (defaults to the whole volume)
+    # shape of the internal blocks (defaults to the whole volume)
     BlockShape = InputSlot(optional=True)
 
     # Output as numpy arrays
@@ -89,28 +88,41 @@ class OpUnmanagedCompressedCache(Operator):
     InputHdf5 = InputSlot(optional=True, allow_mask=True)
     # A list of rois (tuples) of the blocks that are currently stored in the cache
     CleanBlocks = OutputSlot()
-    # Provides data as hdf5 datasets.  Only allowed for rois that exactly match a block.
+    # Provides data as (lzf compressed) hdf5 datasets.  Only allowed for rois that exactly match a block.
     OutputHdf5 = OutputSlot(allow_mask=True)
 
     def __init__(self, *args, **kwargs):
         super(OpUnmanagedCompressedCache, self).__init__(*args, **kwargs)
         self._lock = RequestLock()
+        # Optional disk tier for evicted blocks (see OpCompressedCache.setSpillStore())
+        self._spill_store = None
+        self._spill_namespace = None
+        self._hits = TierHitCounter()
+        self._codec = create_codec()
         self._init_cache(None)
-        self._block_id_counter = itertools.count()  # Used to ensure unique in-memory file names
         self._ignore_ideal_blockshape = False
 
     def _init_cache(self, new_blockshape):
+        if self._spill_store is not None:
+            self._spill_store.discard_namespace(self._spill_namespace)
         with self._lock:
+            # block_start -> compute time, for all blocks in the disk tier
+            self._spilled_blocks = {}
+            # block_start -> number of writes to the block (to detect concurrent writes while spilling)
+            self._block_versions = collections.Counter()
             self._blockshape = new_blockshape
-            self._cacheFiles = {}
+            self._cacheBlocks = {}
             self._dirtyBlocks = set()
             self._blockLocks = {}
             self._chunkshape = self._chooseChunkshape(self._blockshape)
             self._last_access_times = collections.defaultdict(float)
+            # Time it took to compute each block (seconds), for cost aware eviction
+            self._block_compute_times = {}
+            self._resetMemoryCounters()
 
     def cleanUp(self):
         logger.debug("Cleaning up")
-        self._closeAllCacheFiles()
+        self._clearAllCacheBlocks()
         super(OpUnmanagedCompressedCache, self).cleanUp()
 
     def setupOutputs(self):
@@ -158,56 +170,61 @@ class OpUnmanagedCompressedCache(Operator):
             roi.stop, self.Input.meta.shape
         ).all(), "roi: {} is out-of-bounds for Input shape: {}" "".format(roi, self.Input.meta.shape)
 
-        block_starts = getIntersectingBlocks(self._blockshape, (roi.start, roi.stop))
-        block_starts = list(map(tuple, block_starts))
+        geometry = getIntersectingBlockGeometry(self.Output.meta.shape, self._blockshape, (roi.start, roi.stop))
 
-        # Ensure all block cache files are up-to-date
-        self._waitForBlocks(block_starts)
-        self._copyData(roi, destination, block_starts)
+        # Ensure all cache blocks are up-to-date
+        self._waitForBlocks(geometry)
+        self._copyData(destination, geometry)
         return destination
 
-    def _waitForBlocks(self, block_starts):
+    def _waitForBlocks(self, geometry):
         """
-        Make sure that all blocks in the given list of blocks are present in the cache before returning.
+        Make sure that all blocks of the given BlockGeometry are present in the cache before returning.
         (Blocks that are not yet present will be requested from our Input slot.)
         """
         reqPool = RequestPool()  # (Do the work in parallel.)
-        for block_start in block_starts:
-            entire_block_roi = getBlockBounds(self.Output.meta.shape, self._blockshape, block_start)
+        for entire_block_roi in zip(geometry.block_starts, geometry.block_stops):
             f = partial(self._ensureCached, entire_block_roi)
             reqPool.add(Request(f))
-        logger.debug("Waiting for {} blocks...".format(len(block_starts)))
+        logger.debug("Waiting for {} blocks...".format(geometry.num_blocks))
         reqPool.wait()
 
-    def _copyData(self, roi, destination, block_starts):
-        # Copy data from each block
-        # (Parallelism not needed here: h5py will serialize these requests anyway)
-        logger.debug("Copying data from {} blocks...".format(len(block_starts)))
-        for block_start in block_starts:
-            entire_block_roi = getBlockBounds(self.Output.meta.shape, self._blockshape, block_start)
-
-            # This block's portion of the roi
-            intersecting_roi = getIntersection((roi.start, roi.stop), entire_block_roi)
-
-            # Compute slicing within destination array and slicing within this block
-            destination_relative_intersection = numpy.subtract(intersecting_roi, roi.start)
-            block_relative_intersection = numpy.subtract(intersecting_roi, block_start)
-            destination_relative_intersection_slicing = roiToSlice(*destination_relative_intersection)
-            block_relative_intersection_slicing = roiToSlice(*block_relative_intersection)
-
+    def _copyData(self, destination, geometry):
+        """
+        Copy the blocks of the given BlockGeometry into the destination array,
+        decompressing all chunks in parallel.
+        """
+        logger.debug("Copying data from {} blocks...".format(geometry.num_blocks))
+        tasks = []
+        for entire_block_roi, destination_slicing, block_slicing in zip(
+            zip(geometry.block_starts, geometry.block_stops),
+            geometry.destination_slicings(),
+            geometry.source_slicings(),
+        ):
             # Copy from block to destination
             dataset = self._getBlockDataset(entire_block_roi)
             if self.Output.meta.has_mask:
-                destination.data[destination_relative_intersection_slicing] = dataset["data"][
-                    block_relative_intersection_slicing
-                ]
-                destination.mask[destination_relative_intersection_slicing] = dataset["mask"][
-                    block_relative_intersection_slicing
-                ]
+                tasks += dataset["data"].read_tasks(block_slicing, destination.data[destination_slicing])
+                tasks += dataset["mask"].read_tasks(block_slicing, destination.mask[destination_slicing])
                 destination.fill_value = dataset["fill_value"][()]
             else:
-                destination[destination_relative_intersection_slicing] = dataset[block_relative_intersection_slicing]
-            self._last_access_times[block_start] = time.time()
+                tasks += dataset.read_tasks(block_slicing, destination[destination_slicing])
+            self._last_access_times[tuple(entire_block_roi[0])] = time.time()
+        self._runTasks(tasks)
+
+    @staticmethod
+    def _runTasks(tasks):
+        """
+        Run the given (de)compression tasks of our blocks, in parallel if there is more than one.
+        """
+        if len(tasks) <= 1:
+            for task in tasks:
+                task()
+            return
+        pool = RequestPool()
+        for task in tasks:
+            pool.add(Request(task))
+        pool.wait()
 
     def _executeCleanBlocks(self, destination):
         """
@@ -215,7 +232,7 @@ class OpUnmanagedCompressedCache(Operator):
         an *unsorted* list of block rois that the cache currently holds.
         """
         # Set difference: clean = existing - dirty
-        clean_block_starts = set(self._cacheFiles.keys()) - self._dirtyBlocks
+        clean_block_starts = set(self._cacheBlocks.keys()) - self._dirtyBlocks
 
         output_shape = self.Output.meta.shape
         clean_block_rois = list(map(partial(getBlockBounds, output_shape, self._blockshape), clean_block_starts))
@@ -239,9 +256,19 @@ class OpUnmanagedCompressedCache(Operator):
 
         block_roi = [roi.start, roi.stop]
         self._ensureCached(block_roi)
-        dataset = self._getBlockDataset(block_roi)
-        assert str(block_roi) not in destination, "destination hdf5 group already has a dataset with this block's name"
-        destination.copy(dataset, str(block_roi))
+        block = self._getCacheBlock(block_roi)
+        name = str(block_roi)
+        assert name not in destination, "destination hdf5 group already has a dataset with this block's name"
+
+        # Only the export is hdf5, the block itself is decompressed into a temporary array.
+        chunks = block["data"].chunkshape
+        if self.Output.meta.has_mask:
+            group = destination.create_group(name)
+            group.create_dataset("data", data=block["data"][()], chunks=chunks, compression="lzf")
+            group.create_dataset("mask", data=block["mask"][()], chunks=chunks, compression="lzf")
+            group.create_dataset("fill_value", data=block["fill_value"][()])
+        else:
+            destination.create_dataset(name, data=block["data"][()], chunks=chunks, compression="lzf")
         return destination
 
     def propagateDirty(self, slot, subindex, roi):
@@ -254,6 +281,8 @@ class OpUnmanagedCompressedCache(Operator):
 
                     for block_start in block_starts:
                         self._dirtyBlocks.add(block_start)
+                for block_start in block_starts:
+                    self._discardSpilledBlock(block_start)
             # Forward to downstream connections
             self.Output.setDirty(roi)
         elif slot == self.BlockShape:
@@ -356,104 +385,115 @@ class OpUnmanagedCompressedCache(Operator):
         return tot
 
     def _usedMemory(self):
-        tot = 0.0
-        unc = 0.0
-        for key in list(self._cacheFiles.keys()):
-            real, virt = self._memoryForBlock(key)
-            tot += real
-            unc += virt
-        return tot, unc
+        # Running totals, see _updateBlockMemory()
+        return self._used_memory, self._used_memory_uncompressed
+
+    def _resetMemoryCounters(self):
+        # block_start -> (storage size, uncompressed size) as of the last write to the block
+        self._block_memory = {}
+        self._used_memory = 0
+        self._used_memory_uncompressed = 0
+
+    def _updateBlockMemory(self, block_start):
+        """
+        Measure the storage of the given block after it has been written to (or removed),
+        and update the running memory totals accordingly.
+
+        :returns: change of the block's storage size in bytes
+        """
+        real, virt = self._memoryForBlock(block_start)
+        with self._lock:
+            self._block_versions[block_start] += 1
+            old_real, old_virt = self._block_memory.pop(block_start, (0, 0))
+            if block_start in self._cacheBlocks:
+                self._block_memory[block_start] = (real, virt)
+            else:
+                real, virt = 0, 0
+            self._used_memory += real - old_real
+            self._used_memory_uncompressed += virt - old_virt
+        return real - old_real
 
     def _memoryForBlock(self, key):
         try:
-            group = self._cacheFiles[key]
+            block = self._cacheBlocks[key]
         except KeyError:
             # entry was removed, ignore it
-            return 0
-        tot = 0
-        unc = 0
-        if "data" in group:
-            ds = group["data"]
-            # actual size
-            tot += get_storage_size(ds)
-            # uncompressed size
-            unc += ds.size * self._getDtypeBytes(ds.dtype)
-        if "mask" in group:
-            tot += group["mask"].size * self._getDtypeBytes(group["mask"].dtype)
-        if "fill_value" in group:
-            tot += group["fill_value"].size * self._getDtypeBytes(group["fill_value"].dtype)
+            return 0, 0
+        # actual (compressed) size
+        tot = block["data"].nbytes
+        # uncompressed size
+        unc = block["data"].uncompressed_nbytes
+        if "mask" in block:
+            tot += block["mask"].nbytes
+        if "fill_value" in block:
+            tot += block["fill_value"].nbytes
         return tot, unc
 
-    def _getCacheFile(self, entire_block_roi):
+    def _getCacheBlock(self, entire_block_roi):
         """
-        Get the cache file for the block that starts at block_start.
+        Get the cache block that starts at block_start.
         If it doesn't exist yet, create it first.
+
+        A cache block is a dict with the CompressedChunkArray "data" and, if the
+        output has a mask, the CompressedChunkArray "mask" and the 0-d array "fill_value".
         """
         block_start = tuple(entire_block_roi[0])
-        if block_start in self._cacheFiles:
-            return self._cacheFiles[block_start]
+        if block_start in self._cacheBlocks:
+            return self._cacheBlocks[block_start]
         with self._lock:
-            if block_start not in self._cacheFiles:
-                # Create an in-memory hdf5 file with a unique name
-                # (the counter ensures that even blocks that have been deleted previously get a unique name when they are re-created).
-                logger.debug("Creating a cache file for block: {}".format(list(block_start)))
-                filename = (
-                    str(id(self)) + str(id(self._cacheFiles)) + str(block_start) + str(next(self._block_id_counter))
-                )
-                mem_file = h5py.File(filename, driver="core", backing_store=False, mode="w")
-
-                # h5py will crash if the chunkshape is larger than the dataset shape.
+            if block_start not in self._cacheBlocks:
+                logger.debug("Creating a cache block: {}".format(list(block_start)))
                 datashape = tuple(entire_block_roi[1] - entire_block_roi[0])
-                chunkshape = numpy.minimum(numpy.array(datashape), self._chunkshape)
-                chunkshape = tuple(chunkshape)
-
-                # Make a compressed dataset
-                mem_file.create_dataset(
-                    "data", shape=datashape, dtype=self.Output.meta.dtype, chunks=chunkshape, compression="lzf"
-                )  # lzf should be faster than gzip,
-                # with a slightly worse compression ratio
-                # Add mask information if needed.
-                if self.Output.meta.has_mask:
-                    mem_file.create_dataset(
-                        "mask", shape=datashape, dtype=bool, chunks=chunkshape, compression="lzf"
-                    )  # lzf should be faster than gzip,
-                    # with a slightly worse compression ratio
-                    mem_file.create_dataset("fill_value", shape=tuple(), dtype=self.Output.meta.dtype)
-
                 self._blockLocks[block_start] = RequestLock()
-                self._cacheFiles[block_start] = mem_file
+                self._cacheBlocks[block_start] = self._createCacheBlock(datashape)
                 self._dirtyBlocks.add(block_start)
-            return self._cacheFiles[block_start]
+            return self._cacheBlocks[block_start]
+
+    def _createCacheBlock(self, datashape):
+        """
+        Create the storage for a new cache block of the given shape (see _getCacheBlock()).
+        """
+        block = {"data": CompressedChunkArray(datashape, self.Output.meta.dtype, self._chunkshape, self._codec)}
+        # Add mask information if needed.
+        if self.Output.meta.has_mask:
+            block["mask"] = CompressedChunkArray(datashape, bool, self._chunkshape, self._codec)
+            block["fill_value"] = numpy.zeros((), dtype=self.Output.meta.dtype)
+        return block
 
     def _ensureCached(self, entire_block_roi):
         """
-        Ensure that the cache file for the given block is up-to-date.
+        Ensure that the cache block for the given block is up-to-date.
         (Refresh it if it's dirty.)
         """
         block_start = tuple(entire_block_roi[0])
-        block_file = self._getCacheFile(entire_block_roi)
+        block = self._getCacheBlock(entire_block_roi)
         if block_start in self._dirtyBlocks:
             updated_cache = False
             with self._blockLocks[block_start]:
                 # Check AGAIN now that we have the lock.
                 # (Avoid doing this twice in parallel requests.)
                 if block_start in self._dirtyBlocks:
-                    # Can't write directly into the hdf5 dataset because
-                    #  h5py.dataset.__getitem__ creates a copy, not a view.
+                    # The compressed block can't be written in-place by the upstream operator.
                     # We must use a temporary numpy array to hold the data.
-                    data = self.Input(*entire_block_roi).wait()
-                    block_file["data"][...] = data
+                    data, compute_time = self._unspillBlock(block_start)
+                    if data is not None:
+                        self._hits.count("disk")
+                    else:
+                        self._hits.count("recomputed")
+                        start_time = time.time()
+                        data = self.Input(*entire_block_roi).wait()
+                        compute_time = time.time() - start_time
+                    self._block_compute_times[block_start] = compute_time
+                    tasks = block["data"].write_tasks(..., data)
                     if self.Output.meta.has_mask:
-                        block_file["mask"][...] = data.mask
-                        block_file["fill_value"][...] = data.fill_value
+                        tasks += block["mask"].write_tasks(..., data.mask)
+                        block["fill_value"][...] = data.fill_value
+                    self._runTasks(tasks)
+                    self._updateBlockMemory(block_start)
 
                     if logger.isEnabledFor(logging.DEBUG):
                         uncompressed_size = numpy.prod(data.shape) * self._getDtypeBytes(data.dtype)
-                        storage_size = block_file["data"].id.get_storage_size()
-                        if "mask" in block_file:
-                            storage_size += block_file["mask"].id.get_storage_size()
-                        if "fill_value" in block_file:
-                            storage_size += block_file["fill_value"].id.get_storage_size()
+                        storage_size = self._memoryForBlock(block_start)[0]
                         logger.debug(
                             "Storage for block: {} is {}. ({}% of original)".format(
                                 block_start, storage_size, 100 * storage_size / uncompressed_size
@@ -468,6 +508,36 @@ class OpUnmanagedCompressedCache(Operator):
                 self.Output._sig_value_changed()
                 self.OutputHdf5._sig_value_changed()
                 self.CleanBlocks._sig_value_changed()
+        else:
+            self._hits.count("memory")
+
+    def _unspillBlock(self, block_start):
+        """
+        Read a block back from the disk tier, and remove it from there.
+        :returns: (data, compute_time), data is None if the block wasn't spilled (or is corrupted)
+        """
+        with self._lock:
+            store, namespace = self._spill_store, self._spill_namespace
+            if store is None or block_start not in self._spilled_blocks:
+                return None, None
+
+        data = store.get(namespace, block_start)
+        with self._lock:
+            # The block may have become dirty while it was read
+            if store is not self._spill_store or block_start not in self._spilled_blocks:
+                return None, None
+            compute_time = self._spilled_blocks.pop(block_start)
+        store.discard(namespace, block_start)
+        return data, compute_time
+
+    def _discardSpilledBlock(self, block_start):
+        """Drop the disk copy of the given block (if any), e.g. because it is outdated."""
+        with self._lock:
+            if block_start not in self._spilled_blocks:
+                return
+            del self._spilled_blocks[block_start]
+            store, namespace = self._spill_store, self._spill_namespace
+        store.discard(namespace, block_start)
 
     def setInSlot(self, slot, subindex, roi, value):
         """
@@ -493,26 +563,20 @@ class OpUnmanagedCompressedCache(Operator):
             roi.stop, self.Input.meta.shape
         ).all(), "roi: {} is out-of-bounds for Input shape: {}" "".format(roi, self.Input.meta.shape)
 
-        block_starts = getIntersectingBlocks(self._blockshape, (roi.start, roi.stop))
-        block_starts = list(map(tuple, block_starts))
+        geometry = getIntersectingBlockGeometry(self.Output.meta.shape, self._blockshape, (roi.start, roi.stop))
 
         # Copy data to each block
-        logger.debug("Copying data INTO {} blocks...".format(len(block_starts)))
-        for block_start in block_starts:
-            entire_block_roi = getBlockBounds(self.Output.meta.shape, self._blockshape, block_start)
-
-            # This block's portion of the roi
-            intersecting_roi = getIntersection((roi.start, roi.stop), entire_block_roi)
-
-            # Compute slicing within source array and slicing within this block
-            source_relative_intersection = numpy.subtract(intersecting_roi, roi.start)
-            block_relative_intersection = numpy.subtract(intersecting_roi, block_start)
-            source_relative_intersection_slicing = roiToSlice(*source_relative_intersection)
-            block_relative_intersection_slicing = roiToSlice(*block_relative_intersection)
+        logger.debug("Copying data INTO {} blocks...".format(geometry.num_blocks))
+        for entire_block_roi, source_relative_intersection_slicing, block_relative_intersection_slicing in zip(
+            zip(geometry.block_starts, geometry.block_stops),
+            geometry.destination_slicings(),
+            geometry.source_slicings(),
+        ):
+            block_start = tuple(entire_block_roi[0])
 
             new_block_data = value[source_relative_intersection_slicing]
             new_block_sum = new_block_data.sum()
-            if not store_zero_blocks and new_block_sum == 0 and block_start not in self._cacheFiles:
+            if not store_zero_blocks and new_block_sum == 0 and block_start not in self._cacheBlocks:
                 # Special fast-path: If this block doesn't exist yet,
                 #  don't bother creating if we're just going to fill it with zeros.
                 # (This feature is used by the OpCompressedUserLabelArray)
@@ -530,24 +594,29 @@ class OpUnmanagedCompressedCache(Operator):
                     # if not store_zero_blocks and new_block_sum == 0 and (dataset["data"][:] == 0).all() and (dataset["mask"]).any() and (dataset["fill_value"] == 0).all():
                     #     with self._lock:
                     #         with self._blockLocks[block_start]:
-                    #            self._cacheFiles[block_start].close()
-                    #            del self._cacheFiles[block_start]
+                    #            del self._cacheBlocks[block_start]
                     #         del self._blockLocks[block_start]
                 else:
                     dataset[block_relative_intersection_slicing] = new_block_data
 
                     # If we can, remove this block entirely.
-                    if not store_zero_blocks and new_block_sum == 0 and (dataset[:] == 0).all():
+                    # (Chunks that contain only zeros aren't stored, so usually nothing needs to be decompressed.)
+                    if (
+                        not store_zero_blocks
+                        and new_block_sum == 0
+                        and (dataset.num_stored_chunks == 0 or (dataset[:] == 0).all())
+                    ):
                         with self._lock:
                             with self._blockLocks[block_start]:
-                                self._cacheFiles[block_start].close()
-                                del self._cacheFiles[block_start]
+                                del self._cacheBlocks[block_start]
                             del self._blockLocks[block_start]
+                self._updateBlockMemory(block_start)
 
             # Here, we assume that if this function is used to update ANY PART of a
             #  block, he is responsible for updating the ENTIRE block.
             # Therefore, this block is no longer 'dirty'
             self._dirtyBlocks.discard(block_start)
+            self._discardSpilledBlock(block_start)
 
     #            self.Output._sig_value_changed()
     #            self.OutputHdf5._sig_value_changed()
@@ -570,7 +639,7 @@ class OpUnmanagedCompressedCache(Operator):
         roi_is_exactly_one_block &= ((roi.start % self._blockshape) == 0).all()
         roi_is_exactly_one_block &= (block_roi == numpy.array((roi.start, roi.stop))).all()
         if roi_is_exactly_one_block:
-            cachefile = self._getCacheFile(block_roi)
+            block = self._getCacheBlock(block_roi)
             logger.debug("Copying HDF5 data directly into block {}".format(block_roi))
 
             if self.Output.meta.has_mask:
@@ -578,20 +647,22 @@ class OpUnmanagedCompressedCache(Operator):
 
                 for each in ["data", "mask", "fill_value"]:
                     assert each in value
-                    assert cachefile[each].dtype == value[each].dtype
-                    assert cachefile[each].shape == value[each].shape
+                    assert block[each].dtype == value[each].dtype
+                    assert block[each].shape == value[each].shape
 
-                for each in ["data", "mask", "fill_value"]:
-                    del cachefile[each]
-                    cachefile.copy(value[each], each)
+                tasks = block["data"].write_tasks(..., value["data"][()])
+                tasks += block["mask"].write_tasks(..., value["mask"][()])
+                block["fill_value"][...] = value["fill_value"][()]
             else:
-                assert cachefile["data"].dtype == value.dtype
-                assert cachefile["data"].shape == value.shape
-                del cachefile["data"]
-                cachefile.copy(value, "data")
+                assert block["data"].dtype == value.dtype
+                assert block["data"].shape == value.shape
+                tasks = block["data"].write_tasks(..., value[()])
+            self._runTasks(tasks)
 
             block_start = tuple(roi.start)
+            self._updateBlockMemory(block_start)
             self._dirtyBlocks.discard(block_start)
+            self._discardSpilledBlock(block_start)
         else:
             # This hdf5 data does not correspond to exactly one block.
             # We must uncompress it and write it the "normal" way (the slow way)
@@ -613,24 +684,22 @@ class OpUnmanagedCompressedCache(Operator):
 
     def _getBlockDataset(self, entire_block_roi):
         """
-        Get the correct cache file and return the *dataset* handle,
+        Get the correct cache block and return the compressed array
+        (or the dict of data, mask and fill_value for masked data),
         not a numpy array of its contents.
         """
-        block_file = self._getCacheFile(entire_block_roi)
+        block = self._getCacheBlock(entire_block_roi)
         if self.Output.meta.has_mask:
-            return block_file["/"]
+            return block
         else:
-            return block_file["data"]
-
-    def _closeAllCacheFiles(self):
-        logger.debug("Closing all caches")
-        cacheFiles = self._cacheFiles
-        for k, v in list(cacheFiles.items()):
-            with self._blockLocks[k]:
-                v.close()
+            return block["data"]
+
+    def _clearAllCacheBlocks(self):
+        logger.debug("Clearing all caches")
         with self._lock:
             self._blockLocks = {}
-            self._cacheFiles = {}
+            self._cacheBlocks = {}
+            self._resetMemoryCounters()
 
 
 class OpCompressedCache(OpUnmanagedCompressedCache, ManagedBlockedCache):
@@ -639,14 +708,16 @@ class OpCompressedCache(OpUnmanagedCompressedCache, ManagedBlockedCache):
         # Now that we're initialized, it's safe to register with the memory manager
         self.registerWithMemoryManager()
 
+    def _updateBlockMemory(self, block_start):
+        growth = super(OpCompressedCache, self)._updateBlockMemory(block_start)
+        if growth > 0:
+            self.notifyMemoryAllocated(growth)
+        return growth
+
     def fractionOfUsedMemoryDirty(self):
-        tot = 0.0
-        dirty = 0.0
-        for key in list(self._cacheFiles.keys()):
-            real, virt = self._memoryForBlock(key)
-            tot += real
-            if key in self._dirtyBlocks:
-                dirty += real
+        tot, _ = self._usedMemory()
+        with self._lock:
+            dirty = sum(self._block_memory.get(key, (0, 0))[0] for key in self._dirtyBlocks)
         if tot > 0:
             return dirty / tot
         else:
@@ -656,19 +727,19 @@ class OpCompressedCache(OpUnmanagedCompressedCache, ManagedBlockedCache):
         super(OpCompressedCache, self).generateReport(report)
         report.dtype = self.Output.meta.dtype
         f = self._compression_factor
-        report.info = "Compression factor: {:.2f}".format(f)
+        report.info = "Compression factor: {:.2f}; {}".format(f, self._hits)
 
     def freeMemory(self):
         mem = self.usedMemory()
-        self._closeAllCacheFiles()
+        self._clearAllCacheBlocks()
         with self._lock:
-            self._cacheFiles = {}
+            self._cacheBlocks = {}
             self._dirtyBlocks = set()
         return mem
 
     def freeDirtyMemory(self):
         dirty = 0.0
-        for key in list(self._cacheFiles.keys()):
+        for key in list(self._cacheBlocks.keys()):
             if key in self._dirtyBlocks:
                 dirty += self.freeBlock(key)
                 with self._lock:
@@ -680,20 +751,18 @@ class OpCompressedCache(OpUnmanagedCompressedCache, ManagedBlockedCache):
             return 0
         with self._blockLocks[block_id]:
             try:
-                f = self._cacheFiles[block_id]
+                block = self._cacheBlocks[block_id]
             except KeyError:
-                # this file was deleted
-                return 0
-            if "data" not in f:
+                # this block was deleted
                 return 0
-            ds = f["data"]
             # use actual size, not number of bytes in
             # *uncompressed* array
-            mem = get_storage_size(ds)
-            f.close()
+            mem = block["data"].nbytes
             with self._lock:
-                del self._cacheFiles[block_id]
-                del self._last_access_times[block_id]
+                del self._cacheBlocks[block_id]
+                self._last_access_times.pop(block_id, None)
+                self._block_compute_times.pop(block_id, None)
+            self._updateBlockMemory(block_id)
             return mem
 
     def getBlockAccessTimes(self):
@@ -701,3 +770,56 @@ class OpCompressedCache(OpUnmanagedCompressedCache, ManagedBlockedCache):
             # needs to be locked because dicts must not change size
             # during iteration
             return [(key, self._last_access_times[key]) for key in self._last_access_times]
+
+    def setSpillStore(self, store):
+        with self._lock:
+            old_store, old_namespace = self._spill_store, self._spill_namespace
+            self._spill_store = store
+            self._spill_namespace = store.new_namespace() if store is not None else None
+            self._spilled_blocks = {}
+        if old_store is not None:
+            old_store.discard_namespace(old_namespace)
+
+    def evictBlock(self, block_id):
+        with self._lock:
+            store, namespace = self._spill_store, self._spill_namespace
+            block_lock = self._blockLocks.get(block_id)
+        if store is None or block_lock is None or self.Output.meta.has_mask:
+            return self.freeBlock(block_id)
+
+        with block_lock:
+            block = self._cacheBlocks.get(block_id)
+            if block is None or block_id in self._dirtyBlocks:
+                data = None
+            else:
+                version = self._block_versions[block_id]
+                data = block["data"][()]
+        if data is None:
+            return self.freeBlock(block_id)
+
+        evicted = store.put(namespace, block_id, data)
+        with self._lock:
+            # The block may have become dirty or been overwritten while it was written to disk
+            valid = (
+                block_id not in evicted
+                and block_id not in self._dirtyBlocks
+                and self._cacheBlocks.get(block_id) is block
+                and self._block_versions[block_id] == version
+                and store is self._spill_store
+            )
+            if store is self._spill_store:
+                for evicted_id in evicted:
+                    self._spilled_blocks.pop(evicted_id, None)
+            if valid:
+                self._spilled_blocks[block_id] = self._block_compute_times.get(block_id)
+        if not valid:
+            store.discard(namespace, block_id)
+        return self.freeBlock(block_id)
+
+    def getBlockStats(self):
+        with self._lock:
+            # compressed size, consistent with the result of freeBlock()
+            return [
+                (key, access_time, self._block_compute_times.get(key), self._block_memory.get(key, (None, None))[0])
+                for key, access_time in self._last_access_times.items()
+            ]
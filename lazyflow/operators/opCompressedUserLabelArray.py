@@ -36,12 +36,13 @@ from lazyflow.graph import InputSlot, OutputSlot
 from lazyflow.roi import (
     TinyVector,
     getIntersectingBlocks,
-    getIntersectingRois,
+    getIntersectingBlockGeometry,
     getBlockBounds,
     roiToSlice,
     getIntersection,
     roiFromShape,
 )
+from lazyflow.operators.compressedBlockStore import SparseArray
 from lazyflow.operators.opCompressedCache import OpUnmanagedCompressedCache
 from lazyflow.rtype import SubRegion
 
@@ -54,6 +55,13 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
     (This is not a 'managed' cache because its data must never be deleted by the memory manager.)
     Note that setInSlot has special functionality (only non-zero pixels are written, and there is also an "eraser" pixel value).
 
+    For every stored block, a histogram of its label values is maintained.
+    It is used to answer nonzeroBlocks and maxLabel without decompressing anything,
+    and to restrict clearLabel(), mergeLabels() and deleteLabel to the blocks that contain the affected labels.
+
+    If SparseStorage is True, new blocks only store their labeled pixels, run-length encoded (see SparseArray),
+    and brush strokes are inserted without decompressing the blocks. This is not supported for masked data.
+
     See note below about blockshape changes.
     """
 
@@ -62,12 +70,13 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
     eraser = InputSlot()
     deleteLabel = InputSlot(optional=True)
     blockShape = InputSlot()  # If the blockshape is changed after labels have been stored, all cache data is lost.
+    SparseStorage = InputSlot(value=False)  # Only affects blocks that are created after it has been changed.
 
     # Output = OutputSlot()
     # nonzeroValues = OutputSlot()
     # nonzeroCoordinates = OutputSlot()
     nonzeroBlocks = OutputSlot()
-    # maxLabel = OutputSlot()
+    maxLabel = OutputSlot()
 
     Projection2D = OutputSlot(allow_mask=True)  # A somewhat magic output that returns a projection of all
     # label data underneath a given roi, from all slices.
@@ -84,12 +93,59 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
     def __init__(self, *args, **kwargs):
         self._blockshape = None
         self._label_to_purge = 0
+        self._sparse_storage = False
         super(OpCompressedUserLabelArray, self).__init__(*args, **kwargs)
 
         # ignoring the ideal chunk shape is ok because we use the input only
         # to get the volume shape
         self._ignore_ideal_blockshape = True
 
+    def _init_cache(self, new_blockshape):
+        super(OpCompressedUserLabelArray, self)._init_cache(new_blockshape)
+        # block_start -> numpy.bincount() of the (unmasked) label values in the block, for all stored blocks
+        self._block_label_counts = {}
+
+    def _clearAllCacheBlocks(self):
+        super(OpCompressedUserLabelArray, self)._clearAllCacheBlocks()
+        self._block_label_counts = {}
+
+    def _createCacheBlock(self, datashape):
+        if self._sparse_storage:
+            return {"data": SparseArray(datashape, self.Output.meta.dtype, self._chunkshape)}
+        return super(OpCompressedUserLabelArray, self)._createCacheBlock(datashape)
+
+    def _isSparseBlock(self, block_start):
+        """True if the block is stored as a SparseArray or, if it doesn't exist yet, will be created as one."""
+        block = self._cacheBlocks.get(block_start)
+        if block is None:
+            return self._sparse_storage
+        return isinstance(block["data"], SparseArray)
+
+    def _storeLabelCounts(self, block_start, label_counts):
+        """
+        Store the label histogram of a block after it has been written to.
+        Only the counts of the labels > 0 are meaningful, trailing zero counts are dropped.
+        (The superclass doesn't keep blocks that were entirely cleared.)
+        """
+        if block_start in self._cacheBlocks:
+            labels_present = numpy.flatnonzero(label_counts[1:])
+            num_counts = labels_present[-1] + 2 if len(labels_present) > 0 else 1
+            self._block_label_counts[block_start] = label_counts[:num_counts]
+        else:
+            self._block_label_counts.pop(block_start, None)
+
+    def _updateLabelCounts(self, block_start, old_counts, new_counts):
+        """
+        Update the label histogram of a block after a part of it with the histogram old_counts
+        has been overwritten by data with the histogram new_counts.
+        """
+        label_counts = self._block_label_counts.get(block_start, numpy.zeros(1, dtype=numpy.int64))
+        size = max(len(label_counts), len(old_counts), len(new_counts))
+        label_counts = numpy.pad(label_counts, (0, size - len(label_counts)))
+        label_counts[: len(new_counts)] += new_counts
+        label_counts[: len(old_counts)] -= old_counts
+        self._storeLabelCounts(block_start, label_counts)
+
     def clearLabel(self, label_value):
         """
         Clear (reset to 0) all pixels of the given label value.
@@ -108,10 +164,13 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
         super(OpCompressedUserLabelArray, self).setupOutputs()
         if self.Output.meta.NOTREADY:
             self.nonzeroBlocks.meta.NOTREADY = True
+            self.maxLabel.meta.NOTREADY = True
             self.Projection2D.meta.NOTREADY = True
             return
         self.nonzeroBlocks.meta.dtype = object
         self.nonzeroBlocks.meta.shape = (1,)
+        self.maxLabel.meta.dtype = numpy.uint8
+        self.maxLabel.meta.shape = (1,)
 
         # Overwrite the Output metadata (should be uint8 no matter what the input data is...)
         self.Output.meta.assignFrom(self.Input.meta)
@@ -143,6 +202,7 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
         self._chunkshape = self._chooseChunkshape(self._blockshape)
 
         self._eraser_magic_value = self.eraser.value
+        self._sparse_storage = self.SparseStorage.value and not self.Output.meta.has_mask
 
         # Are we being told to delete a label?
         if self.deleteLabel.ready():
@@ -159,14 +219,19 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
         (2) If decrement_remaining=True, decrement all labels above that
             value so the set of stored labels remains consecutive.
             Note that the decrement is performed AFTER replacement.
+        Only blocks that contain the given label (or, with decrement_remaining, any label above it) are read.
         """
         changed_block_rois = []
-        # stored_block_rois = self.CleanBlocks.value
-        stored_block_roi_destination = [None]
-        self.execute(self.CleanBlocks, (), SubRegion(self.Output, (0,), (1,)), stored_block_roi_destination)
-        stored_block_rois = stored_block_roi_destination[0]
+        for block_start, label_counts in list(self._block_label_counts.items()):
+            if decrement_remaining:
+                affected_counts = label_counts[label_to_purge:]
+            else:
+                affected_counts = label_counts[label_to_purge : label_to_purge + 1]
+            if not affected_counts.any():
+                continue
+
+            block_roi = getBlockBounds(self.Output.meta.shape, self._blockshape, block_start)
 
-        for block_roi in stored_block_rois:
             # Get data
             block_shape = numpy.subtract(block_roi[1], block_roi[0])
             block = self.Output.stype.allocateDestination(SubRegion(self.Output, *roiFromShape(block_shape)))
@@ -187,6 +252,7 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
                 super(OpCompressedUserLabelArray, self)._setInSlotInput(
                     self.Input, (), SubRegion(self.Output, *block_roi), block, store_zero_blocks=False
                 )
+                self._storeLabelCounts(block_start, numpy.bincount(numpy.ma.compressed(block), minlength=1))
                 changed_block_rois.append(block_roi)
 
         for block_roi in changed_block_rois:
@@ -198,6 +264,8 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
             self._executeOutput(roi, destination)
         elif slot == self.nonzeroBlocks:
             self._execute_nonzeroBlocks(destination)
+        elif slot == self.maxLabel:
+            destination[0] = self._maxLabel()
         elif slot == self.Projection2D:
             self._executeProjection2D(roi, destination)
         else:
@@ -211,17 +279,21 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
             roi.stop, self.Output.meta.shape
         ).all(), "roi: {} is out-of-bounds for Output shape: {}" "".format(roi, self.Output.meta.shape)
 
-        block_starts = getIntersectingBlocks(self._blockshape, (roi.start, roi.stop))
-        self._copyData(roi, destination, block_starts)
+        geometry = getIntersectingBlockGeometry(self.Output.meta.shape, self._blockshape, (roi.start, roi.stop))
+        self._copyData(destination, geometry)
         return destination
 
     def _execute_nonzeroBlocks(self, destination):
-        stored_block_rois_destination = [None]
-        self._executeCleanBlocks(stored_block_rois_destination)
-        stored_block_rois = stored_block_rois_destination[0]
-        block_slicings = [roiToSlice(*block_roi) for block_roi in stored_block_rois]
+        block_slicings = [
+            roiToSlice(*getBlockBounds(self.Output.meta.shape, self._blockshape, block_start))
+            for block_start in self._block_label_counts
+        ]
         destination[0] = block_slicings
 
+    def _maxLabel(self):
+        # The last entry of a bincount is always nonzero (except for blocks without any unmasked label pixels)
+        return max([len(label_counts) - 1 for label_counts in self._block_label_counts.values()], default=0)
+
     def _executeProjection2D(self, roi, destination):
         assert sum(TinyVector(destination.shape) > 1) <= 2, "Projection result must be exactly 2D"
 
@@ -268,10 +340,9 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
         # Get the logical blocking.
         block_starts = getIntersectingBlocks(self._blockshape, (input_roi.start, input_roi.stop))
 
-        # (Parallelism wouldn't help here: h5py will serialize these requests anyway)
         block_starts = list(map(tuple, block_starts))
         for block_start in block_starts:
-            if block_start not in self._cacheFiles:
+            if block_start not in self._cacheBlocks:
                 # No label data in this block.  Move on.
                 continue
 
@@ -346,44 +417,29 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
 
         return
 
-    def _copyData(self, roi, destination, block_starts):
+    def _copyData(self, destination, geometry):
         """
-        Copy data from each block into the destination array.
+        Copy data from each block of the given BlockGeometry into the destination array.
         For blocks that aren't currently stored, just write zeros.
         """
-        # (Parallelism not needed here: h5py will serialize these requests anyway)
-        block_starts = list(map(tuple, block_starts))
-        for block_start in block_starts:
-            entire_block_roi = getBlockBounds(self.Output.meta.shape, self._blockshape, block_start)
-
-            # This block's portion of the roi
-            intersecting_roi = getIntersection((roi.start, roi.stop), entire_block_roi)
-
-            # Compute slicing within destination array and slicing within this block
-            destination_relative_intersection = numpy.subtract(intersecting_roi, roi.start)
-            block_relative_intersection = numpy.subtract(intersecting_roi, block_start)
-            destination_relative_intersection_slicing = roiToSlice(*destination_relative_intersection)
-            block_relative_intersection_slicing = roiToSlice(*block_relative_intersection)
-
-            if block_start in self._cacheFiles:
+        tasks = []
+        for block_start, block_stop, destination_slicing, block_slicing in zip(
+            geometry.block_starts, geometry.block_stops, geometry.destination_slicings(), geometry.source_slicings()
+        ):
+            if tuple(block_start) in self._cacheBlocks:
                 # Copy from block to destination
-                dataset = self._getBlockDataset(entire_block_roi)
+                dataset = self._getBlockDataset((block_start, block_stop))
 
                 if self.Output.meta.has_mask:
-                    destination[destination_relative_intersection_slicing] = dataset["data"][
-                        block_relative_intersection_slicing
-                    ]
-                    destination.mask[destination_relative_intersection_slicing] = dataset["mask"][
-                        block_relative_intersection_slicing
-                    ]
+                    tasks += dataset["data"].read_tasks(block_slicing, destination.data[destination_slicing])
+                    tasks += dataset["mask"].read_tasks(block_slicing, destination.mask[destination_slicing])
                     destination.fill_value = dataset["fill_value"][()]
                 else:
-                    destination[destination_relative_intersection_slicing] = dataset[
-                        block_relative_intersection_slicing
-                    ]
+                    tasks += dataset.read_tasks(block_slicing, destination[destination_slicing])
             else:
                 # Not stored yet.  Overwrite with zeros.
-                destination[destination_relative_intersection_slicing] = 0
+                destination[destination_slicing] = 0
+        self._runTasks(tasks)
 
     def propagateDirty(self, slot, subindex, roi):
         # There should be no way to make the output dirty except via setInSlot()
@@ -413,12 +469,13 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
             new_pixels = new_pixels.view(numpy.ndarray)
 
         # Get logical blocking.
-        block_rois = getIntersectingRois(self.Output.meta.shape, self._blockshape, (roi.start, roi.stop))
+        geometry = getIntersectingBlockGeometry(self.Output.meta.shape, self._blockshape, (roi.start, roi.stop))
         # Convert to tuples
-        block_rois = [(tuple(start), tuple(stop)) for start, stop in block_rois]
+        block_starts = [tuple(block_start) for block_start in geometry.block_starts]
+        block_rois = [(tuple(start), tuple(stop)) for start, stop in zip(geometry.starts, geometry.stops)]
 
         max_label = 0
-        for block_roi in block_rois:
+        for block_start, block_roi in zip(block_starts, block_rois):
             roi_within_data = numpy.array(block_roi) - roi.start
             new_block_pixels = new_pixels[roiToSlice(*roi_within_data)]
 
@@ -426,28 +483,11 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
             if not new_block_pixels.any():
                 continue
 
-            block_slot_roi = SubRegion(self.Output, *block_roi)
-
-            # Extract the data to modify
-            original_block_data = self.Output.stype.allocateDestination(block_slot_roi)
-            self.execute(self.Output, (), block_slot_roi, original_block_data)
-
-            # Reset the pixels we need to change (so we can use |= below)
-            original_block_data[new_block_pixels.nonzero()] = 0
-
-            # Update
-            original_block_data |= new_block_pixels
-
-            # Replace 'eraser' values with zeros.
-            cleaned_block_data = original_block_data.copy()
-            cleaned_block_data[original_block_data == self._eraser_magic_value] = 0
-
-            # Set in the cache (our superclass).
-            super(OpCompressedUserLabelArray, self)._setInSlotInput(
-                slot, subindex, block_slot_roi, cleaned_block_data, store_zero_blocks=False
-            )
-
-            max_label = max(max_label, cleaned_block_data.max())
+            if self._isSparseBlock(block_start):
+                block_max_label = self._paintSparseBlock(block_start, block_roi, new_block_pixels)
+            else:
+                block_max_label = self._paintDenseBlock(slot, subindex, block_start, block_roi, new_block_pixels)
+            max_label = max(max_label, block_max_label)
 
             # We could wait to send out one big dirty notification (instead of one per block),
             # But that might result in a lot of unecessarily dirty pixels in cases when the
@@ -462,6 +502,65 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
 
         return max_label  # Internal use: Return max label
 
+    def _paintDenseBlock(self, slot, subindex, block_start, block_roi, new_block_pixels):
+        """
+        Apply new pixels (see _setInSlotInput()) to the part block_roi of a block that is stored as a
+        CompressedChunkArray: decompress it, modify it and store it again.
+
+        Returns: the max label in block_roi
+        """
+        block_slot_roi = SubRegion(self.Output, *block_roi)
+
+        # Extract the data to modify
+        original_block_data = self.Output.stype.allocateDestination(block_slot_roi)
+        self.execute(self.Output, (), block_slot_roi, original_block_data)
+        old_label_counts = numpy.bincount(numpy.ma.compressed(original_block_data), minlength=1)
+
+        # Reset the pixels we need to change (so we can use |= below)
+        original_block_data[new_block_pixels.nonzero()] = 0
+
+        # Update
+        original_block_data |= new_block_pixels
+
+        # Replace 'eraser' values with zeros.
+        cleaned_block_data = original_block_data.copy()
+        cleaned_block_data[original_block_data == self._eraser_magic_value] = 0
+
+        # Set in the cache (our superclass).
+        super(OpCompressedUserLabelArray, self)._setInSlotInput(
+            slot, subindex, block_slot_roi, cleaned_block_data, store_zero_blocks=False
+        )
+        self._updateLabelCounts(
+            block_start, old_label_counts, numpy.bincount(numpy.ma.compressed(cleaned_block_data), minlength=1)
+        )
+
+        return cleaned_block_data.max()
+
+    def _paintSparseBlock(self, block_start, block_roi, new_block_pixels):
+        """
+        Apply new pixels (see _setInSlotInput()) to the part block_roi of a block that is stored as a SparseArray.
+        Only the new pixels are inserted, the block is not materialized.
+
+        Returns: the max label in block_roi
+        """
+        entire_block_roi = getBlockBounds(self.Output.meta.shape, self._blockshape, block_start)
+        dataset = self._getBlockDataset(entire_block_roi)
+        block_relative_slicing = roiToSlice(*numpy.subtract(block_roi, block_start))
+        dataset.paint(block_relative_slicing, new_block_pixels, self._eraser_magic_value)
+
+        # Like the superclass, don't keep blocks that were entirely cleared.
+        if dataset.num_nonzero == 0:
+            with self._lock:
+                with self._blockLocks[block_start]:
+                    del self._cacheBlocks[block_start]
+                del self._blockLocks[block_start]
+        self._updateBlockMemory(block_start)
+        self._dirtyBlocks.discard(block_start)
+        self._discardSpilledBlock(block_start)
+
+        self._storeLabelCounts(block_start, dataset.count_values())
+        return dataset[block_relative_slicing].max()
+
     def ingestData(self, slot):
         """
         Read the data from the given slot and copy it into this cache.
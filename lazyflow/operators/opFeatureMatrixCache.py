@@ -31,7 +31,7 @@ import numpy
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.request import RequestLock, Request, RequestPool
 from lazyflow.utility import OrderedSignal
-from lazyflow.roi import getBlockBounds, getIntersectingBlocks, determineBlockShape
+from lazyflow.roi import getBlockBounds, getIntersectingBlocks, getIntersection, determineBlockShape
 
 
 class OpFeatureMatrixCache(Operator):
@@ -41,6 +41,11 @@ class OpFeatureMatrixCache(Operator):
     - Cache the feature matrix for each block separately
     - Output the concatenation of all feature matrices
 
+    Blocks are updated incrementally: only the labels within the dirty part of a block are requested,
+    and features are only requested for newly labeled pixels.  Rows of pixels that were unlabeled are
+    deleted, and pixels that got a different label only have their label entry updated.
+    (If the features are dirty, a block's matrix is extracted from scratch.)
+
     Note: This operator does not currently have "NonZeroLabelBlocks" input slot.
           Instead, it only requests labels for blocks that have been
           marked dirty via dirty notifications from the LabelImage slot.
@@ -71,9 +76,18 @@ class OpFeatureMatrixCache(Operator):
 
         self._blockshape = None
         self._dirty_blocks = set()
+        # For each dirty block, the (spatial) roi of its dirty labels, or None if the whole block must be extracted
+        self._dirty_rois = {}
         self._blockwise_feature_matrices = {}
+        # For each stored block, the raveled in-block positions of its feature matrix rows (sorted)
+        self._blockwise_label_positions = {}
         self._block_locks = {}  # One lock per stored block
 
+        # The concatenated matrix, with room to append rows.
+        # The output is a view of its first rows, so rows that were output must never be modified.
+        self._total_buffer = None
+        self._total_rows = 0
+
         self._init_blocks(None, None)
 
     def _init_blocks(self, input_shape, new_blockshape):
@@ -139,12 +153,15 @@ class OpFeatureMatrixCache(Operator):
         assert slot == self.LabelAndFeatureMatrix
         self.progressSignal(0.0)
 
+        with self._lock:
+            dirty_blocks = list(self._dirty_blocks)
+
         # Technically, this could result in strange progress reporting if execute()
         #  is called by multiple threads in parallel.
         # This could be fixed with some fancier progress state, but
         # (1) We don't expect that to by typical, and
         # (2) progress reporting is merely informational.
-        num_dirty_blocks = len(self._dirty_blocks)
+        num_dirty_blocks = len(dirty_blocks)
         remaining_dirty = [num_dirty_blocks]
 
         def update_progress(result):
@@ -159,56 +176,53 @@ class OpFeatureMatrixCache(Operator):
         # It's better to do this now instead of inside each request
         #  to avoid contention over self._lock
         with self._lock:
-            for block_start in self._dirty_blocks:
+            for block_start in dirty_blocks:
                 if block_start not in self._block_locks:
                     self._block_locks[block_start] = RequestLock()
 
         # Update each block in its own request.
         pool = RequestPool()
-        reqs = {}
-        for block_start in self._dirty_blocks:
+        for block_start in dirty_blocks:
             req = Request(partial(self._get_features_for_block, block_start))
             req.notify_finished(update_progress)
-            reqs[block_start] = req
             pool.add(req)
         pool.wait()
 
-        # Now store the results we got.
-        # It's better to store the blocks here -- rather than within each request -- to
-        #  avoid contention over self._lock from within every block's request.
+        # Each block request has already stored its result.
         with self._lock:
-            for block_start, req in list(reqs.items()):
-                if req.result is None:
-                    # 'None' means the block wasn't dirty. No need to update.
-                    continue
-                labels_and_features_matrix = req.result
-                self._dirty_blocks.remove(block_start)
-
-                if labels_and_features_matrix.shape[0] > 0:
-                    # Update the block entry with the new matrix.
-                    self._blockwise_feature_matrices[block_start] = labels_and_features_matrix
-                else:
-                    # All labels were removed from the block,
-                    # So the new feature matrix is empty.
-                    # Just delete its entry from our list.
-                    try:
-                        del self._blockwise_feature_matrices[block_start]
-                    except KeyError:
-                        pass
-
-        # Concatenate the all blockwise results
-        if self._blockwise_feature_matrices:
-            total_feature_matrix = numpy.concatenate(list(self._blockwise_feature_matrices.values()), axis=0)
-        else:
-            # No label points at all.
-            # Return an empty label&feature matrix (of the correct shape)
-            num_feature_channels = self.FeatureImage.meta.shape[-1]
-            total_feature_matrix = numpy.ndarray(shape=(0, 1 + num_feature_channels), dtype=numpy.float32)
+            if self._total_buffer is None:
+                self._rebuild_total_matrix()
+            total_feature_matrix = self._total_buffer[: self._total_rows]
 
         self.progressSignal(100.0)
         logger.debug("After update, there are {} clean blocks".format(len(self._blockwise_feature_matrices)))
         result[0] = total_feature_matrix
 
+    def _rebuild_total_matrix(self):
+        """Concatenate all blockwise results into a new buffer."""
+        num_feature_channels = self.FeatureImage.meta.shape[-1]
+        matrices = list(self._blockwise_feature_matrices.values())
+        num_rows = sum(len(matrix) for matrix in matrices)
+        # (A new buffer, because earlier outputs are views of the old one.)
+        self._total_buffer = numpy.ndarray(shape=(num_rows, 1 + num_feature_channels), dtype=numpy.float32)
+        if matrices:
+            numpy.concatenate(matrices, axis=0, out=self._total_buffer)
+        self._total_rows = num_rows
+
+    def _append_to_total_matrix(self, matrices):
+        """Append rows to the total matrix, in place if there is room left in the buffer."""
+        num_rows = self._total_rows + sum(len(matrix) for matrix in matrices)
+        if num_rows > len(self._total_buffer):
+            # Grow geometrically, so that appending stays cheap on average
+            capacity = max(num_rows, 2 * len(self._total_buffer))
+            new_buffer = numpy.ndarray(shape=(capacity, self._total_buffer.shape[1]), dtype=numpy.float32)
+            new_buffer[: self._total_rows] = self._total_buffer[: self._total_rows]
+            self._total_buffer = new_buffer
+
+        for matrix in matrices:
+            self._total_buffer[self._total_rows : self._total_rows + len(matrix)] = matrix
+            self._total_rows += len(matrix)
+
     def propagateDirty(self, slot, subindex, roi):
         assert slot == self.FeatureImage or slot == self.LabelImage
 
@@ -227,67 +241,170 @@ class OpFeatureMatrixCache(Operator):
             # Technically, this would be inefficient if it's possible for the features
             # to become only partially dirty in a small ROI.
             # But currently, there is no known use-case for that.
-            block_starts = list(self._blockwise_feature_matrices.keys())
+            with self._lock:
+                for block_start in list(self._blockwise_feature_matrices.keys()):
+                    self._mark_dirty(block_start, None)
         else:
             block_starts = getIntersectingBlocks(self._blockshape, (roi.start, roi.stop))
-            block_starts = list(map(tuple, block_starts))
-
-        with self._lock:
-            self._dirty_blocks.update(set(block_starts))
+            dirty_roi = (numpy.asarray(roi.start[:-1]), numpy.asarray(roi.stop[:-1]))
+            with self._lock:
+                for block_start in map(tuple, block_starts):
+                    self._mark_dirty(block_start, dirty_roi)
 
         # Output has no notion of roi. It's all dirty.
         self.LabelAndFeatureMatrix.setDirty()
 
+    def _mark_dirty(self, block_start, dirty_roi):
+        """
+        Add a dirty (spatial) roi to a block (dirty_roi=None: the whole block).
+        The caller must hold self._lock.
+        """
+        if block_start in self._dirty_blocks and self._dirty_rois[block_start] is not None and dirty_roi is not None:
+            previous_start, previous_stop = self._dirty_rois[block_start]
+            dirty_roi = (numpy.minimum(previous_start, dirty_roi[0]), numpy.maximum(previous_stop, dirty_roi[1]))
+        elif block_start in self._dirty_blocks:
+            dirty_roi = None
+        self._dirty_blocks.add(block_start)
+        self._dirty_rois[block_start] = dirty_roi
+
     def _get_features_for_block(self, block_start):
         """
-        Computes the feature matrix for the given block IFF the block is dirty.
-        Otherwise, returns None.
+        Updates the feature matrix for the given block IFF the block is dirty.
+
+        The new matrix is stored (and appended to the total matrix) while the block lock is still held,
+        so that the next update of this block is computed against it.
         """
         # Caller must ensure that the lock for this block already exists!
         with self._block_locks[block_start]:
-            if block_start not in self._dirty_blocks:
-                # Nothing to do if this block isn't actually dirty
-                # (For parallel requests, its theoretically possible.)
-                return None
-            block_roi = getBlockBounds(self.LabelImage.meta.shape, self._blockshape, block_start)
-            # TODO: Shrink the requested roi using the nonzero blocks slot...
-            #       ...or just get rid of the nonzero blocks slot...
-            labels_and_features_matrix = self._extract_feature_matrix(block_roi)
-            return labels_and_features_matrix
-
-    def _extract_feature_matrix(self, label_block_roi):
+            with self._lock:
+                if block_start not in self._dirty_blocks:
+                    # Nothing to do if this block isn't actually dirty
+                    # (For parallel requests, its theoretically possible.)
+                    return
+                self._dirty_blocks.remove(block_start)
+                dirty_roi = self._dirty_rois.pop(block_start)
+
+            try:
+                block_roi = getBlockBounds(self.LabelImage.meta.shape, self._blockshape, block_start)
+                labels_and_features_matrix, label_positions, appended_matrix = self._update_block_matrix(
+                    block_start, block_roi, dirty_roi
+                )
+            except BaseException:
+                # Try again next time
+                with self._lock:
+                    self._mark_dirty(block_start, dirty_roi)
+                raise
+
+            with self._lock:
+                self._store_block_matrix(block_start, labels_and_features_matrix, label_positions, appended_matrix)
+
+    def _store_block_matrix(self, block_start, labels_and_features_matrix, label_positions, appended_matrix):
+        """
+        Store a block's new feature matrix and apply the change to the total matrix.
+        (appended_matrix=None: rows were deleted or changed, so the total matrix must be rebuilt.)
+        The caller must hold self._lock.
+        """
+        if labels_and_features_matrix.shape[0] > 0:
+            # Update the block entry with the new matrix.
+            self._blockwise_feature_matrices[block_start] = labels_and_features_matrix
+            self._blockwise_label_positions[block_start] = label_positions
+        else:
+            # All labels were removed from the block,
+            # So the new feature matrix is empty.
+            # Just delete its entry from our list.
+            self._blockwise_feature_matrices.pop(block_start, None)
+            self._blockwise_label_positions.pop(block_start, None)
+
+        if appended_matrix is None:
+            # Rebuilt by the next execute()
+            self._total_buffer = None
+        elif self._total_buffer is not None:
+            self._append_to_total_matrix([appended_matrix])
+
+    def _update_block_matrix(self, block_key, block_roi, dirty_roi):
         num_feature_channels = self.FeatureImage.meta.shape[-1]
-        labels = self.LabelImage(label_block_roi[0], label_block_roi[1]).wait()
-        label_block_positions = numpy.nonzero(labels[..., 0].view(numpy.ndarray))
-        labels_matrix = labels[label_block_positions].astype(numpy.float32).view(numpy.ndarray)
-
+        block_start = numpy.asarray(block_roi[0][:-1])
+        block_shape = numpy.asarray(block_roi[1][:-1]) - block_start
+
+        empty_matrix = numpy.ndarray(shape=(0, 1 + num_feature_channels), dtype=numpy.float32)
+        empty_positions = numpy.zeros((0,), dtype=numpy.intp)
+        if dirty_roi is None:
+            # Extract the whole block from scratch, replacing the stored rows (if any)
+            dirty_start, dirty_stop = block_start, block_start + block_shape
+            old_matrix, old_positions = empty_matrix, empty_positions
+            replaced = block_key in self._blockwise_feature_matrices
+        else:
+            old_matrix = self._blockwise_feature_matrices.get(block_key, empty_matrix)
+            old_positions = self._blockwise_label_positions.get(block_key, empty_positions)
+            replaced = False
+            dirty_roi = getIntersection(dirty_roi, (block_start, block_start + block_shape), assertIntersect=False)
+            if dirty_roi is None:
+                return old_matrix, old_positions, empty_matrix
+            dirty_start, dirty_stop = dirty_roi
+
+        # Request the labels of the dirty part of the block only
+        labels = self.LabelImage(list(dirty_start) + [0], list(dirty_stop) + [1]).wait()
+        labels = labels[..., 0].view(numpy.ndarray)
+        dirty_coords = numpy.nonzero(labels)
+        new_labels = labels[dirty_coords].astype(numpy.float32)
         del labels  # Done with dense labels block; delete immediately.
 
-        if len(label_block_positions) == 0 or len(label_block_positions[0]) == 0:
+        # (sorted, because the nonzero coordinates are in C-order)
+        block_coords = tuple(c + offset for c, offset in zip(dirty_coords, dirty_start - block_start))
+        new_positions = numpy.ravel_multi_index(block_coords, block_shape)
+
+        # Stored rows within the dirty roi are kept only if the pixel is still labeled
+        old_coords = numpy.unravel_index(old_positions, block_shape)
+        old_in_dirty = numpy.ones(len(old_positions), dtype=bool)
+        for c, start, stop in zip(old_coords, dirty_start - block_start, dirty_stop - block_start):
+            old_in_dirty &= (start <= c) & (c < stop)
+        keep = ~old_in_dirty | numpy.isin(old_positions, new_positions)
+        kept_matrix = old_matrix[keep]
+        kept_positions = old_positions[keep]
+
+        # Update the labels of the kept rows (the features are still valid)
+        relabeled = old_in_dirty[keep]
+        updated_labels = new_labels[numpy.searchsorted(new_positions, kept_positions[relabeled])]
+        labels_changed = (kept_matrix[relabeled, 0] != updated_labels).any()
+        kept_matrix[relabeled, 0] = updated_labels
+
+        # Request features for the newly labeled pixels only
+        added = ~numpy.isin(new_positions, old_positions)
+        added_matrix = self._extract_feature_matrix(
+            tuple(c[added] + offset for c, offset in zip(block_coords, block_start)), new_labels[added]
+        )
+
+        positions = numpy.concatenate((kept_positions, new_positions[added]))
+        order = numpy.argsort(positions, kind="stable")
+        matrix = numpy.concatenate((kept_matrix, added_matrix), axis=0)[order]
+
+        only_appended = not replaced and keep.all() and not labels_changed
+        return matrix, positions[order], added_matrix if only_appended else None
+
+    def _extract_feature_matrix(self, label_coords, labels):
+        """
+        The label&feature matrix rows of the labeled pixels at the given (global, spatial) coordinates.
+        """
+        num_feature_channels = self.FeatureImage.meta.shape[-1]
+        if len(labels) == 0:
             # No label points in this roi.
             # Return an empty label&feature matrix (of the correct shape)
             return numpy.ndarray(shape=(0, 1 + num_feature_channels), dtype=numpy.float32)
 
-        # Shrink the roi to the bounding box of nonzero labels
-        block_bounding_box_start = numpy.min(label_block_positions, axis=1)
-        block_bounding_box_stop = 1 + numpy.max(label_block_positions, axis=1)
-
-        global_bounding_box_start = block_bounding_box_start + label_block_roi[0][:-1]
-        global_bounding_box_stop = block_bounding_box_stop + label_block_roi[0][:-1]
+        # Shrink the roi to the bounding box of the labels
+        bounding_box_start = numpy.min(label_coords, axis=1)
+        bounding_box_stop = 1 + numpy.max(label_coords, axis=1)
 
         # Since we're just requesting the bounding box, offset the feature positions by the box start
-        bounding_box_positions = numpy.transpose(
-            numpy.transpose(label_block_positions) - numpy.array(block_bounding_box_start)
-        )
-        bounding_box_positions = tuple(bounding_box_positions)
+        bounding_box_positions = tuple(c - start for c, start in zip(label_coords, bounding_box_start))
 
         # Append channel roi (all feature channels)
-        feature_roi_start = list(global_bounding_box_start) + [0]
-        feature_roi_stop = list(global_bounding_box_stop) + [num_feature_channels]
+        feature_roi_start = list(bounding_box_start) + [0]
+        feature_roi_stop = list(bounding_box_stop) + [num_feature_channels]
 
         # Request features (bounding box only)
         features = self.FeatureImage(feature_roi_start, feature_roi_stop).wait()
 
         # Cast as plain ndarray (not VigraArray), since we don't need/want axistags
         features_matrix = features[bounding_box_positions].view(numpy.ndarray)
-        return numpy.concatenate((labels_matrix, features_matrix), axis=1)
+        return numpy.concatenate((labels[:, numpy.newaxis], features_matrix), axis=1).astype(numpy.float32)
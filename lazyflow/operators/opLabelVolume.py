@@ -9,19 +9,23 @@ if sys.version_info.major >= 3:
 
 from threading import Lock as ThreadLock
 from functools import partial
+from collections import namedtuple
+import itertools
+import tempfile
 from abc import ABCMeta, abstractmethod, abstractproperty
 import logging
 
 import numpy as np
 import vigra
+import h5py
 
 from lazyflow.operator import Operator
 from lazyflow.slot import InputSlot, OutputSlot
 from lazyflow.rtype import SubRegion
 from lazyflow.metaDict import MetaDict
-from lazyflow.request import Request, RequestPool
-from lazyflow.operators import OpBlockedArrayCache, OpReorderAxes
-from .opLazyConnectedComponents import OpLazyConnectedComponents
+from lazyflow.request import Request, RequestPool, RequestLock
+from lazyflow.operators import OpBlockedArrayCache, OpCompressedCache, OpReorderAxes
+from .opLazyConnectedComponents import OpLazyConnectedComponents, UnionFindArray
 from future.utils import with_metaclass
 
 logger = logging.getLogger(__name__)
@@ -57,6 +61,11 @@ class OpLabelVolume(Operator):
     # currently available:
     # * 'vigra': use the fast algorithm from ukoethe/vigra
     # * 'blocked': use the memory saving algorithm from thorbenk/blockedarray
+    # * 'lazy': label only the objects in the requested region, see
+    #   OpLazyConnectedComponents
+    # * 'blockwise': label the volume block by block in parallel and stitch
+    #   the blocks, such that only a few blocks are held in memory at once
+    #   (Output is cached like CachedOutput with this method)
     #
     # A change here deletes all previously cached results.
     Method = InputSlot(value="vigra")
@@ -105,7 +114,12 @@ class OpLabelVolume(Operator):
 
         # available OpLabelingABCs:
         # TODO: OpLazyConnectedComponents and _OpLabelBlocked does not conform to OpLabelingABC
-        self._labelOps = {"vigra": _OpLabelVigra, "blocked": _OpLabelBlocked, "lazy": OpLazyConnectedComponents}
+        self._labelOps = {
+            "vigra": _OpLabelVigra,
+            "blocked": _OpLabelBlocked,
+            "lazy": OpLazyConnectedComponents,
+            "blockwise": _OpLabelBlockwise,
+        }
 
     def setupOutputs(self):
         method = self.Method.value
@@ -308,10 +322,287 @@ class _OpLabelVigra(OpLabelingABC):
 
     def _label3d(self, roi, bg, result):
         source = vigra.taggedView(self.Input.get(roi).wait(), axistags="txyzc").withAxes(*"xyz")
-        if source.shape[2] > 1:
-            result[:] = vigra.analysis.labelVolumeWithBackground(source, background_value=int(bg))
+        result[:] = _labelWithBackground(source, bg)
+
+
+## label a 3d xyz volume with vigra
+def _labelWithBackground(source, bg):
+    if source.shape[2] > 1:
+        return vigra.analysis.labelVolumeWithBackground(source, background_value=int(bg))
+    else:
+        labels = vigra.analysis.labelImageWithBackground(source[..., 0], background_value=int(bg))
+        return labels.reshape(labels.shape + (1,))
+
+
+## state of a labeled (t, c) slice in _OpLabelBlockwise
+#   offsets, counts: global index offset and number of local labels per block
+#   finalLabels: final label of each global index
+#   localBlocks: _SpilledBlocks with the local labels of blocks that were not requested yet
+_SliceLabeling = namedtuple("_SliceLabeling", ["offsets", "counts", "finalLabels", "localBlocks"])
+
+
+## local labels of blocks, stored compressed in a temporary hdf5 file
+# The file is deleted when this object is garbage collected.
+class _SpilledBlocks(object):
+    def __init__(self):
+        self._lock = ThreadLock()
+        self._file = h5py.File(tempfile.TemporaryFile(), "w")
+
+    def put(self, index, labels):
+        with self._lock:
+            self._file.create_dataset(self._name(index), data=labels, compression="lzf")
+
+    ## remove the labels of a block from the file, returns None if they are not stored
+    def pop(self, index):
+        name = self._name(index)
+        with self._lock:
+            if name not in self._file:
+                return None
+            labels = self._file[name][...]
+            del self._file[name]
+        return labels
+
+    @staticmethod
+    def _name(index):
+        return "_".join(map(str, index))
+
+
+## blockwise connected components
+#
+# Labels each (t, c) slice block by block, such that only a few blocks are
+# held in memory at once:
+#   1. The blocks are labeled in parallel, slab by slab along the x axis.
+#      The local labels are spilled to a temporary file (see _SpilledBlocks).
+#      When the slab is done, every block reserves a range of global indices,
+#      in block order (so the labels don't depend on the order in which the
+#      requests finish).
+#   2. Labels touching across the faces of adjacent blocks are joined in a
+#      UnionFindArray, then the faces are discarded. The objects are finally
+#      numbered consecutively, in the order of their first global index.
+#   3. The output cache (an OpCompressedCache with the same block shape)
+#      requests the blocks one by one, which are mapped from local to final
+#      labels. If a block is requested again (e.g. after the cache freed it),
+#      it is labeled again; the labels are the same as long as the input
+#      does not change.
+# The Output slot is cached, too, because labels are only consistent for the
+# whole volume.
+class _OpLabelBlockwise(Operator):
+    name = "OpLabelBlockwise"
+    supportedDtypes = [np.uint8, np.uint32, np.float32]
+    labelType = np.uint32
+
+    Input = InputSlot()
+
+    ## background with axes 'txyzc', spatial axes must be singletons
+    Background = InputSlot()
+
+    ## spatial shape of the blocks, in 'xyz' order (optional)
+    BlockShape = InputSlot(optional=True)
+
+    Output = OutputSlot()
+    CachedOutput = OutputSlot()
+
+    # cache access, see OpCompressedCache
+    CleanBlocks = OutputSlot()
+
+    # final labels, computed block by block
+    _Output = OutputSlot()
+
+    def __init__(self, *args, **kwargs):
+        super(_OpLabelBlockwise, self).__init__(*args, **kwargs)
+        self._lock = ThreadLock()
+        self._slices = {}
+        self._sliceLocks = {}
+        self._blockShape = None
+
+        self._cache = OpCompressedCache(parent=self)
+        self._cache.name = "OpLabelVolume.OutputCache"
+        self._cache.Input.connect(self._Output)
+        self.Output.connect(self._cache.Output)
+        self.CachedOutput.connect(self._cache.Output)
+        self.CleanBlocks.connect(self._cache.CleanBlocks)
+
+    def setupOutputs(self):
+        dtype = self.Input.meta.dtype
+        if dtype not in self.supportedDtypes:
+            msg = "{}: dtype '{}' not supported with method 'blockwise'. Supported types: {}"
+            raise ValueError(msg.format(self.name, dtype, self.supportedDtypes))
+
+        self._Output.meta.assignFrom(self.Input.meta)
+        self._Output.meta.dtype = self.labelType
+
+        shape = self.Input.meta.shape
+        if self.BlockShape.ready():
+            blockShape = np.minimum(shape, (1,) + tuple(self.BlockShape.value) + (1,))
         else:
-            result[..., 0] = vigra.analysis.labelImageWithBackground(source[..., 0], background_value=int(bg))
+            blockShape = self._automaticBlockShape(shape)
+        self._blockShape = tuple(int(s) for s in blockShape)
+        self._cache.BlockShape.setValue(self._blockShape)
+
+        with self._lock:
+            self._slices = {}
+
+    def execute(self, slot, subindex, roi, result):
+        if slot is self._Output:
+            self._executeOutput(roi, result)
+        else:
+            raise ValueError("Request to unknown slot {}".format(slot))
+
+    def propagateDirty(self, slot, subindex, roi):
+        if slot is self.Input:
+            # CCL is a global operation, the whole time-channel-slice is dirty
+            with self._lock:
+                for t in range(roi.start[0], roi.stop[0]):
+                    for c in range(roi.start[4], roi.stop[4]):
+                        self._slices.pop((t, c), None)
+            start = (roi.start[0], 0, 0, 0, roi.start[4])
+            stop = (roi.stop[0],) + tuple(self.Input.meta.shape[1:4]) + (roi.stop[4],)
+            self._Output.setDirty(start, stop)
+        else:
+            with self._lock:
+                self._slices = {}
+            self._Output.setDirty(slice(None))
+
+    def setInSlot(self, slot, subindex, roi, value):
+        pass
+
+    def _executeOutput(self, roi, result):
+        blockShape = np.asarray(self._blockShape[1:4])
+        start = np.asarray(roi.start[1:4])
+        stop = np.asarray(roi.stop[1:4])
+        for ti, t in enumerate(range(roi.start[0], roi.stop[0])):
+            for ci, c in enumerate(range(roi.start[4], roi.stop[4])):
+                labeling = self._getSliceLabeling(t, c)
+                ranges = [range(a // b, (z + b - 1) // b) for a, z, b in zip(start, stop, blockShape)]
+                for index in itertools.product(*ranges):
+                    blockStart = np.asarray(index) * blockShape
+                    localLabels = labeling.localBlocks.pop(index)
+                    if localLabels is None:
+                        localLabels = self._labelBlock(self._readBlock(t, c, index), self._backgroundValue(t, c))
+
+                    offset = labeling.offsets[index]
+                    n = labeling.counts[index]
+                    assert localLabels.max() == n, "Labeling of block {} changed".format(index)
+                    mapping = np.zeros((n + 1,), dtype=self.labelType)
+                    mapping[1:] = labeling.finalLabels[offset + 1 : offset + n + 1]
+
+                    # intersection of block and roi, relative to block and to roi
+                    a = np.maximum(start, blockStart)
+                    b = np.minimum(stop, blockStart + localLabels.shape)
+                    inBlock = tuple(slice(x, y) for x, y in zip(a - blockStart, b - blockStart))
+                    inResult = (ti,) + tuple(slice(x, y) for x, y in zip(a - start, b - start)) + (ci,)
+                    result[inResult] = mapping[localLabels[inBlock]]
+
+    def _getSliceLabeling(self, t, c):
+        with self._lock:
+            lock = self._sliceLocks.setdefault((t, c), RequestLock())
+        with lock:
+            with self._lock:
+                labeling = self._slices.get((t, c))
+            if labeling is None:
+                labeling = self._labelSlice(t, c)
+                with self._lock:
+                    self._slices[(t, c)] = labeling
+        return labeling
+
+    def _backgroundValue(self, t, c):
+        bg = self.Background[...].wait()
+        bg = vigra.taggedView(bg, axistags=self.Background.meta.axistags)
+        bg = bg.withAxes(*"ct")
+        return bg[c, t]
+
+    ## get the input of one block of a (t, c) slice, as an xyz array
+    def _readBlock(self, t, c, index):
+        blockShape = np.asarray(self._blockShape[1:4])
+        start = np.asarray(index) * blockShape
+        stop = np.minimum(start + blockShape, self.Input.meta.shape[1:4])
+        roi = SubRegion(self.Input, start=(t,) + tuple(start) + (c,), stop=(t + 1,) + tuple(stop) + (c + 1,))
+        source = vigra.taggedView(self.Input.get(roi).wait(), axistags="txyzc").withAxes(*"xyz")
+        return source
+
+    ## label one block, returns the local labels
+    def _labelBlock(self, source, bg):
+        return _labelWithBackground(source, bg).view(np.ndarray).astype(self.labelType, copy=False)
+
+    def _labelSlice(self, t, c):
+        logger.debug("{}: Computing connected components for t={}, c={} ...".format(self.name, t, c))
+        bg = self._backgroundValue(t, c)
+        shape = np.asarray(self.Input.meta.shape[1:4])
+        blockShape = np.asarray(self._blockShape[1:4])
+        gridShape = tuple((shape + blockShape - 1) // blockShape)
+
+        uf = UnionFindArray(1, dtype=self.labelType)
+        offsets = np.zeros(gridShape, dtype=np.int64)
+        counts = np.zeros(gridShape, dtype=np.int64)
+        localBlocks = _SpilledBlocks()
+        # (index, axis, side) -> (labels, values) on the first (side 0) and
+        # last (side 1) hyperplane of a block along axis
+        faces = {}
+
+        def labelBlock(index):
+            source = self._readBlock(t, c, index)
+            labels = self._labelBlock(source, bg)
+            source = source.view(np.ndarray)
+
+            counts[index] = int(labels.max())
+            localBlocks.put(index, labels)
+            for axis in range(3):
+                for side in (0, 1):
+                    pos = 0 if side == 0 else labels.shape[axis] - 1
+                    faces[(index, axis, side)] = (labels.take(pos, axis=axis), source.take(pos, axis=axis))
+
+        def stitch(indexA, axis):
+            indexB = list(indexA)
+            indexB[axis] += 1
+            indexB = tuple(indexB)
+            labelsA, valuesA = faces[(indexA, axis, 1)]
+            labelsB, valuesB = faces[(indexB, axis, 0)]
+            adjacent = (labelsA > 0) & (labelsB > 0) & (valuesA == valuesB)
+            pairs = labelsA[adjacent].astype(np.uint64) + np.uint64(offsets[indexA])
+            pairs = pairs << np.uint64(32) | (labelsB[adjacent] + np.uint64(offsets[indexB]))
+            pairs = np.unique(pairs)
+            uf.makeUnions(pairs >> np.uint64(32), pairs & np.uint64(0xFFFFFFFF))
+
+        for x in range(gridShape[0]):
+            slab = [(x, y, z) for y in range(gridShape[1]) for z in range(gridShape[2])]
+            pool = RequestPool()
+            for index in slab:
+                pool.add(Request(partial(labelBlock, index)))
+            pool.wait()
+            pool.clean()
+
+            for index in slab:
+                offsets[index] = uf.makeNewIndices(counts[index]) - 1
+
+            for _, y, z in slab:
+                if y + 1 < gridShape[1]:
+                    stitch((x, y, z), 1)
+                if z + 1 < gridShape[2]:
+                    stitch((x, y, z), 2)
+                if x > 0:
+                    stitch((x - 1, y, z), 0)
+            # only the last hyperplanes along x are needed for the next slab
+            for key in list(faces.keys()):
+                if key[0][0] < x or key[1:] != (0, 1):
+                    del faces[key]
+
+        roots = uf.findIndices(np.arange(counts.sum() + 1, dtype=self.labelType))
+        # number the objects by their first global index (the background, index 0, stays 0)
+        _, first, inverse = np.unique(roots, return_index=True, return_inverse=True)
+        rank = np.empty(first.shape, dtype=self.labelType)
+        rank[np.argsort(first)] = np.arange(len(first), dtype=self.labelType)
+        finalLabels = rank[inverse]
+        logger.debug("{}: Found {} objects for t={}, c={}".format(self.name, finalLabels.max(), t, c))
+        return _SliceLabeling(offsets, counts, finalLabels, localBlocks)
+
+    # split the longest axis until the block has at most 256**3 pixels
+    @staticmethod
+    def _automaticBlockShape(shape):
+        blockShape = [1] + list(shape[1:4]) + [1]
+        while np.prod(blockShape) > 256 ** 3:
+            i = int(np.argmax(blockShape))
+            blockShape[i] = (blockShape[i] + 1) // 2
+        return tuple(blockShape)
 
 
 # try to import the blockedarray module, fail only if neccessary
@@ -34,6 +34,7 @@ from threading import Lock as HardLock
 
 from collections import defaultdict
 from functools import partial, wraps
+import heapq
 import itertools
 
 from lazyflow.operator import Operator, InputSlot, OutputSlot
@@ -148,6 +149,12 @@ class _LabelManager(object):
             d[n] = labels
         return labels, others
 
+    # Forget which labels of a chunk have been processed, e.g. because
+    # the chunk is going to be labeled again.
+    @threadsafe
+    def release(self, chunkIndex):
+        self._managedLabels.pop(chunkIndex, None)
+
 
 # OpLazyConnectedComponents
 # =========================
@@ -169,7 +176,11 @@ class _LabelManager(object):
 # you labels [120..135], but somewhere else in the volume there will be
 # at least one pixel labeled with each of [1..119]. Furthermore, the
 # output is computed as lazy as possible, meaning that only the chunks
-# that intersect with an object in the requested ROI are computed. The
+# that intersect with an object in the requested ROI are computed.
+# When the input changes, only the objects touching the changed chunks
+# are labeled again, all other objects keep their labels. The labels of
+# the invalidated objects are reused for new objects, so there can only
+# be gaps in the set of labels if objects were removed. The
 # operator.execute() method is thread safe, but does not spawn new
 # requests besides the ones needed for gathering input data.
 # This operator conforms to OpLabelingABC, meaning that it can be used
@@ -316,14 +327,20 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
             raise ValueError("Request to invalid slot {}".format(str(slot)))
 
     def propagateDirty(self, slot, subindex, roi):
-        # Dirty handling is not trivial with this operator. The worst
-        # case happens when an object disappears entirely, meaning that
-        # the assigned labels would not be contiguous anymore. We could
-        # check for that here, and set everything dirty if it's the
-        # case, but this would require us to run the entire algorithm
-        # once again, which is not desireable in propagateDirty(). The
-        # simplest valid decision is to set the whole output dirty in
-        # every case.
+        # A change of the input only invalidates the chunks it touches
+        # and the objects extending into them, see _invalidate(). We
+        # start over if the whole volume changed, if the configuration
+        # changed, or if some chunks were filled from HDF5 (there are no
+        # global indices for those).
+        if slot is self.Input:
+            start, stop = self._toInternalRoi(roi)
+            wholeVolume = np.all(start == 0) and np.all(stop == self._shape)
+            fromHdf5 = np.any(self._isFinal & (self._numIndices < 0))
+            if not wholeVolume and not fromHdf5:
+                start, stop = self._invalidate(start, stop)
+                self._Output.setDirty(tuple(start), tuple(stop))
+                return
+
         self._setDefaultInternals()
         self.Output.setDirty(slice(None))
 
@@ -430,17 +447,21 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
         # update the labeling information
         numLabels = labeled.max()  # we ignore 0 here
         self._numIndices[chunkIndex] = numLabels
-        if numLabels > 0:
+        previous = self._relabelOffsets.pop(chunkIndex, None)
+        if previous is not None:
+            # the input of this chunk did not change (see _invalidate()),
+            # reuse its global indices such that unaffected objects keep
+            # their final labels
+            offset, n = previous
+            assert n == numLabels, "Relabeling an unchanged chunk gave a different number of labels"
+            self._globalLabelOffset[chunkIndex] = offset
+        elif numLabels > 0:
             with self._lock:
                 # determine the offset
                 # localLabel + offset = globalLabel (for localLabel>0)
-                offset = self._uf.makeNewIndex()
+                offset = self._uf.makeNewIndices(numLabels)
                 self._globalLabelOffset[chunkIndex] = offset - 1
 
-                # get n-1 more labels
-                for i in range(numLabels - 1):
-                    self._uf.makeNewIndex()
-
     # merge the labels of two adjacent chunks
     # the chunks have to be ordered lexicographically, e.g. by self._orderPair
     @_chunksynchronized
@@ -474,10 +495,10 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
             map_b = self.localToGlobal(chunkB)
             labels_a = map_a[label_hyperplane_a[adjacent_bool_inds]]
             labels_b = map_b[label_hyperplane_b[adjacent_bool_inds]]
-            for a, b in zip(labels_a, labels_b):
-                assert a not in self._globalToFinal, "Invalid merge"
-                assert b not in self._globalToFinal, "Invalid merge"
-                self._uf.makeUnion(a, b)
+            finalized = np.fromiter(self._globalToFinal[(chunkA[0], chunkA[4])].keys(), dtype=_LABEL_TYPE)
+            assert not np.isin(labels_a, finalized).any(), "Invalid merge"
+            assert not np.isin(labels_b, finalized).any(), "Invalid merge"
+            self._uf.makeUnions(labels_a, labels_b)
 
             logger.debug("merged chunks {} and {}".format(chunkA, chunkB))
         correspondingLabelsA = label_hyperplane_a[adjacent_bool_inds]
@@ -529,7 +550,7 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
         numLabels = self._numIndices[chunkIndex]
         labels = np.arange(1, numLabels + 1, dtype=_LABEL_TYPE) + offset
 
-        labels = np.asarray(list(map(self._uf.findIndex, labels)), dtype=_LABEL_TYPE)
+        labels = self._uf.findIndices(labels)
 
         # we got 'numLabels' real labels, and one label '0', so our
         # output has to have numLabels+1 elements
@@ -542,19 +563,103 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
     # UnionFind.makeUnion any more!
     @threadsafe
     def globalToFinal(self, t, c, labels):
-        newlabels = labels.copy()
         d = self._globalToFinal[(t, c)]
         labeler = self._labelIterators[(t, c)]
-        for k in vigra.analysis.unique(labels):
-            l = self._uf.findIndex(k)
+        uniqueLabels, inverse = np.unique(labels, return_inverse=True)
+        roots = self._uf.findIndices(uniqueLabels)
+        finalLabels = np.zeros(roots.shape, dtype=labels.dtype)
+        for i, l in enumerate(roots):
             if l == 0:
                 continue
 
             if l not in d:
-                nextLabel = next(labeler)
+                free = self._freeFinalLabels[(t, c)]
+                nextLabel = heapq.heappop(free) if free else next(labeler)
                 d[l] = nextLabel
-            newlabels[labels == k] = d[l]
-        return newlabels
+            finalLabels[i] = d[l]
+        return finalLabels[inverse].reshape(labels.shape)
+
+    # Forget the labeling of all objects that touch the region
+    # [start, stop) (in 'txyzc' order), such that they are labeled again
+    # on the next request:
+    #   - every chunk intersecting the region, or adjacent to it (a change
+    #     at the border can connect objects across chunks), gets new local
+    #     labels
+    #   - the objects in these chunks are split into their global indices
+    #     again, and every chunk containing one of those indices is merged
+    #     with the other affected chunks again
+    #   - the final labels of these objects are released
+    # Objects that do not touch the changed chunks keep their global
+    # indices and final labels. Merges of affected with unaffected chunks
+    # stay valid: they can only have joined indices of unaffected objects
+    # (otherwise the chunk would be affected), and the border between them
+    # did not change.
+    # @returns start and stop of the region of the output that changed
+    def _invalidate(self, start, stop):
+        grownStart = np.maximum(start - 1, 0)
+        grownStop = np.minimum(stop + 1, self._shape)
+        grownStart[[0, 4]] = start[[0, 4]]
+        grownStop[[0, 4]] = stop[[0, 4]]
+        grownRoi = SubRegion(self._Input, start=tuple(grownStart), stop=tuple(grownStop))
+        changedChunks = set(self._roiToChunkIndex(grownRoi))
+
+        outStart = start.copy()
+        outStop = stop.copy()
+        with self._lock:
+            # global indices of all chunks, including the ones waiting to be
+            # labeled again
+            ranges = {
+                chunk: (self._globalLabelOffset[chunk], self._numIndices[chunk])
+                for chunk in zip(*np.nonzero(self._numIndices > 0))
+            }
+            ranges.update(self._relabelOffsets)
+
+            # representatives of the objects in the changed chunks
+            roots = defaultdict(list)
+            for chunk in changedChunks:
+                if chunk in ranges:
+                    offset, n = ranges[chunk]
+                    indices = np.arange(offset + 1, offset + n + 1, dtype=_LABEL_TYPE)
+                    roots[(chunk[0], chunk[4])].append(self._uf.findIndices(indices))
+
+            # release the final labels of these objects, and split them up
+            affectedChunks = set(changedChunks)
+            if roots:
+                for tc, r in roots.items():
+                    d = self._globalToFinal[tc]
+                    for root in np.unique(np.concatenate(r)):
+                        if root in d:
+                            heapq.heappush(self._freeFinalLabels[tc], d.pop(root))
+                indices = self._uf.resetSets(np.concatenate([np.concatenate(r) for r in roots.values()]))
+                isReset = np.zeros((indices.max() + 1,), dtype=np.bool)
+                isReset[indices] = True
+                for chunk, (offset, n) in ranges.items():
+                    if isReset[offset + 1 : offset + n + 1].any():
+                        affectedChunks.add(chunk)
+
+            for chunk in affectedChunks:
+                if self._isFinal[chunk]:
+                    chunkRoi = self._chunkIndexToRoi(chunk)
+                    outStart = np.minimum(outStart, chunkRoi.start)
+                    outStop = np.maximum(outStop, chunkRoi.stop)
+                    if chunk not in changedChunks:
+                        # the cache holds final labels now, restore the local ones
+                        self._relabelOffsets[chunk] = ranges[chunk]
+                    self._numIndices[chunk] = -1
+                    self._isFinal[chunk] = False
+                if chunk in changedChunks:
+                    self._numIndices[chunk] = -1
+                    self._relabelOffsets.pop(chunk, None)
+                self._mergeMap[chunk] = [other for other in self._mergeMap[chunk] if other not in affectedChunks]
+                self._manager.release(chunk)
+        return outStart, outStop
+
+    # convert a roi of the Input slot to start and stop in 'txyzc' order
+    def _toInternalRoi(self, roi):
+        keys = self.Input.meta.getAxisKeys()
+        start = [roi.start[keys.index(k)] if k in keys else 0 for k in "txyzc"]
+        stop = [roi.stop[keys.index(k)] if k in keys else 1 for k in "txyzc"]
+        return np.asarray(start), np.asarray(stop)
 
     ##########################################################################
     ##################### HELPER METHODS #####################################
@@ -681,6 +786,11 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
         self._labelIterators = defaultdict(gen)
         self._globalToFinal = defaultdict(dict)
         self._isFinal = np.zeros(self._chunkArrayShape, dtype=np.bool)
+        # final labels of invalidated objects, reused for new objects
+        self._freeFinalLabels = defaultdict(list)
+        # (offset, number of labels) of chunks that need to be labeled
+        # again although their input did not change
+        self._relabelOffsets = {}
 
         ### algorithmic ###
 
@@ -789,38 +899,102 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
 ###########
 
 
-# python implementation of vigra's UnionFindArray structure
+# NumPy implementation of vigra's UnionFindArray structure
+#
+# Parents and ranks are stored in arrays that grow geometrically. Roots
+# are found with path compression, and sets are joined by rank. The
+# batched methods makeNewIndices(), makeUnions() and findIndices()
+# process whole arrays of labels while acquiring the lock only once.
 class UnionFindArray(object):
-    def __init__(self, nextFree=1):
-        self._map = dict(list(zip(*(list(range(nextFree)),) * 2)))
+    def __init__(self, nextFree=1, dtype=_LABEL_TYPE):
         self._lock = HardLock()
-        self._nextFree = nextFree
-        self._it = None
+        self._nextFree = int(nextFree)
+        capacity = _get_next_power(max(self._nextFree, 64))
+        self._parents = np.arange(capacity, dtype=dtype)
+        self._ranks = np.zeros((capacity,), dtype=np.uint8)
 
     ## join regions a and b
-    # callback is called whenever two regions are joined that were
-    # separate before, signature is
-    #   callback(smaller_label, larger_label)
     @threadsafe
     def makeUnion(self, a, b):
-        assert a in self._map
-        assert b in self._map
+        assert 0 <= a < self._nextFree
+        assert 0 <= b < self._nextFree
 
         a = self._findIndex(a)
         b = self._findIndex(b)
+        if a == b:
+            return
 
-        # avoid cycles by choosing the smallest label as the common one
-        # swap such that a is smaller
-        if a > b:
+        # attach the tree with lower rank to the one with higher rank
+        if self._ranks[a] > self._ranks[b]:
             a, b = b, a
+        elif self._ranks[a] == self._ranks[b]:
+            self._ranks[b] += 1
+        self._parents[a] = b
 
-        self._map[b] = a
+    ## join regions a[i] and b[i] for all i
+    # @param a array of labels
+    # @param b array of labels with the same shape as a
+    @threadsafe
+    def makeUnions(self, a, b):
+        a = np.asarray(a).ravel()
+        b = np.asarray(b).ravel()
+        assert a.shape == b.shape
+        self._checkIndices(a)
+        self._checkIndices(b)
+
+        while a.size > 0:
+            a = self._findIndices(a)
+            b = self._findIndices(b)
+            differ = a != b
+            a = a[differ]
+            b = b[differ]
+            if a.size == 0:
+                break
+
+            # order the roots of each pair by (rank, label), such that b
+            # is the one that a will be attached to
+            key_a = self._ranks[a].astype(np.int64) << 32 | a
+            key_b = self._ranks[b].astype(np.int64) << 32 | b
+            swap = key_a > key_b
+            a[swap], b[swap] = b[swap], a[swap]
+            key_b[swap] = key_a[swap]
+
+            # A root can only be attached to one other root per round,
+            # choose the partner with the largest key. Attaching roots to
+            # roots with a strictly larger key never creates cycles, the
+            # remaining pairs are handled in the next round.
+            order = np.lexsort((key_b, a))
+            a = a[order]
+            b = b[order]
+            last = np.ones(a.shape, dtype=bool)
+            last[:-1] = a[1:] != a[:-1]
+            children = a[last]
+            parents = b[last]
+            equal_rank = self._ranks[children] == self._ranks[parents]
+            self._parents[children] = parents
+            self._ranks[parents[equal_rank]] += 1
 
     @threadsafe
     def makeNewIndex(self):
+        return self._makeNewIndices(1)
+
+    ## reserve n consecutive labels, returns the first one
+    @threadsafe
+    def makeNewIndices(self, n):
+        return self._makeNewIndices(n)
+
+    def _makeNewIndices(self, n):
         newLabel = self._nextFree
-        self._nextFree += 1
-        self._map[newLabel] = newLabel
+        self._nextFree += int(n)
+        if self._nextFree > len(self._parents):
+            assert self._nextFree - 1 <= np.iinfo(self._parents.dtype).max, "Label overflow."
+            capacity = _get_next_power(self._nextFree)
+            parents = np.arange(capacity, dtype=self._parents.dtype)
+            parents[: len(self._parents)] = self._parents
+            ranks = np.zeros((capacity,), dtype=np.uint8)
+            ranks[: len(self._ranks)] = self._ranks
+            self._parents = parents
+            self._ranks = ranks
         return newLabel
 
     @threadsafe
@@ -828,12 +1002,55 @@ class UnionFindArray(object):
         return self._findIndex(a)
 
     def _findIndex(self, a):
-        while a != self._map[a]:
-            a = self._map[a]
-        return a
+        parents = self._parents
+        a = int(a)
+        root = a
+        while root != parents[root]:
+            root = int(parents[root])
+        # path compression
+        while a != root:
+            parent = int(parents[a])
+            parents[a] = root
+            a = parent
+        return root
+
+    ## map an array of labels to their representatives
+    # @param labels array of labels (any shape)
+    # @returns array of the same shape with the representative labels
+    @threadsafe
+    def findIndices(self, labels):
+        labels = np.asarray(labels)
+        self._checkIndices(labels)
+        return self._findIndices(labels.ravel()).reshape(labels.shape)
+
+    def _findIndices(self, labels):
+        parents = self._parents
+        roots = parents[labels]
+        while True:
+            grandparents = parents[roots]
+            if np.array_equal(grandparents, roots):
+                break
+            roots = grandparents
+        # path compression
+        parents[labels] = roots
+        return roots
+
+    ## split the sets with the given representatives into singletons
+    # @param roots array of representatives (as returned by findIndex())
+    # @returns array of all labels that belonged to these sets
+    @threadsafe
+    def resetSets(self, roots):
+        labels = np.arange(self._nextFree, dtype=self._parents.dtype)
+        labels = labels[np.isin(self._findIndices(labels), roots)]
+        self._parents[labels] = labels
+        self._ranks[labels] = 0
+        return labels
+
+    def _checkIndices(self, labels):
+        assert labels.size == 0 or (labels.min() >= 0 and labels.max() < self._nextFree)
 
     def __str__(self):
-        s = "<UnionFindArray>\n{}".format(self._map)
+        return "<UnionFindArray>\n{}".format(self._parents[: self._nextFree])
 
     def __getstate__(self):
         odict = self.__dict__.copy()
@@ -842,6 +1059,7 @@ class UnionFindArray(object):
 
     def __setstate__(self, dict):
         self.__dict__.update(dict)
+        self._lock = HardLock()
 
 
 class InfiniteLabelIterator(object):
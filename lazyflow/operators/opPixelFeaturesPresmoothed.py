@@ -19,6 +19,7 @@
 # This information is also available on the ilastik web site at:
 #          http://ilastik.org/license/
 ###############################################################################
+import collections
 import copy
 import logging
 import math
@@ -34,7 +35,9 @@ from lazyflow.roi import sliceToRoi, roiToSlice
 from lazyflow.rtype import SubRegion
 
 from .operators import OpArrayPiper
+from .featureBank import FeatureBank
 from .filterOperators import (
+    OpBaseFilter,
     OpGaussianSmoothing,
     OpDifferenceOfGaussians,
     OpHessianOfGaussianEigenvalues,
@@ -76,6 +79,10 @@ class OpPixelFeaturesPresmoothed(Operator):
 
     WINDOW_SIZE = 3.5
 
+    #: If True, the features are computed by a FeatureBank per scale, time step and channel, which shares
+    #: smoothings and derivatives between the features.  Otherwise, by the individual filter operators.
+    use_feature_bank = True
+
     def __init__(self, *args, **kwargs):
         Operator.__init__(self, *args, **kwargs)
         self.source = OpArrayPiper(parent=self)
@@ -442,51 +449,30 @@ class OpPixelFeaturesPresmoothed(Operator):
                 logger.debug("Failed to free array memory.")
             del source
 
-            cnt = 0
-            written = 0
-            closures = []
-            # connect individual operators
-            for i in range(dimRow):
-                for j in range(dimCol):
-                    if self.matrix[i, j]:
-                        oslot = self.featureOps[i][j].Output
-                        req = None
-                        slices = oslot.meta.shape[1]
-                        if (
-                            cnt + slices >= slot_roi.start[1]
-                            and slot_roi.start[1] - cnt < slices
-                            and slot_roi.start[1] + written < slot_roi.stop[1]
-                        ):
-                            begin = 0
-                            if cnt < slot_roi.start[1]:
-                                begin = slot_roi.start[1] - cnt
-                            end = slices
-                            if cnt + end > slot_roi.stop[1]:
-                                end = slot_roi.stop[1] - cnt
-
-                            # feature slice in output frame
-                            feature_slice = (slice(None), slice(written, written + end - begin)) + (slice(None),) * 3
-
-                            subtarget = target[feature_slice]
-                            # readjust the roi for the new source array
-                            full_filter_target_slice = [full_output_slice[0], slice(begin, end), *filter_target_slice]
-                            filter_target_roi = SubRegion(oslot, pslice=full_filter_target_slice)
-
-                            closure = partial(
-                                oslot.operator.call_execute,
-                                oslot,
-                                (),
-                                filter_target_roi,
-                                subtarget,
-                                sourceArray=presmoothed_source[j],
-                            )
-                            closures.append(closure)
-
-                            written += end - begin
-                        cnt += slices
             pool = RequestPool()
-            for c in closures:
-                pool.request(c)
+            if self.use_feature_bank:
+                for task in self._featureBankTasks(slot_roi, presmoothed_source, filter_target_slice, target):
+                    pool.request(task)
+            else:
+                for i, j, begin, end, written in self._requestedFeatureChannels(slot_roi):
+                    oslot = self.featureOps[i][j].Output
+                    # feature slice in output frame
+                    feature_slice = (slice(None), slice(written, written + end - begin)) + (slice(None),) * 3
+
+                    subtarget = target[feature_slice]
+                    # readjust the roi for the new source array
+                    full_filter_target_slice = [full_output_slice[0], slice(begin, end), *filter_target_slice]
+                    filter_target_roi = SubRegion(oslot, pslice=full_filter_target_slice)
+
+                    closure = partial(
+                        oslot.operator.call_execute,
+                        oslot,
+                        (),
+                        filter_target_roi,
+                        subtarget,
+                        sourceArray=presmoothed_source[j],
+                    )
+                    pool.request(closure)
             pool.wait()
             pool.clean()
 
@@ -497,6 +483,76 @@ class OpPixelFeaturesPresmoothed(Operator):
                     except Exception:
                         presmoothed_source[i] = None
 
+    def _requestedFeatureChannels(self, slot_roi):
+        """
+        Yield ``(i, j, begin, end, written)`` for each feature operator with channels in the requested roi:
+        The operator of ``self.featureOps[i][j]`` provides the requested channels ``begin:end`` of its output,
+        which go to the channels ``written:written + end - begin`` of the result.
+        """
+        cnt = 0
+        written = 0
+        for i in range(self.matrix.shape[0]):
+            for j in range(len(self.scales)):
+                if self.matrix[i, j]:
+                    slices = self.featureOps[i][j].Output.meta.shape[1]
+                    if (
+                        cnt + slices >= slot_roi.start[1]
+                        and slot_roi.start[1] - cnt < slices
+                        and slot_roi.start[1] + written < slot_roi.stop[1]
+                    ):
+                        begin = 0
+                        if cnt < slot_roi.start[1]:
+                            begin = slot_roi.start[1] - cnt
+                        end = slices
+                        if cnt + end > slot_roi.stop[1]:
+                            end = slot_roi.stop[1] - cnt
+
+                        yield i, j, begin, end, written
+                        written += end - begin
+                    cnt += slices
+
+    def _featureBankTasks(self, slot_roi, presmoothed_source, filter_target_slice, target):
+        """
+        Callables that compute the requested features, one per scale (and 2d/3d mode), time step and input channel.
+        All features of a task are computed by one :py:class:`FeatureBank<lazyflow.operators.featureBank.FeatureBank>`
+        (per z slice in 2d), which shares the smoothings and derivatives between them.
+        """
+        # (scale index, in 2d) -> input channel -> [(feature id, feature channels begin:end, target channel)]
+        groups = collections.defaultdict(lambda: collections.defaultdict(list))
+        for i, j, begin, end, written in self._requestedFeatureChannels(slot_roi):
+            op = self.featureOps[i][j]
+            channels_per_input = op.resultingChannels()
+            in2d = bool(op.invalid_z or op.ComputeIn2d.value)
+            for input_c in range(begin // channels_per_input, -(-end // channels_per_input)):
+                feature_start = input_c * channels_per_input
+                c_begin = max(begin, feature_start) - feature_start
+                c_end = min(end, feature_start + channels_per_input) - feature_start
+                target_c = written + feature_start + c_begin - begin
+                groups[(j, in2d)][input_c].append((self.FeatureIds.value[i], c_begin, c_end, target_c))
+
+        def task(j, in2d, tstep, input_c, features):
+            source = presmoothed_source[j][tstep, input_c]
+            feature_ids = [feature_id for feature_id, *_ in features]
+            if in2d:
+                z_slices = range(filter_target_slice[0].start, filter_target_slice[0].stop)
+                for target_z, z in enumerate(z_slices):
+                    bank = FeatureBank(source[z], self.newScales[j], OpBaseFilter.window_size_feature)
+                    results = bank.compute_all(feature_ids)
+                    for feature_id, c_begin, c_end, target_c in features:
+                        result = results[feature_id][(slice(c_begin, c_end), *filter_target_slice[1:])]
+                        target[tstep, target_c : target_c + c_end - c_begin, target_z] = result
+            else:
+                bank = FeatureBank(source, self.newScales[j], OpBaseFilter.window_size_feature)
+                results = bank.compute_all(feature_ids)
+                for feature_id, c_begin, c_end, target_c in features:
+                    result = results[feature_id][(slice(c_begin, c_end), *filter_target_slice)]
+                    target[tstep, target_c : target_c + c_end - c_begin] = result
+
+        for (j, in2d), channels in groups.items():
+            for tstep in range(presmoothed_source[j].shape[0]):
+                for input_c, features in channels.items():
+                    yield partial(task, j, in2d, tstep, input_c, features)
+
     def _computeGaussianSmoothing(self, vol, sigma, roi, in2d):
         if WITH_FAST_FILTERS:
             # Use fast filters (if available)
@@ -27,7 +27,7 @@ import numpy
 from functools import partial
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.roi import getIntersectingRois, roiToSlice
+from lazyflow.roi import getIntersectingBlockGeometry
 from lazyflow.request import RequestPool
 
 
@@ -82,34 +82,26 @@ class OpSplitRequestsBlockwise(Operator):
         self.Output.meta.ram_usage_per_requested_pixel = ram_per_pixel
 
     def execute(self, slot, subindex, roi, result):
-        clipped_block_rois = getIntersectingRois(
-            self.Input.meta.shape, self.BlockShape.value, (roi.start, roi.stop), True
-        )
+        geometry = getIntersectingBlockGeometry(self.Input.meta.shape, self.BlockShape.value, (roi.start, roi.stop))
         if self._always_request_full_blocks:
-            full_block_rois = getIntersectingRois(
-                self.Input.meta.shape, self.BlockShape.value, (roi.start, roi.stop), False
-            )
+            request_starts, request_stops = geometry.block_starts, geometry.block_stops
+            is_full_request = geometry.is_full_block()
         else:
-            full_block_rois = clipped_block_rois
+            request_starts, request_stops = geometry.starts, geometry.stops
+            is_full_request = numpy.ones(geometry.num_blocks, dtype=bool)
+
+        def copy_request_result(output_slicing, roi_within_block_slicing, request_result):
+            self.Output.stype.copy_data(result[output_slicing], request_result[roi_within_block_slicing])
 
         pool = RequestPool()
-        for full_block_roi, clipped_block_roi in zip(full_block_rois, clipped_block_rois):
-            full_block_roi = numpy.asarray(full_block_roi)
-            clipped_block_roi = numpy.asarray(clipped_block_roi)
-
-            req = self.Input(*full_block_roi)
-            output_roi = numpy.asarray(clipped_block_roi) - roi.start
-            if (full_block_roi == clipped_block_roi).all():
-                req.writeInto(result[roiToSlice(*output_roi)])
+        for request_start, request_stop, is_full, output_slicing, roi_within_block_slicing in zip(
+            request_starts, request_stops, is_full_request, geometry.destination_slicings(), geometry.source_slicings()
+        ):
+            req = self.Input(request_start, request_stop)
+            if is_full:
+                req.writeInto(result[output_slicing])
             else:
-                roi_within_block = clipped_block_roi - full_block_roi[0]
-
-                def copy_request_result(output_roi, roi_within_block, request_result):
-                    self.Output.stype.copy_data(
-                        result[roiToSlice(*output_roi)], request_result[roiToSlice(*roi_within_block)]
-                    )
-
-                req.notify_finished(partial(copy_request_result, output_roi, roi_within_block))
+                req.notify_finished(partial(copy_request_result, output_slicing, roi_within_block_slicing))
             pool.add(req)
             del req
         pool.wait()
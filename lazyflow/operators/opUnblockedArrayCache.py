@@ -29,9 +29,10 @@ import numpy
 import vigra
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.operators.opCache import ManagedBlockedCache
+from lazyflow.operators.opCache import ManagedBlockedCache, TierHitCounter
 from lazyflow.request import RequestLock
-from lazyflow.roi import getIntersection, roiFromShape, roiToSlice, containing_rois, sliceToRoi
+from lazyflow.roi import roiFromShape, roiToSlice, sliceToRoi
+from lazyflow.utility.roiIndex import RoiIndex
 
 import logging
 
@@ -63,6 +64,10 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
     def __init__(self, *args, **kwargs):
         super(OpUnblockedArrayCache, self).__init__(*args, **kwargs)
         self._lock = RequestLock()
+        # Optional disk tier for evicted blocks, see setSpillStore()
+        self._spill_store = None
+        self._spill_namespace = None
+        self._hits = TierHitCounter()
         self._resetBlocks()
 
         self.Input.notifyUnready(self._resetBlocks)
@@ -101,6 +106,7 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
                 # Data is already in the cache. Just extract it.
                 block_relative_roi = numpy.array(request_roi) - block_roi[0]
                 self.Output.stype.copy_data(result, self._block_data[block_roi][roiToSlice(*block_relative_roi)])
+                self._hits.count("memory")
                 return
 
         if self.Input.meta.dontcache:
@@ -114,11 +120,9 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
     def _get_containing_block_roi(self, request_roi):
         # Does this roi happen to fit ENTIRELY within an existing stored block?
         request_roi = self._standardize_roi(*request_roi)
-        outer_rois = containing_rois(list(self._block_data.keys()), request_roi)
-        if len(outer_rois) > 0:
-            # Standardize roi for usage as dict key
-            block_roi = self._standardize_roi(*outer_rois[0])
-            return block_roi
+        outer_rois = self._block_index.containing(request_roi)
+        if outer_rois:
+            return outer_rois[0]
         return None
 
     def _fetch_and_store_block(self, block_roi, out):
@@ -136,6 +140,7 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
         # without preventing parallel requests for different blocks.
         with block_lock:
             if block_roi in self._block_data:
+                self._hits.count("memory")
                 if out is None:
                     # Extra [:] here is in case we are decompressing from a chunkedarray
                     return self._block_data[block_roi][:]
@@ -144,17 +149,30 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
                     self.Output.stype.copy_data(out, self._block_data[block_roi][:])
                     return out
 
+            block_data, compute_time = self._unspill_block(block_roi)
+            if block_data is not None:
+                self._hits.count("disk")
+                if out is not None:
+                    self.Output.stype.copy_data(out, block_data)
+                self._store_block_data(block_roi, block_data, compute_time)
+                return block_data
+
+            self._hits.count("recomputed")
             req = self.Input(*block_roi)
             if out is not None:
                 req.writeInto(out)
+            start_time = time.time()
             block_data = req.wait()
-            self._store_block_data(block_roi, block_data)
+            self._store_block_data(block_roi, block_data, compute_time=time.time() - start_time)
         return block_data
 
-    def _store_block_data(self, block_roi, block_data):
+    def _store_block_data(self, block_roi, block_data, compute_time=None):
         """
         Copy block_data and store it into the cache.
         The block_lock is not obtained here, so lock it before you call this.
+
+        compute_time: seconds it took to obtain block_data from upstream (None if unknown),
+                      used by cost aware eviction policies.
         """
         with self._lock:
             if self.CompressionEnabled.value and numpy.dtype(block_data.dtype) in [
@@ -174,10 +192,18 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
             # First double-check that the block wasn't removed from the
             #   cache while we were requesting it.
             # (Could have happened via propagateDirty() or eventually the arrayCacheMemoryMgr)
-            if block_roi in self._block_locks:
+            stored = block_roi in self._block_locks
+            if stored:
+                nbytes = block_storage_data.size * numpy.dtype(block_storage_data.dtype).itemsize
+                self._used_memory += nbytes - self._block_sizes.get(block_roi, 0)
                 self._block_data[block_roi] = block_storage_data
+                self._block_sizes[block_roi] = nbytes
+                self._block_compute_times[block_roi] = compute_time
+                self._block_index.add(block_roi)
 
         self._last_access_times[block_roi] = time.time()
+        if stored:
+            self.notifyMemoryAllocated(nbytes)
 
     def _execute_CleanBlocks(self, slot, subindex, roi, result):
         with self._lock:
@@ -210,32 +236,88 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
             # Everything is dirty, so no need to loop
             self._resetBlocks()
         else:
-            # FIXME: This is O(N) for now.
-            #        We should speed this up by maintaining a bookkeeping data structure in execute().
-            for block_roi in list(self._block_data.keys()):
-                if getIntersection(block_roi, dirty_roi, assertIntersect=False):
-                    self.freeBlock(block_roi)
+            with self._lock:
+                dirty_block_rois = self._block_index.intersecting(dirty_roi)
+                dirty_spilled_rois = self._spilled_index.intersecting(dirty_roi)
+                for block_roi in dirty_spilled_rois:
+                    self._forget_spilled_block(block_roi)
+                store, namespace = self._spill_store, self._spill_namespace
+            for block_roi in dirty_block_rois:
+                self.freeBlock(block_roi)
+            for block_roi in dirty_spilled_rois:
+                store.discard(namespace, block_roi)
 
         self.Output.setDirty(roi.start, roi.stop)
 
+    ##
+    ## Disk tier
+    ##
+    def setSpillStore(self, store):
+        with self._lock:
+            old_store, old_namespace = self._spill_store, self._spill_namespace
+            self._spill_store = store
+            self._spill_namespace = store.new_namespace() if store is not None else None
+            self._spilled_compute_times = {}
+            self._spilled_index = RoiIndex()
+        if old_store is not None:
+            old_store.discard_namespace(old_namespace)
+
+    def evictBlock(self, key):
+        with self._lock:
+            store, namespace = self._spill_store, self._spill_namespace
+            if store is None:
+                return self._free_block(key)
+            block = self._block_data.get(key)
+            compute_time = self._block_compute_times.get(key)
+        if block is None or isinstance(block, numpy.ma.MaskedArray) or block.dtype == object:
+            return self.freeBlock(key)
+
+        # Extra [:] here is in case we are decompressing from a chunkedarray
+        evicted = store.put(namespace, key, block[:])
+        with self._lock:
+            # The block may have become dirty while it was written to disk
+            valid = key not in evicted and self._block_data.get(key) is block and store is self._spill_store
+            if store is self._spill_store:
+                for evicted_key in evicted:
+                    self._forget_spilled_block(evicted_key)
+            if valid:
+                self._spilled_compute_times[key] = compute_time
+                self._spilled_index.add(key)
+            mem = self._free_block(key)
+        if not valid:
+            store.discard(namespace, key)
+        return mem
+
+    def _unspill_block(self, block_roi):
+        """
+        Read a block back from the disk tier, and remove it from there.
+        :returns: (block_data, compute_time), block_data is None if the block wasn't spilled (or is corrupted)
+        """
+        with self._lock:
+            store, namespace = self._spill_store, self._spill_namespace
+            if store is None or block_roi not in self._spilled_index:
+                return None, None
+
+        block_data = store.get(namespace, block_roi)
+        with self._lock:
+            # The block may have become dirty while it was read
+            if store is not self._spill_store or block_roi not in self._spilled_index:
+                return None, None
+            compute_time = self._forget_spilled_block(block_roi)
+        store.discard(namespace, block_roi)
+        return block_data, compute_time
+
+    def _forget_spilled_block(self, block_roi):
+        """Must be called with self._lock held.  Returns the compute time of the block."""
+        self._spilled_index.remove(block_roi)
+        return self._spilled_compute_times.pop(block_roi, None)
+
     ##
     ## OpManagedCache interface implementation
     ##
     def usedMemory(self):
-        total = 0.0
-        for k in list(self._block_data.keys()):
-            try:
-                block = self._block_data[k]
-                bytes_per_pixel = numpy.dtype(block.dtype).itemsize
-                portion = block.size * bytes_per_pixel
-            except (KeyError, AttributeError):
-                # what could have happened and why it's fine
-                #  * block was deleted (then it does not occupy memory)
-                #  * block is not array data (then we don't know how
-                #    much memory it ouccupies)
-                portion = 0.0
-            total += portion
-        return total
+        # Running total, updated whenever a block is stored or freed
+        return self._used_memory
 
     def fractionOfUsedMemoryDirty(self):
         # dirty memory is discarded immediately
@@ -251,6 +333,13 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
             l = [(k, self._last_access_times[k]) for k in self._last_access_times]
         return l
 
+    def getBlockStats(self):
+        with self._lock:
+            return [
+                (k, t, self._block_compute_times.get(k), self._block_sizes.get(k))
+                for k, t in self._last_access_times.items()
+            ]
+
     def freeMemory(self):
         used = self.usedMemory()
         self._resetBlocks()
@@ -258,21 +347,42 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
 
     def freeBlock(self, key):
         with self._lock:
-            if key not in self._block_locks:
-                return 0
-            block = self._block_data[key]
-            bytes_per_pixel = numpy.dtype(block.dtype).itemsize
-            mem = block.size * bytes_per_pixel
-            del self._block_data[key]
-            del self._block_locks[key]
-            del self._last_access_times[key]
-            return mem
+            return self._free_block(key)
+
+    def _free_block(self, key):
+        """Must be called with self._lock held."""
+        if key not in self._block_locks:
+            return 0
+        mem = self._block_sizes.pop(key, 0)
+        self._used_memory -= mem
+        self._block_data.pop(key, None)
+        del self._block_locks[key]
+        self._last_access_times.pop(key, None)
+        self._block_compute_times.pop(key, None)
+        self._block_index.remove(key)
+        return mem
 
     def freeDirtyMemory(self):
         return 0.0
 
+    def generateReport(self, report):
+        super(OpUnblockedArrayCache, self).generateReport(report)
+        report.info = str(self._hits)
+
     def _resetBlocks(self, *_):
+        if self._spill_store is not None:
+            self._spill_store.discard_namespace(self._spill_namespace)
         with self._lock:
+            # Blocks in the disk tier (see setSpillStore()), with their compute times
+            self._spilled_compute_times = {}
+            self._spilled_index = RoiIndex()
             self._block_data = {}
             self._block_locks = {}
             self._last_access_times = collections.defaultdict(float)
+            # Time it took to compute each block (seconds), for cost aware eviction
+            self._block_compute_times = {}
+            # Bytes occupied by each block and in total, so that usedMemory() doesn't have to visit all blocks
+            self._block_sizes = {}
+            self._used_memory = 0
+            # Spatial index of the keys of _block_data, for fast containment and dirtiness queries
+            self._block_index = RoiIndex()
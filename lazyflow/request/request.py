@@ -28,7 +28,6 @@ import heapq
 import functools
 import itertools
 import threading
-import multiprocessing
 import platform
 import traceback
 import io
@@ -118,15 +117,20 @@ class Request(object):
     active_count = 0
 
     @classmethod
-    def reset_thread_pool(cls, num_workers=min(multiprocessing.cpu_count(), 8)):
+    def reset_thread_pool(cls, num_workers=None, scheduler=threadPool.DEFAULT_SCHEDULER):
         """
         Change the number of threads allocated to the request system.
 
         :param num_workers: How many threads to create in the threadpool.
-                            Note: Beyond a certain point, we don't benefit from extra
-                            workers, even on machines with many CPUs.
-                            For more details, see:
-                            https://github.com/ilastik/ilastik/issues/1458
+                            If None, use one thread per CPU that this process may run on
+                            (respecting CPU affinity and cgroup quotas, see ``threadPool.default_num_workers()``).
+        :param scheduler: Name of the scheduling strategy (see ``threadPool.SCHEDULERS``):
+
+                          - ``"global_queue"``: unstarted requests are handed out from one
+                            global priority queue.
+                          - ``"work_stealing"``: every worker owns a deque of unstarted requests,
+                            idle workers steal from busy ones.
+                            Helps when many requests are spawned from within a few long-running requests.
 
         As a special case, you may set ``num_workers`` to 0.
         In that case, the normal thread pool is not used at all.
@@ -137,12 +141,17 @@ class Request(object):
         .. note:: It is only valid to call this function during startup.
                   Any existing requests will be dropped from the pool!
         """
+        if num_workers is None:
+            num_workers = threadPool.default_num_workers()
+
         with cls.class_lock:
             active_count = 0
 
+            # Create the new pool first, so that an invalid scheduler doesn't leave us without a pool
+            new_pool = threadPool.create_thread_pool(num_workers, scheduler)
             if cls.global_thread_pool is not None:
                 cls.global_thread_pool.stop()
-            cls.global_thread_pool = threadPool.ThreadPool(num_workers)
+            cls.global_thread_pool = new_pool
 
     class CancellationException(Exception):
         """
@@ -197,17 +206,55 @@ class Request(object):
 
     _root_request_counter = itertools.count()
 
-    def __init__(self, fn, root_priority=[0]):
+    # Requests are created in large numbers, often for tiny workloads, so keep them small.
+    # (A __dict__ is still available for attributes that callers attach to their requests, it is only created if used.)
+    __slots__ = (
+        "_lock",
+        "_sig_failed",
+        "_sig_cancelled",
+        "_sig_finished",
+        "_sig_execution_complete",
+        "fn",
+        "_result",
+        "started",
+        "cancelled",
+        "uncancellable",
+        "finished",
+        "execution_complete",
+        "_finished_event",
+        "exception",
+        "exception_info",
+        "_cleaned",
+        "greenlet",
+        "_assigned_worker",
+        "pending_requests",
+        "blocking_requests",
+        "child_requests",
+        "_current_foreign_thread",
+        "parent_request",
+        "_max_child_priority",
+        "_priority",
+        "__weakref__",
+        "__dict__",
+    )
+
+    def __init__(self, fn, root_priority=(0,)):
         """
         Constructor.
         Postconditions: The request has the same cancelled status as its parent (the request that is creating this one).
+
+        :param root_priority: Sequence of ints, lower is more urgent.
+                              The priority of a request is a tuple of ints:
+                              its parent's priority (if any), the root_priority and a creation counter.
         """
 
         self._lock = threading.Lock()  # NOT an RLock, since requests may share threads
-        self._sig_failed = SimpleSignal()
-        self._sig_cancelled = SimpleSignal()
-        self._sig_finished = SimpleSignal()
-        self._sig_execution_complete = SimpleSignal()
+
+        # The signals are only created if someone subscribes to them (see notify_finished() etc.)
+        self._sig_failed = None
+        self._sig_cancelled = None
+        self._sig_finished = None
+        self._sig_execution_complete = None
 
         # Workload
         self.fn = fn
@@ -221,7 +268,7 @@ class Request(object):
         self.uncancellable = False
         self.finished = False
         self.execution_complete = False
-        self.finished_event = threading.Event()
+        self._finished_event = None  # Only created if a foreign thread has to block for us
         self.exception = None
         self.exception_info = (None, None, None)
         self._cleaned = False
@@ -232,19 +279,22 @@ class Request(object):
 
         # Request relationships
         self.pending_requests = set()  # Requests that are waiting for this one
-        self.blocking_requests = (
-            set()
-        )  # Requests that this one is waiting for (currently one at most since wait() can only be called on one request at a time)
-        self.child_requests = (
-            set()
-        )  # Requests that were created from within this request (NOT the same as pending_requests)
+        # Requests that this one is waiting for
+        # (currently one at most since wait() can only be called on one request at a time)
+        self.blocking_requests = set()
+        # Requests that were created from within this request (NOT the same as pending_requests)
+        self.child_requests = set()
 
         self._current_foreign_thread = None
+        self._max_child_priority = 0
+
+        if root_priority.__class__ is not tuple:
+            root_priority = tuple(root_priority)
+
         current_request = Request._current_request()
         self.parent_request = current_request
-        self._max_child_priority = 0
         if current_request is None:
-            self._priority = root_priority + [next(Request._root_request_counter)]
+            self._priority = root_priority + (next(Request._root_request_counter),)
         else:
             with current_request._lock:
                 current_request.child_requests.add(self)
@@ -252,7 +302,7 @@ class Request(object):
                 self.cancelled = current_request.cancelled
                 # We acquire the same priority as our parent, plus our own sub-priority
                 current_request._max_child_priority += 1
-                self._priority = current_request._priority + root_priority + [current_request._max_child_priority]
+                self._priority = current_request._priority + root_priority + (current_request._max_child_priority,)
 
     def __lt__(self, other):
         """
@@ -299,14 +349,17 @@ class Request(object):
         :param _fullClean: Internal use only.  If False, only clean internal bookkeeping members.
                            Otherwise, delete everything, including the result.
         """
-        self._sig_cancelled.clean()
-        self._sig_finished.clean()
-        self._sig_failed.clean()
+        self._sig_cancelled = None
+        self._sig_finished = None
+        self._sig_failed = None
 
-        with self._lock:
-            for child in self.child_requests:
-                child.parent_request = None
-            self.child_requests.clear()
+        # Most requests never have children, don't bother with the lock in that case.
+        # (A child that is added concurrently would keep its parent either way.)
+        if self.child_requests:
+            with self._lock:
+                for child in self.child_requests:
+                    child.parent_request = None
+                self.child_requests.clear()
 
         parent_req = self.parent_request
         if parent_req is not None:
@@ -336,6 +389,19 @@ class Request(object):
         # Create our greenlet now (so the greenlet has the correct parent, i.e. the worker)
         self.greenlet = RequestGreenlet(self, self._execute)
 
+    @property
+    def finished_event(self):
+        """
+        A threading.Event that is set once this request has completed execution.
+        (It is only created when somebody asks for it.)
+        """
+        with self._lock:
+            if self._finished_event is None:
+                self._finished_event = threading.Event()
+                if self.execution_complete:
+                    self._finished_event.set()
+            return self._finished_event
+
     @property
     def result(self):
         assert not self._cleaned, "Can't get this result.  The request has already been cleaned!"
@@ -378,20 +444,13 @@ class Request(object):
         try:
             # Notify ONE callback (never more than one)
             if self.exception is not None:
-                self._sig_failed(self.exception, self.exception_info)
-
-                if (
-                    len(self._sig_failed.callbacks) == 0  # No callbacks registered
-                    and len(self.pending_requests) == 0  # No pending requests to propagate the exception to
-                    and Request._current_request() is not None
-                ):  # Not executing synchronously in a non-worked ('foreign') thread
-                    # This request failed, but no body is listening.
-                    # Call sys.excepthook so the developer sees what went wrong.
-                    # (Otherwise, it would be hidden.)
-                    sys.excepthook(*self.exception_info)
+                if self._sig_failed is not None:
+                    self._sig_failed(self.exception, self.exception_info)
+                self._report_unhandled_failure()
             elif self.cancelled:
-                self._sig_cancelled()
-            else:
+                if self._sig_cancelled is not None:
+                    self._sig_cancelled()
+            elif self._sig_finished is not None:
                 self._sig_finished(self._result)
 
         except Exception as ex:
@@ -407,18 +466,12 @@ class Request(object):
 
             # If we already fired sig_failed(), then there's no point in firing it again.
             #  That's the function that caused this problem in the first place!
-            if not failed_during_failure_handler:
-                self._sig_failed(self.exception, self.exception_info)
-
-            if failed_during_failure_handler or (
-                len(self._sig_failed.callbacks) == 0  # No callbacks registered
-                and len(self.pending_requests) == 0  # No pending requests to propagate the exception to
-                and Request._current_request() is not None
-            ):  # Not executing synchronously in a non-worked ('foreign') thread
-                # This request failed, but no body is listening.
-                # Call sys.excepthook so the developer sees what went wrong.
-                # (Otherwise, it would be hidden.)
+            if failed_during_failure_handler:
                 sys.excepthook(*self.exception_info)
+            else:
+                if self._sig_failed is not None:
+                    self._sig_failed(self.exception, self.exception_info)
+                self._report_unhandled_failure()
         else:
             # Now that we're complete, the signals have fired and any requests we needed to wait for have completed.
             # To free memory (and child requests), we can clean up everything but the result.
@@ -428,11 +481,14 @@ class Request(object):
             # Unconditionally signal (internal use only)
             with self._lock:
                 self.execution_complete = True
-                self._sig_execution_complete()
-                self._sig_execution_complete.clean()
+                if self._sig_execution_complete is not None:
+                    self._sig_execution_complete()
+                    self._sig_execution_complete = None
+                finished_event = self._finished_event
 
             # Notify non-request-based threads
-            self.finished_event.set()
+            if finished_event is not None:
+                finished_event.set()
 
             # Clean-up
             if self.greenlet is not None:
@@ -443,6 +499,17 @@ class Request(object):
             with Request.class_lock:
                 Request.active_count -= 1
 
+    def _report_unhandled_failure(self):
+        if (
+            (self._sig_failed is None or len(self._sig_failed.callbacks) == 0)  # No callbacks registered
+            and len(self.pending_requests) == 0  # No pending requests to propagate the exception to
+            and Request._current_request() is not None
+        ):  # Not executing synchronously in a non-worked ('foreign') thread
+            # This request failed, but no body is listening.
+            # Call sys.excepthook so the developer sees what went wrong.
+            # (Otherwise, it would be hidden.)
+            sys.excepthook(*self.exception_info)
+
     def submit(self):
         """
         If this request isn't started yet, schedule it to be started.
@@ -575,6 +642,7 @@ class Request(object):
         """
         This is the implementation of wait() when executed from a foreign (non-worker) thread.
         Here, we rely on an ordinary threading.Event primitive: ``self.finished_event``
+        (created on demand, requests that are executed directly in this thread don't need one).
         """
         # Don't allow this request to be cancelled, since a real thread is waiting for it.
         self.uncancellable = True
@@ -610,10 +678,16 @@ class Request(object):
         else:
             self.submit()
 
-        # This is a non-worker thread, so just block the old-fashioned way
-        completed = self.finished_event.wait(timeout)
-        if not completed:
-            raise Request.TimeoutException()
+            # This is a non-worker thread, so just block the old-fashioned way
+            with self._lock:
+                if self.execution_complete:
+                    finished_event = None
+                else:
+                    if self._finished_event is None:
+                        self._finished_event = threading.Event()
+                    finished_event = self._finished_event
+            if finished_event is not None and not finished_event.wait(timeout):
+                raise Request.TimeoutException()
 
         if self.cancelled:
             # It turns out this request was already cancelled.
@@ -629,7 +703,8 @@ class Request(object):
         If we have to wait, suspend the current request instead of blocking the whole worker thread.
         """
         # Before we suspend the current request, check to see if it's been cancelled since it last blocked
-        Request.raise_if_cancelled()
+        if current_request.cancelled:
+            raise Request.CancellationException()
 
         if current_request == self:
             # It's usually nonsense for a request to wait for itself,
@@ -668,6 +743,8 @@ class Request(object):
                 # This request is already started in some other greenlet.
                 # We must suspend the current greenlet while we wait for this request to complete.
                 # Here, we set up a callback so we'll wake up once this request is complete.
+                if self._sig_execution_complete is None:
+                    self._sig_execution_complete = SimpleSignal()
                 self._sig_execution_complete.subscribe(
                     functools.partial(current_request._handle_finished_request, self)
                 )
@@ -690,7 +767,8 @@ class Request(object):
 
         # Now we're back (no longer suspended)
         # Was the current request cancelled while it was waiting for us?
-        Request.raise_if_cancelled()
+        if current_request.cancelled:
+            raise Request.CancellationException()
 
         # Are we back because we failed?
         if self.exception is not None:
@@ -720,6 +798,8 @@ class Request(object):
             finished = self.finished
             if not finished:
                 # Call when we eventually finish
+                if self._sig_finished is None:
+                    self._sig_finished = SimpleSignal()
                 self._sig_finished.subscribe(fn)
 
         if finished:
@@ -739,6 +819,8 @@ class Request(object):
             cancelled = self.cancelled
             if not finished:
                 # Call when we eventually finish
+                if self._sig_cancelled is None:
+                    self._sig_cancelled = SimpleSignal()
                 self._sig_cancelled.subscribe(fn)
 
         if finished and cancelled:
@@ -760,6 +842,8 @@ class Request(object):
             failed = self.exception is not None
             if not finished:
                 # Call when we eventually finish
+                if self._sig_failed is None:
+                    self._sig_failed = SimpleSignal()
                 self._sig_failed.subscribe(fn)
 
         if finished and failed:
@@ -797,10 +881,10 @@ class Request(object):
         """
         Inspect the current greenlet/thread and return the request object associated with it, if any.
         """
-        current_greenlet = greenlet.getcurrent()
         # Greenlets in worker threads have a monkey-patched 'owning-request' member
-        if hasattr(current_greenlet, "owning_requests"):
-            return current_greenlet.owning_requests[-1]
+        owning_requests = getattr(greenlet.getcurrent(), "owning_requests", None)
+        if owning_requests:
+            return owning_requests[-1]
         else:
             # There is no request associated with this greenlet.
             # It must be a regular (foreign) thread.
@@ -1286,7 +1370,6 @@ class RequestPool(object):
             raise RequestPool.RequestPoolError("Attempted to add a request to a pool that was already started!")
 
         self._unsubmitted_requests.append(req)
-        req.owning_pool = self
 
     def wait(self):
         """
@@ -1545,6 +1628,8 @@ class _ValueRequest:
     Request objects in simple cases where they are not needed.
     """
 
+    __slots__ = ("result", "started")
+
     def __init__(self, value):
         self.result = value
         self.started = False
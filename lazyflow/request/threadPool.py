@@ -21,14 +21,65 @@
 ###############################################################################
 
 import atexit
+import collections
+import itertools
 import logging
+import multiprocessing
+import os
 import queue
+import random
 import threading
 from typing import Callable, List
 
 logger = logging.getLogger(__name__)
 
 
+def _cgroup_cpu_limit():
+    """Return the number of CPUs granted by a cgroup CPU quota, or None if there is no quota.
+
+    Checks the cgroup v2 ``cpu.max`` file first, then the cgroup v1 ``cpu.cfs_quota_us``/``cpu.cfs_period_us`` pair.
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return max(1, int(int(quota) / int(period)))
+        return None
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return max(1, quota // period)
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def default_num_workers() -> int:
+    """Number of CPUs this process can actually run on.
+
+    Unlike ``multiprocessing.cpu_count()``, this takes the CPU affinity mask (e.g. ``taskset``, batch schedulers)
+    and cgroup CPU quotas (e.g. containers) into account.
+    """
+    try:
+        num_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not available on Windows and macOS
+        num_cpus = multiprocessing.cpu_count()
+
+    cgroup_limit = _cgroup_cpu_limit()
+    if cgroup_limit is not None:
+        num_cpus = min(num_cpus, cgroup_limit)
+
+    return max(1, num_cpus)
+
+
 class ThreadPool:
     """Manages a set of worker threads and dispatches tasks to them.
 
@@ -40,12 +91,15 @@ class ThreadPool:
         """Start all workers."""
         self.unassigned_tasks = queue.PriorityQueue()
 
-        self.workers = {_Worker(self, i) for i in range(num_workers)}
+        self.workers = {self._create_worker(i) for i in range(num_workers)}
         for w in self.workers:
             w.start()
 
         atexit.register(self.stop)
 
+    def _create_worker(self, index):
+        return _Worker(self, index)
+
     @property
     def num_workers(self):
         return len(self.workers)
@@ -182,3 +236,165 @@ class _Worker(threading.Thread):
                 # You may have to wrap it in a custom class first.
                 task.assigned_worker = self
                 return task
+
+
+class WorkStealingThreadPool(ThreadPool):
+    """Thread pool in which every worker owns a deque of not-yet-started tasks.
+
+    A task that is woken up for the first time is pushed onto the deque of the worker that submitted it
+    (or of the next worker in round-robin order, if it was submitted from a foreign thread).
+    Workers pop from their own deque in LIFO order and, when they run out of work,
+    steal the oldest task from the deque of a busy peer.
+
+    Tasks that were already started are still pinned to their assigned worker (a greenlet cannot switch threads),
+    so only unstarted tasks are ever stolen.
+
+    Note: Unlike ``ThreadPool``, unstarted tasks are not ordered by priority.
+    """
+
+    def __init__(self, num_workers: int):
+        self._idle_workers_lock = threading.Lock()
+        self._idle_workers = set()
+        self._round_robin = itertools.count()
+        # Workers start stealing as soon as they are started, so this must be filled before that.
+        self._worker_list = []
+        super().__init__(num_workers)
+
+    def _create_worker(self, index):
+        worker = _StealingWorker(self, index)
+        self._worker_list.append(worker)
+        return worker
+
+    def wake_up(self, task: Callable[[], None]) -> None:
+        """Schedule the given task on the worker that is assigned to it.
+
+        If it has no assigned worker yet, push it onto the deque of the current (or next) worker
+        and wake up an idle worker to take care of it.
+        """
+        if hasattr(task, "assigned_worker") and task.assigned_worker is not None:
+            task.assigned_worker.wake_up(task)
+            return
+
+        current_thread = threading.current_thread()
+        if isinstance(current_thread, _StealingWorker) and current_thread.thread_pool is self:
+            owner = current_thread
+        else:
+            owner = self._worker_list[next(self._round_robin) % len(self._worker_list)]
+
+        owner.unstarted_tasks.append(task)
+        self._wake_idle_worker(preferred=owner)
+
+    def _wake_idle_worker(self, preferred=None) -> None:
+        """Notify one idle worker (if there is any) that there is work to steal."""
+        with self._idle_workers_lock:
+            if not self._idle_workers:
+                return
+            if preferred in self._idle_workers:
+                worker = preferred
+                self._idle_workers.discard(worker)
+            else:
+                worker = self._idle_workers.pop()
+
+        with worker.job_queue_condition:
+            worker.job_queue_condition.notify()
+
+    def _mark_idle(self, worker) -> None:
+        with self._idle_workers_lock:
+            self._idle_workers.add(worker)
+
+    def _mark_busy(self, worker) -> None:
+        with self._idle_workers_lock:
+            self._idle_workers.discard(worker)
+
+    def _has_unstarted_tasks(self) -> bool:
+        return any(w.unstarted_tasks for w in self._worker_list)
+
+    def _steal(self, thief):
+        """Take the oldest unstarted task from a peer of the given worker, or return None if there is none."""
+        num_peers = len(self._worker_list)
+        offset = random.randrange(num_peers)
+        for i in range(num_peers):
+            victim = self._worker_list[(offset + i) % num_peers]
+            if victim is thief:
+                continue
+            try:
+                return victim.unstarted_tasks.popleft()
+            except IndexError:
+                continue
+        return None
+
+
+class _StealingWorker(_Worker):
+    """Worker of a ``WorkStealingThreadPool``.
+
+    Looks for work in this order: its own pinned tasks, its own unstarted tasks, unstarted tasks of its peers.
+    """
+
+    def __init__(self, thread_pool, index):
+        super().__init__(thread_pool, index)
+        # Appending and popping from either side of a deque is thread-safe.
+        self.unstarted_tasks = collections.deque()
+
+    def _get_next_job(self):
+        """Get the next available job to perform.
+
+        If necessary, block until a task is available (return it) or the worker has been stopped (might return None).
+        """
+        pool = self.thread_pool
+        with self.job_queue_condition:
+            while not self.stopped:
+                # Register as idle *before* looking for work,
+                # so that a task pushed after the search below is guaranteed to wake us up.
+                pool._mark_idle(self)
+                next_task = self._pop_job()
+                if next_task is not None:
+                    pool._mark_busy(self)
+                    break
+                self.job_queue_condition.wait()
+            else:
+                return None
+
+        assert next_task.assigned_worker is self
+
+        # Someone might have picked us to take care of a task, but we found another one.
+        # Pass the wake-up on, so that the remaining work doesn't wait for us.
+        if pool._has_unstarted_tasks():
+            pool._wake_idle_worker()
+
+        return next_task
+
+    def _pop_job(self):
+        """Get a pinned job from our own job queue, an unstarted one from our own deque, or steal one from a peer.
+
+        Return None if there is no work anywhere.
+
+        Non-blocking.
+        """
+        try:
+            return self.job_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        try:
+            task = self.unstarted_tasks.pop()
+        except IndexError:
+            task = self.thread_pool._steal(self)
+            if task is None:
+                return None
+
+        task.assigned_worker = self
+        return task
+
+
+#: Schedulers that can be selected via ``Request.reset_thread_pool(scheduler=...)``
+SCHEDULERS = {"global_queue": ThreadPool, "work_stealing": WorkStealingThreadPool}
+DEFAULT_SCHEDULER = "global_queue"
+
+
+def create_thread_pool(num_workers: int, scheduler: str = DEFAULT_SCHEDULER) -> ThreadPool:
+    """Create a thread pool with the given number of workers, using the scheduler with the given name."""
+    try:
+        pool_class = SCHEDULERS[scheduler]
+    except KeyError:
+        raise ValueError(f"Unknown scheduler {scheduler!r}. Choose one of: {', '.join(SCHEDULERS)}") from None
+    return pool_class(num_workers)
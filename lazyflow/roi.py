@@ -22,7 +22,6 @@
 
 import collections
 import numbers
-from functools import partial
 from itertools import combinations
 from math import ceil, floor, log10, pow
 from typing import Sequence, Tuple, Union
@@ -616,14 +615,10 @@ def getIntersectingBlocks(blockshape, roi, asarray=False):
         blockshape, roi
     )
     assert not numpy.any(numpy.isclose(blockshape, 0)), f"blockshape ({blockshape}) should not contain zero elements"
-    roistart = TinyVector(roi[0])
-    roistop = TinyVector(roi[1])
-    blockshape = TinyVector(blockshape)
-
-    block_index_map_start = roistart // blockshape
-    block_index_map_stop = (
-        roistop + (blockshape - 1)
-    ) // blockshape  # Add (blockshape-1) first as a faster alternative to ceil()
+    blockshape = numpy.asarray(blockshape)
+    block_index_map_start = numpy.floor_divide(roi[0], blockshape)
+    # Add (blockshape-1) first as a faster alternative to ceil()
+    block_index_map_stop = numpy.floor_divide(numpy.add(roi[1], blockshape - 1), blockshape)
     block_index_map_shape = block_index_map_stop - block_index_map_start
 
     num_axes = len(blockshape)
@@ -644,11 +639,103 @@ def getIntersectingBlocks(blockshape, roi, asarray=False):
 
 
 def getIntersectingRois(dataset_shape, blockshape, roi, clip_blocks_to_roi=True):
-    block_starts = getIntersectingBlocks(blockshape, roi)
-    block_rois = list(map(partial(getBlockBounds, dataset_shape, blockshape), block_starts))
+    geometry = getIntersectingBlockGeometry(dataset_shape, blockshape, roi)
     if clip_blocks_to_roi:
-        block_rois = [getIntersection(block_roi, roi) for block_roi in block_rois]
-    return block_rois
+        return list(zip(geometry.starts, geometry.stops))
+    return list(zip(geometry.block_starts, geometry.block_stops))
+
+
+class BlockGeometry(
+    collections.namedtuple("BlockGeometry", ["block_starts", "block_stops", "starts", "stops", "roi_start"])
+):
+    """
+    Geometry of all blocks that intersect a roi, as computed by getIntersectingBlockGeometry().
+
+    All fields except roi_start are integer arrays of shape (N, M) for N blocks with M axes:
+
+    block_starts, block_stops: the whole blocks, clipped to the dataset
+    starts, stops: the portion of each block that lies within the roi
+    """
+
+    __slots__ = ()
+
+    @property
+    def num_blocks(self):
+        return len(self.block_starts)
+
+    def is_full_block(self):
+        """Boolean array: which blocks lie entirely within the roi"""
+        return (self.starts == self.block_starts).all(axis=1) & (self.stops == self.block_stops).all(axis=1)
+
+    def destination_slicings(self):
+        """Slicing of each block's portion of the roi, relative to the roi start (i.e. within a result array)"""
+        return _slicings(self.starts - self.roi_start, self.stops - self.roi_start)
+
+    def source_slicings(self):
+        """Slicing of each block's portion of the roi, relative to the block start (i.e. within the block)"""
+        return _slicings(self.starts - self.block_starts, self.stops - self.block_starts)
+
+
+def _slicings(starts, stops):
+    return [tuple(map(slice, start, stop)) for start, stop in zip(starts.tolist(), stops.tolist())]
+
+
+def getIntersectingBlockGeometry(dataset_shape, blockshape, roi, grid_origin=None):
+    """
+    Batched version of getIntersectingBlocks(), getBlockBounds() and getIntersection():
+    Compute the bounds of all blocks that intersect the given roi at once, with numpy only.
+
+    :param dataset_shape: blocks are clipped to (0, dataset_shape)
+    :param blockshape: shape of the blocks
+    :param roi: (start, stop), must lie within the dataset
+    :param grid_origin: coordinate of a corner of the block grid (default: 0)
+    :returns: BlockGeometry, blocks are in the same order as returned by getIntersectingBlocks()
+
+    >>> geometry = getIntersectingBlockGeometry((35, 35), (10, 20), [(15, 25), (32, 35)])
+    >>> print(geometry.block_starts)
+    [[10 20]
+     [20 20]
+     [30 20]]
+    >>> print(geometry.block_stops)
+    [[20 35]
+     [30 35]
+     [35 35]]
+    >>> print(geometry.starts)
+    [[15 25]
+     [20 25]
+     [30 25]]
+    >>> geometry.destination_slicings()[1]
+    (slice(5, 15, None), slice(0, 10, None))
+    >>> geometry.source_slicings()[1]
+    (slice(0, 10, None), slice(5, 15, None))
+    >>> geometry.is_full_block()
+    array([False, False, False])
+
+    With a grid_origin, blocks are aligned to that coordinate instead of 0:
+
+    >>> print(getIntersectingBlockGeometry((35, 35), (10, 20), [(15, 25), (32, 35)], grid_origin=(15, 25)).block_starts)
+    [[15 25]
+     [25 25]]
+    """
+    blockshape = numpy.asarray(blockshape, dtype=numpy.int64)
+    roi_start = numpy.asarray(roi[0], dtype=numpy.int64)
+    roi_stop = numpy.asarray(roi[1], dtype=numpy.int64)
+    assert len(dataset_shape) == len(blockshape) == len(roi_start) == len(roi_stop), (
+        "dataset_shape, blockshape and roi are mismatched: {} vs {} vs {}".format(dataset_shape, blockshape, roi)
+    )
+    assert (blockshape > 0).all(), f"blockshape ({blockshape}) should not contain zero elements"
+
+    origin = 0 if grid_origin is None else numpy.asarray(grid_origin, dtype=numpy.int64)
+    first_block_index = (roi_start - origin) // blockshape
+    # Add (blockshape-1) first as a faster alternative to ceil()
+    stop_block_index = (roi_stop - origin + blockshape - 1) // blockshape
+    block_indices = numpy.indices(stop_block_index - first_block_index).reshape(len(blockshape), -1).T
+    block_starts = (block_indices + first_block_index) * blockshape + origin
+    block_stops = numpy.minimum(block_starts + blockshape, numpy.asarray(dataset_shape, dtype=numpy.int64))
+    block_starts = numpy.maximum(block_starts, 0)
+    starts = numpy.maximum(block_starts, roi_start)
+    stops = numpy.minimum(block_stops, roi_stop)
+    return BlockGeometry(block_starts, block_stops, starts, stops, roi_start)
 
 
 def is_fully_contained(inner_roi, outer_roi):
@@ -668,13 +755,34 @@ def getBlockBounds(dataset_shape, block_shape, block_start):
         numpy.mod(block_start, block_shape) == 0
     ).all(), "Invalid block_start: {}.  Must be a multiple of the block shape: {}".format(block_start, block_shape)
 
-    entire_dataset_roi = roiFromShape(dataset_shape)
-    block_shape = TinyVector(block_shape)
-    block_bounds = (block_start, block_start + block_shape)
-
     # Clip to dataset bounds
-    block_bounds = getIntersection(block_bounds, entire_dataset_roi)
-    return block_bounds
+    start = numpy.maximum(block_start, 0)
+    stop = numpy.minimum(numpy.add(block_start, block_shape), dataset_shape)
+    assert (stop > start).all(), "Block {} does not intersect the dataset {}".format(block_start, dataset_shape)
+    return (start, stop)
+
+
+def getMortonOrder(block_indices):
+    """
+    Return the permutation that sorts the given block grid indices (one row per block) along a Z-order curve,
+    which keeps consecutive blocks close together along all axes.
+
+    >>> block_indices = [(y, x) for y in range(4) for x in range(4)]
+    >>> print([block_indices[i] for i in getMortonOrder(block_indices)][:8])
+    [(0, 0), (0, 1), (1, 0), (1, 1), (0, 2), (0, 3), (1, 2), (1, 3)]
+    """
+    block_indices = numpy.asarray(block_indices)
+    if len(block_indices) <= 1:
+        return numpy.arange(len(block_indices))
+    block_indices = block_indices - block_indices.min(axis=0)
+    num_bits = int(block_indices.max()).bit_length()
+    # Interleave the bits, most significant first.  lexsort() uses the last key as the primary one.
+    keys = [
+        (block_indices[:, axis] >> bit) & 1
+        for bit in range(num_bits - 1, -1, -1)
+        for axis in range(block_indices.shape[1])
+    ]
+    return numpy.lexsort(keys[::-1])
 
 
 def determineBlockShape(max_shape, target_block_volume):
@@ -720,6 +828,36 @@ def determineBlockShape(max_shape, target_block_volume):
     return tuple(block_shape)
 
 
+def determine_chunk_aligned_shapes(max_chunkshape, request_blockshape, dataset_shape, target_chunk_volume):
+    """
+    Co-select the chunk shape of a dataset and the blockshape of the requests that write it,
+    such that every (absolutely aligned) request covers whole chunks.
+
+    The chunk shape is chosen with determineBlockShape(), but never exceeds the request blockshape.
+    Each axis of the request blockshape is then rounded down to a multiple of the chunk shape
+    (at least one chunk), so that the requests are never larger than request_blockshape (e.g. a RAM bound),
+    and clipped to the dataset shape.
+
+    :param max_chunkshape: maximum chunk extent per axis (e.g. 1 for the time axis)
+    :param request_blockshape: the preferred request blockshape
+    :param target_chunk_volume: desired chunk volume (in pixels)
+    :return: (chunkshape, blockshape)
+
+    >>> determine_chunk_aligned_shapes((1, 1000, 1000, 1), (1, 300, 300, 3), (10, 1000, 1000, 3), 64**2)
+    ((1, 64, 64, 1), (1, 256, 256, 3))
+
+    If the requests are smaller than the target chunk along some axis, the chunks grow along the other axes:
+
+    >>> determine_chunk_aligned_shapes((1000, 1000), (1, 500), (1000, 1000), 100)
+    ((1, 100), (1, 500))
+    """
+    max_chunkshape = numpy.minimum(numpy.minimum(max_chunkshape, request_blockshape), dataset_shape)
+    chunkshape = numpy.array(determineBlockShape(max_chunkshape, target_chunk_volume))
+    num_chunks = numpy.maximum(1, numpy.floor_divide(request_blockshape, chunkshape))
+    blockshape = numpy.minimum(num_chunks * chunkshape, dataset_shape)
+    return tuple(map(int, chunkshape)), tuple(map(int, blockshape))
+
+
 def determine_optimal_request_blockshape(
     max_blockshape, ideal_blockshape, ram_usage_per_requested_pixel, num_threads, available_ram
 ):
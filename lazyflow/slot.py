@@ -211,6 +211,11 @@ class Slot(object):
 
         self._resizing = False
 
+        # In-flight requests by roi, for slots that deduplicate their requests.
+        # None means deduplication is disabled (see OutputSlot.deduplicate_requests)
+        self._inflight_requests = None
+        self._inflight_lock = threading.Lock()
+
         # Allow slots to be sorted by their order of creation for
         # debug output and diagramming purposes.
         self._global_slot_id = next(Slot._global_counter)
@@ -827,6 +832,11 @@ class Slot(object):
                 ), "This inputSlot has no value and no upstream_slot.  You can't ask for its data yet!"
             # normal (outputslot) case
             # --> construct heavy request object..
+            if self._inflight_requests is not None:
+                key = self._inflight_key(roi)
+                if key is not None:
+                    return Request(Slot.DeduplicatedExecutionWrapper(self, roi, key))
+
             execWrapper = Slot.RequestExecutionWrapper(self, roi)
             request = Request(execWrapper)
 
@@ -883,6 +893,82 @@ class Slot(object):
 
             return destination
 
+    class DeduplicatedExecutionWrapper:
+        """
+        Workload of a request for a slot that deduplicates its requests.
+
+        Instead of calling execute() directly, attach to the shared in-flight
+        request for the same roi (starting it if there is none) and copy its result.
+        Every caller keeps its own Request (and its own result array),
+        so callers can't interfere with each other's destinations.
+        """
+
+        __slots__ = ("slot", "roi", "key")
+
+        def __init__(self, slot, roi, key):
+            self.slot = slot
+            self.roi = roi
+            self.key = key
+
+        def __call__(self, destination=None):
+            shared_request = self.slot._get_inflight_request(self.key, self.roi)
+            try:
+                result = shared_request.wait()
+            except Request.InvalidRequestException:
+                # The shared request was cancelled by all of its other callers.
+                # We still need the data, so compute it ourselves.
+                return Slot.RequestExecutionWrapper(self.slot, self.roi)(destination)
+
+            if destination is None:
+                destination = self.slot.stype.allocateDestination(self.roi)
+            self.slot.stype.copy_data(dst=destination, src=result)
+            return destination
+
+    def _inflight_key(self, roi):
+        """
+        Key of the in-flight request table for the given roi,
+        or None if requests for this roi can't be deduplicated.
+        """
+        if not isinstance(roi, rtype.SubRegion) or not isinstance(self.stype, ArrayLike):
+            return None
+        return (tuple(int(x) for x in roi.start), tuple(int(x) for x in roi.stop))
+
+    def _get_inflight_request(self, key, roi):
+        """
+        Return the in-flight request that computes the given roi.
+        If there is none, create one (it is started by the first caller that waits for it).
+        """
+        with self._inflight_lock:
+            inflight = self._inflight_requests
+            request = inflight.get(key) if inflight is not None else None
+            if request is not None:
+                return request
+
+            request = Request(Slot.RequestExecutionWrapper(self, roi))
+            if inflight is not None:
+                inflight[key] = request
+
+        # Forget the request as soon as it is done, so that later calls see fresh data.
+        discard = partial(self._discard_inflight_request, key, request)
+        request.notify_finished(discard)
+        request.notify_failed(discard)
+        request.notify_cancelled(discard)
+        return request
+
+    def _discard_inflight_request(self, key, request, *args):
+        with self._inflight_lock:
+            if self._inflight_requests and self._inflight_requests.get(key) is request:
+                del self._inflight_requests[key]
+
+    def _forget_inflight_requests(self):
+        """
+        Make sure that requests issued from now on don't attach to requests
+        that may have started before the data changed.
+        """
+        with self._inflight_lock:
+            if self._inflight_requests:
+                self._inflight_requests.clear()
+
     @is_setup_fn
     def setDirty(self, *args, **kwargs):
         """This method is called by a partnering OutputSlot when its
@@ -896,6 +982,9 @@ class Slot(object):
             "Slot '{}' cannot be set dirty," " slot not belonging to any" " actual operator instance".format(self.name)
         )
 
+        if self._inflight_requests is not None:
+            self._forget_inflight_requests()
+
         if self.stype.isConfigured():
             if len(args) == 0 or not isinstance(args[0], rtype.Roi):
                 roi = self.rtype(self, *args, **kwargs)
@@ -1309,6 +1398,8 @@ class Slot(object):
         init_kwargs["allow_mask"] = self.allow_mask
         if self._type == "input":
             init_kwargs["optional"] = self._optional
+        elif self._type == "output":
+            init_kwargs["deduplicate_requests"] = self.deduplicate_requests
 
         init_kwargs.update(init_kwarg_overrides)
 
@@ -1480,9 +1571,26 @@ class OutputSlot(Slot):
 
     This call returns an GetItemRequestObject.
 
+    If ``deduplicate_requests`` is True, requests for the same roi that are issued
+    while an identical request is still running share a single call to execute().
+    This is useful for expensive, uncached outputs that are read by several consumers at once.
+
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, deduplicate_requests=False, **kwargs):
         super(OutputSlot, self).__init__(*args, **kwargs)
         self._type = "output"
         assert "optional" not in kwargs, '"optional" init arg cannot be used with OutputSlot'
+        self.deduplicate_requests = deduplicate_requests
+
+    @property
+    def deduplicate_requests(self):
+        return self._inflight_requests is not None
+
+    @deduplicate_requests.setter
+    def deduplicate_requests(self, enabled):
+        with self._inflight_lock:
+            if not enabled:
+                self._inflight_requests = None
+            elif self._inflight_requests is None:
+                self._inflight_requests = {}
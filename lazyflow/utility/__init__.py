@@ -32,6 +32,7 @@ from .fileLock import FileLock
 from .tracer import Tracer, traceLogged
 from .pathHelpers import PathComponents, getPathVariants, isUrl, make_absolute, globH5N5, globList, mkdir_p, lsH5N5
 
+from .blockJournal import BlockJournal, MemoryBlockJournal, FileBlockJournal, AttributeBlockJournal
 from .roiRequestBatch import RoiRequestBatch
 from .bigRequestStreamer import BigRequestStreamer
 from . import io_util
@@ -45,3 +46,4 @@ from .log_exception import log_exception
 from .transposed_view import TransposedView
 from .reorderAxesDecorator import reorder_options, reorder
 from .pipeline import Pipeline
+from .roiIndex import RoiIndex
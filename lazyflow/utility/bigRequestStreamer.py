@@ -24,13 +24,15 @@ from builtins import object
 # This information is also available on the ilastik web site at:
 # 		   http://ilastik.org/license/
 ###############################################################################
+import threading
+
 import numpy
+import psutil
 from lazyflow.request import Request
 from lazyflow.utility import RoiRequestBatch
 from lazyflow.roi import (
-    getIntersectingBlocks,
-    getBlockBounds,
-    getIntersection,
+    getIntersectingBlockGeometry,
+    getMortonOrder,
     determine_optimal_request_blockshape,
     determineBlockShape,
 )
@@ -42,6 +44,157 @@ from .memory import Memory
 logger = logging.getLogger(__name__)
 
 
+class BlockAutotuner(object):
+    """
+    Adapts the size of the blocks, and the number of requests in flight, of a running BigRequestStreamer.
+
+    The roi is divided into columns of the initial blockshape along one axis (the tuning axis).
+    Each column is cut into blocks whose extent along that axis (the block "thickness") is only
+    decided when the block is requested, so changes take effect immediately.
+    Every ``num_threads`` finished blocks, the mean wall time per block, the bytes produced and the
+    peak resident memory (RSS) of the process since the last decision are used to adapt:
+
+    - If the RSS grew by more than ``ram_budget`` since the start, blocks are halved
+      (or, once they can't shrink any further, fewer requests are run in parallel).
+    - If blocks take much longer than ``target_seconds``, they are halved, to keep load balancing
+      and progress reporting responsive.
+    - Otherwise, parallelism that was given up earlier is restored first.  Then, if blocks take less
+      than half of ``target_seconds`` and twice the memory in use still fits into ``ram_budget``,
+      the blocks are doubled, to reduce the per-request overhead.
+    """
+
+    def __init__(
+        self,
+        roi,
+        blockshape,
+        axis,
+        batch_size,
+        num_threads,
+        grid_origin=None,
+        grid_step=1,
+        ram_budget=None,
+        target_seconds=1.0,
+        rss_fn=None,
+    ):
+        """
+        :param roi: The roi `(start, stop)` to divide.
+        :param blockshape: The initial blockshape.  Stays fixed for all axes except ``axis``.
+        :param axis: The tuning axis.
+        :param batch_size: The initial (and maximal) number of requests in flight.
+        :param num_threads: Number of finished blocks between two adaptations.
+        :param grid_origin: Origin of the grid of columns (see ``getIntersectingBlockGeometry``).
+        :param grid_step: Block boundaries along the tuning axis are multiples of this (absolute coordinates).
+        :param ram_budget: Bytes that the export may add to the RSS.  Default: ``Memory.getAvailableRamComputation()``.
+        :param target_seconds: Desired wall time per block.
+        :param rss_fn: Returns the current RSS in bytes.  Default: ask psutil.
+        """
+        self._roi = (tuple(map(int, roi[0])), tuple(map(int, roi[1])))
+        self._blockshape = tuple(map(int, blockshape))
+        self._axis = axis
+        self._grid_origin = grid_origin
+        self._step = int(grid_step)
+        self._num_threads = num_threads
+        self._ram_budget = Memory.getAvailableRamComputation() if ram_budget is None else ram_budget
+        self._target_seconds = target_seconds
+        if rss_fn is None:
+            process = psutil.Process()
+            rss_fn = lambda: process.memory_info().rss
+        self._rss = rss_fn
+
+        extent = self._roi[1][axis] - self._roi[0][axis]
+        self._min_thickness = min(self._step, extent)
+        self._max_thickness = max(self._min_thickness, extent)
+        self._thickness = self._align(self._blockshape[axis])
+        self._max_batch_size = batch_size
+        self._batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._baseline_rss = self._rss()
+        self._peak_rss = self._baseline_rss
+        self._round_seconds = []
+        self._round_bytes = []
+
+    @property
+    def thickness(self):
+        """The extent of the next blocks along the tuning axis."""
+        return self._thickness
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    def _align(self, thickness):
+        thickness = max(self._min_thickness, min(self._max_thickness, thickness))
+        return max(self._min_thickness, thickness // self._step * self._step)
+
+    def rois(self):
+        """
+        Generate the block rois, sized according to the current thickness.
+        """
+        start, stop = self._roi
+        axis = self._axis
+        # One column per block of the cross section
+        column_blockshape = list(self._blockshape)
+        column_blockshape[axis] = max(1, stop[axis])
+        geometry = getIntersectingBlockGeometry(stop, column_blockshape, self._roi, self._grid_origin)
+        for column_start, column_stop in zip(geometry.starts, geometry.stops):
+            block_start, block_stop = list(column_start), list(column_stop)
+            position = column_start[axis]
+            while position < column_stop[axis]:
+                end = position + self._thickness
+                # Continue at a grid boundary
+                end = min(column_stop[axis], -(-end // self._step) * self._step)
+                block_start[axis], block_stop[axis] = position, end
+                yield tuple(block_start), tuple(block_stop)
+                position = end
+
+    def block_finished(self, roi, seconds, nbytes):
+        """
+        Record the measurements of a finished block, adapting the blocking if a round is complete.
+
+        :return: The number of requests that should be in flight.
+        """
+        with self._lock:
+            rss = self._rss()
+            self._peak_rss = max(self._peak_rss, rss)
+            self._round_seconds.append(seconds)
+            self._round_bytes.append(nbytes)
+            if len(self._round_seconds) >= self._num_threads:
+                self._adapt(
+                    numpy.mean(self._round_seconds), numpy.mean(self._round_bytes), self._peak_rss - self._baseline_rss
+                )
+                self._round_seconds = []
+                self._round_bytes = []
+                self._peak_rss = self._baseline_rss
+            return self._batch_size
+
+    def _adapt(self, mean_seconds, mean_bytes, used_ram):
+        thickness, batch_size = self._thickness, self._batch_size
+        if used_ram > self._ram_budget:
+            if thickness > self._min_thickness:
+                thickness = self._align(thickness // 2)
+            else:
+                batch_size = max(1, batch_size - 1)
+        elif mean_seconds > 4 * self._target_seconds and thickness > self._min_thickness:
+            thickness = self._align(thickness // 2)
+        elif batch_size < self._max_batch_size and 2 * used_ram < self._ram_budget:
+            batch_size += 1
+        elif (
+            mean_seconds < self._target_seconds / 2
+            and 2 * max(used_ram, batch_size * mean_bytes) < self._ram_budget
+            and thickness < self._max_thickness
+        ):
+            thickness = self._align(2 * thickness)
+
+        if (thickness, batch_size) != (self._thickness, self._batch_size):
+            logger.debug(
+                "Block autotuning: {:.2f}s per block, {} added RSS: thickness {} -> {}, batch size {} -> {}".format(
+                    mean_seconds, Memory.format(used_ram), self._thickness, thickness, self._batch_size, batch_size
+                )
+            )
+            self._thickness, self._batch_size = thickness, batch_size
+
+
 class BigRequestStreamer(object):
     """
     Execute a big request by breaking it up into smaller requests.
@@ -94,7 +247,20 @@ class BigRequestStreamer(object):
     """
 
     def __init__(
-        self, outputSlot, roi, blockshape=None, batchSize=None, blockAlignment="absolute", allowParallelResults=False
+        self,
+        outputSlot,
+        roi,
+        blockshape=None,
+        batchSize=None,
+        blockAlignment="absolute",
+        allowParallelResults=False,
+        numWriters=0,
+        writeBufferBytes=None,
+        blockGrid=None,
+        adaptive=False,
+        targetBlockSeconds=1.0,
+        blockOrder="C",
+        journal=None,
     ):
         """
         Constructor.
@@ -106,6 +272,23 @@ class BigRequestStreamer(object):
         :param blockAlignment: Determines how block the requests. Choices are 'absolute' or 'relative'.
         :param allowParallelResults: If False, The resultSignal will not be called in parallel.
                                      In that case, your handler function has no need for locks.
+        :param numWriters: Number of threads that handle the results behind the computation (write-behind).
+                           See :py:class:`RoiRequestBatch<lazyflow.utility.roiRequestBatch.RoiRequestBatch>`.
+        :param writeBufferBytes: Maximum size of the results waiting for the writers.
+        :param blockGrid: If given, the blockshape is rounded down to a multiple of this shape (at least one),
+                          e.g. the chunk shape of the dataset that the results are written to,
+                          so that no two (absolutely aligned) blocks share a chunk.
+        :param adaptive: If True, the size of the blocks along one axis and the number of requests in flight
+                         are adapted while running, based on the measured time per block and memory usage.
+                         The given (or determined) blockshape is the starting point.  See :py:class:`BlockAutotuner`.
+        :param targetBlockSeconds: The wall time per block that the adaptive mode aims for.
+        :param blockOrder: The order in which the blocks are requested: 'C' (row-major) or 'morton' (Z-order curve,
+                           which keeps consecutive blocks close together along all axes).  Ignored in adaptive mode.
+        :param journal: A :py:class:`BlockJournal<lazyflow.utility.blockJournal.BlockJournal>` that records the
+                        blocks whose results have been handled by all subscribers of the resultSignal.
+                        If it already holds blocks of a compatible run (same roi and blocking), these are skipped,
+                        and the blockshape of that run is used.  Progress is reported for the remaining blocks only.
+                        Not supported in adaptive mode.
         """
         self._outputSlot = outputSlot
         self._bigRoi = roi
@@ -119,65 +302,131 @@ class BigRequestStreamer(object):
         if blockshape is None:
             blockshape = self._determine_blockshape(outputSlot)
 
+        if blockGrid is not None:
+            blockshape = numpy.maximum(1, numpy.asarray(blockshape) // blockGrid) * blockGrid
+            blockshape = tuple(map(int, numpy.minimum(blockshape, outputSlot.meta.shape)))
+
         assert blockAlignment in ["relative", "absolute"]
         if blockAlignment == "relative":
             # Align the blocking with the start of the roi
-            offsetRoi = ([0] * len(roi[0]), numpy.subtract(roi[1], roi[0]))
-            block_starts = getIntersectingBlocks(blockshape, offsetRoi)
-            block_starts += roi[0]  # Un-offset
-
-            # For now, simply iterate over the min blocks
-            # TODO: Auto-dialate block sizes based on CPU/RAM usage.
-            def roiGen():
-                block_iter = block_starts.__iter__()
-                while True:
-                    try:
-                        block_start = next(block_iter)
-                    except StopIteration:
-                        # As of Python 3.7, not allowed to let StopIteration exceptions escape a generator
-                        # https://www.python.org/dev/peps/pep-0479
-                        break
-                    else:
-                        # Use offset blocking
-                        offset_block_start = block_start - self._bigRoi[0]
-                        offset_data_shape = numpy.subtract(self._bigRoi[1], self._bigRoi[0])
-                        offset_block_bounds = getBlockBounds(offset_data_shape, blockshape, offset_block_start)
-
-                        # Un-offset
-                        block_bounds = (
-                            offset_block_bounds[0] + self._bigRoi[0],
-                            offset_block_bounds[1] + self._bigRoi[0],
-                        )
-                        logger.debug("Requesting Roi: {}".format(block_bounds))
-                        yield block_bounds
-
+            grid_origin = roi[0]
         else:
             # Absolute blocking.
             # Blocks are simply relative to (0,0,0,...)
             # But we still clip the requests to the overall roi bounds.
-            block_starts = getIntersectingBlocks(blockshape, roi)
+            grid_origin = None
+
+        if adaptive:
+            assert journal is None, "Journals are not supported in adaptive mode"
+            axis = self._choose_tuning_axis(blockshape, roi)
+            self._autotuner = BlockAutotuner(
+                roi,
+                blockshape,
+                axis,
+                batchSize,
+                self._num_threads,
+                grid_origin=grid_origin,
+                grid_step=1 if blockGrid is None else blockGrid[axis],
+                target_seconds=targetBlockSeconds,
+            )
+            rois = self._autotuner.rois()
+        else:
+            self._autotuner = None
+            assert blockOrder in ["C", "morton"]
+            finished = set()
+            if journal is not None:
+                blockshape, finished = self._startJournal(journal, roi, blockshape, blockAlignment, blockGrid)
+            geometry = getIntersectingBlockGeometry(outputSlot.meta.shape, blockshape, roi, grid_origin)
+            if blockOrder == "C":
+                order = range(geometry.num_blocks)
+            else:
+                order = getMortonOrder(geometry.block_starts // numpy.asarray(blockshape))
+
+            if finished:
+                order = [i for i in order if i not in finished]
+                volumes = numpy.prod(geometry.stops[order] - geometry.starts[order], axis=1)
+                totalVolume = int(volumes.sum())
+                logger.info(f"Resuming: {len(finished)} of {geometry.num_blocks} blocks are already finished")
+            self._blockIndices = {tuple(geometry.starts[i]): i for i in order} if journal is not None else None
 
             def roiGen():
-                block_iter = block_starts.__iter__()
-                while True:
-                    try:
-                        block_start = next(block_iter)
-                    except StopIteration:
-                        # As of Python 3.7, not allowed to let StopIteration exceptions escape a generator
-                        # https://www.python.org/dev/peps/pep-0479
-                        break
-                    else:
-                        block_bounds = getBlockBounds(outputSlot.meta.shape, blockshape, block_start)
-                        block_intersecting_portion = getIntersection(block_bounds, roi)
-
-                        logger.debug("Requesting Roi: {}".format(block_bounds))
-                        yield block_intersecting_portion
-
-        self._requestBatch = RoiRequestBatch(self._outputSlot, roiGen(), totalVolume, batchSize, allowParallelResults)
+                for i in order:
+                    block_bounds = (geometry.starts[i], geometry.stops[i])
+                    logger.debug("Requesting Roi: {}".format(block_bounds))
+                    yield block_bounds
+
+            rois = roiGen()
+
+        self._requestBatch = RoiRequestBatch(
+            self._outputSlot,
+            rois,
+            totalVolume,
+            batchSize,
+            allowParallelResults,
+            numWriters=numWriters,
+            writeBufferBytes=writeBufferBytes,
+        )
+        if self._autotuner is not None:
+            self._requestBatch.requestFinishedSignal.subscribe(self._handleRequestFinished)
+        self._journal = journal
+
+    def _startJournal(self, journal, roi, blockshape, blockAlignment, blockGrid):
+        """
+        Start recording blocks in the journal.
+        If it holds blocks of an earlier run with the same roi and blocking, continue with that run's
+        blockshape (which may differ from ours, e.g. if it was chosen for a different amount of RAM).
+
+        Returns the blockshape to use and the indices of the blocks that are already finished.
+        """
+        shape = self._outputSlot.meta.shape
+        plan = {
+            "shape": [int(s) for s in shape],
+            "roi": [[int(x) for x in roi[0]], [int(x) for x in roi[1]]],
+            "blockAlignment": blockAlignment,
+        }
+        stored_plan, finished = journal.read()
+        if stored_plan is not None:
+            stored_blockshape = tuple(stored_plan.pop("blockshape", ()))
+            grid = blockGrid if blockGrid is not None else (1,) * len(shape)
+            on_grid = len(stored_blockshape) == len(shape) and all(
+                b > 0 and (b % g == 0 or b >= s) for b, g, s in zip(stored_blockshape, grid, shape)
+            )
+            if stored_plan == plan and on_grid:
+                blockshape = stored_blockshape
+            else:
+                logger.info("The block journal was written for a different roi or blocking.  Starting over.")
+                finished = set()
+        journal.start(dict(plan, blockshape=[int(b) for b in blockshape]), finished)
+        return blockshape, finished
+
+    def _recordFinishedBlock(self, roi, result):
+        self._journal.add(self._blockIndices[tuple(roi[0])])
+
+    def _choose_tuning_axis(self, blockshape, roi):
+        """
+        The axis with the most blocks, never the channel axis.  (Ties go to the outermost axis.)
+        """
+        num_blocks = -(-numpy.subtract(roi[1], roi[0]) // blockshape)
+        axes = list(range(len(blockshape)))
+        if self._outputSlot.meta.axistags is not None and "c" in self._outputSlot.meta.getAxisKeys():
+            axes.remove(self._outputSlot.meta.getAxisKeys().index("c"))
+        return max(axes, key=lambda axis: num_blocks[axis])
+
+    def _handleRequestFinished(self, roi, seconds, result):
+        batch_size = self._autotuner.block_finished(roi, seconds, getattr(result, "nbytes", 0))
+        if batch_size != self._requestBatch.batchSize:
+            self._requestBatch.batchSize = batch_size
 
     def _determine_blockshape(self, outputSlot):
+        return BigRequestStreamer.determine_blockshape(outputSlot, self._num_threads)
+
+    @staticmethod
+    def determine_blockshape(outputSlot, num_threads):
         """
         Choose a blockshape using the slot metadata (if available) or an arbitrary guess otherwise.
+        This is what BigRequestStreamer uses if no blockshape is given.
+
+        :param num_threads: Number of requests that run in parallel (and share the available RAM)
         """
         input_shape = outputSlot.meta.shape
         ideal_blockshape = outputSlot.meta.ideal_blockshape
@@ -230,14 +479,14 @@ class BigRequestStreamer(object):
 
         if ideal_blockshape is None:
             blockshape = determineBlockShape(
-                input_shape, (available_ram // (self._num_threads * ram_usage_per_requested_pixel))
+                input_shape, (available_ram // (num_threads * ram_usage_per_requested_pixel))
             )
             blockshape = tuple(numpy.minimum(max_blockshape, blockshape))
             warnings.warn("Chose an arbitrary request blockshape")
         else:
             logger.info(
                 "determining blockshape assuming available_ram is {}"
-                ", split between {} threads".format(Memory.format(available_ram), self._num_threads)
+                ", split between {} threads".format(Memory.format(available_ram), num_threads)
             )
 
             # By convention, ram_usage_per_requested_pixel refers to the ram used when requesting ALL channels of a 'pixel'
@@ -245,7 +494,7 @@ class BigRequestStreamer(object):
             #
             # Also, it rarely makes sense to request more than one time slice, so we omit that, too. (See above.)
             blockshape = determine_optimal_request_blockshape(
-                max_blockshape, ideal_blockshape, ram_usage_per_requested_pixel, self._num_threads, available_ram
+                max_blockshape, ideal_blockshape, ram_usage_per_requested_pixel, num_threads, available_ram
             )
 
         # If we removed time and channel from consideration, add them back now before returning
@@ -265,7 +514,8 @@ class BigRequestStreamer(object):
     def resultSignal(self):
         """
         Results signal. Signature: ``f(roi, result)``.
-        Guaranteed not to be called from multiple threads in parallel.
+        Guaranteed not to be called from multiple threads in parallel,
+        unless allowParallelResults=True was given to the constructor.
         """
         return self._requestBatch.resultSignal
 
@@ -287,7 +537,14 @@ class BigRequestStreamer(object):
         This method returns ``None``.  All results must be handled via the
         :py:obj:`resultSignal`.
         """
-        self._requestBatch.execute()
+        if self._journal is not None:
+            # Subscribed last, so that a block is only recorded once all other subscribers have handled it.
+            self._requestBatch.resultSignal.subscribe(self._recordFinishedBlock)
+        try:
+            self._requestBatch.execute()
+        finally:
+            if self._journal is not None:
+                self._requestBatch.resultSignal.unsubscribe(self._recordFinishedBlock)
 
 
 if __name__ == "__main__":
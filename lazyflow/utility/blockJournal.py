@@ -0,0 +1,248 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+import base64
+import json
+import logging
+import os
+import threading
+import zlib
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+Plan = Dict[str, Any]
+
+
+class BlockJournal:
+    """
+    Records which blocks of a long blockwise job (e.g. an export) are finished,
+    so that the job can be resumed after an interruption without computing these blocks again.
+
+    Blocks are identified by their index in a fixed blocking, which is described by the "plan":
+    a JSON-serializable dict, e.g. with the shape and the blockshape of the job.
+    The recorded blocks are only valid for the plan they were recorded with.
+
+    Subclasses decide where the journal is stored, see :py:class:`FileBlockJournal` and
+    :py:class:`AttributeBlockJournal`.  Recording a block is thread-safe.
+
+    >>> journal = MemoryBlockJournal()
+    >>> journal.start({"shape": [10, 10], "blockshape": [5, 5]})
+    >>> journal.add(0)
+    >>> journal.add(3)
+    >>> journal.read()
+    ({'blockshape': [5, 5], 'shape': [10, 10]}, {0, 3})
+    >>> journal.remove()
+    >>> journal.read()
+    (None, set())
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plan = None
+        self._finished = set()
+
+    def read(self) -> Tuple[Optional[Plan], Set[int]]:
+        """
+        The stored plan and the indices of the finished blocks, or ``(None, set())`` if nothing is stored.
+        """
+        with self._lock:
+            stored = self._load()
+        if stored is None:
+            return None, set()
+        return stored
+
+    def start(self, plan: Plan, finished: Iterable[int] = ()) -> None:
+        """
+        Begin recording blocks of the given plan, replacing whatever the journal contained.
+
+        :param finished: Blocks that are already done (i.e. the ones that are skipped when resuming).
+        """
+        plan = _normalized(plan)
+        with self._lock:
+            self._plan = plan
+            self._finished = set(map(int, finished))
+            self._store_all(self._plan, self._finished)
+
+    def add(self, block_index: int) -> None:
+        """
+        Record that a block is finished.  Call this only after the block's result has been stored.
+        """
+        assert self._plan is not None, "start() the journal first"
+        with self._lock:
+            self._finished.add(int(block_index))
+            self._store_added(self._plan, self._finished, int(block_index))
+
+    def remove(self) -> None:
+        """
+        Delete the journal, e.g. after the job has been completed.
+        """
+        with self._lock:
+            self._plan = None
+            self._finished = set()
+            self._delete()
+
+    def _load(self) -> Optional[Tuple[Plan, Set[int]]]:
+        raise NotImplementedError
+
+    def _store_all(self, plan: Plan, finished: Set[int]) -> None:
+        raise NotImplementedError
+
+    def _store_added(self, plan: Plan, finished: Set[int], block_index: int) -> None:
+        self._store_all(plan, finished)
+
+    def _delete(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryBlockJournal(BlockJournal):
+    """
+    Keeps the journal in memory only (e.g. for testing).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._stored = None
+
+    def _load(self):
+        if self._stored is None:
+            return None
+        plan, finished = self._stored
+        return _normalized(plan), set(finished)
+
+    def _store_all(self, plan, finished):
+        self._stored = (plan, set(finished))
+
+    def _delete(self):
+        self._stored = None
+
+
+class FileBlockJournal(BlockJournal):
+    """
+    Stores the journal in a small sidecar text file: the plan as JSON in the first line,
+    followed by one line per finished block.  Finished blocks are appended (and flushed) one by one,
+    so a crash can at most lose the last line, which is then ignored.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._file = None
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                lines = f.read().split("\n")
+        except FileNotFoundError:
+            return None
+        try:
+            plan = json.loads(lines[0])
+        except ValueError:
+            logger.warning(f"Ignoring the unreadable block journal {self.path}")
+            return None
+        # The last line is either empty or was cut off.
+        finished = {int(line) for line in lines[1:-1]}
+        return plan, finished
+
+    def _store_all(self, plan, finished):
+        self._close()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(plan, sort_keys=True) + "\n")
+            f.writelines(f"{block_index}\n" for block_index in sorted(finished))
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a")
+
+    def _store_added(self, plan, finished, block_index):
+        self._file.write(f"{block_index}\n")
+        self._file.flush()
+
+    def _delete(self):
+        self._close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class AttributeBlockJournal(BlockJournal):
+    """
+    Stores the journal in an attribute of the (hdf5 or n5) dataset that the blocks are written to.
+    The finished blocks are stored as a compressed bitmap, so the attribute stays small
+    (about one byte per 8 blocks, before compression).
+    """
+
+    ATTRIBUTE_NAME = "lazyflow_block_journal"
+
+    def __init__(self, attrs, flush: Optional[Callable[[], None]] = None):
+        """
+        :param attrs: The ``attrs`` of an h5py or z5py dataset.
+        :param flush: Called after every update, e.g. to flush the hdf5 file,
+                      so that the journal on disk never lists blocks that are not on disk.
+        """
+        super().__init__()
+        self._attrs = attrs
+        self._flush = flush
+
+    def _load(self):
+        if self.ATTRIBUTE_NAME not in self._attrs:
+            return None
+        stored = self._attrs[self.ATTRIBUTE_NAME]
+        if isinstance(stored, bytes):
+            stored = stored.decode("utf-8")
+        stored = json.loads(stored)
+        bitmap = numpy.frombuffer(zlib.decompress(base64.b64decode(stored["finished"])), dtype=numpy.uint8)
+        finished = set(map(int, numpy.flatnonzero(numpy.unpackbits(bitmap))))
+        return stored["plan"], finished
+
+    def _store_all(self, plan, finished):
+        bits = numpy.zeros(max(finished, default=-1) + 1, dtype=bool)
+        bits[list(finished)] = True
+        bitmap = base64.b64encode(zlib.compress(numpy.packbits(bits).tobytes())).decode("ascii")
+        self._attrs[self.ATTRIBUTE_NAME] = json.dumps({"plan": plan, "finished": bitmap}, sort_keys=True)
+        if self._flush is not None:
+            self._flush()
+
+    def _delete(self):
+        if self.ATTRIBUTE_NAME in self._attrs:
+            del self._attrs[self.ATTRIBUTE_NAME]
+            if self._flush is not None:
+                self._flush()
+
+
+def _normalized(plan: Plan) -> Plan:
+    """The plan as it is read back from JSON (lists instead of tuples, plain ints, ...)."""
+    return json.loads(json.dumps(plan, sort_keys=True, default=_to_json))
+
+
+def _to_json(obj):
+    if isinstance(obj, numpy.integer):
+        return int(obj)
+    if isinstance(obj, numpy.ndarray):
+        return obj.tolist()
+    raise TypeError(f"{type(obj)} is not JSON serializable")
@@ -0,0 +1,155 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+import collections
+import itertools
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+Roi = Tuple[Tuple[int, ...], Tuple[int, ...]]
+
+
+class RoiIndex:
+    """
+    Spatial index (grid buckets) over a set of n-dimensional rois.
+
+    Space is divided into a regular grid of cells.  Each roi is registered in every cell it overlaps,
+    so containment and intersection queries only need to look at the rois in the cells that the
+    query roi touches, instead of at all rois.
+    Rois that would span too many cells are kept in a separate list that is always searched linearly.
+
+    Rois must be given in standardized form, i.e. as tuple-of-tuples-of-int: ``((x0, y0, ...), (x1, y1, ...))``.
+
+    Not synchronized: callers must provide their own locking.
+
+    >>> index = RoiIndex(cell_shape=(10, 10))
+    >>> index.add(((0, 0), (10, 10)))
+    >>> index.add(((10, 0), (20, 10)))
+    >>> index.containing(((2, 2), (5, 5)))
+    [((0, 0), (10, 10))]
+    >>> sorted(index.intersecting(((5, 5), (15, 6))))
+    [((0, 0), (10, 10)), ((10, 0), (20, 10))]
+    """
+
+    #: Rois that overlap more cells than this are not bucketed.
+    MAX_CELLS_PER_ROI = 64
+
+    def __init__(self, cell_shape: Optional[Sequence[int]] = None):
+        """
+        :param cell_shape: Shape of the grid cells.
+                           If None, the shape of the first roi that is added is used,
+                           which works well if the stored rois are blocks of roughly the same shape.
+        """
+        self._cell_shape = tuple(int(s) for s in cell_shape) if cell_shape is not None else None
+        self._cells = collections.defaultdict(set)
+        self._oversized = set()
+        self._rois = set()
+
+    def __len__(self):
+        return len(self._rois)
+
+    def __contains__(self, roi: Roi):
+        return roi in self._rois
+
+    def __iter__(self):
+        return iter(self._rois)
+
+    def clear(self):
+        self._cells.clear()
+        self._oversized.clear()
+        self._rois.clear()
+
+    def add(self, roi: Roi):
+        if roi in self._rois:
+            return
+        if self._cell_shape is None:
+            self._cell_shape = tuple(max(1, b - a) for a, b in zip(*roi))
+
+        self._rois.add(roi)
+        cells = self._cells_for(roi)
+        if cells is None:
+            self._oversized.add(roi)
+        else:
+            for cell in cells:
+                self._cells[cell].add(roi)
+
+    def remove(self, roi: Roi):
+        """Remove the given roi from the index.  Rois that aren't in the index are ignored."""
+        if roi not in self._rois:
+            return
+        self._rois.remove(roi)
+        cells = self._cells_for(roi)
+        if cells is None:
+            self._oversized.discard(roi)
+            return
+        for cell in cells:
+            bucket = self._cells.get(cell)
+            if bucket is not None:
+                bucket.discard(roi)
+                if not bucket:
+                    del self._cells[cell]
+
+    def containing(self, inner_roi: Roi) -> List[Roi]:
+        """Return all stored rois that entirely envelop the given roi."""
+        if not self._rois:
+            return []
+        inner_start, inner_stop = inner_roi
+        # Any roi that contains inner_roi must contain its start point,
+        # so it is registered in the cell that contains that point.
+        candidates = self._cells.get(self._cell_of(inner_start), ())
+        return [
+            roi
+            for roi in itertools.chain(candidates, self._oversized)
+            if all(a <= b for a, b in zip(roi[0], inner_start)) and all(a >= b for a, b in zip(roi[1], inner_stop))
+        ]
+
+    def intersecting(self, query_roi: Roi) -> List[Roi]:
+        """Return all stored rois that have a non-empty intersection with the given roi."""
+        if not self._rois:
+            return []
+        cells = self._cells_for(query_roi)
+        if cells is None or len(cells) > len(self._rois):
+            # Visiting all cells would be more expensive than checking every roi.
+            candidates = self._rois
+        else:
+            candidates = set(self._oversized)
+            for cell in cells:
+                candidates.update(self._cells.get(cell, ()))
+
+        query_start, query_stop = query_roi
+        return [
+            roi
+            for roi in candidates
+            if all(max(a0, b0) < min(a1, b1) for a0, a1, b0, b1 in zip(roi[0], roi[1], query_start, query_stop))
+        ]
+
+    def _cell_of(self, point: Iterable[int]) -> Tuple[int, ...]:
+        return tuple(p // s for p, s in zip(point, self._cell_shape))
+
+    def _cells_for(self, roi: Roi) -> Optional[List[Tuple[int, ...]]]:
+        """All grid cells that overlap the given roi, or None if there are more than MAX_CELLS_PER_ROI."""
+        start, stop = roi
+        cell_ranges = [range(a // s, max(a, b - 1) // s + 1) for a, b, s in zip(start, stop, self._cell_shape)]
+        num_cells = 1
+        for r in cell_ranges:
+            num_cells *= len(r)
+        if num_cells > self.MAX_CELLS_PER_ROI:
+            return None
+        return list(itertools.product(*cell_ranges))
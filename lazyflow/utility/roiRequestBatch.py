@@ -24,13 +24,17 @@ from builtins import next
 from builtins import range
 from builtins import object
 from future.utils import raise_with_traceback
+import collections
 import sys
+import threading
+import time
 from functools import partial
 
 import numpy
 
 import lazyflow.stype
 from lazyflow.utility import OrderedSignal
+from lazyflow.utility.memory import Memory
 from lazyflow.request import Request, SimpleRequestCondition, log_exception
 
 
@@ -97,7 +101,16 @@ class RoiRequestBatch(object):
     Processed 5 result blocks with a total sum of: 14500
     """
 
-    def __init__(self, outputSlot, roiIterator, totalVolume=None, batchSize=2, allowParallelResults=False):
+    def __init__(
+        self,
+        outputSlot,
+        roiIterator,
+        totalVolume=None,
+        batchSize=2,
+        allowParallelResults=False,
+        numWriters=0,
+        writeBufferBytes=None,
+    ):
         """
         Constructor.
 
@@ -109,13 +122,23 @@ class RoiRequestBatch(object):
         :param batchSize: The maximum number of requests to launch in parallel.
         :param allowParallelResults: If False, The resultSignal will not be called in parallel.
                                      In that case, your handler function has no need for locks.
+        :param numWriters: If 0, the resultSignal is called by the worker that finished the request.
+                           Otherwise, finished results are queued (write-behind) and the resultSignal is
+                           called from this many dedicated writer threads, so that slow result handlers
+                           (e.g. writing to disk) don't hold up the computation.
+                           More than one writer requires allowParallelResults=True.
+        :param writeBufferBytes: With writers, no new requests are launched while the queued results
+                                 take more than this many bytes, so at most this plus the results of the
+                                 running requests are held in RAM.  Default: a quarter of the RAM for computation.
         """
         self._resultSignal = OrderedSignal()
         self._progressSignal = OrderedSignal()
+        self._requestFinishedSignal = OrderedSignal()
 
         assert isinstance(
             outputSlot.stype, lazyflow.stype.ArrayLike
         ), "Only Array-like slots supported."  # Because progress reporting depends on the roi shape
+        assert numWriters <= 1 or allowParallelResults, "Multiple writers call the resultSignal in parallel"
         self._outputSlot = outputSlot
         self._roiIter = roiIterator
         self._batchSize = batchSize
@@ -132,11 +155,23 @@ class RoiRequestBatch(object):
         self._totalVolume = totalVolume
         self._processedVolume = 0
 
+        # Write-behind
+        self._numWriters = numWriters
+        if writeBufferBytes is None:
+            writeBufferBytes = Memory.getAvailableRamComputation() // 4
+        self._writeBufferBytes = writeBufferBytes
+        self._queuedBytes = 0  # Protected by self._condition
+        self._written_count = 0  # Protected by self._condition
+        self._writeQueue = collections.deque()
+        self._writeQueueCondition = threading.Condition()
+        self._stopWriters = False
+
     @property
     def resultSignal(self):
         """
         Results signal. Signature: ``f(roi, result)``.
-        Guaranteed not to be called from multiple threads in parallel.
+        Guaranteed not to be called from multiple threads in parallel,
+        unless allowParallelResults=True was given to the constructor.
         """
         return self._resultSignal
 
@@ -147,6 +182,31 @@ class RoiRequestBatch(object):
         """
         return self._progressSignal
 
+    @property
+    def requestFinishedSignal(self):
+        """
+        Emitted by the worker as soon as a request has finished, before its result is handled.
+        Signature: ``f(roi, seconds, result)``, where ``seconds`` is the time since the request was submitted.
+        May be called from multiple threads in parallel.
+        """
+        return self._requestFinishedSignal
+
+    @property
+    def batchSize(self):
+        """
+        The maximum number of requests in flight.
+        May be changed during execute(), e.g. from a requestFinishedSignal handler.
+        A smaller batch takes effect as running requests finish (they are never cancelled).
+        """
+        return self._batchSize
+
+    @batchSize.setter
+    def batchSize(self, batchSize):
+        assert batchSize >= 1
+        with self._condition:
+            self._batchSize = batchSize
+            self._condition.notify()
+
     def execute(self):
         """
         Execute the batch of requests and wait for all of them to complete.
@@ -155,8 +215,26 @@ class RoiRequestBatch(object):
         will be N requests executing in parallel at all times.
 
         This method returns ``None``.  All results must be handled via the
-        :py:obj:`resultSignal`.
+        :py:obj:`resultSignal`.  With writer threads, it returns once all results have been handled.
         """
+        writers = [
+            threading.Thread(target=self._writeResults, name="RoiRequestBatch-writer-{}".format(i), daemon=True)
+            for i in range(self._numWriters)
+        ]
+        for writer in writers:
+            writer.start()
+        try:
+            self._execute()
+        finally:
+            with self._writeQueueCondition:
+                # After a failure (or cancellation), don't bother writing the remaining results
+                self._writeQueue.clear()
+                self._stopWriters = True
+                self._writeQueueCondition.notify_all()
+            for writer in writers:
+                writer.join()
+
+    def _execute(self):
         self.progressSignal(0)
 
         ## In the lines below, we acquire/release self._condition with high frequency,
@@ -175,8 +253,8 @@ class RoiRequestBatch(object):
             while True:
                 # Wait for at least one active request to finish
                 with self._condition:
-                    while (
-                        not self._failure_excinfo and (self._activated_count - self._completed_count) == self._batchSize
+                    while not self._failure_excinfo and (
+                        (self._activated_count - self._completed_count) >= self._batchSize or self._writeBufferFull()
                     ):
                         self._condition.wait()
 
@@ -185,7 +263,11 @@ class RoiRequestBatch(object):
                     raise_with_traceback(exc_type(exc_value), exc_tb)
 
                 # Launch new requests until we have the correct number of active requests
-                while not self._failure_excinfo and self._activated_count - self._completed_count < self._batchSize:
+                while (
+                    not self._failure_excinfo
+                    and self._activated_count - self._completed_count < self._batchSize
+                    and not self._writeBufferFull()
+                ):
                     with self._condition:
                         self._activateNewRequest()  # Eventually raises StopIteration
                         self._activated_count += 1
@@ -198,7 +280,10 @@ class RoiRequestBatch(object):
             # We've run out of requests to launch.
             # Wait for the remaining active requests to finish.
             with self._condition:
-                while not self._failure_excinfo and self._completed_count < self._activated_count:
+                while not self._failure_excinfo and (
+                    self._completed_count < self._activated_count
+                    or (self._numWriters > 0 and self._written_count < self._completed_count)
+                ):
                     self._condition.wait()
 
             if self._failure_excinfo:
@@ -221,12 +306,32 @@ class RoiRequestBatch(object):
         # (This can happen if array data was given to a slot via setValue().)
         assert isinstance(req, Request), "Can't use RoiRequestBatch with non-standard requests.  See comment above."
 
-        req.notify_finished(partial(self._handleCompletedRequest, roi))
+        req.notify_finished(partial(self._handleCompletedRequest, roi, time.perf_counter()))
         req.notify_failed(partial(self._handleFailedRequest, roi))
         req.notify_cancelled(partial(self._handleCancelledRequest, roi))
         req.submit()
 
-    def _handleCompletedRequest(self, roi, result):
+    def _writeBufferFull(self):
+        # Keep launching requests while nothing is queued, otherwise a single huge result could stall us forever
+        return self._numWriters > 0 and self._queuedBytes > 0 and self._queuedBytes >= self._writeBufferBytes
+
+    def _handleCompletedRequest(self, roi, submit_time, result):
+        try:
+            self.requestFinishedSignal(roi, time.perf_counter() - submit_time, result)
+        except Exception:
+            msg = "Encountered exception while handling the finished request for roi: {}".format(roi)
+            log_exception(logger, msg)
+            with self._condition:
+                # The request itself is done, so it still counts as completed.
+                self._failure_excinfo = sys.exc_info()
+                self._completed_count += 1
+                self._condition.notify()
+            return
+
+        if self._numWriters > 0:
+            self._queueResult(roi, result)
+            return
+
         try:
             if self._allowParallelResults:
                 # Signal the user with the result before the critical section
@@ -244,12 +349,7 @@ class RoiRequestBatch(object):
                     # Signal here, inside the critical section.
                     self.resultSignal(roi, result)
 
-                # Report progress (if possible)
-                if self._totalVolume is not None:
-                    self._processedVolume += numpy.prod(numpy.subtract(roi[1], roi[0]))
-                    progress = 100 * self._processedVolume // self._totalVolume
-                    self.progressSignal(progress)
-
+                self._reportProgress(roi)
                 logger.debug("Request completed for roi: {}".format(roi))
                 self._completed_count += 1
             finally:
@@ -257,6 +357,64 @@ class RoiRequestBatch(object):
                 #  even if the client result/progress handler raised.
                 self._condition.notify()
 
+    def _reportProgress(self, roi):
+        """
+        Report progress (if possible).  Must be called while owning self._condition.
+        """
+        if self._totalVolume is not None:
+            self._processedVolume += numpy.prod(numpy.subtract(roi[1], roi[0]))
+            progress = 100 * self._processedVolume // self._totalVolume
+            self.progressSignal(progress)
+
+    def _queueResult(self, roi, result):
+        """
+        Hand a finished result over to the writer threads.  Never blocks the calling worker for a write;
+        the back-pressure is applied by execute(), which stops launching requests while the queue is full.
+        """
+        nbytes = getattr(result, "nbytes", 0)
+        with self._condition:
+            self._queuedBytes += nbytes
+            logger.debug("Request completed for roi: {}".format(roi))
+            self._completed_count += 1
+            self._condition.notify()
+
+        with self._writeQueueCondition:
+            if not self._stopWriters:
+                self._writeQueue.append((roi, result, nbytes))
+                self._writeQueueCondition.notify()
+
+    def _writeResults(self):
+        """
+        Writer thread: call the resultSignal for queued results, in the order in which their requests finished.
+        """
+        while True:
+            with self._writeQueueCondition:
+                while not self._writeQueue and not self._stopWriters:
+                    self._writeQueueCondition.wait()
+                if not self._writeQueue:
+                    return
+                roi, result, nbytes = self._writeQueue.popleft()
+
+            try:
+                self.resultSignal(roi, result)
+            except Exception:
+                msg = "Encountered exception while handling the result for roi: {}".format(roi)
+                log_exception(logger, msg)
+                with self._condition:
+                    self._failure_excinfo = sys.exc_info()
+                    self._condition.notify()
+                return
+            finally:
+                del result
+
+            with self._condition:
+                try:
+                    self._queuedBytes -= nbytes
+                    self._written_count += 1
+                    self._reportProgress(roi)
+                finally:
+                    self._condition.notify()
+
     def _handleFailedRequest(self, roi, exc, exc_info):
         with self._condition:
             msg = "Encountered exception while processing roi: {}".format(roi)
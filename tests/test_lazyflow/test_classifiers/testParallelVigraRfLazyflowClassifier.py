@@ -1,4 +1,5 @@
 from builtins import object
+import h5py
 import numpy
 from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory, ParallelVigraRfLazyflowClassifier
 
@@ -56,6 +57,72 @@ class TestParallelVigraRfLazyflowClassifier(object):
         assert (0 <= probabilities).all() and (probabilities <= 1.0).all()
         assert (numpy.argmax(probabilities, axis=-1) + 1 == self.expected_classes).all()
 
+    def test_chunked_prediction(self):
+        factory = ParallelVigraRfLazyflowClassifierFactory(10, num_forests=3, prediction_ram_budget=3 * 2 * 4)
+        classifier = factory.create_and_train(self.training_feature_matrix, self.training_labels)
+        assert factory.estimated_ram_usage_per_requested_predictionchannel() == 4
+
+        # Predict the training data, in chunks of (at least) one row
+        chunked = classifier.predict_probabilities(self.training_feature_matrix)
+        assert chunked.shape == (100, 2)
+        assert chunked.dtype == numpy.float32
+
+        unchunked_classifier = ParallelVigraRfLazyflowClassifier(
+            classifier._forests, classifier.oobs, classifier.known_classes
+        )
+        unchunked = unchunked_classifier.predict_probabilities(self.training_feature_matrix)
+        assert numpy.allclose(chunked, unchunked)
+
+        probabilities = classifier.predict_probabilities(self.prediction_data)
+        assert (numpy.argmax(probabilities, axis=-1) + 1 == self.expected_classes).all()
+
+    def test_update_and_train(self):
+        factory = ParallelVigraRfLazyflowClassifierFactory(12, num_forests=4)
+        classifier = factory.create_and_train(self.training_feature_matrix, self.training_labels)
+        assert classifier.forest_generations == [0, 0, 0, 0]
+
+        # Each update replaces the oldest forest
+        updated = factory.update_and_train(
+            classifier, self.training_feature_matrix, self.training_labels, num_forests_to_retrain=1
+        )
+        assert updated.forest_generations == [1, 0, 0, 0]
+        assert updated._forests[0] is not classifier._forests[0]
+        assert all(new is old for new, old in zip(updated._forests[1:], classifier._forests[1:]))
+
+        updated = factory.update_and_train(updated, self.training_feature_matrix, self.training_labels)
+        assert updated.forest_generations == [1, 2, 0, 0]
+
+        probabilities = updated.predict_probabilities(self.prediction_data)
+        assert probabilities.shape == (4, 2)
+        assert (numpy.argmax(probabilities, axis=-1) + 1 == self.expected_classes).all()
+
+        # A new label class can't be learned by the old forests, so the classifier is trained from scratch
+        labels = self.training_labels.copy()
+        labels[:10] = 3
+        retrained = factory.update_and_train(updated, self.training_feature_matrix, labels)
+        assert list(retrained.known_classes) == [1, 2, 3]
+        assert retrained.forest_generations == [0, 0, 0, 0]
+        assert not set(map(id, retrained._forests)) & set(map(id, updated._forests))
+
+    def test_serialization(self):
+        factory = ParallelVigraRfLazyflowClassifierFactory(12, num_forests=4, prediction_ram_budget=1000)
+        classifier = factory.create_and_train(self.training_feature_matrix, self.training_labels)
+        classifier = factory.update_and_train(
+            classifier, self.training_feature_matrix, self.training_labels, num_forests_to_retrain=1
+        )
+
+        with h5py.File("classifier.h5", "w", driver="core", backing_store=False) as f:
+            classifier.serialize_hdf5(f.create_group("classifier"))
+            restored = ParallelVigraRfLazyflowClassifier.deserialize_hdf5(f["classifier"])
+
+        assert isinstance(restored, ParallelVigraRfLazyflowClassifier)
+        assert list(restored.known_classes) == [1, 2]
+        assert restored.forest_generations == [1, 0, 0, 0]
+        assert restored._prediction_ram_budget == 1000
+
+        probabilities = restored.predict_probabilities(self.prediction_data)
+        assert numpy.allclose(probabilities, classifier.predict_probabilities(self.prediction_data))
+
     def test_pickle_fields(self):
         """
         Classifier factories are meant to be pickled and restored, but that only
@@ -87,7 +154,7 @@ class TestParallelVigraRfLazyflowClassifier(object):
         # Quick way to get the updated set of members.
         # print members
 
-        assert ParallelVigraRfLazyflowClassifierFactory.VERSION == 2
+        assert ParallelVigraRfLazyflowClassifierFactory.VERSION == 3
         assert members == set(
             [
                 "VERSION",
@@ -97,6 +164,7 @@ class TestParallelVigraRfLazyflowClassifier(object):
                 "_num_trees",
                 "_label_proportion",
                 "_num_forests",
+                "_prediction_ram_budget",
             ]
         )
 
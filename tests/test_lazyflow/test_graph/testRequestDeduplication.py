@@ -0,0 +1,118 @@
+import threading
+import time
+
+import numpy
+import pytest
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.rtype import SubRegion
+
+
+class OpGatedDouble(Operator):
+    """Doubles its input. Every call to execute() blocks until the gate is opened."""
+
+    Input = InputSlot()
+    Output = OutputSlot(deduplicate_requests=True)
+    UndedupedOutput = OutputSlot()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gate = threading.Event()
+        self.entered = threading.Event()
+        self.execute_count = 0
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom(self.Input.meta)
+        self.UndedupedOutput.meta.assignFrom(self.Input.meta)
+
+    def execute(self, slot, subindex, roi, result):
+        self.execute_count += 1
+        self.entered.set()
+        assert self.gate.wait(timeout=5)
+        result[:] = 2 * self.Input(roi.start, roi.stop).wait()
+
+    def propagateDirty(self, slot, subindex, roi):
+        self.Output.setDirty(roi)
+        self.UndedupedOutput.setDirty(roi)
+
+
+@pytest.fixture
+def op(graph):
+    op = OpGatedDouble(graph=graph)
+    op.Input.setValue(numpy.arange(10, dtype=numpy.uint8))
+    return op
+
+
+def _wait_in_threads(slot, rois, op):
+    results = [None] * len(rois)
+
+    def get(i, key):
+        results[i] = slot[key].wait()
+
+    threads = [threading.Thread(target=get, args=(i, key)) for i, key in enumerate(rois)]
+    threads[0].start()
+    assert op.entered.wait(timeout=5)
+    for t in threads[1:]:
+        t.start()
+
+    # Give the other threads some time to attach to the running request
+    time.sleep(0.2)
+    op.gate.set()
+
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_deduplication_is_opt_in(op):
+    assert op.Output.deduplicate_requests
+    assert not op.UndedupedOutput.deduplicate_requests
+
+
+def test_identical_inflight_requests_execute_once(op):
+    results = _wait_in_threads(op.Output, [slice(2, 8)] * 3, op)
+
+    assert op.execute_count == 1
+    for result in results:
+        numpy.testing.assert_array_equal(result, 2 * numpy.arange(2, 8))
+
+    # Every caller gets its own result array
+    assert len({id(r) for r in results}) == 3
+
+
+def test_identical_inflight_requests_without_deduplication(op):
+    _wait_in_threads(op.UndedupedOutput, [slice(2, 8)] * 2, op)
+    assert op.execute_count == 2
+
+
+def test_different_rois_are_not_deduplicated(op):
+    results = _wait_in_threads(op.Output, [slice(2, 8), slice(3, 8)], op)
+
+    assert op.execute_count == 2
+    numpy.testing.assert_array_equal(results[1], 2 * numpy.arange(3, 8))
+
+
+def test_finished_requests_are_not_reused(op):
+    op.gate.set()
+    op.Output[2:8].wait()
+    op.Output[2:8].wait()
+
+    assert op.execute_count == 2
+    assert not op.Output._inflight_requests
+
+
+def test_dedup_request_writes_into_destination(op):
+    op.gate.set()
+    destination = numpy.zeros(6, dtype=numpy.uint8)
+    op.Output[2:8].writeInto(destination).wait()
+
+    numpy.testing.assert_array_equal(destination, 2 * numpy.arange(2, 8))
+
+
+def test_set_dirty_forgets_inflight_requests(op):
+    roi = SubRegion(op.Output, start=(2,), stop=(8,))
+    op.Output._get_inflight_request(op.Output._inflight_key(roi), roi)
+    assert len(op.Output._inflight_requests) == 1
+
+    op.Input.setDirty(slice(None))
+    assert not op.Output._inflight_requests
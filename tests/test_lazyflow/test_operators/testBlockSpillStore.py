@@ -0,0 +1,113 @@
+import os
+
+import numpy
+import pytest
+
+from lazyflow.operators.blockSpillStore import BlockSpillStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = BlockSpillStore(max_bytes=10 * 2 ** 20, directory=str(tmp_path))
+    yield store
+    store.close()
+
+
+def _block_files(store):
+    return [name for name in os.listdir(store.directory) if name.endswith(".blk")]
+
+
+def test_roundtrip(store):
+    ns = store.new_namespace()
+    data = numpy.random.random((10, 20, 3)).astype(numpy.float32)
+    assert store.put(ns, "a", data) == []
+
+    result = store.get(ns, "a")
+    assert result.dtype == data.dtype
+    numpy.testing.assert_array_equal(result, data)
+    # The result must be writeable, it is handed to caches
+    result[:] = 0
+
+    assert store.get(ns, "b") is None
+    stats = store.stats()
+    assert (stats.hits, stats.misses, stats.num_blocks) == (1, 1, 1)
+
+
+def test_namespaces(store):
+    ns1, ns2 = store.new_namespace(), store.new_namespace()
+    store.put(ns1, "a", numpy.zeros(5))
+    store.put(ns2, "a", numpy.ones(5))
+
+    numpy.testing.assert_array_equal(store.get(ns1, "a"), numpy.zeros(5))
+    numpy.testing.assert_array_equal(store.get(ns2, "a"), numpy.ones(5))
+
+    store.discard_namespace(ns1)
+    assert store.get(ns1, "a") is None
+    assert store.get(ns2, "a") is not None
+    assert len(_block_files(store)) == 1
+
+
+def test_budget_evicts_least_recently_used(tmp_path):
+    # incompressible blocks of 8kB each
+    blocks = [numpy.random.random(1000) for _ in range(3)]
+    store = BlockSpillStore(max_bytes=20000, directory=str(tmp_path))
+    ns = store.new_namespace()
+    other_ns = store.new_namespace()
+
+    store.put(ns, 0, blocks[0])
+    store.put(other_ns, 1, blocks[1])
+    # touch block 0, so that block 1 is the least recently used
+    store.get(ns, 0)
+
+    # Only evicted blocks of the same namespace are reported
+    assert store.put(ns, 2, blocks[2]) == []
+    assert (ns, 0) in store
+    assert (other_ns, 1) not in store
+    assert store.stats().evictions == 1
+    assert store.stats().nbytes <= 20000
+
+    # A block that doesn't fit at all is evicted right away
+    assert 3 in store.put(ns, 3, numpy.random.random(10000))
+    store.close()
+
+
+def test_corrupted_block_is_discarded(store):
+    ns = store.new_namespace()
+    data = numpy.arange(1000, dtype=numpy.uint16)
+    store.put(ns, "a", data)
+
+    (name,) = _block_files(store)
+    path = os.path.join(store.directory, name)
+    with open(path, "r+b") as f:
+        f.seek(-10, os.SEEK_END)
+        byte = f.read(1)
+        f.seek(-10, os.SEEK_END)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    assert store.get(ns, "a") is None
+    assert store.stats().corrupted == 1
+    assert (ns, "a") not in store
+    assert not os.path.exists(path)
+
+
+def test_truncated_block_is_discarded(store):
+    ns = store.new_namespace()
+    store.put(ns, "a", numpy.arange(1000))
+
+    (name,) = _block_files(store)
+    path = os.path.join(store.directory, name)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+    assert store.get(ns, "a") is None
+    assert store.stats().corrupted == 1
+
+
+def test_close_removes_directory(tmp_path):
+    store = BlockSpillStore(max_bytes=2 ** 20, directory=str(tmp_path))
+    store.put(store.new_namespace(), "a", numpy.zeros(10))
+    directory = store.directory
+    assert os.path.isdir(directory)
+
+    store.close()
+    assert not os.path.exists(directory)
@@ -0,0 +1,72 @@
+import pytest
+
+from lazyflow.operators.cacheEvictionPolicies import (
+    CacheEntry,
+    CostPerByteEvictionPolicy,
+    GreedyDualSizeEvictionPolicy,
+    LruEvictionPolicy,
+    create_eviction_policy,
+    EVICTION_POLICIES,
+)
+
+
+def entry(key, last_access_time, compute_time=None, nbytes=None):
+    return CacheEntry(key, str(key), last_access_time, compute_time, nbytes, lambda: nbytes or 0)
+
+
+def keys(entries):
+    return [e.key for e in entries]
+
+
+def test_create_eviction_policy():
+    for name, policy_class in EVICTION_POLICIES.items():
+        assert isinstance(create_eviction_policy(name), policy_class)
+
+    with pytest.raises(ValueError):
+        create_eviction_policy("nonexistent")
+
+
+def test_lru_orders_by_access_time():
+    entries = [entry("new", 3.0, 100.0, 1), entry("old", 1.0, 0.1, 1000), entry("mid", 2.0)]
+    assert keys(LruEvictionPolicy().order(entries)) == ["old", "mid", "new"]
+
+
+def test_cost_per_byte_evicts_cheap_entries_first():
+    entries = [
+        entry("expensive", 1.0, compute_time=10.0, nbytes=100),
+        entry("cheap", 3.0, compute_time=1.0, nbytes=100),
+        entry("big", 2.0, compute_time=10.0, nbytes=10000),
+        entry("unknown", 4.0),
+    ]
+    assert keys(CostPerByteEvictionPolicy().order(entries)) == ["unknown", "big", "cheap", "expensive"]
+
+
+def test_greedy_dual_size_ages_out_unused_entries():
+    policy = GreedyDualSizeEvictionPolicy()
+
+    expensive = entry("expensive", 1.0, compute_time=10.0, nbytes=1)
+    cheap = entry("cheap", 1.0, compute_time=1.0, nbytes=1)
+    assert keys(policy.order([expensive, cheap])) == ["cheap", "expensive"]
+
+    # Evicting raises the inflation value, so that re-accessed entries
+    # are valued higher than entries that have not been touched since.
+    for _ in range(20):
+        policy.evicted(cheap)
+        cheap = entry("cheap", cheap.last_access_time + 1, compute_time=1.0, nbytes=1)
+        ordered = policy.order([expensive, cheap])
+        if ordered[0].key == "expensive":
+            break
+    else:
+        assert False, "expensive entry was never evicted"
+
+
+def test_greedy_dual_size_keeps_value_of_untouched_entries():
+    policy = GreedyDualSizeEvictionPolicy()
+    a = entry("a", 1.0, compute_time=1.5, nbytes=1)
+    b = entry("b", 1.0, compute_time=1.0, nbytes=1)
+    policy.order([a, b])
+    policy.evicted(b)
+
+    # a has not been accessed, so its value must not be re-inflated
+    c = entry("c", 2.0, compute_time=1.0, nbytes=1)
+    assert keys(policy.order([a, c])) == ["a", "c"]
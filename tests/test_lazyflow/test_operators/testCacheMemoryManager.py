@@ -40,7 +40,7 @@ from lazyflow.utility import BigRequestStreamer
 from lazyflow.operators.cacheMemoryManager import _CacheMemoryManager
 from lazyflow.utility import Memory
 from lazyflow.operators.cacheMemoryManager import default_refresh_interval
-from lazyflow.operators.opCache import Cache
+from lazyflow.operators.opCache import Cache, ManagedBlockedCache
 from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
 from lazyflow.operators.opSplitRequestsBlockwise import OpSplitRequestsBlockwise
 from lazyflow.operators.filterOperators import OpGaussianSmoothing
@@ -70,6 +70,41 @@ Cache.register(NonRegisteredCache)
 assert issubclass(NonRegisteredCache, Cache)
 
 
+class FakeBlockedCache(ManagedBlockedCache):
+    """
+    Blocked cache with fixed per-block statistics: {block_id: (last_access_time, compute_time, nbytes)}
+    """
+
+    def __init__(self, name, blocks):
+        self.name = name
+        self.blocks = dict(blocks)
+        self.freed = []
+
+    def usedMemory(self):
+        return sum(nbytes for _, _, nbytes in self.blocks.values())
+
+    def fractionOfUsedMemoryDirty(self):
+        return 0.0
+
+    def getBlockAccessTimes(self):
+        return [(block_id, t) for block_id, (t, _, _) in self.blocks.items()]
+
+    def getBlockStats(self):
+        return [(block_id, t, cost, nbytes) for block_id, (t, cost, nbytes) in self.blocks.items()]
+
+    def freeBlock(self, block_id):
+        self.freed.append(block_id)
+        return self.blocks.pop(block_id)[2]
+
+    def freeMemory(self):
+        mem = self.usedMemory()
+        self.blocks = {}
+        return mem
+
+    def freeDirtyMemory(self):
+        return 0.0
+
+
 class TestCacheMemoryManager:
     def teardown_method(self, method):
         # reset cleanup frequency to sane value
@@ -200,6 +235,80 @@ class TestCacheMemoryManager:
         c = pipe.accessCount
         assert c > b, "did not clean up"
 
+    @pytest.mark.parametrize(
+        "policy,expected_freed",
+        [("lru", ["old_expensive"]), ("cost_per_byte", ["new_cheap"]), ("greedy_dual_size", ["new_cheap"])],
+    )
+    def testEvictionPolicy(self, cacheMemoryManager, policy, expected_freed):
+        cacheMemoryManager.disable()
+        cache = FakeBlockedCache(
+            "fake", {"old_expensive": (1.0, 100.0, 1000), "new_cheap": (2.0, 0.01, 1000), "newest": (3.0, 1.0, 1000)}
+        )
+        cacheMemoryManager.addFirstClassCache(cache)
+        cacheMemoryManager.setEvictionPolicy(policy)
+        assert cacheMemoryManager.getEvictionPolicy().name == policy
+
+        # one block too many
+        Memory.setAvailableRamCaches(2500)
+        cacheMemoryManager._cleanup()
+
+        assert cache.freed == expected_freed
+
+    def testUnknownEvictionPolicy(self, cacheMemoryManager):
+        with pytest.raises(ValueError):
+            cacheMemoryManager.setEvictionPolicy("nonexistent")
+
+    def testAllocationTriggersCleanup(self, cacheMemoryManager):
+        cache = FakeBlockedCache("fake", {"a": (1.0, 1.0, 1000), "b": (2.0, 1.0, 1000)})
+        cacheMemoryManager.addFirstClassCache(cache)
+        Memory.setAvailableRamCaches(2500)
+
+        # periodic sweeps alone would not clean up within this test
+        cacheMemoryManager.setRefreshInterval(1000)
+        cacheMemoryManager._cleanup()
+        assert not cache.freed
+
+        # below the high-water mark: nothing happens
+        cacheMemoryManager.notifyMemoryAllocated(100)
+        assert not cacheMemoryManager._cleanup_requested
+
+        cache.blocks["c"] = (3.0, 1.0, 1000)
+        cacheMemoryManager.notifyMemoryAllocated(1000)
+        deadline = time.time() + 5
+        while not cache.freed and time.time() < deadline:
+            time.sleep(0.01)
+        assert cache.freed == ["a"]
+
+    def testBlockedCacheReportsAllocations(self, cacheMemoryManager, monkeypatch):
+        reported = []
+        monkeypatch.setattr(cacheMemoryManager, "notifyMemoryAllocated", reported.append)
+
+        g = Graph()
+        pipe = OpArrayPiperWithAccessCount(graph=g)
+        cache = OpBlockedArrayCache(graph=g)
+        cache.BlockShape.setValue((5, 5))
+        cache.Input.connect(pipe.Output)
+        pipe.Input.setValue(np.zeros((10, 10), dtype=np.uint32))
+
+        cache.Output[...].wait()
+        assert reported == [5 * 5 * 4] * 4
+
+    def testBlockedCacheReportsBlockStats(self):
+        g = Graph()
+        pipe = OpArrayPiperWithAccessCount(graph=g)
+        cache = OpBlockedArrayCache(graph=g)
+        cache.BlockShape.setValue((5, 5))
+        cache.Input.connect(pipe.Output)
+        pipe.Input.setValue(np.zeros((10, 10), dtype=np.uint32))
+
+        cache.Output[...].wait()
+        stats = cache.getBlockStats()
+        assert len(stats) == 4
+        for block_id, access_time, compute_time, nbytes in stats:
+            assert access_time > 0
+            assert compute_time >= 0
+            assert nbytes == 5 * 5 * 4
+
     def testBadMemoryConditions(self):
         """
         TestCacheMemoryManager.testBadMemoryConditions
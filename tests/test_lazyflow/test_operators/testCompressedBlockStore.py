@@ -0,0 +1,157 @@
+import threading
+
+import numpy
+import pytest
+from numpy.testing import assert_array_equal
+
+from lazyflow.operators.compressedBlockStore import CompressedChunkArray, SparseArray, available_codecs, create_codec
+
+
+@pytest.fixture(params=available_codecs())
+def codec(request):
+    return create_codec(request.param)
+
+
+def test_roundtrip(codec):
+    data = numpy.random.random((50, 60, 3)).astype(numpy.float32)
+    array = CompressedChunkArray(data.shape, data.dtype, (16, 16, 3), codec)
+    assert array.nbytes == 0
+
+    array[...] = data
+    assert_array_equal(array[()], data)
+    assert_array_equal(array[10:45, 3:4], data[10:45, 3:4])
+    assert_array_equal(array[5:7], data[5:7])
+    assert array.num_stored_chunks == 4 * 4
+    assert 0 < array.nbytes
+    assert array.uncompressed_nbytes == data.nbytes
+
+
+def test_partial_writes(codec):
+    data = numpy.arange(40 * 30, dtype=numpy.uint32).reshape(40, 30)
+    array = CompressedChunkArray(data.shape, data.dtype, (16, 16), codec)
+    array[...] = data
+
+    array[5:20, 10:25] = 7
+    data[5:20, 10:25] = 7
+    array[30:, :3] = data[:10, :3] + 1
+    data[30:, :3] = data[:10, :3] + 1
+    assert_array_equal(array[()], data)
+
+
+def test_zero_chunks_are_not_stored(codec):
+    array = CompressedChunkArray((20, 20), numpy.uint8, (10, 10), codec)
+    assert_array_equal(array[()], 0)
+
+    array[2:3, 2:3] = 1
+    assert array.num_stored_chunks == 1
+    array[...] = 0
+    assert array.num_stored_chunks == 0
+    assert array.nbytes == 0
+
+    # -0.0 == 0, but it must survive the roundtrip
+    floats = CompressedChunkArray((4,), numpy.float64, (2,), codec)
+    floats[...] = -0.0
+    assert numpy.signbit(floats[()]).all()
+
+
+def test_bool_and_masked_values(codec):
+    mask = numpy.zeros((10, 12), dtype=bool)
+    mask[3:5, 4:11] = True
+    array = CompressedChunkArray(mask.shape, bool, (4, 4), codec)
+    array[...] = mask
+    assert array[()].dtype == bool
+    assert_array_equal(array[()], mask)
+
+    # a scalar (e.g. numpy.ma.nomask) is broadcast
+    array[...] = numpy.ma.nomask
+    assert not array[()].any()
+
+
+def test_parallel_tasks(codec):
+    data = numpy.random.randint(0, 5, size=(64, 64, 8)).astype(numpy.uint16)
+    array = CompressedChunkArray(data.shape, data.dtype, (16, 16, 8), codec)
+
+    def run_in_threads(tasks):
+        threads = [threading.Thread(target=task) for task in tasks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    write_tasks = array.write_tasks(..., data)
+    assert len(write_tasks) == 16
+    run_in_threads(write_tasks)
+
+    out = numpy.zeros((40, 50, 8), dtype=data.dtype)
+    run_in_threads(array.read_tasks(numpy.s_[10:50, 5:55], out))
+    assert_array_equal(out, data[10:50, 5:55])
+
+
+def test_unsupported_keys():
+    array = CompressedChunkArray((10, 10), numpy.uint8, (5, 5))
+    with pytest.raises(TypeError):
+        array[::2]
+    with pytest.raises(TypeError):
+        array[1, 2]
+    with pytest.raises(ValueError):
+        create_codec("nonexisting")
+
+
+def test_sparse_array_paint():
+    rng = numpy.random.RandomState(0)
+    data = numpy.zeros((20, 30, 20), dtype=numpy.uint8)
+    array = SparseArray(data.shape, data.dtype, (8, 8, 8))
+    assert array.nbytes == 0
+    assert array.num_stored_chunks == 0
+
+    for _ in range(50):
+        start = rng.randint(0, 10, size=3)
+        stop = start + rng.randint(1, 10, size=3)
+        region = tuple(slice(a, b) for a, b in zip(start, stop))
+        stroke = (rng.rand(*(stop - start)) < 0.3) * rng.randint(1, 5, size=stop - start)
+        array.paint(region, stroke, eraser_value=4)
+
+        data[region][stroke != 0] = stroke[stroke != 0]
+        data[region][stroke == 4] = 0
+        assert_array_equal(array[region], data[region])
+
+    assert_array_equal(array[()], data)
+    assert array.num_nonzero == numpy.count_nonzero(data)
+    assert array.nbytes == array.num_runs * (2 * numpy.dtype(numpy.intp).itemsize + 1)
+    assert_array_equal(array.count_values(minlength=5)[1:], numpy.bincount(data.ravel(), minlength=5)[1:])
+
+    # A row along the last axis is a single run
+    array.clear()
+    array.paint(numpy.s_[5:6, 6:7, 2:18], numpy.full((1, 1, 16), 3))
+    assert array.num_runs == 1
+    assert array.num_nonzero == 16
+
+
+def test_sparse_array_writes():
+    data = numpy.zeros((40, 30), dtype=numpy.uint32)
+    data[5:30:4, 2:20:4] = numpy.arange(7 * 5).reshape(7, 5) + 1
+    array = SparseArray(data.shape, data.dtype)
+    assert array.chunkshape == data.shape
+
+    array[...] = data
+    assert_array_equal(array[()], data)
+    assert array.num_nonzero == 7 * 5
+
+    # Writes replace the whole region, zeros included
+    array[10:20, 5:25] = 0
+    data[10:20, 5:25] = 0
+    array[30:, :3] = data[:10, :3] + 1
+    data[30:, :3] = data[:10, :3] + 1
+    assert_array_equal(array[()], data)
+    assert_array_equal(array[12:35, 1:2], data[12:35, 1:2])
+
+    out = numpy.empty((10, 10), dtype=data.dtype)
+    for task in array.read_tasks(numpy.s_[25:35, 0:10], out):
+        task()
+    assert_array_equal(out, data[25:35, 0:10])
+
+    array[...] = 0
+    assert array.num_stored_chunks == 0
+    assert array.nbytes == 0
+    with pytest.raises(TypeError):
+        array[::2]
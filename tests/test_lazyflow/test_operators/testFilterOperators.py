@@ -0,0 +1,59 @@
+import numpy
+import pytest
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators.filterOperators import (
+    OpDifferenceOfGaussians,
+    OpGaussianGradientMagnitude,
+    OpGaussianSmoothing,
+    OpHessianOfGaussianEigenvalues,
+    OpLaplacianOfGaussian,
+    OpStructureTensorEigenvalues,
+)
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = numpy.random.RandomState(0)
+    return vigra.taggedView(rng.rand(2, 3, 9, 30, 31).astype(numpy.float32), "tczyx")
+
+
+@pytest.fixture(
+    params=[
+        (OpGaussianSmoothing, {"sigma": 1.0}),
+        (OpDifferenceOfGaussians, {"sigma0": 1.0, "sigma1": 0.66}),
+        (OpHessianOfGaussianEigenvalues, {"scale": 0.7}),
+        (OpStructureTensorEigenvalues, {"innerScale": 1.0, "outerScale": 0.5}),
+        (OpGaussianGradientMagnitude, {"sigma": 1.6}),
+        (OpLaplacianOfGaussian, {"scale": 1.0}),
+    ],
+    ids=lambda param: param[0].__name__,
+)
+def filter_op(request):
+    op_class, filter_params = request.param
+    return op_class(graph=Graph(), **filter_params)
+
+
+@pytest.mark.parametrize("compute_in_2d", [False, True])
+def test_batched_execution_matches_single_steps(data, filter_op, compute_in_2d):
+    """
+    A request for all time steps, channels and slices is processed in one batch,
+    which must give exactly the same result as processing each of them with a separate request.
+    """
+    filter_op.ComputeIn2d.setValue(compute_in_2d)
+    filter_op.Input.setValue(data)
+    res_c = filter_op.resultingChannels()
+
+    roi = numpy.s_[:, res_c:, 2:8, 3:25, :29]
+    batched = filter_op.Output[roi].wait()
+
+    full = numpy.full(filter_op.Output.meta.shape, numpy.nan, dtype=numpy.float32)
+    z_ranges = [(z, z + 1) for z in range(2, 8)] if compute_in_2d else [(2, 8)]
+    for t in range(data.shape[0]):
+        for c in range(1, data.shape[1]):
+            for z_start, z_stop in z_ranges:
+                step_roi = numpy.s_[t : t + 1, c * res_c : (c + 1) * res_c, z_start:z_stop, 3:25, :29]
+                full[step_roi] = filter_op.Output[step_roi].wait()
+
+    assert numpy.array_equal(batched, full[roi])
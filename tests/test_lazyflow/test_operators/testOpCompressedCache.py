@@ -46,6 +46,7 @@ from lazyflow.graph import Graph
 from lazyflow.operators import OpCompressedCache, OpArrayPiper
 from lazyflow.utility.slicingtools import slicing2shape
 from lazyflow.operators.opCache import MemInfoNode
+from lazyflow.operators.blockSpillStore import BlockSpillStore
 from lazyflow.operators.cacheMemoryManager import CacheMemoryManager
 
 from lazyflow.utility.testing import OpArrayPiperWithAccessCount
@@ -795,6 +796,77 @@ class TestOpCompressedCache(object):
         op.freeBlock(key)
         assert op.usedMemory() < mem
 
+    def testUsedMemory(self):
+        sampleData = numpy.indices((100, 200, 150), dtype=numpy.float32).sum(0)
+        sampleData = vigra.taggedView(sampleData, axistags="xyz")
+
+        graph = Graph()
+        opData = OpArrayPiperWithAccessCount(graph=graph)
+        opData.Input.setValue(sampleData)
+
+        op = OpCompressedCache(graph=graph)
+        op.BlockShape.setValue([100, 75, 50])
+        op.Input.connect(opData.Output)
+
+        def storage_size():
+            return sum(block["data"].nbytes for block in op._cacheBlocks.values())
+
+        assert op.usedMemory() == 0
+        op.Output[:, :100, :].wait()
+        assert op.usedMemory() == storage_size() > 0
+
+        # setInSlot into an existing and a new block
+        op.Input[:, 50:100, :] = numpy.zeros((100, 50, 150), dtype=numpy.float32)
+        assert op.usedMemory() == storage_size()
+
+        key = op.getBlockAccessTimes()[0][0]
+        op.freeBlock(key)
+        assert op.usedMemory() == storage_size() > 0
+
+        op.freeMemory()
+        assert op.usedMemory() == 0
+
+    def testSpillToDisk(self, tmp_path):
+        sampleData = numpy.indices((100, 200, 150), dtype=numpy.float32).sum(0)
+        sampleData = vigra.taggedView(sampleData, axistags="xyz")
+
+        graph = Graph()
+        opData = OpArrayPiperWithAccessCount(graph=graph)
+        opData.Input.setValue(sampleData)
+
+        op = OpCompressedCache(graph=graph)
+        op.BlockShape.setValue([100, 75, 50])
+        op.Input.connect(opData.Output)
+        store = BlockSpillStore(max_bytes=2 ** 30, directory=str(tmp_path))
+        op.setSpillStore(store)
+
+        op.Output[...].wait()
+        num_blocks = opData.accessCount
+        mem = op.usedMemory()
+
+        for key, _ in op.getBlockAccessTimes():
+            op.evictBlock(key)
+        assert op.usedMemory() == 0
+        assert store.stats().num_blocks == num_blocks
+
+        # Read back from disk, not recomputed
+        assert_array_equal(op.Output[...].wait(), sampleData)
+        assert opData.accessCount == num_blocks
+        assert op.usedMemory() == mem
+
+        # Spilled blocks that become dirty are discarded
+        for key, _ in op.getBlockAccessTimes():
+            op.evictBlock(key)
+        opData.Input.setDirty((0, 0, 0), (1, 1, 1))
+        assert store.stats().num_blocks == num_blocks - 1
+        assert_array_equal(op.Output[...].wait(), sampleData)
+        assert opData.accessCount == num_blocks + 1
+
+        report = MemInfoNode()
+        op.generateReport(report)
+        assert "disk" in report.info
+        store.close()
+
     def testHDF5(self):
         logger.info("Generating sample data...")
         sampleData = numpy.indices((150, 250, 150), dtype=numpy.float32).sum(0)
@@ -25,6 +25,7 @@ from builtins import object
 import numpy
 import vigra
 from lazyflow.graph import Graph
+from lazyflow.operators.compressedBlockStore import SparseArray
 from lazyflow.operators.opArrayPiper import OpArrayPiper
 from lazyflow.operators import OpCompressedUserLabelArray
 
@@ -32,6 +33,8 @@ from lazyflow.utility.slicingtools import slicing2shape
 
 
 class TestOpCompressedUserLabelArray(object):
+    sparse_storage = False
+
     def setup(self):
         graph = Graph()
         op = OpCompressedUserLabelArray(graph=graph)
@@ -40,6 +43,7 @@ class TestOpCompressedUserLabelArray(object):
         blockshape = (1, 10, 10, 10, 1)  # Why doesn't this work if blockshape is an ndarray?
         op.inputs["blockShape"].setValue(blockshape)
         op.eraser.setValue(100)
+        op.SparseStorage.setValue(self.sparse_storage)
 
         dummyData = vigra.VigraArray(arrayshape, axistags=vigra.defaultAxistags("txyzc"), dtype=numpy.uint8)
         op.Input.setValue(dummyData)
@@ -74,7 +78,7 @@ class TestOpCompressedUserLabelArray(object):
         assert numpy.all(outputData[...] == data[...])
 
         # maxLabel
-        # assert op.maxLabel.value == inData.max()
+        assert op.maxLabel.value == inData.max()
 
         # nonzeroValues
         # nz = op.nonzeroValues.value
@@ -107,7 +111,7 @@ class TestOpCompressedUserLabelArray(object):
         expectedOutput = numpy.where(expectedOutput == 2, 1, expectedOutput)
         assert (outputData[...] == expectedOutput[...]).all()
 
-        # assert op.maxLabel.value == expectedOutput.max() == 1
+        assert op.maxLabel.value == expectedOutput.max() == 1
 
         # delete label input resets automatically
         # assert op.deleteLabel.value == -1 # Apparently not?
@@ -121,7 +125,7 @@ class TestOpCompressedUserLabelArray(object):
         slicing = self.slicing
         data = self.data
 
-        # assert op.maxLabel.value == 2
+        assert op.maxLabel.value == 2
 
         # Choose slicings that do NOT intersect with any of the previous data or with each other
         # The goal is to make sure that the data for each slice ends up in a separate block
@@ -144,7 +148,7 @@ class TestOpCompressedUserLabelArray(object):
         # Does the data contain our new labels?
         assert (op.Output[...].wait() == expectedData).all()
         assert expectedData.max() == 2
-        # assert op.maxLabel.value == 2
+        assert op.maxLabel.value == 2
 
         # Delete label 1
         op.deleteLabel.setValue(1)
@@ -155,7 +159,7 @@ class TestOpCompressedUserLabelArray(object):
         expectedData = numpy.where(expectedData == 2, 1, expectedData)
         assert (outputData[...] == expectedData[...]).all()
 
-        # assert op.maxLabel.value == expectedData.max() == 1
+        assert op.maxLabel.value == expectedData.max() == 1
 
     def testEraser(self):
         """
@@ -166,7 +170,7 @@ class TestOpCompressedUserLabelArray(object):
         inData = self.inData
         data = self.data
 
-        # assert op.maxLabel.value == 2
+        assert op.maxLabel.value == 2
 
         erasedSlicing = list(slicing)
         erasedSlicing[1] = slice(1, 2)
@@ -183,7 +187,7 @@ class TestOpCompressedUserLabelArray(object):
         assert (outputData == expectedOutput).all()
 
         assert expectedOutput.max() == 2
-        # assert op.maxLabel.value == 2
+        assert op.maxLabel.value == 2
 
     def testEraseAll(self):
         """
@@ -194,7 +198,7 @@ class TestOpCompressedUserLabelArray(object):
         slicing = self.slicing
         data = self.data
 
-        # assert op.maxLabel.value == 2
+        assert op.maxLabel.value == 2
 
         newSlicing = list(slicing)
         newSlicing[1] = slice(1, 2)
@@ -209,7 +213,7 @@ class TestOpCompressedUserLabelArray(object):
         # Sanity check: Are the new labels in the data?
         assert (op.Output[...].wait() == expectedData).all()
         assert expectedData.max() == 3
-        # assert op.maxLabel.value == 3
+        assert op.maxLabel.value == 3
 
         # Now erase all the 3s
         eraserData = numpy.ones(slicing2shape(newSlicing), dtype=numpy.uint8) * 100
@@ -225,7 +229,7 @@ class TestOpCompressedUserLabelArray(object):
 
         # The maximum label should be reduced, because all the 3s were removed.
         assert expectedData.max() == 2
-        # assert op.maxLabel.value == 2
+        assert op.maxLabel.value == 2
 
     def testEraseBlock(self):
         """
@@ -260,6 +264,42 @@ class TestOpCompressedUserLabelArray(object):
 
         assert before_set - set([block_roi]) == after_set
 
+    def testPurgeOnlyReadsBlocksWithLabel(self):
+        """
+        clearLabel() and mergeLabels() use the per-block label histograms to skip blocks without the label.
+        """
+        op = self.op
+        assert len(op.nonzeroBlocks.value) == 8
+
+        op.Input[0:1, 50:52, 50:52, 0:2, 0:1] = numpy.full((1, 2, 2, 2, 1), 4, dtype=numpy.uint8)
+        op.Input[0:1, 70:72, 50:52, 0:2, 0:1] = numpy.full((1, 2, 2, 2, 1), 5, dtype=numpy.uint8)
+        assert len(op.nonzeroBlocks.value) == 10
+        assert op.maxLabel.value == 5
+
+        read_rois = []
+        original_execute = op.execute
+
+        def recording_execute(slot, subindex, roi, destination):
+            if slot is op.Output:
+                read_rois.append((tuple(roi.start), tuple(roi.stop)))
+            return original_execute(slot, subindex, roi, destination)
+
+        op.execute = recording_execute
+
+        op.mergeLabels(5, 3)
+        assert read_rois == [((0, 70, 50, 0, 0), (1, 80, 60, 10, 1))]
+        assert op.maxLabel.value == 4
+
+        del read_rois[:]
+        op.clearLabel(4)
+        assert read_rois == [((0, 50, 50, 0, 0), (1, 60, 60, 10, 1))]
+        assert len(op.nonzeroBlocks.value) == 9
+        assert op.maxLabel.value == 3
+
+        expected_data = self.data.copy()
+        expected_data[0:1, 70:72, 50:52, 0:2, 0:1] = 3
+        assert (op.Output[:].wait() == expected_data).all()
+
     def testDimensionalityChange(self):
         """
         What happens if we configure the operator, use it a bit,
@@ -314,6 +354,50 @@ class TestOpCompressedUserLabelArray(object):
         assert ((summed_projection != 0) == (projected_data != 0)).all()
 
 
+class TestOpCompressedUserLabelArray_sparse(TestOpCompressedUserLabelArray):
+    """
+    Same tests, but with the labels stored as SparseArrays.
+    """
+
+    sparse_storage = True
+
+    def testBlocksAreSparse(self):
+        op = self.op
+        assert all(isinstance(block["data"], SparseArray) for block in op._cacheBlocks.values())
+
+        # Only the runs of labeled pixels are stored, as start, length and value
+        num_runs = sum(block["data"].num_runs for block in op._cacheBlocks.values())
+        assert op.usedMemory() == num_runs * (2 * numpy.dtype(numpy.intp).itemsize + 1)
+        assert sum(block["data"].num_nonzero for block in op._cacheBlocks.values()) == numpy.count_nonzero(self.data)
+
+        # Erasing a whole block removes it
+        op.Input[0:1, 0:10, 0:10, 0:10, 0:1] = numpy.full((1, 10, 10, 10, 1), 100, dtype=numpy.uint8)
+        assert (0, 0, 0, 0, 0) not in op._cacheBlocks
+        assert len(op.nonzeroBlocks.value) == 7
+
+    def testSwitchStorage(self):
+        """
+        Blocks keep their storage if SparseStorage is changed, only new blocks use the new setting.
+        """
+        op = self.op
+        op.SparseStorage.setValue(False)
+        op.Input[0:1, 50:52, 50:52, 0:2, 0:1] = numpy.full((1, 2, 2, 2, 1), 4, dtype=numpy.uint8)
+        op.Input[0:1, 10:12, 10:12, 3:5, 0:1] = numpy.full((1, 2, 2, 2, 1), 4, dtype=numpy.uint8)
+        assert not isinstance(op._cacheBlocks[(0, 50, 50, 0, 0)]["data"], SparseArray)
+        assert isinstance(op._cacheBlocks[(0, 10, 10, 0, 0)]["data"], SparseArray)
+
+        expected_data = self.data.copy()
+        expected_data[0:1, 50:52, 50:52, 0:2, 0:1] = 4
+        expected_data[0:1, 10:12, 10:12, 3:5, 0:1] = 4
+        assert (op.Output[:].wait() == expected_data).all()
+
+        op.deleteLabel.setValue(2)
+        expected_data[expected_data == 2] = 0
+        expected_data[expected_data > 2] -= 1
+        assert (op.Output[:].wait() == expected_data).all()
+        assert op.maxLabel.value == 3
+
+
 class TestOpCompressedUserLabelArray_masked(object):
     def setup(self):
         graph = Graph()
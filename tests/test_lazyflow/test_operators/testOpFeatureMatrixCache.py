@@ -1,10 +1,13 @@
 from builtins import object
+import threading
+
 import numpy
 import vigra
 
 from lazyflow.graph import Graph
 from lazyflow.operators.opFeatureMatrixCache import OpFeatureMatrixCache
 from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
+from lazyflow.operators.opArrayPiper import OpArrayPiper
 
 
 class TestOpFeatureMatrixCache(object):
@@ -52,6 +55,131 @@ class TestOpFeatureMatrixCache(object):
         for feature_vec in [[10.5, 10.5], [10.5, 11.5], [20.5, 20.5], [20.5, 21.5]]:
             assert feature_vec in labels_and_features[:, 1:]
 
+    def testIncrementalUpdates(self):
+        features = numpy.indices((100, 100)).astype(numpy.float32) + 0.5
+        features = numpy.rollaxis(features, 0, 3)
+        features = vigra.taggedView(features, "xyc")
+
+        labels = numpy.zeros((100, 100, 1), dtype=numpy.uint8)
+        labels = vigra.taggedView(labels, "xyc")
+
+        graph = Graph()
+        opLabelCache = OpBlockedArrayCache(graph=graph)
+        opLabelCache.BlockShape.setValue((50, 50, 1))
+        opLabelCache.Input.setValue(labels)
+
+        opFeatures = OpArrayPiper(graph=graph)
+        opFeatures.Input.setValue(features)
+        feature_requests = []
+        original_execute = opFeatures.execute
+
+        def recording_execute(slot, subindex, roi, result):
+            feature_requests.append((tuple(roi.start), tuple(roi.stop)))
+            return original_execute(slot, subindex, roi, result)
+
+        opFeatures.execute = recording_execute
+
+        opFeatureMatrixCache = OpFeatureMatrixCache(graph=graph)
+        opFeatureMatrixCache.LabelImage.connect(opLabelCache.Output)
+        opFeatureMatrixCache.FeatureImage.connect(opFeatures.Output)
+
+        def set_labels(slicing, value):
+            labels[slicing] = value
+            opLabelCache.Input.setDirty(slicing)
+
+        def sorted_rows(matrix):
+            return sorted(map(tuple, matrix))
+
+        set_labels(numpy.s_[10:12, 10:11, 0:1], 1)
+        labels_and_features = opFeatureMatrixCache.LabelAndFeatureMatrix.value
+        assert sorted_rows(labels_and_features) == [(1, 10.5, 10.5), (1, 11.5, 10.5)]
+
+        # Adding labels to the same block only requests features of the new labels
+        del feature_requests[:]
+        set_labels(numpy.s_[20:21, 30:32, 0:1], 2)
+        first_output = opFeatureMatrixCache.LabelAndFeatureMatrix.value
+        assert feature_requests == [((20, 30, 0), (21, 32, 2))]
+        assert sorted_rows(first_output) == [(1, 10.5, 10.5), (1, 11.5, 10.5), (2, 20.5, 30.5), (2, 20.5, 31.5)]
+        first_output_copy = first_output.copy()
+
+        # Relabeling and removing labels doesn't request any features
+        del feature_requests[:]
+        set_labels(numpy.s_[10:11, 10:11, 0:1], 2)
+        set_labels(numpy.s_[20:21, 31:32, 0:1], 0)
+        labels_and_features = opFeatureMatrixCache.LabelAndFeatureMatrix.value
+        assert feature_requests == []
+        assert sorted_rows(labels_and_features) == [(1, 11.5, 10.5), (2, 10.5, 10.5), (2, 20.5, 30.5)]
+
+        # Earlier outputs are not modified by the updates
+        assert (first_output == first_output_copy).all()
+
+        # If the features change, the stored blocks are extracted again
+        del feature_requests[:]
+        opFeatures.Input.setValue(vigra.taggedView(features + 1, "xyc"))
+        labels_and_features = opFeatureMatrixCache.LabelAndFeatureMatrix.value
+        assert len(feature_requests) == 1
+        assert sorted_rows(labels_and_features) == [(1, 12.5, 11.5), (2, 11.5, 11.5), (2, 21.5, 31.5)]
+
+    def testConcurrentUpdates(self):
+        features = numpy.indices((100, 100)).astype(numpy.float32) + 0.5
+        features = numpy.rollaxis(features, 0, 3)
+        features = vigra.taggedView(features, "xyc")
+
+        labels = numpy.zeros((100, 100, 1), dtype=numpy.uint8)
+        labels = vigra.taggedView(labels, "xyc")
+
+        graph = Graph()
+        opLabelCache = OpBlockedArrayCache(graph=graph)
+        opLabelCache.BlockShape.setValue((50, 50, 1))
+        opLabelCache.Input.setValue(labels)
+
+        opFeatures = OpArrayPiper(graph=graph)
+        opFeatures.Input.setValue(features)
+
+        opFeatureMatrixCache = OpFeatureMatrixCache(graph=graph)
+        opFeatureMatrixCache.LabelImage.connect(opLabelCache.Output)
+        opFeatureMatrixCache.FeatureImage.connect(opFeatures.Output)
+
+        def set_labels(slicing, value):
+            labels[slicing] = value
+            opLabelCache.Input.setDirty(slicing)
+
+        def sorted_rows(matrix):
+            return sorted(map(tuple, matrix))
+
+        set_labels(numpy.s_[10:11, 10:11, 0:1], 1)
+        assert sorted_rows(opFeatureMatrixCache.LabelAndFeatureMatrix.value) == [(1, 10.5, 10.5)]
+
+        # While the first execute extracts the features of a new label,
+        # the block is labeled again and a second execute starts.
+        original_execute = opFeatures.execute
+        second_outputs = []
+
+        def second_execute():
+            second_outputs.append(opFeatureMatrixCache.LabelAndFeatureMatrix.value)
+
+        second_thread = threading.Thread(target=second_execute)
+
+        def interrupting_execute(slot, subindex, roi, result):
+            if second_thread.ident is None:
+                set_labels(numpy.s_[30:31, 30:31, 0:1], 2)
+                second_thread.start()
+            return original_execute(slot, subindex, roi, result)
+
+        opFeatures.execute = interrupting_execute
+
+        set_labels(numpy.s_[20:21, 20:21, 0:1], 1)
+        first_output = opFeatureMatrixCache.LabelAndFeatureMatrix.value
+        second_thread.join()
+        expected = [(1, 10.5, 10.5), (1, 20.5, 20.5), (2, 30.5, 30.5)]
+        assert sorted_rows(first_output) in (expected[:2], expected)
+        assert sorted_rows(second_outputs[0]) == expected
+
+        # The stored block matrix agrees with the total matrix (rebuilt after relabeling a pixel)
+        set_labels(numpy.s_[10:11, 10:11, 0:1], 2)
+        labels_and_features = opFeatureMatrixCache.LabelAndFeatureMatrix.value
+        assert sorted_rows(labels_and_features) == [(1, 20.5, 20.5), (2, 10.5, 10.5), (2, 30.5, 30.5)]
+
 
 if __name__ == "__main__":
     import sys
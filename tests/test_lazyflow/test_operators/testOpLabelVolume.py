@@ -1,4 +1,6 @@
 from builtins import range
+import itertools
+
 import numpy as np
 import vigra
 
@@ -16,7 +18,7 @@ from lazyflow.operators.cacheMemoryManager import CacheMemoryManager
 
 from numpy.testing import assert_array_equal
 
-from lazyflow.operators.opLabelVolume import haveBlocked
+from lazyflow.operators.opLabelVolume import haveBlocked, _OpLabelBlockwise
 
 
 class TestVigra(unittest.TestCase):
@@ -371,6 +373,82 @@ class TestLazy(TestVigra):
         )
 
 
+class TestBlockwise(TestVigra):
+    def setup_method(self, method):
+        self.method = np.asarray(["blockwise"], dtype=np.object)
+
+    # Output is cached with blockwise labeling
+    def testThreadSafety(self):
+        g = Graph()
+
+        vol = np.zeros((1000, 100, 10))
+        vol = vol.astype(np.uint8)
+        vol = vigra.taggedView(vol, axistags="xyz")
+        vol[:200, ...] = 1
+        vol[800:, ...] = 1
+
+        opCount = CountExecutes(graph=g)
+        opCount.Input.setValue(vol)
+
+        op = OpLabelVolume(graph=g)
+        op.Method.setValue(self.method)
+        op.Input.connect(opCount.Output)
+
+        reqs = [op.CachedOutput[...] for i in range(4)]
+        [r.submit() for r in reqs]
+        [r.block() for r in reqs]
+        assert opCount.numExecutes == 1, "Parallel requests to CachedOutput resulted in recomputation " "({}/4)".format(
+            opCount.numExecutes
+        )
+
+    def testStitching(self):
+        g = Graph()
+        vol = (np.random.RandomState(0).rand(1, 40, 37, 9, 2) < 0.4).astype(np.uint8)
+        vol = vigra.taggedView(vol, axistags="txyzc")
+
+        opCount = CountExecutes(graph=g)
+        opCount.Input.setValue(vol)
+
+        op = _OpLabelBlockwise(graph=g)
+        op.Input.connect(opCount.Output)
+        op.Background.setValue(vigra.taggedView(np.zeros((1, 1, 1, 1, 2), dtype=np.uint8), axistags="txyzc"))
+        op.BlockShape.setValue((8, 10, 4))
+
+        out = op.Output[...].wait()
+        for c in range(2):
+            expected = vigra.analysis.labelVolumeWithBackground(vol[0, ..., c])
+            assertEquivalentLabeling(expected, out[0, ..., c])
+            assert out[0, ..., c].max() == expected.max()
+
+        # every block was read once
+        num_blocks = 5 * 4 * 3 * 2
+        assert opCount.numExecutes == num_blocks
+
+    def testDeterministicLabels(self):
+        g = Graph()
+        vol = (np.random.RandomState(1).rand(1, 40, 37, 9, 1) < 0.4).astype(np.uint8)
+        vol = vigra.taggedView(vol, axistags="txyzc")
+
+        op = _OpLabelBlockwise(graph=g)
+        op.Input.setValue(vol)
+        op.Background.setValue(vigra.taggedView(np.zeros((1, 1, 1, 1, 1), dtype=np.uint8), axistags="txyzc"))
+        op.BlockShape.setValue((8, 10, 4))
+        out = op.Output[...].wait()[0, ..., 0]
+
+        # Objects are numbered in the order in which they first appear, going through
+        # the blocks in index order and through the local labels of each block,
+        # regardless of the order in which the block requests finished.
+        order = []
+        for index in itertools.product(range(5), range(4), range(3)):
+            block = tuple(slice(i * s, (i + 1) * s) for i, s in zip(index, (8, 10, 4)))
+            local = vigra.analysis.labelVolumeWithBackground(vol[0, ..., 0].view(np.ndarray)[block])
+            for label in range(1, local.max() + 1):
+                final = out[block][local == label][0]
+                if final not in order:
+                    order.append(final)
+        assert order == list(range(1, out.max() + 1))
+
+
 class DirtyAssert(Operator):
     Input = InputSlot()
 
@@ -30,6 +30,7 @@ from numpy.testing import assert_array_equal, assert_array_almost_equal
 
 from lazyflow.utility.testing import assertEquivalentLabeling
 from lazyflow.operators.opLazyConnectedComponents import OpLazyConnectedComponents as OpLazyCC
+from lazyflow.operators.opLazyConnectedComponents import UnionFindArray
 
 from lazyflow.graph import Graph
 from lazyflow.operator import Operator
@@ -275,6 +276,43 @@ class TestOpLazyCC(unittest.TestCase):
         out2 = op.Output[:, :1, :1].wait()
         assert np.all(out2 > 0)
 
+    def testLocalizedDirtyPropagation(self):
+        g = Graph()
+        vol = np.zeros((9, 9), dtype=np.uint8)
+        vol[1, 1:5] = 1
+        vol[7, 1] = 1
+        vol[7, 7] = 1
+        vol = vigra.taggedView(vol, axistags="yx").withAxes(*"zyx")
+        chunkShape = (1, 3, 3)
+
+        opCache = OpCompressedCache(graph=g)
+        opCache.Input.setValue(vol)
+        opCache.BlockShape.setValue(chunkShape)
+
+        op = OpLazyCC(graph=g)
+        op.Input.connect(opCache.Output)
+        op.ChunkShape.setValue((3, 3, 1))
+
+        dirtyRois = []
+        op.Output.notifyDirty(lambda slot, roi: dirtyRois.append((tuple(roi.start), tuple(roi.stop))))
+
+        out1 = op.Output[...].wait()
+        assert out1.max() == 3
+
+        # extend the first object into the next chunk
+        opCache.Input[0:1, 1:2, 5:6] = np.asarray([[[1]]], dtype=np.uint8)
+        assert len(dirtyRois) == 1
+        start, stop = dirtyRois[0]
+        assert stop[1] <= 6, "Dirty region {} contains unaffected objects".format(dirtyRois[0])
+
+        out2 = op.Output[...].wait()
+        assertEquivalentLabeling(vigra.analysis.labelVolumeWithBackground(opCache.Output[...].wait()), out2)
+        assert out2.max() == 3
+        # unaffected objects keep their labels
+        assert out2[0, 7, 1] == out1[0, 7, 1]
+        assert out2[0, 7, 7] == out1[0, 7, 7]
+        assert np.all(out2[0, 1, 1:6] == out2[0, 1, 1])
+
     @unittest.skip("too costly")
     def testFromDataset(self):
         shape = (500, 500, 500)
@@ -460,6 +498,54 @@ class TestOpLazyCC(unittest.TestCase):
         assert len(blocks) == 100, "Got {} clean blocks (expected {}".format(len(blocks), 100)
 
 
+class TestUnionFindArray(object):
+    @staticmethod
+    def _components(n, pairs):
+        # reference: merge sets of labels explicitly
+        sets = {i: {i} for i in range(n)}
+        for a, b in pairs:
+            if sets[a] is not sets[b]:
+                merged = sets[a] | sets[b]
+                for i in merged:
+                    sets[i] = merged
+        return sets
+
+    def testNewIndices(self):
+        uf = UnionFindArray(1)
+        assert uf.makeNewIndex() == 1
+        assert uf.makeNewIndices(1000) == 2
+        assert uf.makeNewIndex() == 1002
+        assert_array_equal(uf.findIndices(np.arange(1003)), np.arange(1003))
+
+    def testUnions(self):
+        rng = np.random.RandomState(0)
+        n = 500
+        pairs = rng.randint(0, n, size=(300, 2))
+        pairs[:100, 0] = 7  # many unions with the same label
+
+        uf_single = UnionFindArray(n)
+        for a, b in pairs:
+            uf_single.makeUnion(a, b)
+        uf_batched = UnionFindArray(n)
+        uf_batched.makeUnions(pairs[:, 0], pairs[:, 1])
+
+        sets = self._components(n, pairs)
+        for uf in (uf_single, uf_batched):
+            roots = uf.findIndices(np.arange(n).reshape(20, 25)).ravel()
+            for i in range(n):
+                assert uf.findIndex(i) == roots[i]
+                assert set(np.flatnonzero(roots == roots[i])) == sets[i]
+
+    def testResetSets(self):
+        uf = UnionFindArray(10)
+        uf.makeUnions([1, 2, 5, 7], [2, 3, 6, 8])
+
+        labels = uf.resetSets([uf.findIndex(1), uf.findIndex(7)])
+        assert_array_equal(np.sort(labels), [1, 2, 3, 7, 8])
+        assert_array_equal(uf.findIndices(labels), labels)
+        assert uf.findIndex(5) == uf.findIndex(6)
+
+
 class OpExecuteCounter(OpArrayPiper):
     def __init__(self, *args, **kwargs):
         self.numCalls = 0
@@ -76,6 +76,37 @@ class TestOpPixelFeaturesPresmoothed(object):
         assert computed_whole.shape == computed_per_slice.shape
         assert numpy.allclose(computed_whole, computed_per_slice), abs(computed_whole - computed_per_slice).max()
 
+    def test_feature_bank_matches_per_feature_operators(self, monkeypatch):
+        op = OpPixelFeaturesPresmoothed(graph=Graph())
+        scales = [0.3, 0.7, 1.0, 1.6, 3.5]
+        op.Scales.setValue(scales)
+        op.FeatureIds.setValue(
+            [
+                "GaussianSmoothing",
+                "LaplacianOfGaussian",
+                "StructureTensorEigenvalues",
+                "HessianOfGaussianEigenvalues",
+                "GaussianGradientMagnitude",
+                "DifferenceOfGaussians",
+            ]
+        )
+        op.SelectionMatrix.setValue(numpy.ones((6, len(scales)), dtype=bool))
+        op.Input.setValue(self.data)
+
+        for compute_in_2d in (False, True):
+            op.ComputeIn2d.setValue([compute_in_2d] * len(scales))
+            # full output, and a roi that starts and ends within the channels of a feature
+            slicings = [slice(None), numpy.s_[1:2, 4:17, 2:7, 3:15, 5:18]]
+
+            with_bank = [op.Output[slicing].wait() for slicing in slicings]
+            monkeypatch.setattr(OpPixelFeaturesPresmoothed, "use_feature_bank", False)
+            without_bank = [op.Output[slicing].wait() for slicing in slicings]
+            monkeypatch.undo()
+
+            for computed, expected in zip(with_bank, without_bank):
+                assert computed.shape == expected.shape
+                assert numpy.allclose(computed, expected, atol=1e-4), abs(computed - expected).max()
+
 
 if __name__ == "__main__":
     import sys
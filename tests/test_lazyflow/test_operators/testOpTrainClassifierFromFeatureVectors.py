@@ -44,6 +44,34 @@ class TestOpTrainClassifierFromFeatureVectors(object):
             trained_classifier, ParallelVigraRfLazyflowClassifier
         ), "classifier is of the wrong type: {}".format(type(trained_classifier))
 
+    def testIncrementalTraining(self):
+        class RecordingFactory(ParallelVigraRfLazyflowClassifierFactory):
+            VERSION = ParallelVigraRfLazyflowClassifierFactory.VERSION
+            updates = []
+
+            def update_and_train(self, classifier, X, y, feature_names=None):
+                self.updates.append(classifier)
+                return super().update_and_train(classifier, X, y, feature_names)
+
+        labels_and_features = numpy.zeros((4, 3), dtype=numpy.float32)
+        labels_and_features[:, 0] = [1, 1, 2, 2]
+        labels_and_features[:, 1:] = [[10.5, 10.5], [10.5, 11.5], [20.5, 20.5], [20.5, 21.5]]
+
+        graph = Graph()
+        opTrain = OpTrainClassifierFromFeatureVectors(graph=graph)
+        opTrain.ClassifierFactory.setValue(RecordingFactory(8, num_forests=4))
+        opTrain.MaxLabel.setValue(2)
+        opTrain.IncrementalTraining.setValue(True)
+        opTrain.LabelAndFeatureMatrix.setValue(labels_and_features)
+
+        first_classifier = opTrain.Classifier.value
+        assert RecordingFactory.updates == []
+
+        opTrain.LabelAndFeatureMatrix.setValue(labels_and_features[::-1].copy())
+        second_classifier = opTrain.Classifier.value
+        assert RecordingFactory.updates == [first_classifier]
+        assert second_classifier.forest_generations == [1, 0, 0, 0]
+
 
 if __name__ == "__main__":
     import sys
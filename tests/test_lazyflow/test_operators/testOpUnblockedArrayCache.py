@@ -7,6 +7,8 @@ from lazyflow.request import RequestPool
 from lazyflow.graph import Graph
 from lazyflow.roi import roiToSlice
 from lazyflow.operators.opUnblockedArrayCache import OpUnblockedArrayCache
+from lazyflow.operators.opCache import MemInfoNode
+from lazyflow.operators.blockSpillStore import BlockSpillStore
 from lazyflow.utility.testing import OpArrayPiperWithAccessCount
 
 import logging
@@ -120,6 +122,71 @@ class TestOpUnblockedArrayCacheCache(object):
         for k, t in l:
             assert t > 0.0
 
+    def testUsedMemory(self):
+        graph = Graph()
+        opDataProvider = OpArrayPiperWithAccessCount(graph=graph)
+        opCache = OpUnblockedArrayCache(graph=graph)
+
+        data = np.random.random((100, 100, 100)).astype(np.float32)
+        opDataProvider.Input.setValue(vigra.taggedView(data, "zyx"))
+        opCache.Input.connect(opDataProvider.Output)
+        assert opCache.usedMemory() == 0
+
+        opCache.Output[0:10, 0:10, 0:10].wait()
+        opCache.Output[10:20, 0:20, 0:10].wait()
+        # contained in the first block, not stored again
+        opCache.Output[0:5, 0:5, 0:5].wait()
+        assert opCache.usedMemory() == (1000 + 2000) * 4
+
+        # overwriting a block doesn't count twice
+        opCache.Input[0:10, 0:10, 0:10] = data[0:10, 0:10, 0:10]
+        assert opCache.usedMemory() == (1000 + 2000) * 4
+
+        assert opCache.freeBlock(((10, 0, 0), (20, 20, 10))) == 2000 * 4
+        assert opCache.usedMemory() == 1000 * 4
+
+        opDataProvider.Input.setDirty(slice(None))
+        assert opCache.usedMemory() == 0
+
+    def testSpillToDisk(self, tmp_path):
+        graph = Graph()
+        opDataProvider = OpArrayPiperWithAccessCount(graph=graph)
+        opCache = OpUnblockedArrayCache(graph=graph)
+        store = BlockSpillStore(max_bytes=2 ** 30, directory=str(tmp_path))
+        opCache.setSpillStore(store)
+
+        data = np.random.random((100, 100, 100)).astype(np.float32)
+        opDataProvider.Input.setValue(vigra.taggedView(data, "zyx"))
+        opCache.Input.connect(opDataProvider.Output)
+
+        roi = ((0, 0, 0), (50, 50, 50))
+        opCache.Output(*roi).wait()
+        assert opDataProvider.accessCount == 1
+
+        block_size = opCache.usedMemory()
+        assert opCache.evictBlock(roi) == block_size
+        assert opCache.usedMemory() == 0
+        assert store.stats().num_blocks == 1
+
+        # Read back from disk, not recomputed
+        result = opCache.Output(*roi).wait()
+        assert (result == data[roiToSlice(*roi)]).all()
+        assert opDataProvider.accessCount == 1
+        assert opCache.usedMemory() == block_size
+        assert store.stats().num_blocks == 0
+
+        # Spilled blocks that become dirty are discarded
+        opCache.evictBlock(roi)
+        opDataProvider.Input.setDirty((10, 10, 10), (11, 11, 11))
+        assert store.stats().num_blocks == 0
+        opCache.Output(*roi).wait()
+        assert opDataProvider.accessCount == 2
+
+        report = MemInfoNode()
+        opCache.generateReport(report)
+        assert report.info == "Lookups: memory 0.0%, disk 33.3%, recomputed 66.7%"
+        store.close()
+
     def testCompressed(self):
         graph = Graph()
         opDataProvider = OpArrayPiperWithAccessCount(graph=graph)
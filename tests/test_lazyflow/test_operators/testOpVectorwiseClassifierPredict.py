@@ -0,0 +1,97 @@
+import numpy
+import pytest
+import vigra
+
+from lazyflow.classifiers import LazyflowVectorwiseClassifierABC, LazyflowVectorwiseClassifierFactoryABC
+from lazyflow.graph import Graph
+from lazyflow.operators.classifierOperators import OpVectorwiseClassifierPredict
+from lazyflow.operators.opArrayPiper import OpArrayPiper
+
+
+class CountingClassifierFactory(LazyflowVectorwiseClassifierFactoryABC):
+    VERSION = 1
+
+    def create_and_train(self, X, y, feature_names=None):
+        raise NotImplementedError
+
+    @property
+    def description(self):
+        return "counting classifier"
+
+
+class CountingClassifier(LazyflowVectorwiseClassifierABC):
+    """Deterministic two-class 'classifier' that records how many feature vectors it was asked to predict."""
+
+    def __init__(self):
+        self.predicted_vectors = 0
+
+    def predict_probabilities(self, X):
+        self.predicted_vectors += len(X)
+        p = 1 / (1 + numpy.exp(-X.sum(axis=1)))
+        return numpy.stack([p, 1 - p], axis=1).astype(numpy.float32)
+
+    @property
+    def known_classes(self):
+        return [1, 2]
+
+    @property
+    def feature_count(self):
+        return 3
+
+    @property
+    def feature_names(self):
+        return None
+
+    def serialize_hdf5(self, h5py_group):
+        raise NotImplementedError
+
+
+class TestOpVectorwiseClassifierPredict:
+    @pytest.fixture
+    def op(self):
+        rng = numpy.random.RandomState(0)
+        features = vigra.taggedView(rng.normal(size=(20, 30, 40, 3)).astype(numpy.float32), "zyxc")
+        mask = numpy.zeros((20, 30, 40, 2), dtype=numpy.uint8)
+        mask[2:5, 10:12, 5:9, 0] = 1
+        mask[7, 20:25, 30:33, 1] = 1
+
+        graph = Graph()
+        self.opFeatures = OpArrayPiper(graph=graph)
+        self.opFeatures.Input.setValue(features)
+        self.classifier = CountingClassifier()
+
+        op = OpVectorwiseClassifierPredict(graph=graph)
+        op.Image.connect(self.opFeatures.Output)
+        op.Classifier.setValue(self.classifier)
+        op.Classifier.meta.classifier_factory = CountingClassifierFactory()
+        op.PredictionMask.setValue(vigra.taggedView(mask, "zyxc"))
+        op.LabelsCount.setValue(2)
+        return op
+
+    def test_sparse_prediction_matches_dense_prediction(self, op):
+        op.SparsePrediction.setValue(False)
+        dense = op.PMaps[:].wait()
+        assert self.classifier.predicted_vectors == 20 * 30 * 40
+
+        self.classifier.predicted_vectors = 0
+        op.SparsePrediction.setValue(True)
+        sparse = op.PMaps[:].wait()
+        assert self.classifier.predicted_vectors == 3 * 2 * 4 + 5 * 3
+
+        assert numpy.array_equal(sparse, dense)
+        assert (sparse[:2] == 0).all()
+        assert (sparse[2:5, 10:12, 5:9] > 0).all()
+
+    def test_features_are_requested_for_bounding_box_of_mask(self, op):
+        requested = []
+        original_execute = self.opFeatures.execute
+
+        def recording_execute(slot, subindex, roi, result):
+            requested.append((tuple(roi.start), tuple(roi.stop)))
+            return original_execute(slot, subindex, roi, result)
+
+        self.opFeatures.execute = recording_execute
+        result = op.PMaps[:, 5:30, :, 1:2].wait()
+
+        assert result.shape == (20, 25, 40, 1)
+        assert requested == [((2, 10, 5, 0), (8, 25, 33, 3))]
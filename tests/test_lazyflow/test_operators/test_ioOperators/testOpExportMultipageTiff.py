@@ -31,7 +31,7 @@ from lazyflow.operators.ioOperators import OpExportMultipageTiff
 from lazyflow.operators.ioOperators.opTiffReader import OpTiffReader
 from lazyflow.operators.opArrayPiper import OpArrayPiper
 from lazyflow.operators.opReorderAxes import OpReorderAxes
-from lazyflow.utility import Pipeline
+from lazyflow.utility import FileBlockJournal, Pipeline
 
 
 def test_OpExportMultipageTiff():
@@ -56,3 +56,41 @@ def test_OpExportMultipageTiff():
             actual = read_tiff[-1].Output[:].wait().astype(dtype)
 
     numpy.testing.assert_array_equal(expected, actual)
+
+
+def test_OpExportMultipageTiff_resume():
+    shape = 2, 3, 32, 64, 1
+    axes = "tzyxc"
+    dtype = numpy.uint16
+    data = numpy.arange(numpy.prod(shape), dtype=dtype).reshape(shape)
+    expected = vigra.VigraArray(data, axistags=vigra.defaultAxistags(axes), order="C")
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        filepath = str(pathlib.Path(tempdir, "multipage.tiff"))
+        graph = Graph()
+
+        with Pipeline(graph=graph) as write_tiff:
+            write_tiff.add(OpArrayPiper, Input=expected)
+            write_tiff.add(OpExportMultipageTiff, Filepath=filepath)
+            write_tiff[-1].run_export()
+
+        # Simulate an export that was interrupted after 4 of the 6 pages (in tzcyx order).
+        plan = {"shape": [2, 3, 1, 32, 64], "dtype": numpy.dtype(dtype).str}
+        FileBlockJournal(filepath + ".journal").start(plan, range(4))
+
+        # The first 4 pages are copied from the file, even though their input has changed.
+        changed = expected.copy()
+        changed[0, :, ...] = 0
+        changed[1, 0, ...] = 0
+        with Pipeline(graph=graph) as write_tiff:
+            write_tiff.add(OpArrayPiper, Input=changed)
+            write_tiff.add(OpExportMultipageTiff, Filepath=filepath, Resume=True)
+            write_tiff[-1].run_export()
+        assert not pathlib.Path(filepath + ".journal").exists()
+
+        with Pipeline(graph=graph) as read_tiff:
+            read_tiff.add(OpTiffReader, Filepath=filepath)
+            read_tiff.add(OpReorderAxes, AxisOrder=axes)
+            actual = read_tiff[-1].Output[:].wait().astype(dtype)
+
+    numpy.testing.assert_array_equal(expected, actual)
@@ -23,6 +23,8 @@ from builtins import object
 ###############################################################################
 from lazyflow.operators.opArrayPiper import OpArrayPiper
 from lazyflow.operators.ioOperators import OpH5N5WriterBigDataset
+from lazyflow.roi import roiToSlice
+from lazyflow.utility import AttributeBlockJournal
 from shutil import rmtree
 import numpy
 import vigra
@@ -97,6 +99,62 @@ class TestOpH5N5WriterBigDataset(object):
         hdf5File.close()
         n5File.close()
 
+    def test_request_blocks_cover_whole_chunks(self):
+        hdf5File = h5py.File(self.testDataH5FileName)
+
+        opPiper = OpArrayPiper(graph=self.graph)
+        opPiper.Input.setValue(self.testData)
+        opWriter = OpH5N5WriterBigDataset(graph=self.graph)
+        opWriter.h5N5File.setValue(hdf5File)
+        opWriter.h5N5Path.setValue(self.datasetInternalPath)
+        opWriter.Image.connect(opPiper.Output)
+
+        assert hdf5File[self.datasetInternalPath].chunks == opWriter.chunkShape
+        for block, chunk, size in zip(opWriter.requestBlockShape, opWriter.chunkShape, self.dataShape):
+            assert block % chunk == 0 or block == size
+        hdf5File.close()
+
+    def test_resume(self):
+        hdf5File = h5py.File(self.testDataH5FileName)
+
+        opPiper = OpArrayPiper(graph=self.graph)
+        opPiper.Input.setValue(self.testData)
+        opWriter = OpH5N5WriterBigDataset(graph=self.graph)
+        opWriter.h5N5File.setValue(hdf5File)
+        opWriter.h5N5Path.setValue(self.datasetInternalPath)
+        opWriter.Image.connect(opPiper.Output)
+        assert opWriter.WriteImage.value
+        dataset = hdf5File[self.datasetInternalPath]
+        assert AttributeBlockJournal.ATTRIBUTE_NAME not in dataset.attrs
+
+        # Simulate an export that was interrupted after the first block.
+        first_block = roiToSlice((0,) * 5, numpy.minimum(opWriter.requestBlockShape, self.dataShape))
+        plan = {
+            "shape": list(self.dataShape),
+            "roi": [[0] * 5, list(self.dataShape)],
+            "blockAlignment": "absolute",
+            "blockshape": list(opWriter.requestBlockShape),
+        }
+        AttributeBlockJournal(dataset.attrs).start(plan, [0])
+        dataset[...] = 0
+        dataset[first_block] = self.testData[first_block]
+        opWriter.cleanUp()
+
+        # The first block is not written again: its input has changed, but the dataset still holds the old data.
+        changedData = self.testData.copy()
+        changedData[first_block] = -1
+        opPiper.Input.setValue(changedData)
+        opWriter = OpH5N5WriterBigDataset(graph=self.graph, Resume=True)
+        opWriter.h5N5File.setValue(hdf5File)
+        opWriter.h5N5Path.setValue(self.datasetInternalPath)
+        opWriter.Image.connect(opPiper.Output)
+        assert opWriter.WriteImage.value
+
+        dataset = hdf5File[self.datasetInternalPath]
+        numpy.testing.assert_array_equal(dataset[...], self.testData.view(numpy.ndarray))
+        assert AttributeBlockJournal.ATTRIBUTE_NAME not in dataset.attrs
+        hdf5File.close()
+
 
 class TestOpH5N5WriterBigDataset_2(object):
     def setup_method(self, method):
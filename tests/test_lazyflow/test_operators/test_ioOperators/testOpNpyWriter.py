@@ -31,6 +31,7 @@ import vigra
 from lazyflow.graph import Graph
 from lazyflow.operators import OpArrayPiper
 from lazyflow.operators.ioOperators import OpInputDataReader, OpNpyWriter
+from lazyflow.utility import FileBlockJournal
 
 
 class TestOpNpyWriter(object):
@@ -67,6 +68,29 @@ class TestOpNpyWriter(object):
         finally:
             opRead.cleanUp()
 
+    def testResume(self):
+        data = numpy.random.random((100, 100)).astype(numpy.float32)
+        path = self._tmpdir + "/npy_writer_resume_output.npy"
+
+        # Simulate an export that was interrupted after the first of two blocks.
+        partial = numpy.lib.format.open_memmap(path, mode="w+", dtype=data.dtype, shape=data.shape)
+        partial[:50] = data[:50]
+        del partial
+        plan = {"shape": [100, 100], "roi": [[0, 0], [100, 100]], "blockAlignment": "absolute", "blockshape": [50, 100]}
+        FileBlockJournal(path + ".journal").start(plan, [0])
+
+        # The first block is not written again: its input has changed, but the file still holds the old data.
+        changed_data = data.copy()
+        changed_data[:50] = -1
+        opWriter = OpNpyWriter(graph=Graph())
+        opWriter.Input.setValue(vigra.taggedView(changed_data, "xy"))
+        opWriter.Filepath.setValue(path)
+        opWriter.Resume.setValue(True)
+        opWriter.write()
+
+        numpy.testing.assert_array_equal(numpy.load(path), data)
+        assert not os.path.exists(path + ".journal")
+
 
 if __name__ == "__main__":
     import sys
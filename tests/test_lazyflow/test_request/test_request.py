@@ -196,6 +196,34 @@ class TestRequest:
         recv.assert_called_once()
         assert isinstance(recv.call_args[0][0], TExc)
 
+    def test_wait_on_unsubmitted_request_executes_in_calling_thread(self):
+        req = Request(threading.current_thread)
+        assert req.wait() is threading.current_thread()
+        assert req.assigned_worker is None
+
+    def test_wait_timeout_from_foreign_thread(self):
+        unpause = threading.Event()
+        req = Request(unpause.wait)
+        req.submit()
+
+        with pytest.raises(Request.TimeoutException):
+            req.wait(timeout=0.01)
+
+        unpause.set()
+        assert req.wait()
+
+    def test_child_requests_are_prioritized_by_creation(self):
+        def work_fn():
+            first, second = Request(lambda: 1), Request(lambda: 2)
+            assert first < second
+            assert first._priority[: len(req._priority)] == req._priority
+            return first.wait() + second.wait()
+
+        req = Request(work_fn)
+        req.submit()
+        assert req.wait() == 3
+        assert Request(lambda: None, root_priority=[-1]) < Request(lambda: None)
+
 
 @pytest.fixture
 def work():
@@ -5,7 +5,7 @@ import itertools
 
 import pytest
 
-from lazyflow.request.threadPool import ThreadPool
+from lazyflow.request.threadPool import ThreadPool, WorkStealingThreadPool, create_thread_pool, default_num_workers
 
 
 NUM_WORKERS = 4
@@ -119,3 +119,91 @@ def test_exception_in_task_logged(caplog, pool):
     record = caplog.records[0]
 
     assert issubclass(record.exc_info[0], MyExc)
+
+
+@pytest.fixture
+def stealing_pool():
+    p = WorkStealingThreadPool(NUM_WORKERS)
+    yield p
+    p.stop()
+
+
+def test_create_thread_pool_selects_scheduler():
+    pool = create_thread_pool(2, "work_stealing")
+    try:
+        assert isinstance(pool, WorkStealingThreadPool)
+        assert pool.num_workers == 2
+    finally:
+        pool.stop()
+
+    with pytest.raises(ValueError):
+        create_thread_pool(2, "no_such_scheduler")
+
+
+def test_default_num_workers_is_positive():
+    assert default_num_workers() >= 1
+
+
+def test_work_stealing_executes_all_tasks(stealing_pool: WorkStealingThreadPool):
+    num_tasks = 200
+    done = threading.Semaphore(0)
+    executed = []
+
+    def make_task(i):
+        def task():
+            executed.append(i)
+            done.release()
+
+        return task
+
+    for i in range(num_tasks):
+        stealing_pool.wake_up(make_task(i))
+
+    for _ in range(num_tasks):
+        assert done.acquire(timeout=1)
+    assert sorted(executed) == list(range(num_tasks))
+
+
+def test_idle_workers_steal_tasks_from_busy_worker(stealing_pool: WorkStealingThreadPool):
+    num_children = 3 * NUM_WORKERS
+    children_done = threading.Semaphore(0)
+    release_parent = threading.Event()
+    child_threads = set()
+    parent_thread = None
+
+    def child():
+        child_threads.add(threading.current_thread())
+        children_done.release()
+
+    def parent():
+        nonlocal parent_thread
+        parent_thread = threading.current_thread()
+        # Submitted from within a worker: the children end up in this worker's own deque.
+        for _ in range(num_children):
+            stealing_pool.wake_up(Task(child))
+        # Keep this worker busy, so that the children can only be executed by its peers.
+        release_parent.wait()
+
+    stealing_pool.wake_up(Task(parent))
+    try:
+        for _ in range(num_children):
+            assert children_done.acquire(timeout=1)
+    finally:
+        release_parent.set()
+
+    assert parent_thread not in child_threads
+
+
+def test_work_stealing_resumes_started_task_on_assigned_worker(stealing_pool: WorkStealingThreadPool):
+    stop = threading.Event()
+    worker = None
+
+    def task():
+        nonlocal worker
+        worker = threading.current_thread()
+        stop.set()
+
+    task.assigned_worker = random.choice(list(stealing_pool.workers))
+    stealing_pool.wake_up(task)
+    assert stop.wait(timeout=1)
+    assert worker == task.assigned_worker
@@ -12,6 +12,9 @@ from lazyflow.roi import (
     nonzero_bounding_box,
     containing_rois,
     getIntersectingBlocks,
+    getIntersectingBlockGeometry,
+    getBlockBounds,
+    roiToSlice,
 )
 
 
@@ -149,6 +152,48 @@ class TestGetIntersectionBlocks(TestCase):
             getIntersectingBlocks(numpy.array((256, 256, 0, 2)), ([0, 0, 0, 0], [256, 256, 256, 2]))
 
 
+class TestGetIntersectingBlockGeometry(TestCase):
+    def test_matches_per_block_functions(self):
+        dataset_shape = (100, 57, 3)
+        blockshape = (32, 20, 3)
+        roi = ((5, 17, 0), (99, 57, 3))
+
+        geometry = getIntersectingBlockGeometry(dataset_shape, blockshape, roi)
+        block_starts = getIntersectingBlocks(blockshape, roi)
+        assert geometry.num_blocks == len(block_starts) == 12
+        numpy.testing.assert_array_equal(geometry.block_starts, block_starts)
+
+        destination_slicings = geometry.destination_slicings()
+        source_slicings = geometry.source_slicings()
+        for i, block_start in enumerate(block_starts):
+            block_roi = getBlockBounds(dataset_shape, blockshape, block_start)
+            clipped_roi = getIntersection(block_roi, roi)
+            numpy.testing.assert_array_equal(geometry.block_stops[i], block_roi[1])
+            numpy.testing.assert_array_equal(geometry.starts[i], clipped_roi[0])
+            numpy.testing.assert_array_equal(geometry.stops[i], clipped_roi[1])
+            assert destination_slicings[i] == roiToSlice(*numpy.subtract(clipped_roi, roi[0]))
+            assert source_slicings[i] == roiToSlice(*numpy.subtract(clipped_roi, block_start))
+
+        full_blocks = geometry.is_full_block()
+        # blocks at the dataset border are full if they end at the roi stop
+        assert full_blocks.sum() == 4
+        assert set(geometry.block_starts[full_blocks][:, 0]) == {32, 64}
+        assert set(geometry.block_starts[full_blocks][:, 1]) == {20, 40}
+
+    def test_grid_origin(self):
+        roi = ((15, 25), (32, 35))
+        geometry = getIntersectingBlockGeometry((35, 35), (10, 20), roi, grid_origin=roi[0])
+        numpy.testing.assert_array_equal(geometry.block_starts, [[15, 25], [25, 25]])
+        numpy.testing.assert_array_equal(geometry.stops, [[25, 35], [32, 35]])
+        assert geometry.is_full_block().tolist() == [True, False]
+
+    def test_invalid_parameters(self):
+        with self.assertRaises(AssertionError):
+            getIntersectingBlockGeometry((10, 10), (0, 5), ((0, 0), (10, 10)))
+        with self.assertRaises(AssertionError):
+            getIntersectingBlockGeometry((10, 10), (5, 5, 5), ((0, 0), (10, 10)))
+
+
 if __name__ == "__main__":
     # Run nose
     import sys
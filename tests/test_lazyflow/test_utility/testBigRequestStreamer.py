@@ -28,12 +28,15 @@ import psutil
 import weakref
 import threading
 import unittest
+
+import pytest
 from lazyflow.graph import Graph, Operator, OutputSlot
 from lazyflow.roi import roiToSlice
 from lazyflow.operators import OpArrayPiper
 from lazyflow.request import Request
 
-from lazyflow.utility import BigRequestStreamer
+from lazyflow.utility import BigRequestStreamer, MemoryBlockJournal
+from lazyflow.utility.bigRequestStreamer import BlockAutotuner
 
 import logging
 
@@ -119,6 +122,165 @@ class TestBigRequestStreamer(unittest.TestCase):
         logger.debug("FINISHED")
 
 
+def test_block_grid_and_parallel_writers():
+    op = OpArrayPiper(graph=Graph())
+    inputData = numpy.indices((100, 100)).sum(0)
+    op.Input.setValue(inputData)
+
+    results = numpy.zeros((100, 100), dtype=numpy.int32)
+    chunk_grid = (16, 16)
+
+    def handle_result(roi, result):
+        # Every block covers whole chunks (except at the border)
+        assert all(start % chunk == 0 for start, chunk in zip(roi[0], chunk_grid))
+        # The blockshape (10, 20) is rounded down to whole chunks (at least one per axis)
+        assert (numpy.subtract(roi[1], roi[0]) <= chunk_grid).all()
+        results[roiToSlice(*roi)] = result
+
+    batch = BigRequestStreamer(
+        op.Output, [(0, 0), (100, 100)], (10, 20), allowParallelResults=True, numWriters=3, blockGrid=chunk_grid
+    )
+    batch.resultSignal.subscribe(handle_result)
+    batch.execute()
+    assert (results == inputData).all()
+
+
+def test_adaptive_streamer():
+    op = OpArrayPiper(graph=Graph())
+    inputData = numpy.indices((100, 100)).sum(0)
+    op.Input.setValue(inputData)
+
+    results = numpy.zeros((100, 100), dtype=numpy.int32)
+    covered = numpy.zeros((100, 100), dtype=numpy.int32)
+
+    def handle_result(roi, result):
+        results[roiToSlice(*roi)] = result
+        covered[roiToSlice(*roi)] += 1
+
+    batch = BigRequestStreamer(op.Output, [(5, 0), (100, 95)], (10, 10), adaptive=True, targetBlockSeconds=10.0)
+    batch.resultSignal.subscribe(handle_result)
+    batch.execute()
+    assert (results[5:, :95] == inputData[5:, :95]).all()
+    assert (covered[5:, :95] == 1).all()
+
+
+def test_resume_from_journal():
+    op = OpArrayPiper(graph=Graph())
+    inputData = numpy.indices((100, 100)).sum(0)
+    op.Input.setValue(inputData)
+    journal = MemoryBlockJournal()
+
+    results = numpy.zeros((100, 100), dtype=numpy.int32)
+    covered = numpy.zeros((100, 100), dtype=numpy.int32)
+
+    def handle_result(roi, result):
+        results[roiToSlice(*roi)] = result
+        covered[roiToSlice(*roi)] += 1
+
+    def interrupt_after_5_blocks(roi, result):
+        if covered.sum() == 5 * 20 * 20:
+            raise RuntimeError("Interrupted")
+        handle_result(roi, result)
+
+    batch = BigRequestStreamer(op.Output, [(0, 0), (100, 100)], (20, 20), batchSize=1, journal=journal)
+    batch.resultSignal.subscribe(interrupt_after_5_blocks)
+    with pytest.raises(RuntimeError):
+        batch.execute()
+    assert len(journal.read()[1]) == 5
+
+    # The blockshape of the journaled run is used, even if a different one is given (e.g. for less RAM).
+    progress = []
+
+    def handle_progress(progress_value):
+        progress.append(progress_value)
+
+    batch = BigRequestStreamer(op.Output, [(0, 0), (100, 100)], (50, 50), batchSize=1, journal=journal)
+    batch.resultSignal.subscribe(handle_result)
+    batch.progressSignal.subscribe(handle_progress)
+    batch.execute()
+
+    assert (results == inputData).all()
+    assert (covered == 1).all()
+    assert progress[0] == 0 and progress[-1] == 100
+    assert len(journal.read()[1]) == 25
+
+
+def test_journal_of_different_roi_is_discarded():
+    op = OpArrayPiper(graph=Graph())
+    op.Input.setValue(numpy.zeros((100, 100), dtype=numpy.uint8))
+    journal = MemoryBlockJournal()
+    journal.start({"shape": [100, 100], "roi": [[0, 0], [50, 100]], "blockshape": [20, 20]}, [0, 1, 2])
+
+    handled = []
+    batch = BigRequestStreamer(op.Output, [(0, 0), (100, 100)], (20, 20), journal=journal)
+    batch.resultSignal.subscribe(lambda roi, result: handled.append(roi))
+    batch.execute()
+    assert len(handled) == 25
+
+
+class FakeRss(object):
+    def __init__(self):
+        self.value = 0
+
+    def __call__(self):
+        return self.value
+
+
+def _finish_round(tuner, seconds, nbytes=0):
+    for _ in range(2):
+        batch_size = tuner.block_finished(None, seconds, nbytes)
+    return batch_size
+
+
+def test_autotuner_grows_cheap_blocks():
+    rss = FakeRss()
+    tuner = BlockAutotuner(
+        [(0, 0), (1000, 64)], (10, 64), 0, 2, 2, grid_step=4, ram_budget=1000, target_seconds=1.0, rss_fn=rss
+    )
+    assert tuner.thickness == 8
+    _finish_round(tuner, 0.01)
+    assert tuner.thickness == 16
+    for _ in range(10):
+        _finish_round(tuner, 0.01)
+    assert tuner.thickness == 1000
+
+    # Slow blocks are split again
+    _finish_round(tuner, 10.0)
+    assert tuner.thickness == 500
+
+
+def test_autotuner_shrinks_under_memory_pressure():
+    rss = FakeRss()
+    tuner = BlockAutotuner([(0, 0), (100, 64)], (8, 64), 0, 4, 2, ram_budget=1000, rss_fn=rss)
+    rss.value = 2000
+    _finish_round(tuner, 0.5)
+    assert (tuner.thickness, tuner.batch_size) == (4, 4)
+    for _ in range(2):
+        _finish_round(tuner, 0.5)
+    assert (tuner.thickness, tuner.batch_size) == (1, 4)
+    assert _finish_round(tuner, 0.5) == 3
+
+    # Parallelism comes back first, once the memory is released
+    rss.value = 0
+    assert _finish_round(tuner, 0.1) == 4
+    _finish_round(tuner, 0.1)
+    assert tuner.thickness == 2
+
+
+def test_autotuner_rois_tile_the_roi():
+    roi = [(3, 0, 5), (50, 7, 40)]
+    tuner = BlockAutotuner(roi, (4, 7, 16), 0, 2, 1, grid_step=2, ram_budget=1000, rss_fn=FakeRss())
+    covered = numpy.zeros((50, 7, 40), dtype=int)
+    for i, (start, stop) in enumerate(tuner.rois()):
+        covered[roiToSlice(start, stop)] += 1
+        # blocks start on the grid (except at the roi border)
+        assert start[0] == 3 or start[0] % 2 == 0
+        # change the thickness while iterating
+        tuner._thickness = [2, 6, 4][i % 3]
+    assert (covered[3:, :, 5:] == 1).all()
+    assert covered.sum() == 47 * 7 * 35
+
+
 def test_pool_results_discarded():
     """
     This test checks to make sure that result arrays are discarded in turn as the BigRequestStreamer executes.
@@ -0,0 +1,68 @@
+import os
+
+import numpy
+import pytest
+
+from lazyflow.utility import AttributeBlockJournal, FileBlockJournal, MemoryBlockJournal
+
+PLAN = {"shape": [100, 200], "roi": [[0, 0], [100, 200]], "blockshape": [10, 20]}
+
+
+@pytest.fixture(params=["memory", "file", "attribute"])
+def make_journal(request, tmp_path):
+    attrs = {}
+
+    def make():
+        if request.param == "memory":
+            return MemoryBlockJournal()
+        if request.param == "file":
+            return FileBlockJournal(str(tmp_path / "export.journal"))
+        return AttributeBlockJournal(attrs)
+
+    if request.param == "memory":
+        journal = make()
+        return lambda: journal
+    return make
+
+
+def test_empty(make_journal):
+    assert make_journal().read() == (None, set())
+
+
+def test_record_and_read_back(make_journal):
+    journal = make_journal()
+    journal.start(PLAN, [7, 3])
+    for block_index in (0, 99, 42):
+        journal.add(numpy.int64(block_index))
+    assert make_journal().read() == (PLAN, {0, 3, 7, 42, 99})
+
+
+def test_start_replaces_previous_journal(make_journal):
+    journal = make_journal()
+    journal.start(PLAN)
+    journal.add(5)
+    other_plan = dict(PLAN, blockshape=(5, 5))
+    make_journal().start(other_plan)
+    assert make_journal().read() == (dict(PLAN, blockshape=[5, 5]), set())
+
+
+def test_remove(make_journal):
+    journal = make_journal()
+    journal.start(PLAN)
+    journal.add(1)
+    journal.remove()
+    assert make_journal().read() == (None, set())
+    journal.remove()
+
+
+def test_file_journal_ignores_incomplete_last_line(tmp_path):
+    path = str(tmp_path / "export.journal")
+    journal = FileBlockJournal(path)
+    journal.start(PLAN)
+    journal.add(1)
+    journal.add(12)
+    with open(path, "a") as f:
+        f.write("3")
+
+    assert FileBlockJournal(path).read() == (PLAN, {1, 12})
+    assert not os.path.exists(path + ".tmp")
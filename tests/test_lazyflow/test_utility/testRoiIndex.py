@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from lazyflow.utility.roiIndex import RoiIndex
+
+
+def _contains(outer, inner):
+    return all(a <= b for a, b in zip(outer[0], inner[0])) and all(a >= b for a, b in zip(outer[1], inner[1]))
+
+
+def _intersects(roi_a, roi_b):
+    return all(max(a0, b0) < min(a1, b1) for a0, a1, b0, b1 in zip(roi_a[0], roi_a[1], roi_b[0], roi_b[1]))
+
+
+def _random_roi(rng, ndim, max_size):
+    start = tuple(rng.randint(0, 100) for _ in range(ndim))
+    stop = tuple(s + rng.randint(1, max_size) for s in start)
+    return (start, stop)
+
+
+@pytest.fixture
+def index():
+    index = RoiIndex(cell_shape=(10, 10, 10))
+    for x in range(0, 50, 10):
+        for y in range(0, 50, 10):
+            index.add(((x, y, 0), (x + 10, y + 10, 10)))
+    return index
+
+
+def test_containing(index):
+    assert index.containing(((12, 13, 1), (18, 20, 5))) == [((10, 10, 0), (20, 20, 10))]
+    assert index.containing(((12, 13, 1), (18, 21, 5))) == []
+
+
+def test_intersecting(index):
+    result = index.intersecting(((15, 15, 5), (25, 16, 6)))
+    assert sorted(result) == [((10, 10, 0), (20, 20, 10)), ((20, 10, 0), (30, 20, 10))]
+
+    # Touching boundaries don't count as intersection
+    assert index.intersecting(((0, 0, 10), (50, 50, 20))) == []
+
+
+def test_remove(index):
+    block = ((10, 10, 0), (20, 20, 10))
+    assert block in index
+    index.remove(block)
+    assert block not in index
+    assert len(index) == 24
+    assert index.containing(((12, 13, 1), (18, 20, 5))) == []
+
+    # Removing twice is fine
+    index.remove(block)
+
+
+def test_clear(index):
+    index.clear()
+    assert len(index) == 0
+    assert index.intersecting(((0, 0, 0), (50, 50, 10))) == []
+
+
+def test_cell_shape_defaults_to_first_roi():
+    index = RoiIndex()
+    index.add(((0, 0), (4, 8)))
+    assert index._cell_shape == (4, 8)
+
+
+@pytest.mark.parametrize("ndim", [1, 2, 3])
+def test_queries_match_brute_force(ndim):
+    rng = random.Random(ndim)
+    index = RoiIndex()
+    rois = set()
+    for _ in range(200):
+        # Mix of small, block-sized and oversized rois
+        roi = _random_roi(rng, ndim, rng.choice([5, 30, 300]))
+        index.add(roi)
+        rois.add(roi)
+        if rng.random() < 0.3:
+            removed = rng.choice(sorted(rois))
+            index.remove(removed)
+            rois.discard(removed)
+
+    for _ in range(100):
+        query = _random_roi(rng, ndim, rng.choice([3, 30, 300]))
+        assert sorted(index.containing(query)) == sorted(r for r in rois if _contains(r, query))
+        assert sorted(index.intersecting(query)) == sorted(r for r in rois if _intersects(r, query))
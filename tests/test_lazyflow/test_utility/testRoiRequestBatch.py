@@ -108,6 +108,90 @@ class TestRoiRequestBatch(object):
         with pytest.raises(SpecialException):
             batch.execute()
 
+    def _blockRois(self, shape, blockshape):
+        block_starts = getIntersectingBlocks(blockshape, ([0] * len(shape), shape))
+        return [getBlockBounds(shape, blockshape, block_start) for block_start in block_starts]
+
+    @pytest.mark.parametrize("numWriters", [1, 3])
+    def testWriteBehind(self, numWriters):
+        op = OpArrayPiper(graph=Graph())
+        inputData = numpy.indices((100, 100)).sum(0)
+        op.Input.setValue(inputData)
+        roiList = self._blockRois([100, 100], [10, 10])
+
+        results = numpy.zeros((100, 100), dtype=numpy.int32)
+        writer_threads = set()
+        handled = []
+
+        def handleResult(roi, result):
+            writer_threads.add(threading.current_thread().name)
+            results[roiToSlice(*roi)] = result
+            handled.append(roi)
+
+        progressList = []
+
+        def handleProgress(progress):
+            progressList.append(progress)
+
+        totalVolume = numpy.prod(inputData.shape)
+        # Room for about two blocks, so that the back-pressure kicks in
+        batch = RoiRequestBatch(
+            op.Output,
+            iter(roiList),
+            totalVolume,
+            batchSize=10,
+            allowParallelResults=numWriters > 1,
+            numWriters=numWriters,
+            writeBufferBytes=2 * 10 * 10 * inputData.dtype.itemsize,
+        )
+        batch.resultSignal.subscribe(handleResult)
+        batch.progressSignal.subscribe(handleProgress)
+
+        batch.execute()
+        assert len(handled) == len(roiList)
+        assert (results == inputData).all()
+        assert all(name.startswith("RoiRequestBatch-writer") for name in writer_threads)
+        assert progressList[0] == 0 and progressList[-1] == 100
+        assert progressList == sorted(progressList)
+        assert not any(t.name.startswith("RoiRequestBatch-writer") for t in threading.enumerate())
+
+    def testFailedWriteBehind(self):
+        op = OpArrayPiper(graph=Graph())
+        op.Input.setValue(numpy.indices((100, 100)).sum(0))
+
+        class SpecialException(Exception):
+            pass
+
+        def handleResult(roi, result):
+            raise SpecialException("Intentional Exception: raised while writing the result")
+
+        batch = RoiRequestBatch(op.Output, iter(self._blockRois([100, 100], [10, 10])), batchSize=4, numWriters=1)
+        batch.resultSignal.subscribe(handleResult)
+
+        with pytest.raises(SpecialException):
+            batch.execute()
+        assert not any(t.name.startswith("RoiRequestBatch-writer") for t in threading.enumerate())
+
+    @pytest.mark.parametrize("numWriters", [0, 1])
+    def testFailedRequestFinishedHandler(self, numWriters):
+        op = OpArrayPiper(graph=Graph())
+        op.Input.setValue(numpy.indices((100, 100)).sum(0))
+
+        class SpecialException(Exception):
+            pass
+
+        def handleRequestFinished(roi, seconds, result):
+            raise SpecialException("Intentional Exception: raised while handling a finished request")
+
+        batch = RoiRequestBatch(
+            op.Output, iter(self._blockRois([100, 100], [10, 10])), batchSize=4, numWriters=numWriters
+        )
+        batch.requestFinishedSignal.subscribe(handleRequestFinished)
+
+        with pytest.raises(SpecialException):
+            batch.execute()
+        assert not any(t.name.startswith("RoiRequestBatch-writer") for t in threading.enumerate())
+
 
 if __name__ == "__main__":
     # Run this file independently to see debug output.